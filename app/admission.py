@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import deque
+from typing import NamedTuple, Optional
+from app.data_store import DataStore
+from app.metrics import ADMISSION_DECISIONS, ADMISSION_WAIT, LLM_SLOTS_IN_USE
+
+def refill_tokens(tokens: float, elapsed: float, capacity: float, refill_rate: float) -> float:
+    """Return a token bucket's level after elapsed seconds of refilling at refill_rate tokens per second."""
+    return min(capacity, tokens + max(elapsed, 0) * refill_rate)
+
+def client_identity(api_key: Optional[str], remote_addr: Optional[str]) -> str:
+    """Identify a client by API key, or by IP address without one. API keys are hashed before being stored."""
+    if api_key:
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:32]
+    return f"ip:{remote_addr or 'unknown'}"
+
+class FairSemaphore:
+    """Counting semaphore that hands freed slots to waiters in arrival order."""
+
+    def __init__(self, limit: int, max_waiters: int):
+        self.limit = limit
+        self.max_waiters = max_waiters
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiters = deque()
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    def acquire(self, timeout: float) -> bool:
+        """Take a slot, waiting up to timeout seconds behind earlier waiters. Returns whether a slot was taken."""
+        with self._lock:
+            if self._in_use < self.limit and not self._waiters:
+                self._in_use += 1
+                return True
+            if timeout <= 0 or len(self._waiters) >= self.max_waiters:
+                return False
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+
+        if waiter.wait(timeout):
+            return True
+        with self._lock:
+            # The slot may have been handed over just as the wait timed out
+            if waiter.is_set():
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def release(self):
+        """Free a slot, handing it straight to the oldest waiter if there is one."""
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self._in_use -= 1
+
+class AsyncFairSemaphore:
+    """FairSemaphore for coroutines on one event loop."""
+
+    def __init__(self, limit: int, max_waiters: int):
+        self.limit = limit
+        self.max_waiters = max_waiters
+        self._in_use = 0
+        self._waiters = deque()
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    async def acquire(self, timeout: float) -> bool:
+        """Take a slot, waiting up to timeout seconds behind earlier waiters. Returns whether a slot was taken."""
+        if self._in_use < self.limit and not self._waiters:
+            self._in_use += 1
+            return True
+        if timeout <= 0 or len(self._waiters) >= self.max_waiters:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            # The slot may have been handed over just as the wait timed out
+            if waiter.done():
+                return True
+            self._waiters.remove(waiter)
+            return False
+        except asyncio.CancelledError:
+            # A cancelled waiter gives back a slot it was handed, or leaves the queue
+            if waiter.done():
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        """Free a slot, handing it straight to the oldest waiter if there is one."""
+        if self._waiters:
+            self._waiters.popleft().set_result(True)
+        else:
+            self._in_use -= 1
+
+class Admission(NamedTuple):
+    admitted: bool
+    reason: Optional[str] = None  # 'rate_limited' or 'overloaded' when rejected
+    retry_after: float = 0.0
+
+class AdmissionController:
+    """Admits requests to expensive endpoints: a per-client token bucket kept in the DataStore, so every worker
+    shares it, then a fair-queued slot among this process's in-flight LLM calls. A client without a token is
+    rejected at once, so it never takes a place in the queue; a request that gets no slot has its token given back."""
+
+    def __init__(self, store: DataStore, capacity: float, refill_rate: float, max_concurrency: int,
+                 max_wait: float, max_queue: int):
+        self.store = store
+        self.capacity = capacity        # Burst size per client, 0 disables rate limiting
+        self.refill_rate = refill_rate  # Tokens per second per client
+        self.max_wait = max_wait        # Seconds a request may wait before being rejected
+        self.slots = FairSemaphore(max_concurrency, max_queue)
+
+    def acquire(self, endpoint: str, client: str) -> Admission:
+        """Decide whether to admit a request. Admitted requests must call release() when done."""
+        started = time.perf_counter()
+        retry_after = self._consume(endpoint, client)
+        if retry_after:
+            ADMISSION_DECISIONS.inc(1, endpoint, 'rate_limited')
+            return Admission(False, 'rate_limited', retry_after)
+
+        if not self.slots.acquire(self.max_wait):
+            self._consume(endpoint, client, cost=-1)
+            ADMISSION_DECISIONS.inc(1, endpoint, 'overloaded')
+            return Admission(False, 'overloaded', self.max_wait or 1.0)
+
+        ADMISSION_WAIT.observe(time.perf_counter() - started, endpoint)
+        ADMISSION_DECISIONS.inc(1, endpoint, 'admitted')
+        LLM_SLOTS_IN_USE.set(self.slots.in_use)
+        return Admission(True)
+
+    def release(self):
+        self.slots.release()
+        LLM_SLOTS_IN_USE.set(self.slots.in_use)
+
+    def _consume(self, endpoint: str, client: str, cost: float = 1.0) -> float:
+        # A negative cost gives tokens back; the bucket is capped at its capacity again when it next refills
+        if not self.capacity:
+            return 0.0
+        try:
+            return self.store.consume_rate_limit(f"{endpoint}:{client}", self.capacity, self.refill_rate, cost)
+        except Exception:
+            # Fail open: an unreachable limiter store shouldn't take the endpoint down with it
+            ADMISSION_DECISIONS.inc(1, endpoint, 'limiter_error')
+            return 0.0
+
+class AsyncAdmissionController(AdmissionController):
+    """AdmissionController for the ASGI app: waits without blocking the event loop, against an AsyncDataStore.
+    Coroutines waiting on the LLM are cheap, so max_concurrency can be far higher than with threads."""
+
+    def __init__(self, store, capacity: float, refill_rate: float, max_concurrency: int,
+                 max_wait: float, max_queue: int):
+        super().__init__(store, capacity, refill_rate, max_concurrency, max_wait, max_queue)
+        self.slots = AsyncFairSemaphore(max_concurrency, max_queue)
+
+    async def acquire(self, endpoint: str, client: str) -> Admission:
+        """Decide whether to admit a request. Admitted requests must call release() when done."""
+        started = time.perf_counter()
+        retry_after = await self._consume(endpoint, client)
+        if retry_after:
+            ADMISSION_DECISIONS.inc(1, endpoint, 'rate_limited')
+            return Admission(False, 'rate_limited', retry_after)
+
+        if not await self.slots.acquire(self.max_wait):
+            await self._consume(endpoint, client, cost=-1)
+            ADMISSION_DECISIONS.inc(1, endpoint, 'overloaded')
+            return Admission(False, 'overloaded', self.max_wait or 1.0)
+
+        ADMISSION_WAIT.observe(time.perf_counter() - started, endpoint)
+        ADMISSION_DECISIONS.inc(1, endpoint, 'admitted')
+        LLM_SLOTS_IN_USE.set(self.slots.in_use)
+        return Admission(True)
+
+    async def _consume(self, endpoint: str, client: str, cost: float = 1.0) -> float:
+        if not self.capacity:
+            return 0.0
+        try:
+            return await self.store.consume_rate_limit(f"{endpoint}:{client}", self.capacity, self.refill_rate, cost)
+        except Exception:
+            ADMISSION_DECISIONS.inc(1, endpoint, 'limiter_error')
+            return 0.0
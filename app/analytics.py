@@ -0,0 +1,85 @@
+from collections import Counter
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+from app.medication_matching import normalize_medication
+
+BUCKETS = ('day', 'week', 'month')
+DEFAULT_TOP_N = 10
+
+# Breakdown dimension -> response key
+DIMENSIONS = {
+    'medication': 'by_medication',
+    'provider': 'by_provider',
+    'diagnosis': 'top_diagnoses',
+}
+
+def validate_bucket(bucket: str) -> str:
+    """Check a time bucket name. Raises ValueError if it isn't supported."""
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of: {', '.join(BUCKETS)}")
+    return bucket
+
+def bucket_start(day: date, bucket: str) -> date:
+    """Return the first day of the bucket containing a day. Weeks start on Monday."""
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+def dimension_keys(order: Dict) -> Dict[str, str]:
+    """Return the key an order is counted under for each breakdown dimension."""
+    medication = order.get('medication') or ""
+    return {
+        'medication': normalize_medication(medication) or medication.lower(),
+        'provider': order.get('provider_npi') or "",
+        'diagnosis': (order.get('primary_diagnosis') or "").lower().strip(),
+    }
+
+def top_counts(counts: Counter, top_n: int) -> List[Dict]:
+    """Return the top_n keys of a counter, largest first."""
+    return [{'key': key, 'count': count} for key, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:top_n]]
+
+class DailyAggregates:
+    """Order counts per day broken down by medication, provider and diagnosis, updated as orders arrive."""
+
+    def __init__(self):
+        self.days = {}  # ISO date -> {'orders': int, dimension: Counter}
+
+    def record(self, order: Dict):
+        """Count an order in the aggregates for its day."""
+        day = (order.get('timestamp') or date.today().isoformat())[:10]
+        aggregates = self.days.get(day)
+        if aggregates is None:
+            aggregates = {'orders': 0}
+            aggregates.update({dimension: Counter() for dimension in DIMENSIONS})
+            self.days[day] = aggregates
+
+        aggregates['orders'] += 1
+        for dimension, key in dimension_keys(order).items():
+            aggregates[dimension][key] += 1
+
+    def query(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+              bucket: str = 'day', top_n: int = DEFAULT_TOP_N) -> Dict:
+        """Summarize the days in [start_date, end_date) into time buckets and top breakdowns."""
+        validate_bucket(bucket)
+        start_day = start_date[:10] if start_date else None
+        end_day = end_date[:10] if end_date else None
+
+        series = Counter()
+        totals = {dimension: Counter() for dimension in DIMENSIONS}
+        for day, aggregates in self.days.items():
+            if (start_day and day < start_day) or (end_day and day >= end_day):
+                continue
+            series[bucket_start(date.fromisoformat(day), bucket).isoformat()] += aggregates['orders']
+            for dimension in DIMENSIONS:
+                totals[dimension].update(aggregates[dimension])
+
+        result = {
+            'bucket': bucket,
+            'total_orders': sum(series.values()),
+            'series': [{'period': period, 'orders': count} for period, count in sorted(series.items())],
+        }
+        for dimension, response_key in DIMENSIONS.items():
+            result[response_key] = top_counts(totals[dimension], top_n)
+        return result
@@ -0,0 +1,115 @@
+"""Request parsing and response shaping shared by the Flask views (app/routes.py) and the ASGI app's native routes
+(app/asgi.py), so both serve the same API. Nothing here depends on either framework."""
+import json
+import math
+from typing import Callable, Dict, List, Optional, Tuple
+from app.input_validations import InputHandler
+from app.pagination import decode_position, encode_position
+
+input_handler = InputHandler()
+
+# A response before either app renders it: body, status and extra headers
+Reply = Tuple[Dict, int, Dict]
+
+# Longest Retry-After sent with 429 responses, in seconds
+MAX_RETRY_AFTER = 3600
+
+# Retry-After sent when every stream slot of the worker is taken, in seconds
+STREAM_RETRY_AFTER = 5
+
+# Large fields the client sent, left out of responses to requests with Prefer: return=minimal
+ECHOED_TEXT_FIELDS = ('patient_records', 'medication_history', 'care_plan')
+
+# Change feed long-poll limits
+CHANGES_DEFAULT_TIMEOUT = 25
+CHANGES_MAX_TIMEOUT = 60
+CHANGES_PAGE_SIZE = 100
+
+# Seconds between keepalive comments on idle event streams
+STREAM_KEEPALIVE = 15
+
+NO_CACHE_HEADERS = {'Cache-Control': 'no-cache, no-store, must-revalidate', 'Pragma': 'no-cache', 'Expires': '0'}
+EVENT_STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+# Comments sent on event streams: on opening, so the headers go out at once, and to keep idle ones from being
+# closed by proxies
+CONNECTED_EVENT = ": connected\n\n"
+KEEPALIVE_EVENT = ": keepalive\n\n"
+
+VALIDATION_FAILED = "Validation request failed due to an internal error."
+GENERATION_FAILED = 'Failed to generate care plan due to an internal error.'
+SUBMISSION_FAILED = 'Failed to persist order due to an internal error.'
+CHANGES_FAILED = 'Failed to read changes due to an internal error.'
+
+def failed(message: str, status: int = 500) -> Reply:
+    return {'errors': [message]}, status, {}
+
+def minimal_order(order: Dict, keep=()) -> Dict:
+    return {k: v for k, v in order.items() if k in keep or k not in ECHOED_TEXT_FIELDS}
+
+def prefers_minimal(prefer_header: str) -> bool:
+    # Prefer: return=minimal (RFC 7240) asks for responses without the large fields the client just sent
+    preferences = [preference.strip().lower() for preference in prefer_header.split(',')]
+    return 'return=minimal' in preferences
+
+def retry_after_header(retry_after: float) -> str:
+    return str(max(1, math.ceil(min(retry_after, MAX_RETRY_AFTER))))
+
+def admission_message(reason: str) -> str:
+    if reason == 'rate_limited':
+        return 'Too many care plan requests. Please retry later.'
+    return 'The care plan service is busy. Please retry shortly.'
+
+def admission_rejected(decision) -> Reply:
+    """The 429 for a request admission control turned away."""
+    headers = {'Retry-After': retry_after_header(decision.retry_after)}
+    return {'errors': [admission_message(decision.reason)]}, 429, headers
+
+def streams_busy() -> Reply:
+    """The 503 for a stream opened while every stream slot of the worker is taken."""
+    return {'errors': ['Too many open streams. Please retry shortly.']}, 503, {'Retry-After': str(STREAM_RETRY_AFTER)}
+
+def check_order_input(data: Dict) -> Tuple[Dict, Optional[List[str]]]:
+    """Sanitize order input and check it on its own, before the store is asked. Returns the sanitized order and
+    its input errors, if any."""
+    sanitized_data = input_handler.sanitize_input(data)
+    return sanitized_data, input_handler.validate_input(sanitized_data) or None
+
+def validated(sanitized_data: Dict, warnings: Optional[List], echo_order: Callable) -> Reply:
+    return {'sanitized_data': echo_order(sanitized_data), 'warnings': warnings or None}, 200, {}
+
+def generated(data: Dict, care_plan: str, echo_order: Callable) -> Reply:
+    data['care_plan'] = care_plan
+    return {'full_order': echo_order(data, keep=('care_plan',))}, 200, {}
+
+def submitted(data: Dict, echo_order: Callable) -> Reply:
+    return {'full_order': echo_order(data)}, 200, {}
+
+def parse_changes_cursor(value: str):
+    # Change feed cursors are opaque, since a sharded store resumes each shard separately; 0 is the start
+    if not value or value == '0':
+        return None
+    return decode_position(value, "after must be a cursor from an earlier change feed response")
+
+def parse_changes_args(args) -> Tuple[str, int, float]:
+    """The `after` cursor as sent, page size and timeout of a change feed request, clamped to the limits."""
+    after = args.get('after', '0')
+    limit = min(max(args.get('limit', CHANGES_PAGE_SIZE, type=int), 1), CHANGES_PAGE_SIZE)
+    timeout = min(max(args.get('timeout', CHANGES_DEFAULT_TIMEOUT, type=float), 0), CHANGES_MAX_TIMEOUT)
+    return after, limit, timeout
+
+def stream_resume_cursor(headers, args):
+    """Where a change stream starts: after the Last-Event-ID a reconnecting client sends, or the `after` cursor."""
+    return parse_changes_cursor(headers.get('Last-Event-ID') or args.get('after', '0'))
+
+def changes_body(changes: list, after: str) -> Dict:
+    """The change feed response: the orders, and the cursor to pass as `after` next time."""
+    cursor = encode_position(changes[-1].cursor) if changes else after
+    return {'orders': [change.order for change in changes], 'cursor': cursor}
+
+def change_event(change) -> str:
+    """A server-sent event carrying one order, whose id resumes the feed right after it."""
+    return f"id: {encode_position(change.cursor)}\ndata: {json.dumps(change.order, default=str)}\n\n"
+
+def stats_event(stats: Dict) -> str:
+    return f"data: {json.dumps(stats)}\n\n"
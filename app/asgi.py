@@ -0,0 +1,479 @@
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qsl
+from flask import Flask
+from werkzeug.datastructures import Accept, Headers, MultiDict
+from werkzeug.http import parse_accept_header
+from app import metrics
+from app.admission import AsyncAdmissionController, AsyncFairSemaphore, client_identity
+from app.api import (
+    CHANGES_FAILED, CHANGES_PAGE_SIZE, CONNECTED_EVENT, EVENT_STREAM_HEADERS, GENERATION_FAILED, KEEPALIVE_EVENT,
+    NO_CACHE_HEADERS, STREAM_KEEPALIVE, SUBMISSION_FAILED, VALIDATION_FAILED, Reply, admission_rejected,
+    change_event, changes_body, check_order_input, failed, generated, minimal_order, parse_changes_args,
+    parse_changes_cursor, prefers_minimal, stats_event, stream_resume_cursor, streams_busy, submitted, validated
+)
+from app.async_data_store import AsyncDataStore
+from app.compression import compress_body, negotiate_encoding
+from app.factory import EXTENSION_KEY, create_app, create_async_care_plan_generator, create_async_store
+from app.stats_broadcaster import AsyncSubscription
+
+class RequestTooLarge(Exception):
+    pass
+
+class AsgiRequest:
+    """The parts of an ASGI HTTP request the native routes use."""
+
+    def __init__(self, scope: Dict, body: bytes):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = Headers([(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope.get('headers', [])])
+        self.args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.remote_addr = scope['client'][0] if scope.get('client') else None
+        self.body = body
+        self.return_minimal = prefers_minimal(self.headers.get('Prefer', ''))
+        self.return_minimal_applied = False
+
+    def echo_order(self, order: Dict, keep=()) -> Dict:
+        """Return an order for a response, without the echoed large fields if the client asked for a minimal response."""
+        if not self.return_minimal:
+            return order
+        self.return_minimal_applied = True
+        return minimal_order(order, keep)
+
+class AsyncResources:
+    """Per-event-loop resources of the ASGI app, next to the Flask app's per-process ones."""
+
+    def __init__(self, flask_app: Flask):
+        config = flask_app.config
+        self.config = config
+        self.sync = flask_app.extensions[EXTENSION_KEY]
+        self.store: AsyncDataStore = create_async_store(config, self.sync.store)
+        self.admission = AsyncAdmissionController(
+            self.store,
+            capacity=config['RATE_LIMIT_BURST'],
+            refill_rate=config['RATE_LIMIT_PER_MINUTE'] / 60,
+            max_concurrency=config['ASYNC_LLM_MAX_CONCURRENCY'],
+            max_wait=config['ADMISSION_MAX_WAIT'],
+            max_queue=config['ADMISSION_MAX_QUEUE']
+        )
+        # Open event streams; each is a coroutine, so far more can be open than with gunicorn's threads
+        self.stream_slots = AsyncFairSemaphore(config['ASYNC_STREAM_MAX_CONNECTIONS'], 0)
+        self._care_plan_generator = None
+
+    @property
+    def care_plan_generator(self):
+        # Only touched from the event loop's thread, so no lock is needed
+        if self._care_plan_generator is None:
+            self._care_plan_generator = create_async_care_plan_generator(self.config)
+        return self._care_plan_generator
+
+class AsgiApp:
+    """ASGI entry point. The request paths that wait on the database or the LLM run as coroutines; every other
+    route is served by the Flask app on a small thread pool, so the sync API keeps working unchanged."""
+
+    def __init__(self, flask_app: Flask):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=flask_app.config['ASGI_WSGI_THREADS'], thread_name_prefix='wsgi')
+        self._resources: Optional[AsyncResources] = None
+        self.routes: Dict[Tuple[str, str], Callable] = {
+            ('POST', '/care-plan/validate'): self.validate_order,
+            ('POST', '/care-plan/generate'): self.generate_care_plan,
+            ('POST', '/care-plan/submit'): self.submit_order,
+            ('GET', '/care-plan/stats'): self.get_stats,
+            ('GET', '/care-plan/changes'): self.get_changes,
+            ('GET', '/healthz'): self.liveness,
+            ('GET', '/readyz'): self.readiness,
+        }
+        # Server-sent event streams, served by async generators rather than on the thread pool
+        self.stream_routes: Dict[Tuple[str, str], Callable] = {
+            ('GET', '/care-plan/stats/stream'): self.stream_stats,
+            ('GET', '/care-plan/changes/stream'): self.stream_changes,
+        }
+
+    @property
+    def resources(self) -> AsyncResources:
+        if self._resources is None:
+            self._resources = AsyncResources(self.flask_app)
+        return self._resources
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']}")
+
+        key = (scope['method'], scope['path'])
+        if key in self.stream_routes:
+            await self.call_stream(self.stream_routes[key], scope, receive, send)
+        elif key in self.routes:
+            await self.call_native(self.routes[key], scope, receive, send)
+        else:
+            await self.call_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive: Callable, send: Callable):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        """Per-worker setup: the sync resources for bridged routes, then the async pool and LLM client."""
+        config = self.flask_app.config
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.resources.sync.init_worker)
+        await self.resources.store.open_pool(config['DATABASE_POOL_MIN_SIZE'], config['DATABASE_POOL_MAX_SIZE'])
+        try:
+            self.resources.care_plan_generator
+        except ValueError:
+            # Missing API key: generate requests report the error, the rest of the app still serves
+            pass
+
+    async def shutdown(self):
+        if self._resources is not None:
+            await self._resources.store.close()
+        self.executor.shutdown(wait=False)
+
+    async def call_native(self, handler: Callable, scope: Dict, receive: Callable, send: Callable):
+        route = scope['path']
+        started = time.perf_counter()
+        metrics.HTTP_REQUESTS_IN_FLIGHT.inc(1, route)
+        status = 500
+        try:
+            try:
+                request = AsgiRequest(scope, await self.read_body(receive))
+            except RequestTooLarge:
+                status = 413
+                await self.send_json(scope, send, {'errors': ['Request body is too large.']}, status, {})
+                return
+            body, status, headers = await handler(request)
+            if request.return_minimal_applied:
+                headers['Preference-Applied'] = 'return=minimal'
+            await self.send_json(scope, send, body, status, headers)
+        finally:
+            metrics.HTTP_REQUESTS_IN_FLIGHT.dec(1, route)
+            metrics.HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, scope['method'], route, status)
+
+    async def call_stream(self, handler: Callable, scope: Dict, receive: Callable, send: Callable):
+        """Serve a server-sent event stream from the async generator a stream route returns, within the worker's
+        ASYNC_STREAM_MAX_CONNECTIONS. A route may return a Reply instead, e.g. to reject a bad cursor."""
+        route = scope['path']
+        started = time.perf_counter()
+        metrics.HTTP_REQUESTS_IN_FLIGHT.inc(1, route)
+        status = 500
+        slots = self.resources.stream_slots
+        try:
+            if not await slots.acquire(0):
+                body, status, headers = streams_busy()
+                await self.send_json(scope, send, body, status, headers)
+                return
+            try:
+                # Stream routes are GETs, whose body isn't read so the disconnect can be watched for
+                result = await handler(AsgiRequest(scope, b''))
+                if isinstance(result, tuple):
+                    body, status, headers = result
+                    await self.send_json(scope, send, body, status, headers)
+                    return
+                status = 200
+                await self.send_events(receive, send, result)
+            finally:
+                slots.release()
+        finally:
+            metrics.HTTP_REQUESTS_IN_FLIGHT.dec(1, route)
+            metrics.HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, scope['method'], route, status)
+
+    async def send_events(self, receive: Callable, send: Callable, events: AsyncIterator[str]):
+        """Send each event as it's yielded, until the generator ends or the client goes away."""
+        headers = [('Content-Type', 'text/event-stream; charset=utf-8'), *EVENT_STREAM_HEADERS.items()]
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+        })
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        event = None
+        try:
+            while True:
+                event = asyncio.ensure_future(events.__anext__())
+                await asyncio.wait({event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if not event.done():
+                    break
+                try:
+                    chunk = event.result()
+                except StopAsyncIteration:
+                    await send({'type': 'http.response.body', 'body': b''})
+                    break
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+        finally:
+            disconnected.cancel()
+            # Cancelling a pending event runs the generator's cleanup, such as unsubscribing
+            if event is not None and not event.done():
+                event.cancel()
+                await asyncio.gather(event, return_exceptions=True)
+            await events.aclose()
+
+    async def read_body(self, receive: Callable) -> bytes:
+        limit = self.flask_app.config.get('MAX_CONTENT_LENGTH')
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if limit and size > limit:
+                raise RequestTooLarge()
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    async def send_json(self, scope: Dict, send: Callable, payload: Dict, status: int, headers: Dict):
+        body = self.flask_app.json.dumps(payload).encode('utf-8')
+        response_headers = [('Content-Type', 'application/json'), ('Vary', 'Accept-Encoding')]
+        response_headers.extend(headers.items())
+
+        # Same negotiation as the Flask app's compress hook
+        min_size = self.flask_app.config['COMPRESSION_MIN_SIZE']
+        if min_size and len(body) >= min_size:
+            accept_encoding = b','.join(v for k, v in scope.get('headers', []) if k.lower() == b'accept-encoding')
+            encoding = negotiate_encoding(parse_accept_header(accept_encoding.decode('latin-1'), Accept))
+            compressed = compress_body(body, encoding) if encoding else None
+            if compressed is not None:
+                body = compressed
+                response_headers.append(('Content-Encoding', encoding))
+        response_headers.append(('Content-Length', str(len(body))))
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in response_headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    # Native routes, mirroring the Flask views in app/routes.py
+
+    async def validate_order(self, request: AsgiRequest) -> Reply:
+        """Validate order data."""
+        try:
+            data = self.flask_app.json.loads(request.body)
+
+            # If basic input validation fails, return error response
+            sanitized_data, input_errors = check_order_input(data)
+            if input_errors:
+                return {'errors': input_errors}, 400, {}
+
+            # Return success response along with warnings
+            warnings = await self.resources.store.validate_order(sanitized_data)
+            return validated(sanitized_data, warnings, request.echo_order)
+        except Exception:
+            return failed(VALIDATION_FAILED)
+
+    async def generate_care_plan(self, request: AsgiRequest) -> Reply:
+        """Generate care plan using LLM, once admitted."""
+        admission = self.resources.admission
+        client = client_identity(request.headers.get('X-API-Key'), request.remote_addr)
+        decision = await admission.acquire('generate', client)
+        if not decision.admitted:
+            return admission_rejected(decision)
+        try:
+            data = self.flask_app.json.loads(request.body)
+            care_plan = await self.resources.care_plan_generator.generate_care_plan_with_llm(data)
+            return generated(data, care_plan, request.echo_order)
+        except Exception:
+            return failed(GENERATION_FAILED)
+        finally:
+            admission.release()
+
+    async def submit_order(self, request: AsgiRequest) -> Reply:
+        """Persist Full Validated Order with Care Plan in Internal Data Storage."""
+        try:
+            data = self.flask_app.json.loads(request.body)
+            store = self.resources.store
+            await store.add_patient(data['patient_mrn'], data['patient_first_name'], data['patient_last_name'])
+            await store.add_provider(data['provider_npi'], data['provider_name'])
+            await store.add_order(data)
+            self.resources.sync.stats_broadcaster.notify_change()
+            return submitted(data, request.echo_order)
+        except Exception:
+            return failed(SUBMISSION_FAILED)
+
+    async def get_stats(self, request: AsgiRequest) -> Reply:
+        """Get statistics about stored data."""
+        return await self.resources.store.get_stats(), 200, dict(NO_CACHE_HEADERS)
+
+    async def get_changes(self, request: AsgiRequest) -> Reply:
+        """Long-poll for orders persisted after the `after` cursor, without holding a thread."""
+        try:
+            after, limit, timeout = parse_changes_args(request.args)
+            changes = await self.resources.store.get_changes(parse_changes_cursor(after), limit, timeout)
+            return changes_body(changes, after), 200, {}
+        except ValueError as e:
+            return failed(str(e), 400)
+        except Exception:
+            return failed(CHANGES_FAILED)
+
+    async def stream_stats(self, request: AsgiRequest) -> Union[Reply, AsyncIterator[str]]:
+        """Stream statistics as server-sent events whenever stored data changes."""
+        broadcaster = self.resources.sync.stats_broadcaster
+        subscription = broadcaster.subscribe(AsyncSubscription())
+
+        async def events():
+            try:
+                while True:
+                    try:
+                        yield stats_event(await subscription.get(STREAM_KEEPALIVE))
+                    except asyncio.TimeoutError:
+                        yield KEEPALIVE_EVENT
+            finally:
+                broadcaster.unsubscribe(subscription)
+
+        return events()
+
+    async def stream_changes(self, request: AsgiRequest) -> Union[Reply, AsyncIterator[str]]:
+        """Stream persisted orders as server-sent events, resuming after `after` or the Last-Event-ID header.
+        New orders come from the process's change broadcaster; the store is only read to catch up."""
+        store = self.resources.store
+        broadcaster = self.resources.sync.change_broadcaster
+        # Subscribing before the first read means no batch published meanwhile is missed
+        subscription = broadcaster.subscribe(AsyncSubscription())
+        try:
+            after = stream_resume_cursor(request.headers, request.args)
+            # Reading the first page here turns a cursor the store doesn't recognize into a 400
+            pending = await store.get_changes(after, CHANGES_PAGE_SIZE, 0)
+        except ValueError as e:
+            broadcaster.unsubscribe(subscription)
+            return failed(str(e), 400)
+        except BaseException:
+            broadcaster.unsubscribe(subscription)
+            raise
+
+        async def events(cursor, changes):
+            try:
+                yield CONNECTED_EVENT
+                while True:
+                    for change in changes:
+                        cursor = change.cursor
+                        yield change_event(change)
+                    if len(changes) == CHANGES_PAGE_SIZE:
+                        # Still catching up on a backlog
+                        changes = await store.get_changes(cursor, CHANGES_PAGE_SIZE, 0)
+                        continue
+                    try:
+                        batch = await subscription.get(STREAM_KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        yield KEEPALIVE_EVENT
+                        changes = []
+                        continue
+                    # A batch that doesn't follow on from this stream's cursor means some were replaced unread
+                    changes = batch.changes if batch.after == cursor else await store.get_changes(cursor, CHANGES_PAGE_SIZE, 0)
+            finally:
+                broadcaster.unsubscribe(subscription)
+
+        return events(after, pending)
+
+    async def liveness(self, request: AsgiRequest) -> Reply:
+        """Liveness probe: the event loop is up and serving requests."""
+        return {'status': 'ok'}, 200, {}
+
+    async def readiness(self, request: AsgiRequest) -> Reply:
+        """Readiness probe: the store is reachable and its schema has been migrated."""
+        try:
+            await self.resources.store.get_version()
+        except Exception:
+            return {'status': 'unavailable'}, 503, {}
+        return {'status': 'ready'}, 200, {}
+
+    # Every other route goes through the Flask app
+
+    async def call_wsgi(self, scope: Dict, receive: Callable, send: Callable):
+        """Serve a request with the Flask app on the thread pool, streaming its body chunk by chunk."""
+        loop = asyncio.get_running_loop()
+        try:
+            body = await self.read_body(receive)
+        except RequestTooLarge:
+            await self.send_json(scope, send, {'errors': ['Request body is too large.']}, 413, {})
+            return
+
+        started = {}
+        def start_response(status: str, headers: List[Tuple[str, str]], exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        chunks = await loop.run_in_executor(self.executor, self.flask_app, wsgi_environ(scope, body), start_response)
+        await send({
+            'type': 'http.response.start',
+            'status': started['status'],
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in started['headers']],
+        })
+
+        # Streams such as server-sent events end when the client goes away
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        iterator = iter(chunks)
+        try:
+            while not disconnected.done():
+                chunk = await loop.run_in_executor(self.executor, next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not disconnected.done():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            if hasattr(chunks, 'close'):
+                await loop.run_in_executor(self.executor, chunks.close)
+
+async def wait_for_disconnect(receive: Callable):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+def wsgi_environ(scope: Dict, body: bytes) -> Dict:
+    """Build a WSGI environ from an ASGI HTTP scope and its buffered body."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(body)),
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def create_asgi_app(config_overrides: Optional[Dict] = None) -> AsgiApp:
+    """Create the ASGI app around a Flask app created with the same configuration."""
+    return AsgiApp(create_app(config_overrides))
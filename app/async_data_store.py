@@ -0,0 +1,153 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List
+from app.data_store import Change, DataStore
+from app.in_memory_data_store import InMemoryDataStore
+
+class AsyncDataStore(ABC):
+    """Coroutine version of the DataStore methods on the request path of the ASGI app. Everything else
+    (exports, listings, analytics) is still served by the sync store."""
+
+    CONFLICT_KEY = DataStore.CONFLICT_KEY
+    ERROR_MESSAGE_KEY = DataStore.ERROR_MESSAGE_KEY
+
+    similarity_threshold: float
+
+    async def validate_order(self, data: Dict) -> List:
+        warnings = []
+
+        # Check for duplicate provider with different name or different npi
+        provider_check = await self.validate_provider(data['provider_npi'], data['provider_name'])
+        if provider_check.get(self.CONFLICT_KEY, False):
+            warnings.append(provider_check.get(self.ERROR_MESSAGE_KEY, "Provider Input Error"))
+
+        # Check for duplicate patient
+        patient_check = await self.validate_patient(
+            data['patient_mrn'],
+            data['patient_first_name'],
+            data['patient_last_name']
+        )
+        if patient_check.get(self.CONFLICT_KEY, False):
+            warnings.append(patient_check.get(self.ERROR_MESSAGE_KEY, "Patient Input Error"))
+
+        # Check for duplicate order
+        if await self.check_duplicate_order(data['patient_mrn'], data['medication']):
+            warnings.append(
+                f"A similar order already exists for patient {data['patient_mrn']} "
+                f"with medication {data['medication']}"
+            )
+        else:
+            # Check for near-duplicate orders such as "IVIG" vs "Immune Globulin 10%"
+            for match in await self.find_similar_orders(data['patient_mrn'], data['medication'], self.similarity_threshold):
+                warnings.append(
+                    f"A similar order already exists for patient {data['patient_mrn']} "
+                    f"with medication {match['medication']} (similarity {match['similarity']:.0%})"
+                )
+
+        # Return all the validation warnings that exist
+        return warnings
+
+    @abstractmethod
+    async def validate_provider(self, npi: str, name: str) -> Dict:
+        pass
+
+    @abstractmethod
+    async def add_provider(self, npi: str, name: str):
+        pass
+
+    @abstractmethod
+    async def validate_patient(self, mrn: str, first_name: str, last_name: str) -> Dict:
+        pass
+
+    @abstractmethod
+    async def add_patient(self, mrn: str, first_name: str, last_name: str):
+        pass
+
+    @abstractmethod
+    async def check_duplicate_order(self, mrn: str, medication: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def find_similar_orders(self, mrn: str, medication: str, threshold: float) -> List[Dict]:
+        pass
+
+    @abstractmethod
+    async def add_order(self, order_data: Dict):
+        pass
+
+    @abstractmethod
+    async def get_changes(self, after: Any, limit: int, timeout: float) -> List[Change]:
+        pass
+
+    @abstractmethod
+    async def get_version(self) -> int:
+        pass
+
+    @abstractmethod
+    async def get_stats(self) -> Dict:
+        pass
+
+    @abstractmethod
+    async def consume_rate_limit(self, key: str, capacity: float, refill_rate: float, cost: float = 1.0) -> float:
+        pass
+
+    async def open_pool(self, min_size: int, max_size: int):
+        """Open the event loop's connection pool. Stores without connections do nothing."""
+        pass
+
+    async def close(self):
+        """Close the connection pool when the event loop shuts down."""
+        pass
+
+class AsyncInMemoryDataStore(AsyncDataStore):
+    """Async view of an InMemoryDataStore. Its operations never block on I/O, so they run inline on the event
+    loop, and the sync app serving the same process sees the same data."""
+
+    # Seconds between checks while a change feed request waits for new orders
+    CHANGES_POLL_INTERVAL = 0.1
+
+    def __init__(self, store: InMemoryDataStore):
+        self.store = store
+        self.similarity_threshold = store.similarity_threshold
+
+    async def validate_provider(self, npi: str, name: str) -> Dict:
+        return self.store.validate_provider(npi, name)
+
+    async def add_provider(self, npi: str, name: str):
+        self.store.add_provider(npi, name)
+
+    async def validate_patient(self, mrn: str, first_name: str, last_name: str) -> Dict:
+        return self.store.validate_patient(mrn, first_name, last_name)
+
+    async def add_patient(self, mrn: str, first_name: str, last_name: str):
+        self.store.add_patient(mrn, first_name, last_name)
+
+    async def check_duplicate_order(self, mrn: str, medication: str) -> bool:
+        return self.store.check_duplicate_order(mrn, medication)
+
+    async def find_similar_orders(self, mrn: str, medication: str, threshold: float) -> List[Dict]:
+        return self.store.find_similar_orders(mrn, medication, threshold)
+
+    async def add_order(self, order_data: Dict):
+        self.store.add_order(order_data)
+
+    async def get_changes(self, after: Any, limit: int, timeout: float) -> List[Change]:
+        """Get orders added after a cursor, waiting up to timeout seconds for one to arrive."""
+        # Waiting on the store's condition would block the loop, so poll instead
+        deadline = time.monotonic() + timeout
+        while True:
+            changes = self.store.get_changes(after, limit, 0)
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                return changes
+            await asyncio.sleep(min(self.CHANGES_POLL_INTERVAL, remaining))
+
+    async def get_version(self) -> int:
+        return self.store.get_version()
+
+    async def get_stats(self) -> Dict:
+        return self.store.get_stats()
+
+    async def consume_rate_limit(self, key: str, capacity: float, refill_rate: float, cost: float = 1.0) -> float:
+        return self.store.consume_rate_limit(key, capacity, refill_rate, cost)
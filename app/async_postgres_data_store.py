@@ -0,0 +1,163 @@
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+import psycopg
+from psycopg.rows import dict_row
+from app.async_data_store import AsyncDataStore
+from app.change_signal import ChangeSignal
+from app.data_store import Change
+from app.medication_matching import normalize_medication, DEFAULT_SIMILARITY_THRESHOLD, MAX_SIMILAR_RESULTS
+from app.postgres_data_store import PostgreSQLDataStore
+from app.text_blobs import TextCodec
+
+try:
+    import psycopg_pool
+except ImportError:
+    psycopg_pool = None
+
+# The sync store owns the schema and the SQL, so both stores always agree on them
+SQL = PostgreSQLDataStore
+
+class AsyncPostgreSQLDataStore(AsyncDataStore):
+    """PostgreSQL store on psycopg's AsyncConnection, so waiting on the database never ties up a thread."""
+
+    def __init__(self, database_url: str = None, similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+                 codec: Optional[TextCodec] = None, order_signal: Optional[ChangeSignal] = None):
+        self.database_url = database_url
+        self.similarity_threshold = similarity_threshold
+        if not self.database_url:
+            raise ValueError("Database URL hasn't been provided.")
+        self.pool = None
+        # Without the sync store's codec, text is compressed without a dictionary and dictionaries can't be loaded
+        self.codec = codec or TextCodec()
+        # Without the sync store's signal nothing wakes change feed waits, which then re-read periodically
+        self.order_signal = order_signal or ChangeSignal()
+
+    async def open_pool(self, min_size: int, max_size: int):
+        """Open a connection pool for this event loop if psycopg_pool is installed."""
+        if psycopg_pool is None or self.pool is not None:
+            return
+        self.pool = psycopg_pool.AsyncConnectionPool(self.database_url, min_size=min_size, max_size=max_size, open=False)
+        await self.pool.open()
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    @asynccontextmanager
+    async def _conn(self):
+        # Get a pooled connection if a pool was opened, otherwise a new one
+        if self.pool is not None:
+            async with self.pool.connection() as conn:
+                yield conn
+        else:
+            async with await psycopg.AsyncConnection.connect(self.database_url) as conn:
+                yield conn
+
+    async def validate_provider(self, npi: str, name: str) -> Dict:
+        """Validate provider. Returns conflict if exists with different name or NPI."""
+        normalized = name.lower().strip()
+
+        async with self._conn() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                # Check if this NPI already exists with a different name
+                await cur.execute(SQL.SELECT_PROVIDER_BY_NPI_SQL, (npi,))
+                if conflict := SQL.npi_conflict(npi, normalized, await cur.fetchone()):
+                    return conflict
+
+                # Check name with different NPI
+                await cur.execute(SQL.SELECT_PROVIDER_BY_NAME_SQL, (normalized,))
+                if conflict := SQL.name_conflict(npi, name, await cur.fetchone()):
+                    return conflict
+
+        return {self.CONFLICT_KEY: False}
+
+    async def add_provider(self, npi: str, name: str):
+        """Add provider."""
+        async with self._conn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SQL.INSERT_PROVIDER_SQL, (npi, name, name.lower().strip()))
+                await conn.commit()
+
+    async def validate_patient(self, mrn: str, first_name: str, last_name: str) -> Dict:
+        """Validate patient. Returns conflict if MRN exists with different name."""
+        async with self._conn() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(SQL.SELECT_PATIENT_SQL, (mrn,))
+                return SQL.patient_conflict(mrn, first_name, last_name, await cur.fetchone())
+
+    async def add_patient(self, mrn: str, first_name: str, last_name: str):
+        """Add patient."""
+        async with self._conn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SQL.INSERT_PATIENT_SQL, (mrn, first_name, last_name))
+                await conn.commit()
+
+    async def check_duplicate_order(self, mrn: str, medication: str) -> bool:
+        """Check if an identical order already exists."""
+        async with self._conn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SQL.SELECT_DUPLICATE_ORDER_SQL, (mrn, medication))
+                return await cur.fetchone() is not None
+
+    async def find_similar_orders(self, mrn: str, medication: str, threshold: float) -> List[Dict]:
+        """Find a patient's previous orders whose normalized medication is similar to this one."""
+        normalized = normalize_medication(medication)
+        if not normalized:
+            return []
+
+        async with self._conn() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(SQL.SET_SIMILARITY_THRESHOLD_SQL, (str(threshold),))
+                await cur.execute(SQL.SELECT_SIMILAR_ORDERS_SQL, (normalized, mrn, normalized, MAX_SIMILAR_RESULTS))
+                return SQL.similar_orders(await cur.fetchall())
+
+    async def add_order(self, order_data: Dict):
+        """Add order."""
+        async with self._conn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SQL.INSERT_ORDER_SQL, SQL.order_params(order_data, self.codec))
+                await conn.commit()
+
+    async def get_changes(self, after: Optional[List[int]], limit: int, timeout: float) -> List[Change]:
+        """Get orders added after a cursor, waiting up to timeout seconds for one to arrive. Cursors and
+        ordering are the sync store's, and so is the listener that wakes waiting requests."""
+        position = SQL.change_position(after)
+        deadline = time.monotonic() + timeout
+        while True:
+            generation = self.order_signal.generation
+            async with self._conn() as conn:
+                async with conn.cursor(row_factory=dict_row) as cur:
+                    await cur.execute(SQL.SELECT_CHANGES_SQL, (*position, limit))
+                    changes = SQL.changes(await cur.fetchall(), self.codec)
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                return changes
+            await self.order_signal.wait_async(generation, min(remaining, SQL.CHANGES_RECHECK_INTERVAL))
+
+    async def get_version(self) -> int:
+        """Get a counter that changes whenever stored data changes."""
+        async with self._conn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SQL.SELECT_VERSION_SQL)
+                return (await cur.fetchone())[0]
+
+    async def get_stats(self) -> Dict:
+        """Get statistics."""
+        async with self._conn() as conn:
+            async with conn.cursor() as cur:
+                counts = []
+                for query in SQL.COUNT_SQL:
+                    await cur.execute(query)
+                    counts.append((await cur.fetchone())[0])
+                return SQL.stats(counts)
+
+    async def consume_rate_limit(self, key: str, capacity: float, refill_rate: float, cost: float = 1.0) -> float:
+        """Take cost tokens from a token bucket. Returns 0 if they were taken, else seconds until they're available."""
+        async with self._conn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SQL.CONSUME_RATE_LIMIT_SQL, SQL.rate_limit_params(key, capacity, refill_rate, cost))
+                tokens, allowed = await cur.fetchone()
+                await conn.commit()
+        return SQL.retry_after(tokens, allowed, refill_rate, cost)
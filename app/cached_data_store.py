@@ -0,0 +1,283 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from app.data_store import Change, DataStore
+from app.metrics import IDENTITY_CACHE_LOOKUPS
+from app.replicas import reading_from_primary
+
+def _normalize(name: str) -> str:
+    return name.lower().strip()
+
+class IdentityCache:
+    """Bounded LRU of provider and patient validation results, with an optional time to live.
+    Entries are indexed by the NPI, provider name and MRN they depend on, so a write drops just those."""
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation = 0  # Bumped by every invalidation, so lookups that raced one aren't cached
+        self._entries = OrderedDict()  # Key -> (result, expiry, index keys), least recent first
+        self._index: Dict[Tuple, set] = {}  # Index key -> keys of the entries depending on it
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Tuple) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return dict(entry[0])
+
+    def put(self, key: Tuple, result: Dict, index_keys: Sequence[Tuple], generation: Optional[int] = None):
+        """Cache a result, unless the cache was invalidated since generation was read."""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            expiry = time.monotonic() + self.ttl if self.ttl else None
+            self._entries[key] = (dict(result), expiry, tuple(index_keys))
+            for index_key in index_keys:
+                self._index.setdefault(index_key, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, index_keys: Sequence[Tuple]):
+        """Drop every entry depending on any of the index keys."""
+        with self._lock:
+            self.generation += 1
+            for index_key in index_keys:
+                for key in list(self._index.get(index_key, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._index.clear()
+
+    def _remove(self, key: Tuple):
+        _, _, index_keys = self._entries.pop(key)
+        for index_key in index_keys:
+            keys = self._index.get(index_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[index_key]
+
+class CachedDataStore(DataStore):
+    """Wraps another DataStore, answering provider and patient validations from an in-process cache.
+    Adds through this store invalidate the entries they affect right away; writes by other processes arrive
+    through the inner store's listen_identity_changes, and any gap in those drops the whole cache."""
+
+    LISTEN_WAIT = 5.0  # Seconds warm waits for the listener to connect
+
+    def __init__(self, inner: DataStore, max_size: int = 10000, ttl: Optional[float] = None):
+        self.inner = inner
+        self.cache = IdentityCache(max_size, ttl)
+        self._stop = threading.Event()
+        self._listening = threading.Event()  # Set once the listener has reported in
+        self._listener: Optional[threading.Thread] = None
+        self._listener_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Backend-specific attributes, such as the PostgreSQL store's codec, come from the inner store
+        if name == 'inner':
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    @property
+    def similarity_threshold(self) -> float:
+        return self.inner.similarity_threshold
+
+    @staticmethod
+    def provider_index_keys(npi: str, name: str) -> List[Tuple]:
+        return [('npi', npi), ('provider_name', _normalize(name))]
+
+    @staticmethod
+    def patient_index_keys(mrn: str) -> List[Tuple]:
+        return [('mrn', mrn)]
+
+    def validate_provider(self, npi: str, name: str) -> Dict:
+        return self._lookup(
+            'provider', ('provider', npi, name), self.provider_index_keys(npi, name),
+            lambda: self.inner.validate_provider(npi, name)
+        )
+
+    def add_provider(self, npi: str, name: str):
+        try:
+            return self.inner.add_provider(npi, name)
+        finally:
+            self.cache.invalidate(self.provider_index_keys(npi, name))
+
+    def validate_patient(self, mrn: str, first_name: str, last_name: str) -> Dict:
+        return self._lookup(
+            'patient', ('patient', mrn, first_name, last_name), self.patient_index_keys(mrn),
+            lambda: self.inner.validate_patient(mrn, first_name, last_name)
+        )
+
+    def add_patient(self, mrn: str, first_name: str, last_name: str):
+        try:
+            return self.inner.add_patient(mrn, first_name, last_name)
+        finally:
+            self.cache.invalidate(self.patient_index_keys(mrn))
+
+    def _lookup(self, kind: str, key: Tuple, index_keys: List[Tuple], load: Callable[[], Dict]) -> Dict:
+        self.start_listener()
+        result = self.cache.get(key)
+        if result is not None:
+            IDENTITY_CACHE_LOOKUPS.inc(1, kind, 'hit')
+            return result
+        IDENTITY_CACHE_LOOKUPS.inc(1, kind, 'miss')
+        generation = self.cache.generation
+        # A replica may not have replayed a write whose invalidation already arrived, and what's cached is trusted
+        # for longer than replicas may lag, so misses are loaded from the primary
+        with reading_from_primary():
+            result = load()
+        self.cache.put(key, result, index_keys, generation)
+        return result
+
+    def warm(self, limit: int) -> int:
+        """Cache the validations of up to limit stored providers and patients. Returns how many were cached."""
+        # The listener clears the cache when it connects, which would drop entries warmed before that
+        self.start_listener()
+        deadline = time.monotonic() + self.LISTEN_WAIT
+        while not self._listening.wait(0.05) and self._listener.is_alive() and time.monotonic() < deadline:
+            pass
+        no_conflict = {self.CONFLICT_KEY: False}
+        count = 0
+        generation = self.cache.generation
+        for provider in self.inner.iter_providers(limit):
+            self.cache.put(('provider', provider['npi'], provider['name']), no_conflict,
+                           self.provider_index_keys(provider['npi'], provider['name']), generation)
+            count += 1
+        for patient in self.inner.iter_patients(limit):
+            self.cache.put(('patient', patient['mrn'], patient['first_name'], patient['last_name']), no_conflict,
+                           self.patient_index_keys(patient['mrn']), generation)
+            count += 1
+        return count
+
+    def on_identity_change(self, change: Optional[Dict]):
+        """Invalidate the entries a provider or patient write by any process affects."""
+        self._listening.set()
+        if change is None:
+            self.cache.clear()
+            return
+        row = change.get('row') or {}
+        if change.get('table') == 'providers':
+            self.cache.invalidate(self.provider_index_keys(row.get('npi'), row.get('name') or ''))
+        elif change.get('table') == 'patients':
+            self.cache.invalidate(self.patient_index_keys(row.get('mrn')))
+        else:
+            self.cache.clear()
+
+    def start_listener(self):
+        """Start following writes by other processes, once per process."""
+        if self._listener is not None:
+            return
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(
+                    target=self.inner.listen_identity_changes, args=(self.on_identity_change, self._stop),
+                    name='identity-cache-listener', daemon=True
+                )
+                self._listener.start()
+
+    def close(self):
+        self._stop.set()
+
+    def check_duplicate_order(self, mrn: str, medication: str) -> bool:
+        return self.inner.check_duplicate_order(mrn, medication)
+
+    def find_similar_orders(self, mrn: str, medication: str, threshold: float) -> List[Dict]:
+        return self.inner.find_similar_orders(mrn, medication, threshold)
+
+    def add_order(self, order_data: Dict):
+        return self.inner.add_order(order_data)
+
+    def export_orders(self, since_order_id: Optional[int] = None, since_timestamp: Optional[str] = None,
+                      text_fields: Sequence[str] = DataStore.LARGE_TEXT_FIELDS) -> List[Dict]:
+        return self.inner.export_orders(since_order_id, since_timestamp, text_fields)
+
+    def iter_orders(self, since_order_id: Optional[int] = None, batch_size: int = 1000,
+                    text_fields: Sequence[str] = DataStore.LARGE_TEXT_FIELDS) -> Iterator[Dict]:
+        yield from self.inner.iter_orders(since_order_id, batch_size, text_fields)
+
+    def get_order_details(self, order_ids: List[int],
+                          fields: Sequence[str] = DataStore.LARGE_TEXT_FIELDS) -> Dict[int, Dict]:
+        return self.inner.get_order_details(order_ids, fields)
+
+    def get_changes(self, after: Any, limit: int, timeout: float) -> List[Change]:
+        return self.inner.get_changes(after, limit, timeout)
+
+    def get_change_cursor(self) -> Any:
+        return self.inner.get_change_cursor()
+
+    def get_version(self) -> int:
+        return self.inner.get_version()
+
+    def get_stats(self) -> Dict:
+        return self.inner.get_stats()
+
+    def list_orders(self, limit: int, cursor: Optional[str] = None, provider_npi: Optional[str] = None,
+                    patient_mrn: Optional[str] = None, medication: Optional[str] = None,
+                    start_date: Optional[str] = None, end_date: Optional[str] = None,
+                    include_text: bool = False) -> Dict:
+        return self.inner.list_orders(limit, cursor, provider_npi, patient_mrn, medication, start_date, end_date,
+                                      include_text)
+
+    def get_patient_history(self, mrn: str, limit: int) -> Dict:
+        return self.inner.get_patient_history(mrn, limit)
+
+    def search_orders(self, query: str, limit: int, offset: int = 0, include_text: bool = False) -> Dict:
+        return self.inner.search_orders(query, limit, offset, include_text)
+
+    def query_care_plans(self, section: str, terms: Sequence[str], limit: int, offset: int = 0) -> Dict:
+        return self.inner.query_care_plans(section, terms, limit, offset)
+
+    def get_analytics(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                      bucket: str = 'day', top_n: int = 10) -> Dict:
+        return self.inner.get_analytics(start_date, end_date, bucket, top_n)
+
+    def consume_rate_limit(self, key: str, capacity: float, refill_rate: float, cost: float = 1.0) -> float:
+        return self.inner.consume_rate_limit(key, capacity, refill_rate, cost)
+
+    def migrate(self):
+        return self.inner.migrate()
+
+    def open_pool(self, min_size: int, max_size: int):
+        return self.inner.open_pool(min_size, max_size)
+
+    def ensure_partitions(self):
+        return self.inner.ensure_partitions()
+
+    def prune_rate_limits(self, capacity: float, refill_rate: float) -> int:
+        return self.inner.prune_rate_limits(capacity, refill_rate)
+
+    def archive_orders(self, retention_months: int) -> List[Dict]:
+        return self.inner.archive_orders(retention_months)
+
+    def iter_archived_orders(self, since_order_id: Optional[int] = None) -> Iterator[Dict]:
+        yield from self.inner.iter_archived_orders(since_order_id)
+
+    def iter_providers(self, limit: int) -> Iterator[Dict]:
+        yield from self.inner.iter_providers(limit)
+
+    def iter_patients(self, limit: int) -> Iterator[Dict]:
+        yield from self.inner.iter_patients(limit)
+
+    def listen_identity_changes(self, on_change: Callable[[Optional[Dict]], None], stop):
+        return self.inner.listen_identity_changes(on_change, stop)
+
+    def compress_text(self) -> Dict:
+        return self.inner.compress_text()
+
+    def parse_care_plans(self) -> int:
+        return self.inner.parse_care_plans()
@@ -1,6 +1,9 @@
+import asyncio
 import os
-from anthropic import Anthropic
-from app.prompt import generate_prompt
+import time
+from app.prompt import generate_prompt, select_example
+from app.metrics import LLM_ERRORS, record_llm_usage
+from app.profiling import traced
 from typing import Dict
 
 class CarePlanGenerator:
@@ -9,30 +12,136 @@ class CarePlanGenerator:
     MAX_TOKENS_LIMIT = 4500
 
     def __init__(self):
-        # Initialize anthropic client
+        # Initialize anthropic client, importing the SDK only when a generator is first needed
         api_key = os.environ.get('ANTHROPIC_API_KEY')
         if not api_key:
             raise ValueError("API Key hasn't been provided")
+        from anthropic import Anthropic
         self.client = Anthropic(api_key=api_key)
     
+    @traced('llm.generate_care_plan')
     def generate_care_plan_with_llm(self, data: Dict) -> str:
         """Generate care plan using LLM."""
         try:        
-            # Generate prompt
-            prompt = generate_prompt(data)
+            # Pick the example once, then generate the prompt around it
+            example = select_example(data)
+            prompt = generate_prompt(data, example)
 
-            # Invoke claude-sonnet-4-5-20250929 LLM with prompt
-            message = self.client.messages.create(
+            # Stream the claude-sonnet-4-5-20250929 response so time-to-first-token can be measured
+            start = time.perf_counter()
+            first_token_at = None
+            with self.client.messages.stream(
                 model=self.MODEL_NAME,
                 max_tokens=self.MAX_TOKENS_LIMIT,
                 messages=[
                     {"role": "user", "content": prompt}
                 ]
+            ) as stream:
+                for _ in stream.text_stream:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                message = stream.get_final_message()
+
+            # Record latency and token usage
+            record_llm_usage(
+                message.usage,
+                time.perf_counter() - start,
+                first_token_at - start if first_token_at is not None else None,
+                example=example.name
             )
-            
+
             # Return LLM response
             return message.content[0].text
         except Exception as e:
             # raise runtime error if LLM call fails
+            LLM_ERRORS.inc()
             raise RuntimeError("LLM call failed to return a valid response without any internal errors")
-        
\ No newline at end of file
+
+class AsyncCarePlanGenerator(CarePlanGenerator):
+    """CarePlanGenerator on the async Anthropic client, so a waiting LLM call holds a coroutine, not a thread."""
+
+    def __init__(self):
+        api_key = os.environ.get('ANTHROPIC_API_KEY')
+        if not api_key:
+            raise ValueError("API Key hasn't been provided")
+        from anthropic import AsyncAnthropic
+        self.client = AsyncAnthropic(api_key=api_key)
+
+    @traced('llm.generate_care_plan')
+    async def generate_care_plan_with_llm(self, data: Dict) -> str:
+        """Generate care plan using LLM."""
+        try:
+            example = select_example(data)
+            prompt = generate_prompt(data, example)
+
+            start = time.perf_counter()
+            first_token_at = None
+            async with self.client.messages.stream(
+                model=self.MODEL_NAME,
+                max_tokens=self.MAX_TOKENS_LIMIT,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ]
+            ) as stream:
+                async for _ in stream.text_stream:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                message = await stream.get_final_message()
+
+            record_llm_usage(
+                message.usage,
+                time.perf_counter() - start,
+                first_token_at - start if first_token_at is not None else None,
+                example=example.name
+            )
+            return message.content[0].text
+        except Exception as e:
+            LLM_ERRORS.inc()
+            raise RuntimeError("LLM call failed to return a valid response without any internal errors")
+
+class OfflineCarePlanGenerator:
+    """Stand-in for CarePlanGenerator that never calls the LLM, for load tests and local development."""
+
+    DEFAULT_LATENCY = 2.0
+
+    def __init__(self, latency: float = None):
+        # Seconds each care plan takes, simulating LLM latency
+        if latency is None:
+            latency = float(os.environ.get('OFFLINE_LLM_LATENCY', self.DEFAULT_LATENCY))
+        self.latency = latency
+
+    @traced('llm.generate_care_plan')
+    def generate_care_plan_with_llm(self, data: Dict) -> str:
+        """Return a templated care plan after the configured latency."""
+        example = select_example(data)
+        prompt = generate_prompt(data, example)
+        start = time.perf_counter()
+        time.sleep(self.latency)
+        record_llm_usage(None, time.perf_counter() - start, example=example.name)
+        return self.render(data, prompt)
+
+    @staticmethod
+    def render(data: Dict, prompt: str) -> str:
+        return (
+            f"Care plan for {data.get('patient_first_name', '')} {data.get('patient_last_name', '')} "
+            f"(MRN {data.get('patient_mrn', '')})\n"
+            f"1. Problem list / Drug therapy problems: {data.get('primary_diagnosis', '')} treated with "
+            f"{data.get('medication', '')}.\n"
+            "2. Goals (SMART): Symptom improvement without adverse reactions.\n"
+            "3. Pharmacist interventions / plan: Verify dose, premedication and infusion rate.\n"
+            "4. Monitoring plan & lab schedule: Baseline and follow-up CBC, BMP and vitals.\n"
+            f"(Offline stand-in generated from a {len(prompt)}-character prompt.)"
+        )
+
+class AsyncOfflineCarePlanGenerator(OfflineCarePlanGenerator):
+    """OfflineCarePlanGenerator for the ASGI app: the simulated latency doesn't hold up the event loop."""
+
+    @traced('llm.generate_care_plan')
+    async def generate_care_plan_with_llm(self, data: Dict) -> str:
+        """Return a templated care plan after the configured latency."""
+        example = select_example(data)
+        prompt = generate_prompt(data, example)
+        start = time.perf_counter()
+        await asyncio.sleep(self.latency)
+        record_llm_usage(None, time.perf_counter() - start, example=example.name)
+        return self.render(data, prompt)
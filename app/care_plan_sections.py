@@ -0,0 +1,77 @@
+import re
+from typing import Dict, List, Optional
+
+# The sections generate_prompt asks for, in order
+SECTIONS = ('problems', 'goals', 'interventions', 'monitoring')
+
+# Heading text (after numbering and markdown are stripped) -> section. Sub-items such as "Monitoring during
+# infusion" inside the interventions aren't headings, so monitoring needs the full heading.
+HEADING_PATTERNS = (
+    (re.compile(r"^(problem list|drug therapy problems|problems\b)"), 'problems'),
+    (re.compile(r"^goals\b"), 'goals'),
+    (re.compile(r"^(pharmacist interventions|interventions\b)"), 'interventions'),
+    (re.compile(r"^(monitoring plan|monitoring (and|&) lab|lab schedule)"), 'monitoring'),
+)
+HEADING_DECORATION_PATTERN = re.compile(r"^(#+\s*|\*\*|__)?\s*(\d+[.)]\s*)?(\*\*|__)?")
+BULLET_PATTERN = re.compile(r"^([-*•–]|\d+[.)]|[a-z][.)])\s+")
+TERM_PATTERN = re.compile(r"[a-z][a-z0-9]+")
+
+# Words too common in care plans to narrow a query
+STOP_WORDS = frozenset({
+    'and', 'the', 'for', 'with', 'per', 'of', 'to', 'in', 'on', 'or', 'if', 'as', 'at', 'by', 'be', 'is',
+    'are', 'any', 'not', 'from', 'each', 'than', 'then', 'within', 'before', 'after', 'during',
+})
+
+def _heading(line: str) -> Optional[str]:
+    # Bulleted lines are items, whatever they say
+    if line.strip()[:1] in ('-', '*', '•', '–') and not line.strip().startswith('**'):
+        return None
+    text = HEADING_DECORATION_PATTERN.sub("", line.strip()).lower()
+    for pattern, section in HEADING_PATTERNS:
+        if pattern.match(text):
+            return section
+    return None
+
+def parse_care_plan(text: Optional[str]) -> Dict[str, List[str]]:
+    """Split a care plan into its sections' items, one per bullet or line. Text before the first heading
+    and sections the plan leaves out are ignored, so every section is present, possibly empty."""
+    sections = {section: [] for section in SECTIONS}
+    current = None
+    for line in (text or "").splitlines():
+        section = _heading(line)
+        if section is not None:
+            current = section
+            # Content on the heading line itself, e.g. "Goals: ...", is an item
+            _, _, rest = line.partition(':')
+            if rest.strip():
+                sections[current].append(rest.strip())
+            continue
+        item = BULLET_PATTERN.sub("", line.strip()).strip()
+        if current is not None and item:
+            sections[current].append(item)
+    return sections
+
+def terms(text: str) -> List[str]:
+    """Lowercased words of a text worth querying by, in order of first appearance."""
+    words = []
+    for word in TERM_PATTERN.findall(text.lower()):
+        if word not in STOP_WORDS and word not in words:
+            words.append(word)
+    return words
+
+def section_terms(sections: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """Distinct terms per section, the form queries match against."""
+    return {section: sorted(set(terms(" ".join(items)))) for section, items in sections.items()}
+
+def validate_section(section: str) -> str:
+    """Check a section name. Raises ValueError if it isn't one of SECTIONS."""
+    if section not in SECTIONS:
+        raise ValueError(f"section must be one of: {', '.join(SECTIONS)}")
+    return section
+
+def query_terms(query: str) -> List[str]:
+    """Terms of a section query, all of which a plan must mention. Raises ValueError if there are none."""
+    words = terms(query or "")
+    if not words:
+        raise ValueError("Care plan query is required")
+    return words
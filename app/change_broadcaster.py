@@ -0,0 +1,73 @@
+import queue
+import threading
+import time
+from typing import Any, List, NamedTuple
+from app.data_store import Change, DataStore
+from app.stats_broadcaster import publish_latest
+
+class ChangeBatch(NamedTuple):
+    after: Any  # Change feed cursor the batch follows
+    changes: List[Change]
+
+class ChangeBroadcaster:
+    """Follows the change feed once per process and fans each new batch of orders out to every subscriber,
+    so open change streams don't each poll the store."""
+
+    def __init__(self, store: DataStore, page_size: int = 100, wait_timeout: float = 15.0,
+                 retry_interval: float = 2.0):
+        self.store = store
+        self.page_size = page_size
+        self.wait_timeout = wait_timeout  # Seconds each read of the feed waits for new orders
+        self.retry_interval = retry_interval  # Seconds between reads while the store is unreachable
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._subscribed = threading.Event()
+        self._thread = None
+
+    def subscribe(self, subscription=None):
+        """Register a subscriber. The returned queue, or the given AsyncSubscription, holds only the newest
+        ChangeBatch, so a subscriber whose cursor isn't the batch's `after` has missed some and reads them from
+        the store itself."""
+        subscription = subscription or queue.Queue(maxsize=1)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='change-broadcaster', daemon=True)
+                self._thread.start()
+        self._subscribed.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscriber."""
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _run(self):
+        cursor = None
+        while True:
+            # Nobody is listening, so don't touch the store, and start from the head when someone does
+            with self._lock:
+                if not self._subscribers:
+                    self._subscribed.clear()
+            if not self._subscribed.is_set():
+                cursor = None
+                self._subscribed.wait()
+                continue
+            try:
+                if cursor is None:
+                    # Subscribers that read up to before the head catch up from an empty batch at it
+                    cursor = self.store.get_change_cursor()
+                    self._publish(ChangeBatch(cursor, []))
+                changes = self.store.get_changes(cursor, self.page_size, self.wait_timeout)
+            except Exception:
+                time.sleep(self.retry_interval)
+                continue
+            if changes:
+                self._publish(ChangeBatch(cursor, changes))
+                cursor = changes[-1].cursor
+
+    def _publish(self, batch: ChangeBatch):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            publish_latest(subscription, batch)
@@ -0,0 +1,60 @@
+import asyncio
+import threading
+from typing import Callable, Optional
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+class ChangeSignal:
+    """A generation counter that wakes the threads and coroutines waiting for it to move on, so one listener
+    per process can fan a notification out to every waiting change feed request. Waiters read generation
+    before looking for changes, so a notify between the look and the wait isn't missed."""
+
+    def __init__(self, start: Optional[Callable[[], None]] = None):
+        self.generation = 0
+        self._start = start  # Called before the first wait, e.g. to start the listener that notifies
+        self._started = False
+        self._condition = threading.Condition()
+        self._waiters = set()  # (Event loop, future) of each waiting coroutine
+
+    def notify(self):
+        with self._condition:
+            self.generation += 1
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def _ensure_started(self):
+        if self._started or self._start is None:
+            return
+        with self._condition:
+            if self._started:
+                return
+            self._started = True
+        self._start()
+
+    def wait(self, generation: int, timeout: float) -> bool:
+        """Wait up to timeout seconds for the generation to move past the given one. Returns whether it did."""
+        self._ensure_started()
+        with self._condition:
+            return self._condition.wait_for(lambda: self.generation != generation, timeout)
+
+    async def wait_async(self, generation: int, timeout: float) -> bool:
+        """Coroutine version of wait, which leaves the event loop free while waiting."""
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._condition:
+            if self.generation != generation:
+                return True
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._condition:
+                self._waiters.discard(waiter)
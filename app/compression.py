@@ -0,0 +1,73 @@
+import gzip
+from typing import Optional
+from flask import Request, Response
+from werkzeug.datastructures import Accept
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this aren't worth the CPU or the extra headers
+DEFAULT_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4  # Fast enough to compress per response, still smaller than gzip
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'application/javascript', 'application/x-ndjson', 'image/svg+xml',
+}
+
+def choose_encoding(request: Request) -> Optional[str]:
+    """Pick the best encoding the client accepts: brotli if available, then gzip."""
+    return negotiate_encoding(request.accept_encodings)
+
+def negotiate_encoding(accepted: Accept) -> Optional[str]:
+    """Pick the best encoding from a parsed Accept-Encoding header."""
+    if brotli is not None and accepted.quality('br') > 0:
+        return 'br'
+    if accepted.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+def is_compressible(response: Response, min_size: int) -> bool:
+    """Check whether a response is a complete, uncompressed, text-like body of at least min_size bytes."""
+    if response.direct_passthrough or response.is_streamed:
+        return False
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if 'Content-Encoding' in response.headers:
+        return False
+    mimetype = response.mimetype or ''
+    if not (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES):
+        return False
+    return response.calculate_content_length() >= min_size
+
+def compress_response(request: Request, response: Response, min_size: int = DEFAULT_MIN_SIZE) -> Response:
+    """Compress a response body with the encoding negotiated from Accept-Encoding."""
+    response.vary.add('Accept-Encoding')
+    if not is_compressible(response, min_size):
+        return response
+    encoding = choose_encoding(request)
+    if encoding is None:
+        return response
+
+    compressed = compress_body(response.get_data(), encoding)
+    if compressed is None:
+        return response
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+
+    # The compressed representation is a different entity, so a strong ETag must not be shared with it
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+def compress_body(body: bytes, encoding: str) -> Optional[bytes]:
+    """Compress a body with an encoding. Returns None if compressing doesn't make it smaller."""
+    if encoding == 'br':
+        compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return compressed if len(compressed) < len(body) else None
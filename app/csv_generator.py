@@ -24,11 +24,19 @@ class CSVGenerator:
             row = {k: order.get(k, '') for k in FIELD_NAMES}
             self.writer.writerow(row)
     
+    def get_bytes(self) -> bytes:
+        # Encode the CSV written so far
+        return self.output.getvalue().encode('utf-8')
+
     def prepare_for_download(self):
         # Prepare and send CSV file for download
-        self.output.seek(0)
+        return CSVGenerator.send_artifact(self.get_bytes())
+
+    @staticmethod
+    def send_artifact(artifact: bytes):
+        # Send already encoded CSV bytes for download
         return send_file(
-            io.BytesIO(self.output.getvalue().encode('utf-8')),
+            io.BytesIO(artifact),
             mimetype='text/csv',
             as_attachment=True,
             download_name=f'care_plans_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
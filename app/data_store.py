@@ -1,13 +1,53 @@
 from abc import ABC, abstractmethod
-from typing import Dict, List
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+class Change(NamedTuple):
+    """An order from a store's change feed, with the feed cursor just after it. Cursors are JSON-serializable
+    and only meaningful to the store that returned them."""
+    cursor: Any
+    order: Dict
 
 class DataStore(ABC):
     CONFLICT_KEY = "conflict"
     ERROR_MESSAGE_KEY = "message"
+    LARGE_TEXT_FIELDS = ('care_plan', 'patient_records', 'medication_history')  # Stored apart from order rows
+    SEARCH_FIELDS = ('primary_diagnosis', 'patient_records', 'care_plan')
+
+    similarity_threshold: float
 
-    @abstractmethod
     def validate_order(self, data: Dict) -> List:
-        pass
+        warnings = []
+
+        # Check for duplicate provider with different name or different npi
+        provider_check = self.validate_provider(data['provider_npi'], data['provider_name'])
+        if provider_check.get(self.CONFLICT_KEY, False):
+            warnings.append(provider_check.get(self.ERROR_MESSAGE_KEY, "Provider Input Error"))
+
+        # Check for duplicate patient
+        patient_check = self.validate_patient(
+            data['patient_mrn'],
+            data['patient_first_name'],
+            data['patient_last_name']
+        )
+        if patient_check.get(self.CONFLICT_KEY, False):
+            warnings.append(patient_check.get(self.ERROR_MESSAGE_KEY, "Patient Input Error"))
+
+        # Check for duplicate order
+        if self.check_duplicate_order(data['patient_mrn'], data['medication']):
+            warnings.append(
+                f"A similar order already exists for patient {data['patient_mrn']} "
+                f"with medication {data['medication']}"
+            )
+        else:
+            # Check for near-duplicate orders such as "IVIG" vs "Immune Globulin 10%"
+            for match in self.find_similar_orders(data['patient_mrn'], data['medication'], self.similarity_threshold):
+                warnings.append(
+                    f"A similar order already exists for patient {data['patient_mrn']} "
+                    f"with medication {match['medication']} (similarity {match['similarity']:.0%})"
+                )
+
+        # Return all the validation warnings that exist
+        return warnings
 
     @abstractmethod
     def validate_provider(self, npi: str, name: str) -> Dict:
@@ -29,14 +69,140 @@ class DataStore(ABC):
     def check_duplicate_order(self, mrn: str, medication: str) -> bool:
         pass
 
+    @abstractmethod
+    def find_similar_orders(self, mrn: str, medication: str, threshold: float) -> List[Dict]:
+        pass
+
     @abstractmethod
     def add_order(self, order_data: Dict):
         pass
 
     @abstractmethod
-    def export_orders(self) -> List[Dict]:
+    def export_orders(self, since_order_id: Optional[int] = None, since_timestamp: Optional[str] = None,
+                      text_fields: Sequence[str] = LARGE_TEXT_FIELDS) -> List[Dict]:
+        """Export orders oldest-first, on every backend."""
+        pass
+
+    @abstractmethod
+    def iter_orders(self, since_order_id: Optional[int] = None, batch_size: int = 1000,
+                    text_fields: Sequence[str] = LARGE_TEXT_FIELDS) -> Iterator[Dict]:
+        pass
+
+    @abstractmethod
+    def get_order_details(self, order_ids: List[int], fields: Sequence[str] = LARGE_TEXT_FIELDS) -> Dict[int, Dict]:
+        pass
+
+    @abstractmethod
+    def get_changes(self, after: Any, limit: int, timeout: float) -> List[Change]:
+        """Get up to limit orders added after a change feed cursor (None for the first order), waiting up to
+        timeout seconds for one to arrive. Raises ValueError if the cursor isn't one this store returned."""
+        pass
+
+    @abstractmethod
+    def get_change_cursor(self) -> Any:
+        """The change feed cursor after the newest order, for following only orders added from now on."""
+        pass
+
+    @abstractmethod
+    def get_version(self) -> int:
         pass
 
     @abstractmethod
     def get_stats(self) -> Dict:
         pass
+
+
+    @abstractmethod
+    def list_orders(self, limit: int, cursor: Optional[str] = None, provider_npi: Optional[str] = None,
+                    patient_mrn: Optional[str] = None, medication: Optional[str] = None,
+                    start_date: Optional[str] = None, end_date: Optional[str] = None,
+                    include_text: bool = False) -> Dict:
+        pass
+
+    @abstractmethod
+    def get_patient_history(self, mrn: str, limit: int) -> Dict:
+        pass
+
+    @abstractmethod
+    def search_orders(self, query: str, limit: int, offset: int = 0, include_text: bool = False) -> Dict:
+        pass
+
+    @abstractmethod
+    def query_care_plans(self, section: str, terms: Sequence[str], limit: int, offset: int = 0) -> Dict:
+        """Find orders whose care plan section mentions every term, newest first, from the sections parsed when
+        the order was added. Returns {'total', 'orders', 'next_offset'}; orders carry their 'care_plan_sections'."""
+        pass
+
+    @abstractmethod
+    def get_analytics(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                      bucket: str = 'day', top_n: int = 10) -> Dict:
+        pass
+
+    @abstractmethod
+    def consume_rate_limit(self, key: str, capacity: float, refill_rate: float, cost: float = 1.0) -> float:
+        pass
+
+    def migrate(self):
+        """Create or upgrade the store's schema. Run once per deployment, not per process."""
+        pass
+
+    def open_pool(self, min_size: int, max_size: int):
+        """Open the process's connection pool. Stores without connections do nothing."""
+        pass
+
+    def ensure_partitions(self):
+        """Create the partitions upcoming orders go to. Called at startup and then periodically by every worker.
+        Stores without partitions do nothing."""
+        pass
+
+    def prune_rate_limits(self, capacity: float, refill_rate: float) -> int:
+        """Drop token buckets that have refilled completely, which behave exactly like missing ones. Called
+        periodically by every worker. Returns how many were dropped."""
+        return 0
+
+    def archive_orders(self, retention_months: int) -> List[Dict]:
+        """Move orders older than the retention window out to archive files. Returns what was archived.
+        Stores without archival keep every order."""
+        return []
+
+    def iter_archived_orders(self, since_order_id: Optional[int] = None) -> Iterator[Dict]:
+        """Stream archived orders oldest-first, optionally only those after an order id."""
+        return iter(())
+
+    def iter_providers(self, limit: int) -> Iterator[Dict]:
+        """Stream up to limit providers as {'npi', 'name'}, e.g. to warm a cache."""
+        return iter(())
+
+    def iter_patients(self, limit: int) -> Iterator[Dict]:
+        """Stream up to limit patients as {'mrn', 'first_name', 'last_name'}, e.g. to warm a cache."""
+        return iter(())
+
+    def listen_identity_changes(self, on_change: Callable[[Optional[Dict]], None], stop):
+        """Call on_change with {'op', 'table', 'row'} for each provider or patient any process writes, until the
+        stop event is set. on_change(None) means changes may have been missed, e.g. after reconnecting.
+        Stores only this process writes to have nothing to listen to and return right away."""
+        pass
+
+    def compress_text(self) -> Dict:
+        """Train a compression dictionary from the stored text and recompress it. Returns the dictionary's id
+        and how many texts were recompressed. Stores that train one as they go do nothing."""
+        return {'dictionary_id': None, 'recompressed': 0}
+
+    def parse_care_plans(self) -> int:
+        """Parse the sections of stored care plans added before sections were kept. Returns how many were parsed.
+        Stores that parse every care plan as it's added do nothing."""
+        return 0
+
+    @classmethod
+    def without_large_text(cls, order: Dict) -> Dict:
+        """Return a copy of an order without its large text fields."""
+        return {k: v for k, v in order.items() if k not in cls.LARGE_TEXT_FIELDS}
+
+    @classmethod
+    def validate_text_fields(cls, fields: Sequence[str]) -> List[str]:
+        """Check requested large text fields, returning them in a stable order."""
+        unknown = set(fields) - set(cls.LARGE_TEXT_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown text fields: {', '.join(sorted(unknown))}. "
+                             f"Choose from: {', '.join(cls.LARGE_TEXT_FIELDS)}")
+        return [field for field in cls.LARGE_TEXT_FIELDS if field in fields]
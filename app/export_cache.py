@@ -0,0 +1,29 @@
+import threading
+from typing import Optional
+
+class ExportCache:
+    """Holds the most recent full export artifact, keyed by the store version it was built from."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._artifact = None
+
+    @staticmethod
+    def etag_for(version: int) -> str:
+        """ETag (unquoted) identifying the export of a store version."""
+        return f"orders-v{version}"
+
+    def get(self, version: int) -> Optional[bytes]:
+        """Return the cached artifact if it was built from this version."""
+        with self._lock:
+            if self._version == version:
+                return self._artifact
+        return None
+
+    def put(self, version: int, artifact: bytes):
+        """Cache an artifact built from this version, replacing any older one."""
+        with self._lock:
+            if self._version is None or version >= self._version:
+                self._version = version
+                self._artifact = artifact
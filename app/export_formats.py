@@ -0,0 +1,116 @@
+import csv
+import importlib.util
+import io
+import json
+import zlib
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple
+from app.csv_generator import FIELD_NAMES
+
+# pyarrow is optional and slow to import, so it's only loaded once a Parquet export is written
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+# Rows serialized between yields, so chunks stay large enough to be worth a write
+ROWS_PER_CHUNK = 100
+ROW_GROUP_SIZE = 10000
+
+class ExportFormat(NamedTuple):
+    mimetype: str
+    extension: str
+    serializer: Callable[[Iterable[Dict]], Iterator[bytes]]
+
+def iter_csv(orders: Iterable[Dict]) -> Iterator[bytes]:
+    """Serialize orders as CSV, yielding encoded chunks as rows are written."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELD_NAMES, extrasaction='ignore')
+    writer.writeheader()
+    for count, order in enumerate(orders, start=1):
+        writer.writerow({k: order.get(k, '') for k in FIELD_NAMES})
+        if count % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def iter_gzip_csv(orders: Iterable[Dict]) -> Iterator[bytes]:
+    """Serialize orders as gzip-compressed CSV through an incremental compressor."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in iter_csv(orders):
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def iter_ndjson(orders: Iterable[Dict]) -> Iterator[bytes]:
+    """Serialize orders as newline-delimited JSON, one order per line."""
+    lines = []
+    for order in orders:
+        row = {k: order.get(k) for k in FIELD_NAMES}
+        lines.append(json.dumps(row, default=str))
+        if len(lines) == ROWS_PER_CHUNK:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+class _ChunkSink(io.RawIOBase):
+    # Write-only file that hands written bytes back to the caller while keeping absolute offsets
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_parquet(orders: Iterable[Dict], row_group_size: int = ROW_GROUP_SIZE) -> Iterator[bytes]:
+    """Serialize orders as Parquet, writing one row group per batch. Requires pyarrow."""
+    if not HAS_PYARROW:
+        raise RuntimeError("Parquet export requires the optional pyarrow dependency")
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema(
+        [('order_id', pyarrow.int64())] + [(name, pyarrow.string()) for name in FIELD_NAMES if name != 'order_id']
+    )
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+
+    def write_batch(batch: List[Dict]):
+        columns = {name: [order.get(name) for order in batch] for name in FIELD_NAMES}
+        for name in FIELD_NAMES:
+            if name != 'order_id':
+                columns[name] = [None if value is None else str(value) for value in columns[name]]
+        writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+
+    batch = []
+    for order in orders:
+        batch.append(order)
+        if len(batch) == row_group_size:
+            write_batch(batch)
+            batch = []
+            yield sink.drain()
+    if batch:
+        write_batch(batch)
+    writer.close()
+    yield sink.drain()
+
+EXPORT_FORMATS = {
+    'csv': ExportFormat('text/csv', 'csv', iter_csv),
+    'csv.gz': ExportFormat('application/gzip', 'csv.gz', iter_gzip_csv),
+    'ndjson': ExportFormat('application/x-ndjson', 'ndjson', iter_ndjson),
+}
+if HAS_PYARROW:
+    EXPORT_FORMATS['parquet'] = ExportFormat('application/vnd.apache.parquet', 'parquet', iter_parquet)
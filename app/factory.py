@@ -0,0 +1,295 @@
+import importlib
+import os
+import threading
+import time
+from typing import Dict, Optional
+from flask import Flask, current_app
+from app import metrics
+from app.admission import AdmissionController, FairSemaphore
+from app.change_broadcaster import ChangeBroadcaster
+from app.data_store import DataStore
+from app.export_cache import ExportCache
+from app.json_provider import install_json_provider
+from app.compression import DEFAULT_MIN_SIZE
+from app.medication_matching import DEFAULT_SIMILARITY_THRESHOLD
+from app.profiling import RequestProfiler
+from app.stats_broadcaster import StatsBroadcaster
+
+EXTENSION_KEY = 'care_plan'
+
+def load_config() -> Dict:
+    """Read the app configuration from the environment."""
+    return {
+        'MAX_CONTENT_LENGTH': 16 * 1024 * 1024,  # 16MB max file size
+        'DATABASE_URL': os.environ.get('DATABASE_URL'),
+        'DATABASE_POOL_MIN_SIZE': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 1)),
+        'DATABASE_POOL_MAX_SIZE': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 10)),
+        'DATABASE_REPLICA_URLS': [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()],
+        'DATABASE_SHARD_URLS': [url.strip() for url in os.environ.get('DATABASE_SHARD_URLS', '').split(',') if url.strip()],
+        'DATABASE_REPLICA_MAX_LAG': float(os.environ.get('DATABASE_REPLICA_MAX_LAG', 5)),
+        'IDENTITY_CACHE_SIZE': int(os.environ.get('IDENTITY_CACHE_SIZE', 10000)),
+        'IDENTITY_CACHE_TTL': float(os.environ.get('IDENTITY_CACHE_TTL', 300)),
+        'IDENTITY_CACHE_WARM': os.environ.get('IDENTITY_CACHE_WARM', '').lower() in ('1', 'true', 'yes'),
+        'ORDER_ARCHIVE_DIR': os.environ.get('ORDER_ARCHIVE_DIR', 'archive'),
+        'ORDER_RETENTION_MONTHS': int(os.environ.get('ORDER_RETENTION_MONTHS', 24)),
+        'PARTITION_CHECK_INTERVAL': float(os.environ.get('PARTITION_CHECK_INTERVAL', 3600)),
+        'METRICS_FLUSH_INTERVAL': float(os.environ.get('METRICS_FLUSH_INTERVAL', 5)),
+        'MEDICATION_SIMILARITY_THRESHOLD': float(
+            os.environ.get('MEDICATION_SIMILARITY_THRESHOLD', DEFAULT_SIMILARITY_THRESHOLD)
+        ),
+        'CARE_PLAN_GENERATOR': os.environ.get('CARE_PLAN_GENERATOR', 'anthropic'),
+        'COMPRESSION_MIN_SIZE': int(os.environ.get('COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE)),
+        'RATE_LIMIT_BURST': float(os.environ.get('RATE_LIMIT_BURST', 5)),
+        'RATE_LIMIT_PER_MINUTE': float(os.environ.get('RATE_LIMIT_PER_MINUTE', 10)),
+        'LLM_MAX_CONCURRENCY': int(os.environ.get('LLM_MAX_CONCURRENCY', 4)),
+        'ADMISSION_MAX_WAIT': float(os.environ.get('ADMISSION_MAX_WAIT', 2)),
+        'ADMISSION_MAX_QUEUE': int(os.environ.get('ADMISSION_MAX_QUEUE', 16)),
+        'ASYNC_LLM_MAX_CONCURRENCY': int(os.environ.get('ASYNC_LLM_MAX_CONCURRENCY', 64)),
+        'ASGI_WSGI_THREADS': int(os.environ.get('ASGI_WSGI_THREADS', 8)),
+        'STREAM_MAX_CONNECTIONS': int(os.environ.get('STREAM_MAX_CONNECTIONS', 16)),
+        'ASYNC_STREAM_MAX_CONNECTIONS': int(os.environ.get('ASYNC_STREAM_MAX_CONNECTIONS', 1000)),
+        'ADMIN_TOKEN': os.environ.get('ADMIN_TOKEN'),
+        'PROFILE_SAMPLE_EVERY': int(os.environ.get('PROFILE_SAMPLE_EVERY', 0)),
+    }
+
+def create_store(config: Dict) -> DataStore:
+    # Backends are imported on first use, so psycopg is only loaded when PostgreSQL is configured
+    if config.get('DATABASE_URL'):
+        from app.postgres_data_store import PostgreSQLDataStore
+        store = PostgreSQLDataStore(
+            config['DATABASE_URL'],
+            similarity_threshold=config['MEDICATION_SIMILARITY_THRESHOLD'],
+            replica_urls=config.get('DATABASE_REPLICA_URLS'),
+            max_replica_lag=config.get('DATABASE_REPLICA_MAX_LAG', 5.0),
+            archive_dir=config.get('ORDER_ARCHIVE_DIR', 'archive')
+        )
+        if config.get('DATABASE_SHARD_URLS'):
+            store = create_sharded_store(config, store)
+        # Provider and patient validations are answered in process; the in-memory store needs no cache
+        if config.get('IDENTITY_CACHE_SIZE', 0) > 0:
+            from app.cached_data_store import CachedDataStore
+            store = CachedDataStore(store, config['IDENTITY_CACHE_SIZE'], config.get('IDENTITY_CACHE_TTL') or None)
+        return store
+    from app.in_memory_data_store import InMemoryDataStore
+    return InMemoryDataStore(similarity_threshold=config['MEDICATION_SIMILARITY_THRESHOLD'])
+
+def create_sharded_store(config: Dict, registry: DataStore) -> DataStore:
+    """Spread patients and orders over the DATABASE_SHARD_URLS databases, keeping providers in the
+    DATABASE_URL one. DATABASE_URL may also be listed as a shard."""
+    from app.postgres_data_store import PostgreSQLDataStore
+    from app.sharded_data_store import ShardedDataStore
+    stores = {config['DATABASE_URL']: registry}
+    shards = []
+    for index, url in enumerate(config['DATABASE_SHARD_URLS']):
+        if url not in stores:
+            # Every shard has month partitions of the same names, so each archives to its own directory
+            stores[url] = PostgreSQLDataStore(
+                url,
+                similarity_threshold=config['MEDICATION_SIMILARITY_THRESHOLD'],
+                archive_dir=os.path.join(config.get('ORDER_ARCHIVE_DIR', 'archive'), f'shard-{index}')
+            )
+        shards.append(stores[url])
+    return ShardedDataStore(shards, registry)
+
+def create_care_plan_generator(config: Dict):
+    # CARE_PLAN_GENERATOR=offline swaps the LLM for a templated stand-in, e.g. for load tests
+    from app.care_plan_generator import CarePlanGenerator, OfflineCarePlanGenerator
+    if config.get('CARE_PLAN_GENERATOR') == 'offline':
+        return OfflineCarePlanGenerator()
+    return CarePlanGenerator()
+
+def create_async_store(config: Dict, store: DataStore):
+    """Create the AsyncDataStore of the ASGI app. In memory it shares the sync store's data."""
+    if config.get('DATABASE_SHARD_URLS'):
+        raise ValueError("The ASGI app doesn't support DATABASE_SHARD_URLS, serve sharded stores with gunicorn")
+    if config.get('DATABASE_URL'):
+        from app.async_postgres_data_store import AsyncPostgreSQLDataStore
+        # Both stores compress text with the same dictionaries
+        return metrics.instrument_async_store(AsyncPostgreSQLDataStore(
+            config['DATABASE_URL'], similarity_threshold=config['MEDICATION_SIMILARITY_THRESHOLD'],
+            codec=getattr(store, 'codec', None), order_signal=getattr(store, 'order_signal', None)
+        ))
+    from app.async_data_store import AsyncInMemoryDataStore
+    return AsyncInMemoryDataStore(store)
+
+def create_async_care_plan_generator(config: Dict):
+    from app.care_plan_generator import AsyncCarePlanGenerator, AsyncOfflineCarePlanGenerator
+    if config.get('CARE_PLAN_GENERATOR') == 'offline':
+        return AsyncOfflineCarePlanGenerator()
+    return AsyncCarePlanGenerator()
+
+class AppResources:
+    """Per-process resources of the app. Connections and clients are created on first use or by init_worker,
+    never at import time, so forked workers don't share them."""
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self.export_cache = ExportCache()
+        self.profiler = RequestProfiler(
+            admin_token=config.get('ADMIN_TOKEN'),
+            sample_every=config.get('PROFILE_SAMPLE_EVERY', 0)
+        )
+        # Open server-sent event streams, which each hold a worker thread for as long as they last
+        self.stream_slots = FairSemaphore(config.get('STREAM_MAX_CONNECTIONS', 16), 0)
+        self._lock = threading.Lock()
+        self._store: Optional[DataStore] = None
+        self._stats_broadcaster: Optional[StatsBroadcaster] = None
+        self._change_broadcaster: Optional[ChangeBroadcaster] = None
+        self._care_plan_generator = None
+        self._admission: Optional[AdmissionController] = None
+
+    @property
+    def store(self) -> DataStore:
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = metrics.instrument_store(create_store(self.config))
+        return self._store
+
+    @property
+    def stats_broadcaster(self) -> StatsBroadcaster:
+        if self._stats_broadcaster is None:
+            store = self.store
+            with self._lock:
+                if self._stats_broadcaster is None:
+                    self._stats_broadcaster = StatsBroadcaster(store)
+        return self._stats_broadcaster
+
+    @property
+    def change_broadcaster(self) -> ChangeBroadcaster:
+        if self._change_broadcaster is None:
+            store = self.store
+            with self._lock:
+                if self._change_broadcaster is None:
+                    self._change_broadcaster = ChangeBroadcaster(store)
+        return self._change_broadcaster
+
+    @property
+    def care_plan_generator(self):
+        # One client per process keeps its HTTP connections alive between requests
+        if self._care_plan_generator is None:
+            with self._lock:
+                if self._care_plan_generator is None:
+                    self._care_plan_generator = create_care_plan_generator(self.config)
+        return self._care_plan_generator
+
+    @property
+    def admission(self) -> AdmissionController:
+        if self._admission is None:
+            store = self.store
+            with self._lock:
+                if self._admission is None:
+                    self._admission = AdmissionController(
+                        store,
+                        capacity=self.config['RATE_LIMIT_BURST'],
+                        refill_rate=self.config['RATE_LIMIT_PER_MINUTE'] / 60,
+                        max_concurrency=self.config['LLM_MAX_CONCURRENCY'],
+                        max_wait=self.config['ADMISSION_MAX_WAIT'],
+                        max_queue=self.config['ADMISSION_MAX_QUEUE']
+                    )
+        return self._admission
+
+    def init_worker(self):
+        """Create the store (opening its connection pool) and the LLM client ahead of the first request."""
+        self.store.open_pool(self.config['DATABASE_POOL_MIN_SIZE'], self.config['DATABASE_POOL_MAX_SIZE'])
+        if self.config.get('IDENTITY_CACHE_WARM') and hasattr(self.store, 'warm'):
+            self.store.warm(self.config['IDENTITY_CACHE_SIZE'])
+        self.start_store_upkeep()
+        metrics.REGISTRY.start_flushing(self.config['METRICS_FLUSH_INTERVAL'])
+        try:
+            self.care_plan_generator
+        except ValueError:
+            # Missing API key: generate requests report the error, the rest of the app still serves
+            pass
+
+    def start_store_upkeep(self):
+        """Ensure the store's partitions and prune its full rate limit buckets now and every
+        PARTITION_CHECK_INTERVAL seconds (0 means only now), in a background thread so a worker's startup never
+        waits on it."""
+        store = self.store
+        interval = self.config.get('PARTITION_CHECK_INTERVAL', 0)
+        capacity = self.config.get('RATE_LIMIT_BURST', 0)
+        refill_rate = self.config.get('RATE_LIMIT_PER_MINUTE', 0) / 60
+
+        def upkeep():
+            while True:
+                try:
+                    store.ensure_partitions()
+                except Exception:
+                    # Retried next time; orders meanwhile land in the default partition and are moved out then
+                    pass
+                if capacity:
+                    try:
+                        store.prune_rate_limits(capacity, refill_rate)
+                    except Exception:
+                        # Retried next time; until then full buckets just keep their rows
+                        pass
+                if not interval:
+                    return
+                time.sleep(interval)
+
+        threading.Thread(target=upkeep, name='store-upkeep', daemon=True).start()
+
+def get_resources() -> AppResources:
+    """Get the resources of the current app."""
+    return current_app.extensions[EXTENSION_KEY]
+
+def preload_modules(app: Flask):
+    """Import the modules the configured backends need, without creating any connection or client.
+    Called in the gunicorn master so forked workers start with them already loaded."""
+    modules = ['app.care_plan_generator']
+    if app.config.get('CARE_PLAN_GENERATOR') != 'offline':
+        modules.append('anthropic')
+    if app.config.get('DATABASE_URL'):
+        modules.append('app.postgres_data_store')
+    for module in modules:
+        importlib.import_module(module)
+
+def init_worker(app: Flask):
+    """Per-process setup, called from the gunicorn post_fork hook."""
+    app.extensions[EXTENSION_KEY].init_worker()
+
+def create_app(config_overrides: Optional[Dict] = None) -> Flask:
+    """Create the app. Nothing connects to the database or the LLM until it's needed."""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    app = Flask(__name__.split('.')[0], root_path=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    app.config.update(load_config())
+    app.config.update(config_overrides or {})
+    install_json_provider(app)
+    app.extensions[EXTENSION_KEY] = AppResources(app.config)
+
+    from app.routes import bp
+    app.register_blueprint(bp)
+
+    @app.cli.command('migrate')
+    def migrate():
+        """Create or upgrade the store's schema."""
+        get_resources().store.migrate()
+        print("Schema is up to date.")
+
+    @app.cli.command('archive-orders')
+    def archive_orders():
+        """Move orders older than ORDER_RETENTION_MONTHS to compressed archive files."""
+        archived = get_resources().store.archive_orders(app.config['ORDER_RETENTION_MONTHS'])
+        for archive in archived:
+            print(f"Archived {archive['rows']} orders from {archive['partition']} to {archive['path']}")
+        print(f"Archived {len(archived)} partitions.")
+
+    @app.cli.command('compress-text')
+    def compress_text():
+        """Train a compression dictionary from stored order text and recompress the text with it."""
+        result = get_resources().store.compress_text()
+        if result['dictionary_id'] is None:
+            print("No dictionary trained.")
+        else:
+            print(f"Trained dictionary {result['dictionary_id']}, recompressed {result['recompressed']} texts.")
+
+    @app.cli.command('parse-care-plans')
+    def parse_care_plans():
+        """Parse the sections of care plans stored before sections were kept, so section queries find them."""
+        parsed = get_resources().store.parse_care_plans()
+        print(f"Parsed {parsed} care plans.")
+
+    return app
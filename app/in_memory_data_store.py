@@ -1,43 +1,40 @@
-from typing import List, Dict
+import bisect
+import threading
+import time
+from typing import List, Dict, Iterator, Optional, Sequence
 from datetime import datetime
-from app.data_store import DataStore
+from app.data_store import Change, DataStore
+from app.pagination import encode_cursor, decode_cursor
+from app.text_index import InvertedIndex
+from app.medication_matching import MedicationIndex, DEFAULT_SIMILARITY_THRESHOLD
+from app.analytics import DailyAggregates
+from app.admission import refill_tokens
+from app.text_blobs import TextBlobStore
+from app.care_plan_sections import parse_care_plan, section_terms, validate_section
 
 class InMemoryDataStore(DataStore):
-    def __init__(self):
+
+    MAX_RATE_LIMIT_KEYS = 10000  # Tracked clients before refilled buckets are dropped
+
+    def __init__(self, similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD):
+        self.similarity_threshold = similarity_threshold
+        self.version = 0     # Incremented on every write
         self.providers = {}  # NPI -> Provider
         self.provider_names = {}  # Normalized provider name -> NPI
         self.patients = {}   # MRN -> Patient
-        self.orders = []     # List of orders
-    
-    def validate_order(self, data: Dict) -> List:
-        warnings = []
-
-        # Check for duplicate provider with different name or different npi
-        provider_check = self.validate_provider(data['provider_npi'], data['provider_name'])
-        if provider_check.get(self.CONFLICT_KEY, False):
-            warnings.append(provider_check.get(self.ERROR_MESSAGE_KEY, "Provider Input Error"))
-        
-        # Check for duplicate patient
-        patient_check = self.validate_patient(
-            data['patient_mrn'],
-            data['patient_first_name'],
-            data['patient_last_name']
-        )
-        if patient_check.get(self.CONFLICT_KEY, False):
-            warnings.append(patient_check.get(self.ERROR_MESSAGE_KEY, "Patient Input Error"))
-        
-        # Check for duplicate order
-        if self.check_duplicate_order(
-            data['patient_mrn'],
-            data['medication'],
-        ):
-            warnings.append(
-                f"A similar order already exists for patient {data['patient_mrn']} "
-                f"with medication {data['medication']}"
-            )
-        
-        # Return all the validation warnings that exist
-        return warnings
+        self.orders = []     # List of orders, without their large text fields
+        self.order_ids = []  # Id of each order in orders, ascending
+        self.order_details = {}  # Order id -> hashes of the order's large text fields in text_blobs
+        self.text_blobs = TextBlobStore()  # Deduplicated, compressed large text
+        self.orders_by_mrn = {}  # MRN -> List of orders, oldest first
+        self.search_index = InvertedIndex()  # Search terms -> order ids
+        self.care_plan_sections = {}  # Order id -> care plan items per section, parsed once when added
+        self.care_plan_terms = {}  # (Section, term) -> ids of the orders whose section mentions it, ascending
+        self.medication_index = MedicationIndex()  # (MRN, trigram) -> normalized medications
+        self.daily_aggregates = DailyAggregates()  # Day -> order counts and breakdowns
+        self.orders_appended = threading.Condition()  # Wakes change feed consumers
+        self.rate_limits = {}  # Rate limit key -> [tokens, monotonic time of last update]
+        self.rate_limits_lock = threading.Lock()
     
     def validate_provider(self, npi: str, name: str) -> Dict:
         """Validate provider. Returns conflict if exists with different name or NPI."""
@@ -72,6 +69,7 @@ class InMemoryDataStore(DataStore):
             normalized_name = name.lower().strip()
             self.providers[npi] = {'npi': npi, 'name': name}
             self.provider_names[normalized_name] = npi
+            self.version += 1
     
     def validate_patient(self, mrn: str, first_name: str, last_name: str) -> Dict:
         """Validate patient. Returns conflict if exists with different name."""
@@ -94,24 +92,99 @@ class InMemoryDataStore(DataStore):
             'first_name': first_name,
             'last_name': last_name
         }
+        self.version += 1
     
     def check_duplicate_order(self, mrn: str, medication: str) -> bool:
         """Check if an identical order already exists."""
-        for order in self.orders:
-            if (order.get('patient_mrn', "") == mrn and 
-                order.get('medication', "").lower() == medication.lower()):
+        for order in self.orders_by_mrn.get(mrn, []):
+            if order.get('medication', "").lower() == medication.lower():
                 return True
         return False
     
+    def find_similar_orders(self, mrn: str, medication: str, threshold: float) -> List[Dict]:
+        """Find a patient's previous orders whose normalized medication is similar to this one."""
+        return self.medication_index.find_similar(mrn, medication, threshold)
+
     def add_order(self, order_data: Dict):
         """Add order to storage."""
         order_data['timestamp'] = datetime.now().isoformat()
         order_data['order_id'] = len(self.orders) + 1
-        self.orders.append(order_data)
+
+        # Keep the large text apart so order reads only copy it when asked to
+        order = self.without_large_text(order_data)
+        self.order_details[order['order_id']] = {
+            field: self.text_blobs.put(order_data.get(field)) for field in self.LARGE_TEXT_FIELDS
+        }
+        self.orders.append(order)
+        self.order_ids.append(order['order_id'])
+        self.version += 1
+        self.orders_by_mrn.setdefault(order.get('patient_mrn', ""), []).append(order)
+        self.medication_index.add(order_data.get('patient_mrn', ""), order_data.get('medication', ""))
+        self.daily_aggregates.record(order_data)
+        with self.orders_appended:
+            self.orders_appended.notify_all()
+        self.search_index.add(
+            order_data['order_id'],
+            " ".join(order_data.get(field) or "" for field in self.SEARCH_FIELDS)
+        )
+        sections = parse_care_plan(order_data.get('care_plan'))
+        self.care_plan_sections[order_data['order_id']] = sections
+        for section, terms in section_terms(sections).items():
+            for term in terms:
+                self.care_plan_terms.setdefault((section, term), []).append(order_data['order_id'])
     
-    def export_orders(self) -> List[Dict]:
-        """Export all orders."""
-        return self.orders
+    def export_orders(self, since_order_id: Optional[int] = None, since_timestamp: Optional[str] = None,
+                      text_fields: Sequence[str] = DataStore.LARGE_TEXT_FIELDS) -> List[Dict]:
+        """Export all orders, or only those after an order id or timestamp, with the chosen large text fields."""
+        if since_order_id is not None:
+            # Order ids are list positions + 1
+            orders = self.orders[max(since_order_id, 0):]
+        elif since_timestamp is not None:
+            orders = [order for order in self.orders if order.get('timestamp', "") > since_timestamp]
+        else:
+            orders = self.orders
+        return [self._with_text(order, text_fields) for order in orders]
+
+    def iter_orders(self, since_order_id: Optional[int] = None, batch_size: int = 1000,
+                    text_fields: Sequence[str] = DataStore.LARGE_TEXT_FIELDS) -> Iterator[Dict]:
+        """Stream orders oldest-first with the chosen large text fields, optionally only those after an order id."""
+        start = max(since_order_id or 0, 0)
+        for position in range(start, len(self.orders)):
+            yield self._with_text(self.orders[position], text_fields)
+
+    def get_order_details(self, order_ids: List[int], fields: Sequence[str] = DataStore.LARGE_TEXT_FIELDS) -> Dict[int, Dict]:
+        """Load the large text fields of orders. Unknown order ids are left out."""
+        fields = self.validate_text_fields(fields)
+        return {
+            order_id: {field: self.text_blobs.get(self.order_details[order_id][field]) for field in fields}
+            for order_id in order_ids if order_id in self.order_details
+        }
+
+    def _with_text(self, order: Dict, fields: Sequence[str]) -> Dict:
+        if not fields:
+            return order
+        details = self.order_details[order['order_id']]
+        return {**order, **{field: self.text_blobs.get(details[field]) for field in fields}}
+
+    def get_changes(self, after: Optional[int], limit: int, timeout: float) -> List[Change]:
+        """Get orders added after a cursor, waiting up to timeout seconds for one to arrive.
+        Cursors are order ids, which are list positions + 1."""
+        if after is not None and (not isinstance(after, int) or isinstance(after, bool)):
+            raise ValueError("Invalid change feed cursor")
+        start = max(after or 0, 0)
+        with self.orders_appended:
+            self.orders_appended.wait_for(lambda: len(self.orders) > start, timeout)
+        return [
+            Change(order['order_id'], self._with_text(order, self.LARGE_TEXT_FIELDS))
+            for order in self.orders[start:start + limit]
+        ]
+
+    def get_change_cursor(self) -> int:
+        return len(self.orders)
+
+    def get_version(self) -> int:
+        """Get a counter that changes whenever stored data changes."""
+        return self.version
 
     def get_stats(self) -> Dict:
         """Get statistics."""
@@ -119,5 +192,144 @@ class InMemoryDataStore(DataStore):
         return {
             'total_orders': len(self.orders),
             'total_patients': len(self.patients),
-            'total_providers': len(self.providers)
-        }
\ No newline at end of file
+            'total_providers': len(self.providers),
+            'text_compression_ratio': self.text_blobs.compression_ratio()
+        }
+
+    def list_orders(self, limit: int, cursor: Optional[str] = None, provider_npi: Optional[str] = None,
+                    patient_mrn: Optional[str] = None, medication: Optional[str] = None,
+                    start_date: Optional[str] = None, end_date: Optional[str] = None,
+                    include_text: bool = False) -> Dict:
+        """List orders newest-first using keyset pagination on (timestamp, order_id)."""
+
+        # Orders are appended in (timestamp, order_id) order, so the page starts just before the cursor's order,
+        # found by its id rather than assuming ids are list positions
+        position = len(self.orders) - 1
+        if cursor:
+            _, cursor_order_id = decode_cursor(cursor)
+            position = bisect.bisect_left(self.order_ids, cursor_order_id) - 1
+
+        medication = medication.lower() if medication else None
+        page = []
+        has_more = False
+        while position >= 0:
+            order = self.orders[position]
+            position -= 1
+            timestamp = order.get('timestamp', "")
+
+            # Walking backwards in time, so stop once we fall below the start of the range
+            if start_date and timestamp < start_date:
+                break
+            if end_date and timestamp >= end_date:
+                continue
+            if provider_npi and order.get('provider_npi') != provider_npi:
+                continue
+            if patient_mrn and order.get('patient_mrn') != patient_mrn:
+                continue
+            if medication and order.get('medication', "").lower() != medication:
+                continue
+
+            if len(page) == limit:
+                has_more = True
+                break
+            page.append(self._with_text(order, self.LARGE_TEXT_FIELDS if include_text else ()))
+
+        next_cursor = None
+        if has_more and page:
+            next_cursor = encode_cursor(page[-1]['timestamp'], page[-1]['order_id'])
+        return {'orders': page, 'next_cursor': next_cursor}
+
+    def get_patient_history(self, mrn: str, limit: int) -> Dict:
+        """Get a patient's most recent orders newest-first along with a summary of all their orders."""
+        patient_orders = self.orders_by_mrn.get(mrn, [])
+
+        medications = set()
+        providers = {}
+        for order in patient_orders:
+            medications.add(order.get('medication', ""))
+            providers[order.get('provider_npi', "")] = order.get('provider_name', "")
+
+        return {
+            'patient_mrn': mrn,
+            'orders': [
+                self._with_text(order, self.LARGE_TEXT_FIELDS) for order in reversed(patient_orders[-limit:])
+            ] if limit > 0 else [],
+            'summary': {
+                'total_orders': len(patient_orders),
+                'medications': sorted(medications),
+                'providers': [{'npi': npi, 'name': name} for npi, name in sorted(providers.items())],
+                'last_order_date': patient_orders[-1].get('timestamp') if patient_orders else None
+            }
+        }
+
+    def search_orders(self, query: str, limit: int, offset: int = 0, include_text: bool = False) -> Dict:
+        """Search orders by diagnosis, clinical notes and care plan content, best match first."""
+        if not query or not query.strip():
+            raise ValueError("Search query is required")
+
+        matches = self.search_index.search(query)
+        results = []
+        for order_id, score in matches[offset:offset + limit]:
+            order = self.orders[order_id - 1]
+            result = dict(self._with_text(order, self.LARGE_TEXT_FIELDS if include_text else ()))
+            result['rank'] = score
+            results.append(result)
+
+        next_offset = offset + limit if len(matches) > offset + limit else None
+        return {'orders': results, 'next_offset': next_offset}
+
+    def query_care_plans(self, section: str, terms: Sequence[str], limit: int, offset: int = 0) -> Dict:
+        """Find orders whose care plan section mentions every term, newest first."""
+        validate_section(section)
+        # Intersect starting from the rarest term
+        postings = sorted((self.care_plan_terms.get((section, term), []) for term in terms), key=len)
+        matches = set(postings[0]) if postings else set()
+        for posting in postings[1:]:
+            matches.intersection_update(posting)
+        order_ids = sorted(matches, reverse=True)
+
+        orders = [
+            {**self.orders[order_id - 1], 'care_plan_sections': self.care_plan_sections[order_id]}
+            for order_id in order_ids[offset:offset + limit]
+        ]
+        next_offset = offset + limit if len(order_ids) > offset + limit else None
+        return {'total': len(order_ids), 'orders': orders, 'next_offset': next_offset}
+
+    def iter_providers(self, limit: int) -> Iterator[Dict]:
+        for provider in list(self.providers.values())[:limit]:
+            yield dict(provider)
+
+    def iter_patients(self, limit: int) -> Iterator[Dict]:
+        for patient in list(self.patients.values())[:limit]:
+            yield dict(patient)
+
+    def get_analytics(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                      bucket: str = 'day', top_n: int = 10) -> Dict:
+        """Get order counts over time and top medications, providers and diagnoses from the daily aggregates."""
+        return self.daily_aggregates.query(start_date, end_date, bucket, top_n)
+
+    def consume_rate_limit(self, key: str, capacity: float, refill_rate: float, cost: float = 1.0) -> float:
+        """Take cost tokens from a token bucket. Returns 0 if they were taken, else seconds until they're available."""
+        now = time.monotonic()
+        with self.rate_limits_lock:
+            if len(self.rate_limits) >= self.MAX_RATE_LIMIT_KEYS:
+                self._prune_rate_limits(now, capacity, refill_rate)
+            bucket = self.rate_limits.get(key)
+            tokens = capacity if bucket is None else refill_tokens(bucket[0], now - bucket[1], capacity, refill_rate)
+            if tokens >= cost:
+                self.rate_limits[key] = [tokens - cost, now]
+                return 0.0
+            self.rate_limits[key] = [tokens, now]
+        return (cost - tokens) / refill_rate if refill_rate > 0 else float('inf')
+
+    def prune_rate_limits(self, capacity: float, refill_rate: float) -> int:
+        with self.rate_limits_lock:
+            return self._prune_rate_limits(time.monotonic(), capacity, refill_rate)
+
+    def _prune_rate_limits(self, now: float, capacity: float, refill_rate: float) -> int:
+        # Buckets that have refilled completely behave exactly like missing ones
+        full = [key for key, (tokens, updated_at) in self.rate_limits.items()
+                if refill_tokens(tokens, now - updated_at, capacity, refill_rate) >= capacity]
+        for key in full:
+            del self.rate_limits[key]
+        return len(full)
@@ -0,0 +1,42 @@
+from typing import Any
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson. Calls with stdlib-only options fall back to the default provider."""
+
+    def dumps(self, obj: Any, **kwargs) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Pretty-printed responses go through the stdlib encoder, everything else skips the str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(obj)
+        return self._app.response_class(self._dumps_bytes(obj), mimetype=self.mimetype)
+
+    def _dumps_bytes(self, obj: Any) -> bytes:
+        # Dates go through the default provider's encoder so the wire format doesn't change
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+def install_json_provider(app: Flask) -> str:
+    """Use the fastest available JSON provider for an app. Returns its name."""
+    if orjson is None:
+        return 'json'
+    app.json = OrjsonProvider(app)
+    return 'orjson'
@@ -0,0 +1,107 @@
+import re
+from typing import Dict, List, Set
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.5
+MAX_SIMILAR_RESULTS = 5
+
+# Strengths and concentrations such as "10%", "500 mg" or "2 g/kg"
+DOSE_PATTERN = re.compile(r"\b\d+(?:\.\d+)?\s*(?:%|mg/kg|g/kg|mg/ml|mcg|mg|g|ml|units?|iu|meq)(?![a-z])")
+NON_ALPHANUMERIC_PATTERN = re.compile(r"[^a-z0-9]+")
+
+# Dosage forms, routes, frequencies and filler words that don't change which drug was ordered
+IGNORED_WORDS = frozenset({
+    'human', 'tablet', 'tablets', 'tab', 'tabs', 'capsule', 'capsules', 'cap', 'caps',
+    'injection', 'injectable', 'solution', 'infusion', 'oral', 'po', 'iv', 'sc', 'subq',
+    'im', 'er', 'xr', 'sr', 'dr', 'ec', 'liquid', 'vial', 'premix',
+    'daily', 'weekly', 'bid', 'tid', 'qid', 'qd', 'prn'
+})
+
+# Multi-word names and brands that refer to the same drug, mapped to one canonical name
+MEDICATION_SYNONYMS = {
+    'intravenous immune globulin': 'ivig',
+    'intravenous immunoglobulin': 'ivig',
+    'immune globulin': 'ivig',
+    'immunoglobulin': 'ivig',
+    'igiv': 'ivig',
+    'privigen': 'ivig',
+    'gamunex': 'ivig',
+    'gammagard': 'ivig',
+    'octagam': 'ivig',
+    'acetylsalicylic acid': 'aspirin',
+    'asa': 'aspirin',
+    'paracetamol': 'acetaminophen',
+    'tylenol': 'acetaminophen',
+}
+SYNONYM_PATTERNS = [
+    (re.compile(rf"\b{re.escape(phrase)}\b"), canonical)
+    for phrase, canonical in sorted(MEDICATION_SYNONYMS.items(), key=lambda item: -len(item[0]))
+]
+
+def normalize_medication(medication: str) -> str:
+    """Normalize a medication name by dropping strengths, dosage forms and punctuation and mapping synonyms."""
+    if not medication:
+        return ""
+    normalized = DOSE_PATTERN.sub(" ", medication.lower())
+    normalized = NON_ALPHANUMERIC_PATTERN.sub(" ", normalized)
+    words = [word for word in normalized.split() if word not in IGNORED_WORDS and not word.isdigit()]
+    normalized = " ".join(words)
+    for pattern, canonical in SYNONYM_PATTERNS:
+        normalized = pattern.sub(canonical, normalized)
+    return " ".join(normalized.split())
+
+def trigrams(text: str) -> Set[str]:
+    """Return the padded word trigrams of a string, matching pg_trgm."""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def similarity(a: str, b: str) -> float:
+    """Trigram similarity of two normalized strings, between 0 and 1."""
+    a_grams, b_grams = trigrams(a), trigrams(b)
+    if not a_grams or not b_grams:
+        return 0.0
+    shared = len(a_grams & b_grams)
+    return shared / (len(a_grams) + len(b_grams) - shared)
+
+class MedicationIndex:
+    """Per-patient trigram index over normalized medication names."""
+
+    def __init__(self):
+        self.postings = {}     # (MRN, trigram) -> set of normalized medications
+        self.medications = {}  # (MRN, normalized medication) -> medication name as first ordered
+
+    def add(self, mrn: str, medication: str):
+        """Index a medication ordered for a patient."""
+        normalized = normalize_medication(medication)
+        if not normalized or (mrn, normalized) in self.medications:
+            return
+        self.medications[(mrn, normalized)] = medication
+        for gram in trigrams(normalized):
+            self.postings.setdefault((mrn, gram), set()).add(normalized)
+
+    def find_similar(self, mrn: str, medication: str, threshold: float,
+                     limit: int = MAX_SIMILAR_RESULTS) -> List[Dict]:
+        """Find a patient's previously ordered medications with similarity at or above the threshold."""
+        normalized = normalize_medication(medication)
+        query_grams = trigrams(normalized)
+        if not query_grams:
+            return []
+
+        # Count shared trigrams using only this patient's postings
+        shared_counts = {}
+        for gram in query_grams:
+            for candidate in self.postings.get((mrn, gram), ()):
+                shared_counts[candidate] = shared_counts.get(candidate, 0) + 1
+
+        matches = []
+        for candidate, shared in shared_counts.items():
+            score = shared / (len(query_grams) + len(trigrams(candidate)) - shared)
+            if score >= threshold:
+                matches.append({
+                    'medication': self.medications[(mrn, candidate)],
+                    'similarity': round(score, 3)
+                })
+        matches.sort(key=lambda match: -match['similarity'])
+        return matches[:limit]
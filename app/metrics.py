@@ -0,0 +1,354 @@
+import atexit
+import bisect
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from app.data_store import DataStore
+from app.profiling import traced
+
+# Latency buckets in seconds, from sub-millisecond store lookups up to long LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _format_labels(label_names: Sequence[str], label_values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}  # Label values -> value
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    @staticmethod
+    def _combine(value, other):
+        return value + other
+
+    def snapshot(self) -> List:
+        """Every series as [label values, value], ready for JSON."""
+        with self._lock:
+            return [[list(label_values), self._copy(value)] for label_values, value in self._values.items()]
+
+    def _items(self, series: Optional[Dict]) -> List:
+        if series is not None:
+            return sorted(series.items())
+        with self._lock:
+            return sorted((label_values, self._copy(value)) for label_values, value in self._values.items())
+
+    def render(self, series: Optional[Dict] = None) -> List[str]:
+        """Render this process's series, or the given ones merged from several processes."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        for label_values, value in self._items(series):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+class Gauge(_Metric):
+    TYPE = "gauge"
+
+    def inc(self, amount: float = 1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, amount: float = 1, *label_values):
+        self.inc(-amount, *label_values)
+
+    def set(self, value: float, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *label_values):
+        # Only the matching bucket is incremented; cumulative counts are computed when rendering
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @staticmethod
+    def _copy(series):
+        return [[*series[0]], series[1], series[2]]
+
+    @staticmethod
+    def _combine(series, other):
+        return [[a + b for a, b in zip(series[0], other[0])], series[1] + other[1], series[2] + other[2]]
+
+    def render(self, series: Optional[Dict] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        for label_values, (bucket_counts, total, count) in self._items(series):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, label_values)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, label_values)} {count}")
+        return lines
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class MetricsRegistry:
+    """Holds metrics and renders them in the Prometheus text exposition format.
+
+    Metrics live in each process. Given a directory shared by the workers (PROMETHEUS_MULTIPROC_DIR), every process
+    also flushes its metrics there as <pid>.json and renders the sum over all the files, so a scrape answered by any
+    worker reports the whole server. Counters and histograms of exited workers stay in the sums; their gauges don't.
+    """
+
+    def __init__(self, multiprocess_dir: Optional[str] = None):
+        self._metrics: Dict[str, _Metric] = {}
+        self.multiprocess_dir = multiprocess_dir
+        self._flush_lock = threading.Lock()
+        self._flushing_pid = None
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        merged = self._merge_processes() if self.multiprocess_dir else {}
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render(merged.get(metric.name, {}) if self.multiprocess_dir else None))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, List]:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def flush(self):
+        """Write this process's metrics to the multiprocess directory, if there is one."""
+        if not self.multiprocess_dir:
+            return
+        path = os.path.join(self.multiprocess_dir, f'{os.getpid()}.json')
+        with self._flush_lock:
+            # Written aside and renamed, so other processes never read a partial file
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(f'{path}.tmp', path)
+
+    def start_flushing(self, interval: float):
+        """Flush every `interval` seconds in a background thread, and once more at exit. Called in each worker."""
+        if not self.multiprocess_dir or self._flushing_pid == os.getpid():
+            return
+        self._flushing_pid = os.getpid()
+        self.flush()
+        atexit.register(self.flush)
+
+        def flush_periodically():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush()
+                except OSError:
+                    # Retried at the next interval
+                    pass
+
+        threading.Thread(target=flush_periodically, name='metrics-flush', daemon=True).start()
+
+    def clear(self):
+        """Remove every process's metrics file, so a restarted server counts from zero."""
+        if not self.multiprocess_dir:
+            return
+        for entry in os.scandir(self.multiprocess_dir):
+            if entry.name.endswith('.json'):
+                os.remove(entry.path)
+
+    def _merge_processes(self) -> Dict[str, Dict]:
+        # This process's metrics as they are now, the others' as last flushed
+        snapshots = [self.snapshot()]
+        for entry in os.scandir(self.multiprocess_dir):
+            name, extension = os.path.splitext(entry.name)
+            if extension != '.json' or not name.isdigit() or int(name) == os.getpid():
+                continue
+            try:
+                with open(entry.path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                # Removed since it was listed
+                continue
+            if not _process_alive(int(name)):
+                # In-flight requests and held slots of an exited worker are gone with it
+                snapshot = {metric_name: series for metric_name, series in snapshot.items()
+                            if not isinstance(self._metrics.get(metric_name), Gauge)}
+            snapshots.append(snapshot)
+
+        merged = {}
+        for snapshot in snapshots:
+            for metric_name, series in snapshot.items():
+                metric = self._metrics.get(metric_name)
+                if metric is None:
+                    continue
+                values = merged.setdefault(metric_name, {})
+                for label_values, value in series:
+                    label_values = tuple(label_values)
+                    values[label_values] = (metric._combine(values[label_values], value)
+                                            if label_values in values else value)
+        return merged
+
+REGISTRY = MetricsRegistry(os.environ.get('PROMETHEUS_MULTIPROC_DIR') or None)
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route.', ('method', 'route', 'status'))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    'http_requests_in_flight', 'HTTP requests currently being handled by route.', ('route',))
+
+DATASTORE_OPERATION_DURATION = REGISTRY.histogram(
+    'datastore_operation_duration_seconds', 'DataStore method latency.', ('method',))
+DATASTORE_OPERATION_ERRORS = REGISTRY.counter(
+    'datastore_operation_errors_total', 'DataStore method calls that raised.', ('method',))
+
+LLM_REQUEST_DURATION = REGISTRY.histogram(
+    'llm_request_duration_seconds', 'Care plan LLM call latency.')
+LLM_TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    'llm_time_to_first_token_seconds', 'Time until the LLM streamed its first token.')
+LLM_TOKENS = REGISTRY.counter(
+    'llm_tokens_total', 'LLM tokens by type (input, output, cache_read, cache_creation).', ('type',))
+# Prompts run from under a thousand tokens with a compact example to several thousand with the default one
+PROMPT_TOKEN_BUCKETS = (250, 500, 750, 1000, 1500, 2000, 3000, 4000, 6000, 8000)
+LLM_PROMPT_TOKENS = REGISTRY.histogram(
+    'llm_prompt_tokens', 'Input tokens of care plan prompts by the example they include.', ('example',),
+    buckets=PROMPT_TOKEN_BUCKETS)
+LLM_REQUEST_DURATION_BY_EXAMPLE = REGISTRY.histogram(
+    'llm_request_duration_by_example_seconds', 'Care plan LLM call latency by the example the prompt includes.',
+    ('example',))
+LLM_ERRORS = REGISTRY.counter(
+    'llm_errors_total', 'Care plan LLM calls that failed.')
+
+ADMISSION_DECISIONS = REGISTRY.counter(
+    'admission_decisions_total', 'Admission decisions for expensive endpoints by outcome.', ('endpoint', 'outcome'))
+ADMISSION_WAIT = REGISTRY.histogram(
+    'admission_wait_seconds', 'Time admitted requests waited for a token or an LLM slot.', ('endpoint',))
+LLM_SLOTS_IN_USE = REGISTRY.gauge(
+    'llm_concurrency_slots_in_use', 'In-flight LLM calls holding an admission slot in this process.')
+
+READ_ROUTING = REGISTRY.counter(
+    'datastore_read_routing_total', 'Where replica-eligible reads were served, and why.', ('target', 'reason'))
+
+IDENTITY_CACHE_LOOKUPS = REGISTRY.counter(
+    'identity_cache_lookups_total', 'Provider and patient validations by whether the cache answered.', ('kind', 'result'))
+
+EXPORT_ROWS = REGISTRY.counter('export_rows_total', 'Orders serialized into exports by format.', ('format',))
+EXPORT_BYTES = REGISTRY.counter('export_bytes_total', 'Export bytes sent by format.', ('format',))
+
+def record_llm_usage(usage, duration: float, time_to_first_token: Optional[float] = None,
+                     example: Optional[str] = None):
+    """Record latency and token counts of a completed LLM call, also per prompt example if given."""
+    LLM_REQUEST_DURATION.observe(duration)
+    if example is not None:
+        LLM_REQUEST_DURATION_BY_EXAMPLE.observe(duration, example)
+    if time_to_first_token is not None:
+        LLM_TIME_TO_FIRST_TOKEN.observe(time_to_first_token)
+    if usage is None:
+        return
+    if example is not None and isinstance(getattr(usage, 'input_tokens', None), int):
+        LLM_PROMPT_TOKENS.observe(usage.input_tokens, example)
+    for token_type, attribute in (('input', 'input_tokens'), ('output', 'output_tokens'),
+                                  ('cache_read', 'cache_read_input_tokens'),
+                                  ('cache_creation', 'cache_creation_input_tokens')):
+        count = getattr(usage, attribute, None)
+        if isinstance(count, int):
+            LLM_TOKENS.inc(count, token_type)
+
+def count_export_rows(orders: Iterable[Dict], export_format: str) -> Iterator[Dict]:
+    """Pass orders through while counting them as exported rows."""
+    for order in orders:
+        EXPORT_ROWS.inc(1, export_format)
+        yield order
+
+def count_export_bytes(chunks: Iterable[bytes], export_format: str) -> Iterator[bytes]:
+    """Pass export chunks through while counting the bytes sent."""
+    for chunk in chunks:
+        EXPORT_BYTES.inc(len(chunk), export_format)
+        yield chunk
+
+def _timed(method_name: str, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            DATASTORE_OPERATION_ERRORS.inc(1, method_name)
+            raise
+        finally:
+            DATASTORE_OPERATION_DURATION.observe(time.perf_counter() - start, method_name)
+    return wrapper
+
+def _timed_async(method_name: str, method):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception:
+            DATASTORE_OPERATION_ERRORS.inc(1, method_name)
+            raise
+        finally:
+            DATASTORE_OPERATION_DURATION.observe(time.perf_counter() - start, method_name)
+    return wrapper
+
+def instrument_store(store: DataStore) -> DataStore:
+    """Time and trace every DataStore interface method of a store instance. Streaming generators are left as is."""
+    for name in sorted(DataStore.__abstractmethods__ | {'validate_order'}):
+        if inspect.isgeneratorfunction(getattr(type(store), name, None)):
+            continue
+        setattr(store, name, _timed(name, traced(f'datastore.{name}')(getattr(store, name))))
+    return store
+
+def instrument_async_store(store):
+    """Time and trace every AsyncDataStore interface method of a store instance, under the same metric names."""
+    from app.async_data_store import AsyncDataStore
+    for name in sorted(AsyncDataStore.__abstractmethods__ | {'validate_order'}):
+        setattr(store, name, _timed_async(name, traced(f'datastore.{name}')(getattr(store, name))))
+    return store
@@ -0,0 +1,43 @@
+import gzip
+import json
+import os
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+ARCHIVE_SUFFIX = '.ndjson.gz'
+COMPRESS_LEVEL = 6
+
+def archive_path(archive_dir: str, partition: str) -> str:
+    return os.path.join(archive_dir, partition + ARCHIVE_SUFFIX)
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+def write_archive(path: str, orders: Iterable[Dict]) -> Tuple[int, int]:
+    """Write orders to a gzip-compressed NDJSON file. Returns the row count and the highest order id.
+    The file only appears under its final name once it's complete."""
+    rows = 0
+    max_order_id = 0
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    partial = path + '.partial'
+    with gzip.open(partial, 'wt', encoding='utf-8', compresslevel=COMPRESS_LEVEL) as archive:
+        for order in orders:
+            archive.write(json.dumps(order, default=_encode) + '\n')
+            rows += 1
+            max_order_id = max(max_order_id, order['order_id'])
+    os.replace(partial, path)
+    return rows, max_order_id
+
+def read_archive(path: str, since_order_id: Optional[int] = None) -> Iterator[Dict]:
+    """Stream the orders of an archive file, optionally only those after an order id."""
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        for line in archive:
+            order = json.loads(line)
+            if since_order_id is not None and order['order_id'] <= since_order_id:
+                continue
+            # Exports format timestamps the same whether an order is archived or not
+            if order.get('timestamp'):
+                order['timestamp'] = datetime.fromisoformat(order['timestamp'])
+            yield order
@@ -0,0 +1,46 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple, Union
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def encode_position(position) -> str:
+    """Encode any JSON-serializable position, such as one cursor per shard, as an opaque cursor."""
+    raw = json.dumps(position).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_position(cursor: str, error: str = "Invalid cursor"):
+    """Decode an opaque cursor from encode_position. Raises ValueError with the given message if it's malformed."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError(error)
+
+def encode_cursor(timestamp: Union[str, datetime], order_id: int) -> str:
+    """Encode the (timestamp, order_id) keyset position of an order as an opaque cursor."""
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.isoformat()
+    return encode_position([timestamp, order_id])
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Decode an opaque cursor. Raises ValueError if the cursor is malformed."""
+    try:
+        timestamp, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        datetime.fromisoformat(timestamp)
+        return timestamp, int(order_id)
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+def clamp_page_size(limit: Optional[int]) -> int:
+    """Clamp a requested page size to the supported range."""
+    if not limit or limit < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+def normalize_date(value: Optional[str]) -> Optional[str]:
+    """Normalize an ISO date/datetime filter value. Raises ValueError if it can't be parsed."""
+    if not value:
+        return None
+    return datetime.fromisoformat(value).isoformat()
@@ -1,25 +1,291 @@
-from typing import List, Dict
+from contextlib import ExitStack, contextmanager
+from typing import Callable, List, Dict, Iterator, Optional, Sequence
+import json
+import re
+import threading
+import time
+from datetime import date
 import psycopg
 from psycopg.rows import dict_row
-from app.data_store import DataStore
+from app.change_signal import ChangeSignal
+from app.data_store import Change, DataStore
+from app.metrics import READ_ROUTING
+from app.replicas import ReplicaRouter, current_session, primary_reads
+from app.pagination import encode_cursor, decode_cursor
+from app.medication_matching import normalize_medication, DEFAULT_SIMILARITY_THRESHOLD, MAX_SIMILAR_RESULTS
+from app.analytics import DIMENSIONS, validate_bucket
+from app.order_archive import archive_path, read_archive, write_archive
+from app.text_blobs import HEADER, TextCodec, blob_hash, train_dictionary
+from app.care_plan_sections import parse_care_plan, section_terms, validate_section
+
+try:
+    import psycopg_pool
+except ImportError:
+    psycopg_pool = None
+
+# Large text order_details references by hash, in the order its columns are written
+TEXT_COLUMN_ORDER = ('medication_history', 'patient_records', 'care_plan')
+
+def _text_columns(fields) -> str:
+    return ", ".join(f"{field}_blob.data AS {field}" for field in fields)
+
+def _text_joins(fields, details: str = "order_details") -> str:
+    return " ".join(
+        f"LEFT JOIN text_blobs AS {field}_blob ON {field}_blob.hash = {details}.{field}_hash" for field in fields
+    )
 
 class PostgreSQLDataStore(DataStore):
 
-    def __init__(self, database_url: str = None):
+    ORDERS_CHANNEL = "orders_changed"
+    IDENTITIES_CHANNEL = "identities_changed"
+    LISTEN_TIMEOUT = 5.0  # Seconds between checks whether a listener should stop
+    LISTEN_RECONNECT_INTERVAL = 5.0
+    CHANGES_RECHECK_INTERVAL = 5.0  # Longest a change feed request waits on notifications before reading again
+
+    ORDER_METADATA_COLUMNS = """
+        order_id, patient_mrn, patient_first_name, patient_last_name,
+        provider_npi, provider_name, medication, primary_diagnosis,
+        additional_diagnoses, timestamp
+    """
+    ORDER_TEXT_COLUMNS = _text_columns(TEXT_COLUMN_ORDER)
+
+    # Large text is referenced from order_details and stored compressed in text_blobs,
+    # joined in only by reads that need it and decompressed by the app
+    ORDERS_WITH_TEXT = f"orders LEFT JOIN order_details USING (order_id) {_text_joins(TEXT_COLUMN_ORDER)}"
+
+    # Monthly partitions are named orders_YYYY_MM and created this many months ahead
+    PARTITION_NAME = re.compile(r'^orders_(\d{4})_(\d{2})$')
+    PARTITION_MONTHS_AHEAD = 3
+
+    # Statements shared with AsyncPostgreSQLDataStore
+    SELECT_PROVIDER_BY_NPI_SQL = "SELECT name, name_normalized FROM providers WHERE npi = %s"
+    SELECT_PROVIDER_BY_NAME_SQL = "SELECT npi FROM providers WHERE name_normalized = %s"
+    INSERT_PROVIDER_SQL = "INSERT INTO providers (npi, name, name_normalized) VALUES (%s, %s, %s) ON CONFLICT (npi) DO NOTHING"
+    SELECT_PATIENT_SQL = "SELECT first_name, last_name FROM patients WHERE mrn = %s"
+    INSERT_PATIENT_SQL = "INSERT INTO patients (mrn, first_name, last_name) VALUES (%s, %s, %s) ON CONFLICT (mrn) DO NOTHING"
+    SELECT_DUPLICATE_ORDER_SQL = "SELECT 1 FROM orders WHERE patient_mrn = %s AND LOWER(medication) = LOWER(%s) LIMIT 1"
+
+    # The % operator can use the trigram index; it matches at pg_trgm.similarity_threshold, which
+    # SET_SIMILARITY_THRESHOLD_SQL sets for the current transaction only
+    SET_SIMILARITY_THRESHOLD_SQL = "SELECT SET_CONFIG('pg_trgm.similarity_threshold', %s, TRUE)"
+    SELECT_SIMILAR_ORDERS_SQL = """
+        SELECT medication, MAX(SIMILARITY(medication_normalized, %s)) AS similarity
+        FROM orders
+        WHERE patient_mrn = %s
+          AND medication_normalized %% %s
+        GROUP BY medication
+        ORDER BY similarity DESC
+        LIMIT %s
+    """
+
+    # One statement writes the order, its text blobs and the references to them, so all commit or none do.
+    # A blob that's already stored only gains references, one per field of the order holding its text.
+    INSERT_ORDER_SQL = """
+        WITH new_order AS (
+            INSERT INTO orders (
+                patient_mrn, patient_first_name, patient_last_name,
+                provider_npi, provider_name, medication, medication_normalized, primary_diagnosis,
+                additional_diagnoses
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING order_id, primary_diagnosis
+        ), new_blobs AS (
+            INSERT INTO text_blobs AS blob (hash, raw_size, stored_size, ref_count, data)
+            SELECT hash, MIN(raw_size), MIN(stored_size), COUNT(*), (ARRAY_AGG(data))[1]
+            FROM (VALUES (%s::bytea, %s::integer, %s::integer, %s::bytea), (%s, %s, %s, %s), (%s, %s, %s, %s))
+                AS text (hash, raw_size, stored_size, data)
+            WHERE hash IS NOT NULL
+            GROUP BY hash
+            ON CONFLICT (hash) DO UPDATE SET ref_count = blob.ref_count + EXCLUDED.ref_count
+        )
+        INSERT INTO order_details (
+            order_id, medication_history_hash, patient_records_hash, care_plan_hash, search_vector,
+            care_plan_sections, care_plan_terms
+        )
+        SELECT order_id, %s::bytea, %s::bytea, %s::bytea,
+               TO_TSVECTOR('english', COALESCE(primary_diagnosis, '') || ' ' ||
+                   COALESCE(%s::text, '') || ' ' || COALESCE(%s::text, '')),
+               %s::jsonb, %s::jsonb
+        FROM new_order
+    """
+
+    # Order ids are taken when an order is inserted but seen when it commits, so a lower id can show up after
+    # a higher one. The feed therefore runs in order of the writing transaction and stops short of the oldest
+    # one still running: every order it hasn't reached yet comes after its cursor.
+    CHANGES_HORIZON = "write_xid < PG_SNAPSHOT_XMIN(PG_CURRENT_SNAPSHOT())"
+    SELECT_CHANGES_SQL = f"""
+        SELECT {ORDER_METADATA_COLUMNS}, {ORDER_TEXT_COLUMNS}, write_xid::TEXT::BIGINT AS change_xid
+        FROM {ORDERS_WITH_TEXT}
+        WHERE (write_xid, order_id) > (%s::TEXT::XID8, %s) AND {CHANGES_HORIZON}
+        ORDER BY write_xid, order_id LIMIT %s
+    """
+    SELECT_CHANGE_CURSOR_SQL = f"""
+        SELECT write_xid::TEXT::BIGINT, order_id FROM orders WHERE {CHANGES_HORIZON}
+        ORDER BY write_xid DESC, order_id DESC LIMIT 1
+    """
+
+    # Each table records the transaction that wrote each row. The newest of those older than every transaction
+    # still running only moves forward, and does so once each write commits, without writers sharing a row.
+    VERSIONED_TABLES = ('orders', 'patients', 'providers', 'order_archives')
+    SELECT_VERSION_SQL = "SELECT COALESCE(GREATEST({}), '0')::TEXT::BIGINT".format(", ".join(
+        f"(SELECT write_xid FROM {table} WHERE write_xid < PG_SNAPSHOT_XMIN(PG_CURRENT_SNAPSHOT())"
+        f" ORDER BY write_xid DESC LIMIT 1)"
+        for table in VERSIONED_TABLES
+    ))
+    SELECT_WAL_LSN_SQL = "SELECT pg_current_wal_lsn()::text"
+
+    # An idle primary sends no new WAL, so a replica that replayed everything it received isn't lagging
+    REPLICA_STATUS_SQL = """
+        SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0) END,
+               pg_last_wal_replay_lsn()::text
+    """
+    COUNT_SQL = (
+        "SELECT (SELECT COUNT(*) FROM orders) + (SELECT COALESCE(SUM(row_count), 0) FROM order_archives)",
+        "SELECT COUNT(*) FROM patients",
+        "SELECT COUNT(*) FROM providers",
+        # Referenced text size over stored size, so deduplication counts as well as compression
+        """SELECT COALESCE(ROUND(SUM(raw_size::BIGINT * ref_count)::NUMERIC / NULLIF(SUM(stored_size), 0), 2), 1)
+           FROM text_blobs""",
+    )
+
+    SELECT_DICTIONARY_SQL = "SELECT data FROM text_dictionaries WHERE dictionary_id = %s"
+    SELECT_LATEST_DICTIONARY_SQL = "SELECT dictionary_id, data FROM text_dictionaries ORDER BY dictionary_id DESC LIMIT 1"
+    TEXT_SAMPLE_SIZE = 1000
+    RECOMPRESS_BATCH_SIZE = 500
+    PARSE_BATCH_SIZE = 500
+
+    # Refill and take tokens in one atomic upsert; the row lock serializes workers hitting the same bucket
+    _REFILLED = """LEAST(%(capacity)s, bucket.tokens
+        + EXTRACT(EPOCH FROM EXCLUDED.updated_at - bucket.updated_at)::DOUBLE PRECISION * %(refill_rate)s)"""
+    CONSUME_RATE_LIMIT_SQL = f"""
+        INSERT INTO rate_limits AS bucket (key, tokens, allowed, updated_at)
+        VALUES (%(key)s, %(capacity)s - %(cost)s, TRUE, CLOCK_TIMESTAMP())
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = CASE WHEN {_REFILLED} >= %(cost)s THEN {_REFILLED} - %(cost)s ELSE {_REFILLED} END,
+            allowed = {_REFILLED} >= %(cost)s,
+            updated_at = EXCLUDED.updated_at
+        RETURNING tokens, allowed
+    """
+    # A missing bucket starts full, so full ones can go
+    PRUNE_RATE_LIMITS_SQL = """
+        DELETE FROM rate_limits
+        WHERE tokens + EXTRACT(EPOCH FROM CLOCK_TIMESTAMP() - updated_at)::DOUBLE PRECISION * %(refill_rate)s
+            >= %(capacity)s
+    """
+
+    def __init__(self, database_url: str = None, similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+                 replica_urls: Optional[List[str]] = None, max_replica_lag: float = 5.0,
+                 archive_dir: str = 'archive'):
         self.database_url = database_url
+        self.similarity_threshold = similarity_threshold
         if not self.database_url:
             raise ValueError("Database URL hasn't been provided.")
-        self._init_schema()
-    
-    def _conn(self):
-        # Get database connection
-        return psycopg.connect(self.database_url)
-    
-    def _init_schema(self):
-        # Create tables if they don't exist
+        self.pool = None
+        self.replica_pools = {}  # Replica URL -> pool
+        self.replicas = ReplicaRouter(replica_urls, max_replica_lag) if replica_urls else None
+        self.archive_dir = archive_dir
+        self.codec = TextCodec(self._load_dictionary)
+        # Woken by one listener thread per process, started by the first change feed request that waits
+        self.order_signal = ChangeSignal(self._start_order_listener)
+        self._stop_listening = threading.Event()
+
+    def open_pool(self, min_size: int, max_size: int):
+        """Open connection pools to the primary and each replica for this process if psycopg_pool is installed,
+        and load the dictionary new text is compressed with."""
+        if psycopg_pool is not None and self.pool is None:
+            self.pool = psycopg_pool.ConnectionPool(self.database_url, min_size=min_size, max_size=max_size, open=True)
+            for url in (self.replicas.urls if self.replicas else []):
+                # Replicas may be down at startup, so their pools connect in the background
+                self.replica_pools[url] = psycopg_pool.ConnectionPool(url, min_size=min_size, max_size=max_size, open=True)
+        try:
+            self.load_text_dictionary()
+        except Exception:
+            # Text written before the database is reachable is compressed without a dictionary, still readable
+            pass
+
+    def load_text_dictionary(self):
+        """Compress new text with the most recently trained dictionary, if there is one."""
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(self.SELECT_LATEST_DICTIONARY_SQL)
+                row = cur.fetchone()
+        if row:
+            self.codec.use_dictionary(row[0], bytes(row[1]))
+
+    def _load_dictionary(self, dictionary_id: int) -> Optional[bytes]:
+        # Dictionaries are read from the primary, a replica may not have a new one yet
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(self.SELECT_DICTIONARY_SQL, (dictionary_id,))
+                row = cur.fetchone()
+        return bytes(row[0]) if row else None
+
+    def _conn(self, url: str = None):
+        # Get a pooled connection if a pool was opened, otherwise a new one
+        pool = self.pool if url is None else self.replica_pools.get(url)
+        if pool is not None:
+            return pool.connection()
+        return psycopg.connect(url or self.database_url)
+
+    @contextmanager
+    def _read_conn(self):
+        """Connection for a read that a replica may serve, falling back to the primary."""
+        with ExitStack() as stack:
+            conn = None
+            if self.replicas is not None:
+                if primary_reads.get():
+                    READ_ROUTING.inc(1, 'primary', 'pinned')
+                else:
+                    conn = self._enter_replica(stack)
+            if conn is None:
+                conn = stack.enter_context(self._conn())
+            yield conn
+
+    def _enter_replica(self, stack: ExitStack):
+        session = current_session.get()
+        required_lsn = session.required_lsn if session is not None else None
+        reason = 'no_replica'
+        for url in self.replicas.candidates():
+            attempt = ExitStack()
+            try:
+                conn = attempt.enter_context(self._conn(url))
+                if self.replicas.needs_check(url, required_lsn):
+                    with conn.cursor() as cur:
+                        cur.execute(self.REPLICA_STATUS_SQL)
+                        lag, replay_lsn = cur.fetchone()
+                    self.replicas.update(url, float(lag), replay_lsn)
+                reason = self.replicas.rejection(url, required_lsn)
+                if reason is None:
+                    READ_ROUTING.inc(1, 'replica', 'fresh')
+                    stack.enter_context(attempt.pop_all())
+                    return conn
+            except Exception:
+                # Fail over: skip this replica for a while and try the next one, then the primary
+                self.replicas.mark_down(url)
+                reason = 'failover'
+            try:
+                attempt.close()
+            except Exception:
+                pass
+        READ_ROUTING.inc(1, 'primary', reason)
+        return None
+
+    def _record_write(self, conn):
+        # Note where the session's write ended, so its next reads skip replicas that haven't replayed it
+        session = current_session.get()
+        if self.replicas is None or session is None:
+            return
+        with conn.cursor() as cur:
+            cur.execute(self.SELECT_WAL_LSN_SQL)
+            session.record_write(cur.fetchone()[0])
+
+    def migrate(self):
+        """Create tables, indexes and triggers if they don't exist."""
         with self._conn() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
+                    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
                     CREATE TABLE IF NOT EXISTS providers (
                         npi VARCHAR(10) PRIMARY KEY,
                         name VARCHAR(255) NOT NULL,
@@ -32,8 +298,23 @@ class PostgreSQLDataStore(DataStore):
                         last_name VARCHAR(255) NOT NULL
                     );
                     
+                    -- Orders are partitioned by month, so date-filtered queries only scan the months they cover
+                    CREATE SEQUENCE IF NOT EXISTS orders_order_id_seq;
+
+                    -- An orders table from before partitioning is set aside, then copied in below
+                    DO $$
+                    BEGIN
+                        IF EXISTS (SELECT 1 FROM pg_class WHERE oid = TO_REGCLASS('orders') AND relkind = 'r') THEN
+                            ALTER SEQUENCE orders_order_id_seq OWNED BY NONE;
+                            ALTER TABLE orders RENAME TO orders_unpartitioned;
+                            ALTER TABLE orders_unpartitioned RENAME CONSTRAINT orders_pkey TO orders_unpartitioned_pkey;
+                            DROP INDEX IF EXISTS orders_search_idx, orders_medication_trgm_idx, orders_timestamp_id_idx,
+                                orders_provider_timestamp_idx, orders_patient_timestamp_idx, orders_medication_timestamp_idx;
+                        END IF;
+                    END $$;
+
                     CREATE TABLE IF NOT EXISTS orders (
-                        order_id SERIAL PRIMARY KEY,
+                        order_id INTEGER NOT NULL DEFAULT NEXTVAL('orders_order_id_seq'),
                         patient_mrn VARCHAR(6) REFERENCES patients(mrn),
                         patient_first_name VARCHAR(255) NOT NULL,
                         patient_last_name VARCHAR(255) NOT NULL,
@@ -42,63 +323,332 @@ class PostgreSQLDataStore(DataStore):
                         medication VARCHAR(255) NOT NULL,
                         primary_diagnosis TEXT NOT NULL,
                         additional_diagnoses TEXT,
+                        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        medication_normalized VARCHAR(255),
+                        PRIMARY KEY (order_id, timestamp)
+                    ) PARTITION BY RANGE (timestamp);
+
+                    -- Each distinct large text is stored once, however many orders reference it, compressed by
+                    -- the app (see app/text_blobs.py). PostgreSQL stores the compressed blobs as they are.
+                    -- ref_count counts references: an order holding the text in two fields counts twice.
+                    CREATE TABLE IF NOT EXISTS text_blobs (
+                        hash BYTEA PRIMARY KEY,
+                        raw_size INTEGER NOT NULL,
+                        stored_size INTEGER NOT NULL,
+                        ref_count INTEGER NOT NULL DEFAULT 1,
+                        data BYTEA NOT NULL
+                    );
+                    ALTER TABLE text_blobs ALTER COLUMN data SET STORAGE EXTERNAL;
+
+                    -- Compression dictionaries trained from stored text, kept for as long as blobs may use them
+                    CREATE TABLE IF NOT EXISTS text_dictionaries (
+                        dictionary_id SERIAL PRIMARY KEY,
+                        data BYTEA NOT NULL,
+                        created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    );
+
+                    -- Text stored inline by earlier schemas is gathered here, then moved into text_blobs below
+                    CREATE TEMPORARY TABLE legacy_order_text (
+                        order_id INTEGER PRIMARY KEY,
                         medication_history TEXT,
                         patient_records TEXT,
-                        care_plan TEXT,
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        care_plan TEXT
+                    ) ON COMMIT DROP;
+
+                    DO $$
+                    BEGIN
+                        IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_schema = CURRENT_SCHEMA()
+                                   AND table_name = 'order_details' AND column_name = 'care_plan') THEN
+                            INSERT INTO legacy_order_text
+                            SELECT order_id, medication_history, patient_records, care_plan FROM order_details;
+                            DROP TABLE order_details;
+                        END IF;
+                        IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_schema = CURRENT_SCHEMA()
+                                   AND table_name = 'orders' AND column_name = 'care_plan') THEN
+                            INSERT INTO legacy_order_text
+                            SELECT order_id, medication_history, patient_records, care_plan FROM orders
+                            ON CONFLICT (order_id) DO NOTHING;
+                            DROP INDEX IF EXISTS orders_search_idx;
+                            ALTER TABLE orders DROP COLUMN search_vector, DROP COLUMN medication_history,
+                                DROP COLUMN patient_records, DROP COLUMN care_plan;
+                        END IF;
+                    END $$;
+
+                    -- References from orders to their large text, kept out of orders so metadata reads stay small.
+                    -- The search vector also covers the order's diagnosis, computed when the order is added.
+                    CREATE TABLE IF NOT EXISTS order_details (
+                        order_id INTEGER PRIMARY KEY,
+                        medication_history_hash BYTEA,
+                        patient_records_hash BYTEA,
+                        care_plan_hash BYTEA,
+                        search_vector TSVECTOR
                     );
+
+                    -- Care plan items per section, parsed when the order is added, and the terms each section
+                    -- mentions, which section queries match by containment on a GIN index
+                    ALTER TABLE order_details
+                        ADD COLUMN IF NOT EXISTS care_plan_sections JSONB,
+                        ADD COLUMN IF NOT EXISTS care_plan_terms JSONB;
+
+                    -- Catches orders outside the monthly partitions, so an insert never fails for want of one
+                    CREATE TABLE IF NOT EXISTS orders_default PARTITION OF orders DEFAULT;
+
+                    CREATE OR REPLACE FUNCTION ensure_order_partition(month DATE) RETURNS VOID AS $$
+                    DECLARE
+                        partition_name TEXT := 'orders_' || TO_CHAR(month, 'YYYY_MM');
+                        next_month DATE := month + INTERVAL '1 month';
+                    BEGIN
+                        IF TO_REGCLASS(partition_name) IS NOT NULL THEN
+                            RETURN;
+                        END IF;
+                        IF NOT EXISTS (SELECT 1 FROM orders_default WHERE timestamp >= month AND timestamp < next_month) THEN
+                            EXECUTE FORMAT('CREATE TABLE %I PARTITION OF orders FOR VALUES FROM (%L) TO (%L)',
+                                           partition_name, month, next_month);
+                            RETURN;
+                        END IF;
+                        -- The month's rows in the default partition would fall outside its range once the month has
+                        -- a partition, so they move into a table that is then attached as that partition. Rows keep
+                        -- their write_xid, so the change feed doesn't send them again.
+                        EXECUTE FORMAT('CREATE TABLE %I (LIKE orders INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+                        EXECUTE FORMAT('WITH moved AS (DELETE FROM orders_default WHERE timestamp >= %L AND timestamp < %L '
+                                       || 'RETURNING *) INSERT INTO %I SELECT * FROM moved', month, next_month, partition_name);
+                        EXECUTE FORMAT('ALTER TABLE orders ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                                       partition_name, month, next_month);
+                    END;
+                    $$ LANGUAGE plpgsql;
+
+                    CREATE OR REPLACE FUNCTION ensure_order_partitions(months_ahead INTEGER) RETURNS VOID AS $$
+                    BEGIN
+                        -- Every worker calls this, one at a time
+                        PERFORM PG_ADVISORY_XACT_LOCK(HASHTEXT('ensure_order_partitions'));
+                        PERFORM ensure_order_partition(month::date) FROM (
+                            SELECT GENERATE_SERIES(
+                                DATE_TRUNC('month', CURRENT_DATE),
+                                DATE_TRUNC('month', CURRENT_DATE) + MAKE_INTERVAL(months => months_ahead),
+                                INTERVAL '1 month'
+                            ) AS month
+                            UNION
+                            -- Months that only have orders in the default partition, e.g. back-dated ones. Archived
+                            -- months stay there, since a new partition would be archived over the earlier file.
+                            SELECT DISTINCT DATE_TRUNC('month', timestamp) FROM orders_default
+                            WHERE NOT EXISTS (SELECT 1 FROM order_archives
+                                              WHERE partition_name = 'orders_' || TO_CHAR(timestamp, 'YYYY_MM'))
+                        ) AS months;
+                    END;
+                    $$ LANGUAGE plpgsql;
+
+                    -- Copied before the triggers exist, so copied orders don't count as new
+                    DO $$
+                    BEGIN
+                        IF TO_REGCLASS('orders_unpartitioned') IS NOT NULL THEN
+                            PERFORM ensure_order_partition(month::date) FROM GENERATE_SERIES(
+                                (SELECT DATE_TRUNC('month', MIN(timestamp)) FROM orders_unpartitioned),
+                                (SELECT DATE_TRUNC('month', MAX(timestamp)) FROM orders_unpartitioned),
+                                INTERVAL '1 month'
+                            ) AS month;
+                            INSERT INTO orders (
+                                order_id, patient_mrn, patient_first_name, patient_last_name, provider_npi, provider_name,
+                                medication, primary_diagnosis, additional_diagnoses, timestamp, medication_normalized
+                            )
+                            SELECT order_id, patient_mrn, patient_first_name, patient_last_name, provider_npi, provider_name,
+                                   medication, primary_diagnosis, additional_diagnoses, COALESCE(timestamp, CURRENT_TIMESTAMP),
+                                   medication_normalized
+                            FROM orders_unpartitioned;
+                            INSERT INTO legacy_order_text
+                            SELECT order_id, medication_history, patient_records, care_plan FROM orders_unpartitioned
+                            ON CONFLICT (order_id) DO NOTHING;
+                            DROP TABLE orders_unpartitioned;
+                        END IF;
+                    END $$;
+
+                    -- Gathered legacy text is stored uncompressed (a zero header) until compress-text recompresses it
+                    INSERT INTO text_blobs AS blob (hash, raw_size, stored_size, ref_count, data)
+                    SELECT SHA256(raw), OCTET_LENGTH(raw), OCTET_LENGTH(raw) + 5, COUNT(*),
+                           DECODE('0000000000', 'hex') || raw
+                    FROM legacy_order_text,
+                         UNNEST(ARRAY[medication_history, patient_records, care_plan]) AS text,
+                         CONVERT_TO(text, 'UTF8') AS raw
+                    WHERE text IS NOT NULL
+                    GROUP BY raw
+                    ON CONFLICT (hash) DO UPDATE SET ref_count = blob.ref_count + EXCLUDED.ref_count;
+
+                    INSERT INTO order_details (order_id, medication_history_hash, patient_records_hash, care_plan_hash, search_vector)
+                    SELECT order_id, SHA256(CONVERT_TO(medication_history, 'UTF8')), SHA256(CONVERT_TO(patient_records, 'UTF8')),
+                           SHA256(CONVERT_TO(care_plan, 'UTF8')),
+                           TO_TSVECTOR('english', COALESCE(orders.primary_diagnosis, '') || ' ' ||
+                               COALESCE(patient_records, '') || ' ' || COALESCE(care_plan, ''))
+                    FROM legacy_order_text LEFT JOIN orders USING (order_id)
+                    ON CONFLICT (order_id) DO NOTHING;
+
+                    CREATE INDEX IF NOT EXISTS order_details_search_idx
+                        ON order_details USING GIN (search_vector);
+
+                    CREATE INDEX IF NOT EXISTS order_details_care_plan_terms_idx
+                        ON order_details USING GIN (care_plan_terms jsonb_path_ops);
+
+                    -- Rows written before normalization existed match on their lowercased name
+                    UPDATE orders SET medication_normalized = LOWER(medication) WHERE medication_normalized IS NULL;
+
+                    CREATE INDEX IF NOT EXISTS orders_medication_trgm_idx
+                        ON orders USING GIN (medication_normalized gin_trgm_ops);
+
+                    -- The store version is derived from the transaction that wrote each row (see
+                    -- SELECT_VERSION_SQL), replacing a counter row every writer had to lock
+                    DROP TRIGGER IF EXISTS orders_bump_store_version ON orders;
+                    DROP TRIGGER IF EXISTS patients_bump_store_version ON patients;
+                    DROP TRIGGER IF EXISTS providers_bump_store_version ON providers;
+                    DROP FUNCTION IF EXISTS bump_store_version();
+                    DROP TABLE IF EXISTS store_version;
+
+                    ALTER TABLE orders ADD COLUMN IF NOT EXISTS write_xid XID8 NOT NULL DEFAULT PG_CURRENT_XACT_ID();
+                    ALTER TABLE patients ADD COLUMN IF NOT EXISTS write_xid XID8 NOT NULL DEFAULT PG_CURRENT_XACT_ID();
+                    ALTER TABLE providers ADD COLUMN IF NOT EXISTS write_xid XID8 NOT NULL DEFAULT PG_CURRENT_XACT_ID();
+                    CREATE INDEX IF NOT EXISTS orders_write_xid_idx ON orders (write_xid, order_id);
+                    CREATE INDEX IF NOT EXISTS patients_write_xid_idx ON patients (write_xid);
+                    CREATE INDEX IF NOT EXISTS providers_write_xid_idx ON providers (write_xid);
+
+                    -- Tell every worker's identity cache which provider or patient changed. Updates and deletes
+                    -- also send the old row, whose cached lookups no longer hold either.
+                    CREATE OR REPLACE FUNCTION notify_identity_changed() RETURNS TRIGGER AS $$
+                    BEGIN
+                        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                            PERFORM PG_NOTIFY('identities_changed', JSON_BUILD_OBJECT(
+                                'op', 'DELETE', 'table', TG_TABLE_NAME, 'row', ROW_TO_JSON(OLD))::TEXT);
+                        END IF;
+                        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                            PERFORM PG_NOTIFY('identities_changed', JSON_BUILD_OBJECT(
+                                'op', TG_OP, 'table', TG_TABLE_NAME, 'row', ROW_TO_JSON(NEW))::TEXT);
+                        END IF;
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+
+                    DROP TRIGGER IF EXISTS providers_notify_changed ON providers;
+                    CREATE TRIGGER providers_notify_changed AFTER INSERT OR UPDATE OR DELETE ON providers
+                        FOR EACH ROW EXECUTE FUNCTION notify_identity_changed();
+                    DROP TRIGGER IF EXISTS patients_notify_changed ON patients;
+                    CREATE TRIGGER patients_notify_changed AFTER INSERT OR UPDATE OR DELETE ON patients
+                        FOR EACH ROW EXECUTE FUNCTION notify_identity_changed();
+
+                    -- Daily order counts per breakdown, kept up to date by a trigger so analytics never scan orders
+                    CREATE TABLE IF NOT EXISTS order_daily_stats (
+                        day DATE NOT NULL,
+                        dimension VARCHAR(16) NOT NULL,
+                        key TEXT NOT NULL,
+                        count BIGINT NOT NULL,
+                        PRIMARY KEY (day, dimension, key)
+                    );
+
+                    -- Backfill orders stored before the summary table existed
+                    INSERT INTO order_daily_stats (day, dimension, key, count)
+                    SELECT day, dimension, key, COUNT(*) FROM (
+                        SELECT timestamp::date AS day, 'total' AS dimension, '' AS key FROM orders
+                        UNION ALL
+                        SELECT timestamp::date, 'medication', COALESCE(medication_normalized, LOWER(medication)) FROM orders
+                        UNION ALL
+                        SELECT timestamp::date, 'provider', COALESCE(provider_npi, '') FROM orders
+                        UNION ALL
+                        SELECT timestamp::date, 'diagnosis', LOWER(TRIM(primary_diagnosis)) FROM orders
+                    ) AS breakdowns
+                    WHERE NOT EXISTS (SELECT 1 FROM order_daily_stats)
+                    GROUP BY day, dimension, key;
+
+                    CREATE OR REPLACE FUNCTION record_order_daily_stats() RETURNS TRIGGER AS $$
+                    BEGIN
+                        INSERT INTO order_daily_stats (day, dimension, key, count) VALUES
+                            (NEW.timestamp::date, 'total', '', 1),
+                            (NEW.timestamp::date, 'medication', COALESCE(NEW.medication_normalized, LOWER(NEW.medication)), 1),
+                            (NEW.timestamp::date, 'provider', COALESCE(NEW.provider_npi, ''), 1),
+                            (NEW.timestamp::date, 'diagnosis', LOWER(TRIM(NEW.primary_diagnosis)), 1)
+                        ON CONFLICT (day, dimension, key) DO UPDATE SET count = order_daily_stats.count + 1;
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+
+                    DROP TRIGGER IF EXISTS orders_record_daily_stats ON orders;
+                    CREATE TRIGGER orders_record_daily_stats AFTER INSERT ON orders
+                        FOR EACH ROW EXECUTE FUNCTION record_order_daily_stats();
+
+                    -- Wake change feed consumers when new orders are committed
+                    CREATE OR REPLACE FUNCTION notify_order_added() RETURNS TRIGGER AS $$
+                    BEGIN
+                        PERFORM PG_NOTIFY('orders_changed', NEW.order_id::TEXT);
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+
+                    DROP TRIGGER IF EXISTS orders_notify_added ON orders;
+                    CREATE TRIGGER orders_notify_added AFTER INSERT ON orders
+                        FOR EACH ROW EXECUTE FUNCTION notify_order_added();
+
+                    -- Month partitions moved out to archive files
+                    CREATE TABLE IF NOT EXISTS order_archives (
+                        partition_name VARCHAR(64) PRIMARY KEY,
+                        month DATE NOT NULL,
+                        path TEXT NOT NULL,
+                        row_count BIGINT NOT NULL,
+                        max_order_id BIGINT NOT NULL,
+                        archived_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    );
+                    ALTER TABLE order_archives ADD COLUMN IF NOT EXISTS write_xid XID8 NOT NULL DEFAULT PG_CURRENT_XACT_ID();
+                    CREATE INDEX IF NOT EXISTS order_archives_write_xid_idx ON order_archives (write_xid);
+
+                    -- Token buckets for admission control, shared by every worker
+                    CREATE TABLE IF NOT EXISTS rate_limits (
+                        key VARCHAR(255) PRIMARY KEY,
+                        tokens DOUBLE PRECISION NOT NULL,
+                        allowed BOOLEAN NOT NULL,
+                        updated_at TIMESTAMPTZ NOT NULL DEFAULT CLOCK_TIMESTAMP()
+                    );
+
+                    CREATE INDEX IF NOT EXISTS orders_timestamp_id_idx
+                        ON orders (timestamp DESC, order_id DESC);
+
+                    CREATE INDEX IF NOT EXISTS orders_provider_timestamp_idx
+                        ON orders (provider_npi, timestamp DESC, order_id DESC);
+
+                    CREATE INDEX IF NOT EXISTS orders_patient_timestamp_idx
+                        ON orders (patient_mrn, timestamp DESC, order_id DESC);
+
+                    CREATE INDEX IF NOT EXISTS orders_medication_timestamp_idx
+                        ON orders (LOWER(medication), timestamp DESC, order_id DESC);
+
+                    -- Once order_archives exists, which ensure_order_partitions reads
+                    SELECT ensure_order_partitions(3);
                 """)
                 conn.commit()
     
-    def validate_order(self, data: Dict) -> List:
-        warnings = []
-        
-        # Check for duplicate provider with different name or different npi
-        provider_check = self.validate_provider(data['provider_npi'], data['provider_name'])
-        if provider_check.get(self.CONFLICT_KEY):
-            warnings.append(provider_check.get(self.ERROR_MESSAGE_KEY, "Provider Input Error"))
-        
-        # Check for duplicate patient
-        patient_check = self.validate_patient(
-            data['patient_mrn'],
-            data['patient_first_name'],
-            data['patient_last_name']
-        )
-        if patient_check.get(self.CONFLICT_KEY, False):
-            warnings.append(patient_check.get(self.ERROR_MESSAGE_KEY, "Patient Input Error"))
-        
-        # Check for duplicate order
-        if self.check_duplicate_order(
-            data['patient_mrn'],
-            data['medication'],
-        ):
-            warnings.append(
-                f"A similar order already exists for patient {data['patient_mrn']} "
-                f"with medication {data['medication']}"
-            )
-        
-        # Return all the validation warnings that exist
-        return warnings
-    
     def validate_provider(self, npi: str, name: str) -> Dict:
         """Validate provider. Returns conflict if exists with different name or NPI."""
         normalized = name.lower().strip()
         
-        with self._conn() as conn:
+        with self._read_conn() as conn:
             with conn.cursor(row_factory=dict_row) as cur:
                 # Check if this NPI already exists with a different name
-                cur.execute("SELECT name_normalized FROM providers WHERE npi = %s", (npi,))
-                if row := cur.fetchone():
-                    if row['name_normalized'] != normalized:
-                        return {self.CONFLICT_KEY: True, self.ERROR_MESSAGE_KEY: f'Provider NPI {npi} already exists with name "{row["name"]}"'}
+                cur.execute(self.SELECT_PROVIDER_BY_NPI_SQL, (npi,))
+                if conflict := self.npi_conflict(npi, normalized, cur.fetchone()):
+                    return conflict
                 
                 # Check name with different NPI
-                cur.execute("SELECT npi FROM providers WHERE name_normalized = %s", (normalized,))
-                if row := cur.fetchone():
-                    if row['npi'] != npi:
-                        return {self.CONFLICT_KEY: True, self.ERROR_MESSAGE_KEY: f'Provider "{name}" already exists with NPI {row["npi"]}. Same provider cannot have multiple NPIs.'}
+                cur.execute(self.SELECT_PROVIDER_BY_NAME_SQL, (normalized,))
+                if conflict := self.name_conflict(npi, name, cur.fetchone()):
+                    return conflict
         
         return {self.CONFLICT_KEY: False}
+
+    @classmethod
+    def npi_conflict(cls, npi: str, normalized_name: str, row: Optional[Dict]) -> Optional[Dict]:
+        # The NPI is already registered under another name
+        if row and row['name_normalized'] != normalized_name:
+            return {cls.CONFLICT_KEY: True, cls.ERROR_MESSAGE_KEY: f'Provider NPI {npi} already exists with name "{row["name"]}"'}
+        return None
+
+    @classmethod
+    def name_conflict(cls, npi: str, name: str, row: Optional[Dict]) -> Optional[Dict]:
+        # The provider name is already registered under another NPI
+        if row and row['npi'] != npi:
+            return {cls.CONFLICT_KEY: True, cls.ERROR_MESSAGE_KEY: f'Provider "{name}" already exists with NPI {row["npi"]}. Same provider cannot have multiple NPIs.'}
+        return None
     
     def add_provider(self, npi: str, name: str):
         """Add provider to database."""
@@ -106,91 +656,621 @@ class PostgreSQLDataStore(DataStore):
         # Add provider if new
         with self._conn() as conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO providers (npi, name, name_normalized) VALUES (%s, %s, %s) ON CONFLICT (npi) DO NOTHING",
-                    (npi, name, name.lower().strip())
-                )
+                cur.execute(self.INSERT_PROVIDER_SQL, (npi, name, name.lower().strip()))
                 conn.commit()
+            self._record_write(conn)
     
     def validate_patient(self, mrn: str, first_name: str, last_name: str) -> Dict:
         """Validate patient. Returns conflict if exists with different name."""
 
         # Check if patient with provided mrn already exists with different name details
-        with self._conn() as conn:
+        with self._read_conn() as conn:
             with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute("SELECT first_name, last_name FROM patients WHERE mrn = %s", (mrn,))
-                if row := cur.fetchone():
-                    if row['first_name'].lower() != first_name.lower() or row['last_name'].lower() != last_name.lower():
-                        return {self.CONFLICT_KEY: True, self.ERROR_MESSAGE_KEY: f'Patient MRN {mrn} already exists with name "{row["first_name"]} {row["last_name"]}"'}
-        
-        return {self.CONFLICT_KEY: False}
+                cur.execute(self.SELECT_PATIENT_SQL, (mrn,))
+                return self.patient_conflict(mrn, first_name, last_name, cur.fetchone())
+
+    @classmethod
+    def patient_conflict(cls, mrn: str, first_name: str, last_name: str, row: Optional[Dict]) -> Dict:
+        # The MRN is already registered under another name
+        if row and (row['first_name'].lower() != first_name.lower() or row['last_name'].lower() != last_name.lower()):
+            return {cls.CONFLICT_KEY: True, cls.ERROR_MESSAGE_KEY: f'Patient MRN {mrn} already exists with name "{row["first_name"]} {row["last_name"]}"'}
+        return {cls.CONFLICT_KEY: False}
     
     def add_patient(self, mrn: str, first_name: str, last_name: str):
         """Add patient to database."""
         with self._conn() as conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO patients (mrn, first_name, last_name) VALUES (%s, %s, %s) ON CONFLICT (mrn) DO NOTHING",
-                    (mrn, first_name, last_name)
-                )
+                cur.execute(self.INSERT_PATIENT_SQL, (mrn, first_name, last_name))
                 conn.commit()
+            self._record_write(conn)
     
     def check_duplicate_order(self, mrn: str, medication: str) -> bool:
         """Check if an identical order already exists."""
-        with self._conn() as conn:
+        with self._read_conn() as conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT 1 FROM orders WHERE patient_mrn = %s AND LOWER(medication) = LOWER(%s) LIMIT 1",
-                    (mrn, medication)
-                )
+                cur.execute(self.SELECT_DUPLICATE_ORDER_SQL, (mrn, medication))
                 return cur.fetchone() is not None
         return False
     
+    def find_similar_orders(self, mrn: str, medication: str, threshold: float) -> List[Dict]:
+        """Find a patient's previous orders whose normalized medication is similar to this one."""
+        normalized = normalize_medication(medication)
+        if not normalized:
+            return []
+
+        with self._read_conn() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(self.SET_SIMILARITY_THRESHOLD_SQL, (str(threshold),))
+                cur.execute(self.SELECT_SIMILAR_ORDERS_SQL, (normalized, mrn, normalized, MAX_SIMILAR_RESULTS))
+                return self.similar_orders(cur.fetchall())
+
+    @staticmethod
+    def similar_orders(rows: List[Dict]) -> List[Dict]:
+        return [{'medication': row['medication'], 'similarity': round(float(row['similarity']), 3)} for row in rows]
+
     def add_order(self, order_data: Dict):
         """Add order to database."""
         with self._conn() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO orders (
-                        patient_mrn, patient_first_name, patient_last_name,
-                        provider_npi, provider_name, medication, primary_diagnosis,
-                        additional_diagnoses, medication_history, patient_records, care_plan
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    order_data['patient_mrn'], order_data['patient_first_name'], order_data['patient_last_name'],
-                    order_data['provider_npi'], order_data['provider_name'], order_data['medication'],
-                    order_data['primary_diagnosis'], order_data.get('additional_diagnoses', ''), 
-                    order_data.get('medication_history', ''), order_data.get('patient_records', ''), 
-                    order_data.get('care_plan', '')
-                ))
+                cur.execute(self.INSERT_ORDER_SQL, self.order_params(order_data, self.codec))
                 conn.commit()
+            self._record_write(conn)
+
+    @staticmethod
+    def order_params(order_data: Dict, codec: TextCodec) -> tuple:
+        texts = [order_data.get(field, '') for field in TEXT_COLUMN_ORDER]
+        hashes = [None if text is None else blob_hash(text) for text in texts]
+        blobs = []
+        for text, hash in zip(texts, hashes):
+            if text is None:
+                blobs.extend((None, None, None, None))
+                continue
+            blob = codec.compress(text)
+            blobs.extend((hash, len(text.encode('utf-8')), len(blob), blob))
+        sections = parse_care_plan(order_data.get('care_plan'))
+        return (
+            order_data['patient_mrn'], order_data['patient_first_name'], order_data['patient_last_name'],
+            order_data['provider_npi'], order_data['provider_name'], order_data['medication'],
+            normalize_medication(order_data['medication']),
+            order_data['primary_diagnosis'], order_data.get('additional_diagnoses', ''),
+            *blobs, *hashes,
+            order_data.get('patient_records', ''), order_data.get('care_plan', ''),
+            json.dumps(sections), json.dumps(section_terms(sections))
+        )
+
+    @classmethod
+    def decode_text(cls, row: Dict, codec: TextCodec) -> Dict:
+        """Decompress the large text blobs of a row read from the database."""
+        for field in cls.LARGE_TEXT_FIELDS:
+            if row.get(field) is not None:
+                row[field] = codec.decompress(row[field])
+        return row
     
-    def export_orders(self) -> List[Dict]:
-        """Export all orders."""
+    def export_orders(self, since_order_id: Optional[int] = None, since_timestamp: Optional[str] = None,
+                      text_fields: Sequence[str] = DataStore.LARGE_TEXT_FIELDS) -> List[Dict]:
+        """Export all orders, or only those after an order id or timestamp, with the chosen large text fields."""
+        columns, source = self._order_columns(text_fields)
+        with self._read_conn() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                if since_order_id is not None:
+                    cur.execute(f"SELECT {columns} FROM {source} WHERE order_id > %s ORDER BY order_id", (since_order_id,))
+                elif since_timestamp is not None:
+                    cur.execute(
+                        f"SELECT {columns} FROM {source} WHERE timestamp > %s::timestamp ORDER BY timestamp, order_id",
+                        (since_timestamp,)
+                    )
+                else:
+                    # Oldest-first like the incremental exports and the other stores
+                    cur.execute(f"SELECT {columns} FROM {source} ORDER BY timestamp, order_id")
+                return [self.decode_text(dict(row), self.codec) for row in cur.fetchall()]
+
+    def iter_orders(self, since_order_id: Optional[int] = None, batch_size: int = 1000,
+                    text_fields: Sequence[str] = DataStore.LARGE_TEXT_FIELDS) -> Iterator[Dict]:
+        """Stream orders oldest-first through a server-side cursor, optionally only those after an order id."""
+        columns, source = self._order_columns(text_fields)
+        with self._read_conn() as conn:
+            with conn.cursor(name='iter_orders', row_factory=dict_row) as cur:
+                cur.itersize = batch_size
+                cur.execute(f"SELECT {columns} FROM {source} WHERE order_id > %s ORDER BY order_id", (since_order_id or 0,))
+                for row in cur:
+                    yield self.decode_text(dict(row), self.codec)
+
+    def get_order_details(self, order_ids: List[int], fields: Sequence[str] = DataStore.LARGE_TEXT_FIELDS) -> Dict[int, Dict]:
+        """Load the large text fields of orders. Unknown order ids are left out."""
+        fields = self.validate_text_fields(fields)
+        if not order_ids:
+            return {}
+        with self._read_conn() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                columns = ", ".join(["order_id", _text_columns(fields)]) if fields else "order_id"
+                cur.execute(
+                    f"SELECT {columns} FROM order_details {_text_joins(fields)} WHERE order_id = ANY(%s)",
+                    (list(order_ids),)
+                )
+                rows = [self.decode_text(dict(row), self.codec) for row in cur.fetchall()]
+        return {row.pop('order_id'): row for row in rows}
+
+    def _order_columns(self, text_fields: Sequence[str]) -> tuple:
+        # Field names are checked against LARGE_TEXT_FIELDS, so they're safe to interpolate
+        text_fields = self.validate_text_fields(text_fields)
+        if not text_fields:
+            return self.ORDER_METADATA_COLUMNS, "orders"
+        return (
+            f"{self.ORDER_METADATA_COLUMNS}, {_text_columns(text_fields)}",
+            f"orders LEFT JOIN order_details USING (order_id) {_text_joins(text_fields)}"
+        )
+
+    def get_changes(self, after: Optional[List[int]], limit: int, timeout: float) -> List[Change]:
+        """Get orders added after a cursor, waiting up to timeout seconds for one to arrive. Cursors are the
+        [write transaction id, order id] of the last order seen (see SELECT_CHANGES_SQL). Waits are woken by
+        the process's one orders listener, and the reads themselves use pooled connections."""
+        position = self.change_position(after)
+        deadline = time.monotonic() + timeout
+        while True:
+            generation = self.order_signal.generation
+            with self._conn() as conn:
+                with conn.cursor(row_factory=dict_row) as cur:
+                    cur.execute(self.SELECT_CHANGES_SQL, (*position, limit))
+                    changes = self.changes(cur.fetchall(), self.codec)
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                return changes
+            # A transaction that rolls back sends no notification, yet may have been holding orders back
+            self.order_signal.wait(generation, min(remaining, self.CHANGES_RECHECK_INTERVAL))
+
+    @staticmethod
+    def change_position(after: Optional[List[int]]) -> List[int]:
+        if after is None:
+            return [0, 0]
+        if not (isinstance(after, list) and len(after) == 2
+                and all(isinstance(value, int) and not isinstance(value, bool) and value >= 0 for value in after)):
+            raise ValueError("Invalid change feed cursor")
+        return after
+
+    @classmethod
+    def changes(cls, rows: List[Dict], codec: TextCodec) -> List[Change]:
+        return [
+            Change([row.pop('change_xid'), row['order_id']], cls.decode_text(dict(row), codec)) for row in rows
+        ]
+
+    def get_change_cursor(self) -> List[int]:
         with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(self.SELECT_CHANGE_CURSOR_SQL)
+                row = cur.fetchone()
+        return list(row) if row else [0, 0]
+
+    def _start_order_listener(self):
+        threading.Thread(
+            target=self._listen, args=(self.ORDERS_CHANNEL, lambda payload: self.order_signal.notify(),
+                                       self.order_signal.notify, self._stop_listening),
+            name='orders-listener', daemon=True
+        ).start()
+
+    def _listen(self, channel: str, on_notify: Callable[[str], None], on_gap: Callable[[], None], stop):
+        """Call on_notify with the payload of each notification on a channel, until stop is set. Calls on_gap
+        once listening and after each failure, since notifications sent while not listening are lost."""
+        while not stop.is_set():
+            try:
+                with psycopg.connect(self.database_url, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {channel}")
+                    on_gap()
+                    while not stop.is_set():
+                        for notify in conn.notifies(timeout=self.LISTEN_TIMEOUT):
+                            on_notify(notify.payload)
+            except Exception:
+                on_gap()
+                stop.wait(self.LISTEN_RECONNECT_INTERVAL)
+
+    def iter_providers(self, limit: int) -> Iterator[Dict]:
+        with self._read_conn() as conn:
             with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute("""
-                    SELECT order_id, patient_mrn, patient_first_name, patient_last_name,
-                           provider_npi, provider_name, medication, primary_diagnosis,
-                           additional_diagnoses, medication_history, patient_records, 
-                           care_plan, timestamp
-                    FROM orders ORDER BY timestamp DESC
-                """)
-                return [dict(row) for row in cur.fetchall()]
+                cur.execute("SELECT npi, name FROM providers LIMIT %s", (limit,))
+                rows = cur.fetchall()
+        for row in rows:
+            yield dict(row)
+
+    def iter_patients(self, limit: int) -> Iterator[Dict]:
+        with self._read_conn() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute("SELECT mrn, first_name, last_name FROM patients LIMIT %s", (limit,))
+                rows = cur.fetchall()
+        for row in rows:
+            yield dict(row)
+
+    def listen_identity_changes(self, on_change: Callable[[Optional[Dict]], None], stop):
+        """Call on_change for each provider or patient change notified by the database, until stop is set.
+        Reconnects after failures, calling on_change(None) since notifications sent meanwhile are lost."""
+        self._listen(self.IDENTITIES_CHANNEL, lambda payload: on_change(json.loads(payload)), lambda: on_change(None),
+                     stop)
+
+    def get_version(self) -> int:
+        """Get a number that changes whenever stored data changes. Writes count once every transaction that
+        started before them has finished, so the version never moves past a write that isn't visible yet."""
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(self.SELECT_VERSION_SQL)
+                return cur.fetchone()[0]
     
     def get_stats(self) -> Dict:
         """Get statistics."""
+        with self._read_conn() as conn:
+            with conn.cursor() as cur:
+                counts = []
+                for query in self.COUNT_SQL:
+                    cur.execute(query)
+                    counts.append(cur.fetchone()[0])
+                return self.stats(counts)
+
+    @staticmethod
+    def stats(counts: List) -> Dict:
+        total_orders, total_patients, total_providers, compression_ratio = counts
+        return {
+            'total_orders': total_orders,
+            'total_patients': total_patients,
+            'total_providers': total_providers,
+            'text_compression_ratio': float(compression_ratio)
+        }
+
+    def list_orders(self, limit: int, cursor: Optional[str] = None, provider_npi: Optional[str] = None,
+                    patient_mrn: Optional[str] = None, medication: Optional[str] = None,
+                    start_date: Optional[str] = None, end_date: Optional[str] = None,
+                    include_text: bool = False) -> Dict:
+        """List orders newest-first using keyset pagination on (timestamp, order_id)."""
+        conditions = []
+        params = []
+
+        # Resume strictly after the last row of the previous page
+        if cursor:
+            cursor_timestamp, cursor_order_id = decode_cursor(cursor)
+            conditions.append("(timestamp, order_id) < (%s::timestamp, %s)")
+            params.extend([cursor_timestamp, cursor_order_id])
+
+            # Row comparisons don't prune partitions, this bound does
+            conditions.append("timestamp <= %s::timestamp")
+            params.append(cursor_timestamp)
+        if provider_npi:
+            conditions.append("provider_npi = %s")
+            params.append(provider_npi)
+        if patient_mrn:
+            conditions.append("patient_mrn = %s")
+            params.append(patient_mrn)
+        if medication:
+            conditions.append("LOWER(medication) = LOWER(%s)")
+            params.append(medication)
+        if start_date:
+            conditions.append("timestamp >= %s::timestamp")
+            params.append(start_date)
+        if end_date:
+            conditions.append("timestamp < %s::timestamp")
+            params.append(end_date)
+
+        columns, source = self._order_columns(self.LARGE_TEXT_FIELDS if include_text else ())
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        # Fetch one extra row to know whether another page exists
+        with self._conn() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(
+                    f"SELECT {columns} FROM {source} {where} ORDER BY timestamp DESC, order_id DESC LIMIT %s",
+                    (*params, limit + 1)
+                )
+                rows = [self.decode_text(dict(row), self.codec) for row in cur.fetchall()]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['timestamp'], rows[-1]['order_id'])
+        return {'orders': rows, 'next_cursor': next_cursor}
+
+    def get_patient_history(self, mrn: str, limit: int) -> Dict:
+        """Get a patient's most recent orders newest-first along with a summary of all their orders."""
+        with self._conn() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(f"""
+                    SELECT {self.ORDER_METADATA_COLUMNS}, {self.ORDER_TEXT_COLUMNS}
+                    FROM {self.ORDERS_WITH_TEXT} WHERE patient_mrn = %s
+                    ORDER BY timestamp DESC, order_id DESC LIMIT %s
+                """, (mrn, limit))
+                orders = [self.decode_text(dict(row), self.codec) for row in cur.fetchall()]
+
+                cur.execute("""
+                    SELECT COUNT(*) AS total_orders,
+                           COALESCE(ARRAY_AGG(DISTINCT medication ORDER BY medication)
+                                    FILTER (WHERE medication IS NOT NULL), '{}') AS medications,
+                           COALESCE(JSON_AGG(DISTINCT JSONB_BUILD_OBJECT('npi', provider_npi, 'name', provider_name))
+                                    FILTER (WHERE provider_npi IS NOT NULL), '[]') AS providers,
+                           MAX(timestamp) AS last_order_date
+                    FROM orders WHERE patient_mrn = %s
+                """, (mrn,))
+                summary = dict(cur.fetchone())
+
+        summary['providers'] = sorted(summary['providers'], key=lambda provider: provider['npi'])
+        return {'patient_mrn': mrn, 'orders': orders, 'summary': summary}
+
+    def search_orders(self, query: str, limit: int, offset: int = 0, include_text: bool = False) -> Dict:
+        """Search orders by diagnosis, clinical notes and care plan content, best match first."""
+        if not query or not query.strip():
+            raise ValueError("Search query is required")
+
+        columns = self.ORDER_METADATA_COLUMNS
+        joins = ""
+        if include_text:
+            columns += ", " + self.ORDER_TEXT_COLUMNS
+            joins = _text_joins(TEXT_COLUMN_ORDER)
+
+        # Fetch one extra row to know whether another page exists
+        with self._conn() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(f"""
+                    SELECT {columns}, TS_RANK_CD(search_vector, query) AS rank
+                    FROM orders JOIN order_details USING (order_id) {joins}, PLAINTO_TSQUERY('english', %s) AS query
+                    WHERE search_vector @@ query
+                    ORDER BY rank DESC, order_id DESC
+                    LIMIT %s OFFSET %s
+                """, (query, limit + 1, offset))
+                rows = [self.decode_text(dict(row), self.codec) for row in cur.fetchall()]
+
+        next_offset = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_offset = offset + limit
+        return {'orders': rows, 'next_offset': next_offset}
+
+    def query_care_plans(self, section: str, terms: Sequence[str], limit: int, offset: int = 0) -> Dict:
+        """Find orders whose care plan section mentions every term, newest first, by containment on the
+        parsed terms. Stored care plan text isn't read."""
+        validate_section(section)
+        contains = json.dumps({section: list(terms)})
+        with self._conn() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute("SELECT COUNT(*) AS total FROM order_details WHERE care_plan_terms @> %s::jsonb", (contains,))
+                total = cur.fetchone()['total']
+                cur.execute(f"""
+                    SELECT {self.ORDER_METADATA_COLUMNS}, care_plan_sections
+                    FROM orders JOIN order_details USING (order_id)
+                    WHERE care_plan_terms @> %s::jsonb
+                    ORDER BY order_id DESC
+                    LIMIT %s OFFSET %s
+                """, (contains, limit, offset))
+                rows = [dict(row) for row in cur.fetchall()]
+
+        next_offset = offset + limit if total > offset + limit else None
+        return {'total': total, 'orders': rows, 'next_offset': next_offset}
+
+    def get_analytics(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                      bucket: str = 'day', top_n: int = 10) -> Dict:
+        """Get order counts over time and top medications, providers and diagnoses from the daily summary table."""
+        validate_bucket(bucket)
+        conditions = []
+        params = []
+        if start_date:
+            conditions.append("day >= %s::date")
+            params.append(start_date)
+        if end_date:
+            conditions.append("day < %s::date")
+            params.append(end_date)
+        day_range = "".join(f" AND {condition}" for condition in conditions)
+
+        with self._conn() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(f"""
+                    SELECT DATE_TRUNC(%s, day)::date AS period, SUM(count) AS orders
+                    FROM order_daily_stats
+                    WHERE dimension = 'total'{day_range}
+                    GROUP BY period ORDER BY period
+                """, (bucket, *params))
+                series = [{'period': row['period'].isoformat(), 'orders': int(row['orders'])} for row in cur.fetchall()]
+
+                # Top keys per breakdown, ranked inside the database
+                cur.execute(f"""
+                    SELECT dimension, key, count FROM (
+                        SELECT dimension, key, SUM(count) AS count,
+                               ROW_NUMBER() OVER (PARTITION BY dimension ORDER BY SUM(count) DESC, key) AS position
+                        FROM order_daily_stats
+                        WHERE dimension <> 'total'{day_range}
+                        GROUP BY dimension, key
+                    ) AS ranked
+                    WHERE position <= %s
+                    ORDER BY dimension, position
+                """, (*params, top_n))
+                breakdowns = cur.fetchall()
+
+        result = {
+            'bucket': bucket,
+            'total_orders': sum(point['orders'] for point in series),
+            'series': series,
+        }
+        for dimension, response_key in DIMENSIONS.items():
+            result[response_key] = [
+                {'key': row['key'], 'count': int(row['count'])} for row in breakdowns if row['dimension'] == dimension
+            ]
+        return result
+
+    def ensure_partitions(self, months_ahead: int = PARTITION_MONTHS_AHEAD):
+        """Create the monthly order partitions from this month to months_ahead months from now, and for months
+        whose orders landed in the default partition, moving those orders into them."""
         with self._conn() as conn:
             with conn.cursor() as cur:
-                cur.execute("SELECT COUNT(*) FROM orders")
-                total_orders = cur.fetchone()[0]
-                cur.execute("SELECT COUNT(*) FROM patients")
-                total_patients = cur.fetchone()[0]
-                cur.execute("SELECT COUNT(*) FROM providers")
-                total_providers = cur.fetchone()[0]
-                
-                return {
-                    'total_orders': total_orders,
-                    'total_patients': total_patients,
-                    'total_providers': total_providers
-                }
\ No newline at end of file
+                cur.execute("SELECT ensure_order_partitions(%s)", (months_ahead,))
+                conn.commit()
+
+    def archive_orders(self, retention_months: int) -> List[Dict]:
+        """Move month partitions older than the retention window into compressed archive files."""
+        self.ensure_partitions()
+        today = date.today()
+        cutoff = today.year * 12 + today.month - 1 - retention_months
+
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT child.relname FROM pg_inherits
+                    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                    WHERE pg_inherits.inhparent = 'orders'::regclass
+                    ORDER BY child.relname
+                """)
+                partitions = [row[0] for row in cur.fetchall()]
+
+        archived = []
+        for partition in partitions:
+            match = self.PARTITION_NAME.match(partition)
+            if not match:
+                continue
+            year, month = int(match.group(1)), int(match.group(2))
+            if year * 12 + month - 1 >= cutoff:
+                continue
+            archived.append(self._archive_partition(partition, date(year, month, 1)))
+        return archived
+
+    def _archive_partition(self, partition: str, month: date) -> Dict:
+        # Partition names come from the catalog and match PARTITION_NAME, so they're safe to interpolate
+        path = archive_path(self.archive_dir, partition)
+        with self._conn() as conn:
+            with conn.cursor(name=f'archive_{partition}', row_factory=dict_row) as cur:
+                cur.execute(f"""SELECT {self.ORDER_METADATA_COLUMNS}, {self.ORDER_TEXT_COLUMNS}, medication_normalized
+                                FROM {partition} LEFT JOIN order_details USING (order_id) {_text_joins(TEXT_COLUMN_ORDER)}
+                                ORDER BY order_id""")
+                rows, max_order_id = write_archive(path, (self.decode_text(dict(row), self.codec) for row in cur))
+            conn.commit()
+
+            # Record the archive and drop the partition together, once the file is complete
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO order_archives (partition_name, month, path, row_count, max_order_id)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (partition_name) DO UPDATE SET path = EXCLUDED.path, row_count = EXCLUDED.row_count,
+                        max_order_id = EXCLUDED.max_order_id, archived_at = CURRENT_TIMESTAMP,
+                        write_xid = PG_CURRENT_XACT_ID()
+                """, (partition, month, path, rows, max_order_id))
+                cur.execute(f"""
+                    WITH removed AS (
+                        DELETE FROM order_details WHERE order_id IN (SELECT order_id FROM {partition})
+                        RETURNING order_id, medication_history_hash, patient_records_hash, care_plan_hash
+                    ), refs AS (
+                        SELECT hash, COUNT(*) AS count
+                        FROM removed, UNNEST(ARRAY[medication_history_hash, patient_records_hash, care_plan_hash]) AS hash
+                        WHERE hash IS NOT NULL GROUP BY hash
+                    )
+                    UPDATE text_blobs SET ref_count = text_blobs.ref_count - refs.count
+                    FROM refs WHERE text_blobs.hash = refs.hash
+                """)
+                # Blobs no order references anymore live on only in the archive file
+                cur.execute("DELETE FROM text_blobs WHERE ref_count <= 0")
+                cur.execute(f"ALTER TABLE orders DETACH PARTITION {partition}")
+                cur.execute(f"DROP TABLE {partition}")
+                # The order_archives row written above moves the store version on, invalidating cached exports
+                conn.commit()
+        return {'partition': partition, 'path': path, 'rows': rows}
+
+    def iter_archived_orders(self, since_order_id: Optional[int] = None) -> Iterator[Dict]:
+        """Stream archived orders oldest-first from their archive files, optionally only those after an order id."""
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT path FROM order_archives WHERE max_order_id > %s ORDER BY month",
+                    (since_order_id or 0,)
+                )
+                paths = [row[0] for row in cur.fetchall()]
+        for path in paths:
+            yield from read_archive(path, since_order_id)
+
+    def compress_text(self) -> Dict:
+        """Train a compression dictionary from a sample of the stored text, then recompress every blob
+        not yet compressed with it."""
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT data FROM text_blobs ORDER BY RANDOM() LIMIT %s", (self.TEXT_SAMPLE_SIZE,))
+                samples = [self.codec.decompress(row[0]) for row in cur.fetchall()]
+                dictionary = train_dictionary(samples)
+                if not dictionary:
+                    return {'dictionary_id': None, 'recompressed': 0}
+                cur.execute("INSERT INTO text_dictionaries (data) VALUES (%s) RETURNING dictionary_id", (dictionary,))
+                dictionary_id = cur.fetchone()[0]
+                conn.commit()
+        self.codec.use_dictionary(dictionary_id, dictionary)
+        return {'dictionary_id': dictionary_id, 'recompressed': self._recompress_blobs()}
+
+    def _recompress_blobs(self) -> int:
+        # Walk the blobs in hash order a batch at a time. Only the header is read to find the ones to rewrite,
+        # and blobs are stored uncompressed by PostgreSQL, so that doesn't fetch the whole value.
+        recompressed = 0
+        last_hash = b''
+        while True:
+            with self._conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT hash, SUBSTRING(data FROM 1 FOR %s) FROM text_blobs WHERE hash > %s ORDER BY hash LIMIT %s",
+                        (HEADER.size, last_hash, self.RECOMPRESS_BATCH_SIZE)
+                    )
+                    batch = cur.fetchall()
+                    if not batch:
+                        return recompressed
+                    last_hash = bytes(batch[-1][0])
+                    stale = [bytes(hash) for hash, header in batch
+                             if HEADER.unpack(bytes(header))[1] != self.codec.dictionary_id]
+                    if stale:
+                        cur.execute("SELECT hash, data FROM text_blobs WHERE hash = ANY(%s)", (stale,))
+                        for hash, data in cur.fetchall():
+                            blob = self.codec.compress(self.codec.decompress(data))
+                            if blob != bytes(data):
+                                cur.execute(
+                                    "UPDATE text_blobs SET data = %s, stored_size = %s WHERE hash = %s",
+                                    (blob, len(blob), hash)
+                                )
+                                recompressed += 1
+                    conn.commit()
+
+    def parse_care_plans(self) -> int:
+        """Parse the sections of care plans stored before sections were kept, a batch at a time."""
+        parsed = 0
+        last_order_id = 0
+        while True:
+            with self._conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT order_id, data FROM order_details
+                        LEFT JOIN text_blobs ON text_blobs.hash = order_details.care_plan_hash
+                        WHERE care_plan_terms IS NULL AND order_id > %s
+                        ORDER BY order_id LIMIT %s
+                    """, (last_order_id, self.PARSE_BATCH_SIZE))
+                    batch = cur.fetchall()
+                    if not batch:
+                        return parsed
+                    last_order_id = batch[-1][0]
+                    updates = []
+                    for order_id, data in batch:
+                        sections = parse_care_plan(self.codec.decompress(data) if data is not None else None)
+                        updates.append((json.dumps(sections), json.dumps(section_terms(sections)), order_id))
+                    cur.executemany(
+                        "UPDATE order_details SET care_plan_sections = %s::jsonb, care_plan_terms = %s::jsonb WHERE order_id = %s",
+                        updates
+                    )
+                    conn.commit()
+                    parsed += len(updates)
+
+    def consume_rate_limit(self, key: str, capacity: float, refill_rate: float, cost: float = 1.0) -> float:
+        """Take cost tokens from a token bucket. Returns 0 if they were taken, else seconds until they're available."""
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(self.CONSUME_RATE_LIMIT_SQL, self.rate_limit_params(key, capacity, refill_rate, cost))
+                tokens, allowed = cur.fetchone()
+                conn.commit()
+        return self.retry_after(tokens, allowed, refill_rate, cost)
+
+    def prune_rate_limits(self, capacity: float, refill_rate: float) -> int:
+        """Delete the token buckets that have refilled completely, so every client seen doesn't keep a row."""
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(self.PRUNE_RATE_LIMITS_SQL, {'capacity': float(capacity), 'refill_rate': float(refill_rate)})
+                conn.commit()
+                return cur.rowcount
+
+    @staticmethod
+    def rate_limit_params(key: str, capacity: float, refill_rate: float, cost: float) -> Dict:
+        return {'key': key, 'capacity': float(capacity), 'refill_rate': float(refill_rate), 'cost': float(cost)}
+
+    @staticmethod
+    def retry_after(tokens: float, allowed: bool, refill_rate: float, cost: float) -> float:
+        if allowed:
+            return 0.0
+        return (cost - tokens) / refill_rate if refill_rate > 0 else float('inf')
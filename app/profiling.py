@@ -0,0 +1,173 @@
+import contextvars
+import cProfile
+import functools
+import hmac
+import inspect
+import io
+import itertools
+import pstats
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+_active_report = contextvars.ContextVar('active_profile_report', default=None)
+
+class ProfileReport:
+    """Profile of a single request: cProfile statistics plus span timings from traced functions."""
+
+    def __init__(self, method: str, path: str, sampled: bool):
+        self.profile_id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.duration = None
+        self.status = None
+        self.stats = ""
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, duration: float):
+        # Span start times are reported relative to the start of the request
+        with self._lock:
+            self.spans.append({'name': name, 'start': round(start - self.origin, 6), 'duration': round(duration, 6)})
+
+    def to_dict(self) -> Dict:
+        return {
+            'profile_id': self.profile_id,
+            'method': self.method,
+            'path': self.path,
+            'sampled': self.sampled,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'status': self.status,
+            'spans': list(self.spans),
+            'stats': self.stats,
+        }
+
+class ProfileStore:
+    """Keeps the most recent profile reports in memory."""
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._reports = OrderedDict()
+
+    def save(self, report: ProfileReport):
+        with self._lock:
+            self._reports[report.profile_id] = report
+            while len(self._reports) > self.capacity:
+                self._reports.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[ProfileReport]:
+        with self._lock:
+            return self._reports.get(profile_id)
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            reports = list(self._reports.values())
+        return [
+            {'profile_id': r.profile_id, 'method': r.method, 'path': r.path, 'sampled': r.sampled,
+             'started_at': r.started_at, 'duration': r.duration, 'status': r.status}
+            for r in reversed(reports)
+        ]
+
+class ActiveProfile:
+    def __init__(self, report: ProfileReport, profiler: cProfile.Profile, token):
+        self.report = report
+        self.profiler = profiler
+        self.token = token
+
+class RequestProfiler:
+    """Captures a cProfile profile for requests that ask for it (admins only) or are sampled 1-in-N."""
+
+    def __init__(self, admin_token: Optional[str] = None, sample_every: int = 0,
+                 store: Optional[ProfileStore] = None, top_n: int = 40):
+        self.admin_token = admin_token
+        self.sample_every = sample_every  # 0 disables sampling
+        self.store = store or ProfileStore()
+        self.top_n = top_n
+        self._counter = itertools.count(1)
+
+        # Only one cProfile profiler can be active in a process at a time
+        self._profiling = threading.Lock()
+
+    def is_admin(self, token: Optional[str]) -> bool:
+        """Check an admin token. Always False when no admin token is configured."""
+        return bool(self.admin_token and token and hmac.compare_digest(token, self.admin_token))
+
+    def start(self, method: str, path: str, requested: bool, admin_token: Optional[str]) -> Optional[ActiveProfile]:
+        """Start profiling the current request if it was requested by an admin or is sampled."""
+        sampled = False
+        if requested:
+            if not self.is_admin(admin_token):
+                return None
+        elif self.sample_every and next(self._counter) % self.sample_every == 0:
+            sampled = True
+        else:
+            return None
+
+        # Skip rather than wait if another request is being profiled
+        if not self._profiling.acquire(blocking=False):
+            return None
+        report = ProfileReport(method, path, sampled)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            self._profiling.release()
+            return None
+        token = _active_report.set(report)
+        return ActiveProfile(report, profiler, token)
+
+    def finish(self, active: ActiveProfile, status: Optional[int] = None) -> ProfileReport:
+        """Stop profiling and store the report."""
+        try:
+            active.profiler.disable()
+        finally:
+            self._profiling.release()
+        _active_report.reset(active.token)
+
+        report = active.report
+        report.duration = round(time.perf_counter() - report.origin, 6)
+        report.status = status
+        output = io.StringIO()
+        pstats.Stats(active.profiler, stream=output).sort_stats('cumulative').print_stats(self.top_n)
+        report.stats = output.getvalue()
+        self.store.save(report)
+        return report
+
+def traced(name: Optional[str] = None):
+    """Record the decorated function's duration as a span of the request being profiled, if any."""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            # Coroutines are timed from the first await to completion, not just until they're created
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                report = _active_report.get()
+                if report is None:
+                    return await func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    report.add_span(span_name, start, time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            report = _active_report.get()
+            if report is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                report.add_span(span_name, start, time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -1,4 +1,5 @@
-from typing import Dict
+from typing import Dict, Optional
+from app.prompt_examples import EXAMPLE_INDEX, PromptExample
 
 ONE_SHOT_EXAMPLE = """You are a clinical pharmacist creating a care plan. Here is an example of the format and quality expected:
 <example>
@@ -87,7 +88,16 @@ Monitoring plan & lab schedule (example)
 </example>
 """
 
-def generate_prompt(data: Dict) -> str:
+# Used when the library has no example for the medication
+DEFAULT_EXAMPLE = PromptExample('default', (), ONE_SHOT_EXAMPLE)
+
+def select_example(data: Dict) -> PromptExample:
+    """Pick the compact example closest to the ordered medication and diagnosis, else the full default one."""
+    example = EXAMPLE_INDEX.lookup(data.get('medication', ''), data.get('primary_diagnosis', ''))
+    return example or DEFAULT_EXAMPLE
+
+def generate_prompt(data: Dict, example: Optional[PromptExample] = None) -> str:
+    """Build the prompt for an order around the given example, picking one with select_example if none is given."""
     task_prompt = f"""
 Using the example above as a reference for STRUCTURE and QUALITY ONLY,
 generate a care plan for the patient below.
@@ -135,4 +145,4 @@ REQUIRED OUTPUT SECTIONS
 Do not add extra sections.
 Do not include fictional dates, labs, vitals, products, or dosing details.
 """
-    return ONE_SHOT_EXAMPLE + task_prompt
\ No newline at end of file
+    return (example or select_example(data)).text + task_prompt
\ No newline at end of file
@@ -0,0 +1,202 @@
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from app.medication_matching import normalize_medication
+
+EXAMPLE_HEADER = "You are a clinical pharmacist creating a care plan. Here is an example of the format and quality expected:\n"
+
+# ICD-10 codes such as "G70.00"; examples are matched on the three-character category
+ICD10_CATEGORY_PATTERN = re.compile(r"^([A-Z][0-9][0-9A-Z])")
+
+# Normalized medication names and brands -> the drug class whose example covers them
+MEDICATION_CLASSES = {
+    'rituximab': 'anti-cd20', 'rituxan': 'anti-cd20', 'truxima': 'anti-cd20', 'ruxience': 'anti-cd20',
+    'ocrelizumab': 'anti-cd20', 'ocrevus': 'anti-cd20', 'obinutuzumab': 'anti-cd20', 'ofatumumab': 'anti-cd20',
+    'infliximab': 'anti-tnf', 'remicade': 'anti-tnf', 'inflectra': 'anti-tnf', 'renflexis': 'anti-tnf',
+    'adalimumab': 'anti-tnf', 'humira': 'anti-tnf', 'golimumab': 'anti-tnf', 'simponi': 'anti-tnf',
+    'certolizumab': 'anti-tnf', 'cimzia': 'anti-tnf',
+    'iron sucrose': 'iv-iron', 'venofer': 'iv-iron', 'ferric carboxymaltose': 'iv-iron', 'injectafer': 'iv-iron',
+    'ferumoxytol': 'iv-iron', 'feraheme': 'iv-iron', 'iron dextran': 'iv-iron',
+}
+
+class PromptExample(NamedTuple):
+    name: str  # Label of the example in prompt metrics
+    keys: Tuple[Tuple[str, Optional[str]], ...]  # (medication or class, ICD-10 category or None for any)
+    text: str
+
+def _example(body: str) -> str:
+    return f"{EXAMPLE_HEADER}<example>\n{body.strip()}\n</example>\n"
+
+EXAMPLES = [
+    PromptExample('ivig_myasthenia', (('ivig', 'G70'), ('ivig', None)), _example("""
+INPUT:
+Medication: IVIG
+Primary diagnosis: Generalized myasthenia gravis (AChR antibody positive), MGFA class IIb
+Home meds: Pyridostigmine 60 mg PO q6h PRN, prednisone 10 mg PO daily
+Records: 72 kg. SCr 0.78. FVC 2.8 L (~70% predicted). Plan 2 g/kg over 5 days.
+
+OUTPUT:
+1. Problem list / DTPs
+  - Need for rapid immunomodulation of worsening weakness.
+  - Risk of infusion reactions, renal injury and thrombosis.
+2. Goals (SMART)
+  - Primary: Improved strength and less fatigability within 2 weeks of the course.
+  - Safety: No severe reaction; SCr rise <0.3 mg/dL within 7 days.
+  - Process: Full 2 g/kg course with documented vitals.
+3. Pharmacist interventions / plan
+  - Verify 0.4 g/kg/day x 5 days (28.8 g/day); premedicate with acetaminophen and diphenhydramine.
+  - Start slow, titrate to label maximum; hydrate before infusion.
+  - Continue pyridostigmine and prednisone; educate on clot and reaction symptoms.
+4. Monitoring plan & lab schedule
+  - Baseline: CBC, BMP, FVC. During: vitals q15 min first hour, daily FVC. Post: BMP at 3-7 days.
+""")),
+    PromptExample('ivig_neuropathy', (('ivig', 'G61'), ('ivig', 'G62'), ('ivig', 'G63')), _example("""
+INPUT:
+Medication: IVIG
+Primary diagnosis: Chronic inflammatory demyelinating polyneuropathy
+Home meds: Gabapentin 300 mg PO TID
+Records: 80 kg. SCr 1.1. Loading dose 2 g/kg, then maintenance 1 g/kg every 3 weeks.
+
+OUTPUT:
+1. Problem list / DTPs
+  - Progressive weakness needing induction and maintenance immunotherapy.
+  - Risk of infusion reactions, aseptic meningitis and renal injury.
+2. Goals (SMART)
+  - Primary: Improved INCAT disability score by 1 point within 6 weeks.
+  - Safety: No AKI or thrombotic events during therapy.
+  - Process: Maintenance infusions given on schedule every 3 weeks.
+3. Pharmacist interventions / plan
+  - Verify 2 g/kg load split over 2-5 days, then 1 g/kg maintenance; prefer sucrose-free product.
+  - Premedicate; titrate rate per label; hydrate given SCr 1.1.
+  - Educate on headache, neck stiffness and reduced urine output.
+4. Monitoring plan & lab schedule
+  - Baseline: CBC, BMP, strength scores. During: vitals per protocol. Post: BMP within 7 days, scores each cycle.
+""")),
+    PromptExample('ivig_immunodeficiency', tuple(('ivig', category) for category in ('D80', 'D81', 'D82', 'D83', 'D84')),
+                  _example("""
+INPUT:
+Medication: IVIG
+Primary diagnosis: Common variable immunodeficiency
+Records: 65 kg. Trough IgG 4.2 g/L. Three pneumonias in the past year.
+
+OUTPUT:
+1. Problem list / DTPs
+  - Recurrent infections from hypogammaglobulinemia needing replacement.
+  - Risk of infusion reactions, especially with first infusions.
+2. Goals (SMART)
+  - Primary: Trough IgG >7 g/L and fewer than 2 serious infections in 12 months.
+  - Safety: No moderate or severe infusion reactions.
+  - Process: Infusions every 4 weeks without missed doses.
+3. Pharmacist interventions / plan
+  - Verify 400-600 mg/kg every 4 weeks (26-39 g); adjust to trough and infections.
+  - Premedicate for early infusions; start slow and titrate per label.
+  - Educate on infection warning signs and keeping infusion appointments.
+4. Monitoring plan & lab schedule
+  - Baseline: IgG, CBC, BMP. During: vitals per protocol. Ongoing: trough IgG every 3-6 months, infection log.
+""")),
+    PromptExample('anti_cd20', (('anti-cd20', None),), _example("""
+INPUT:
+Medication: Rituximab
+Primary diagnosis: Rheumatoid arthritis, seropositive
+Home meds: Methotrexate 15 mg PO weekly, folic acid 1 mg PO daily
+Records: HBsAg negative, anti-HBc negative. IgG 9 g/L. Plan 1000 mg on days 1 and 15.
+
+OUTPUT:
+1. Problem list / DTPs
+  - Active disease despite methotrexate needing B-cell depletion.
+  - Risk of infusion reactions, infections and hepatitis B reactivation.
+2. Goals (SMART)
+  - Primary: DAS28 reduced by >1.2 within 16 weeks.
+  - Safety: No grade 3 infusion reaction or serious infection.
+  - Process: Both doses given 2 weeks apart.
+3. Pharmacist interventions / plan
+  - Verify 1000 mg IV days 1 and 15; premedicate with methylprednisolone, acetaminophen and antihistamine.
+  - First infusion 50 mg/h, increase 50 mg/h every 30 min to 400 mg/h as tolerated.
+  - Confirm vaccines before therapy; avoid live vaccines; continue methotrexate.
+4. Monitoring plan & lab schedule
+  - Baseline: hepatitis B serology, CBC, IgG. During: vitals with each rate change. Ongoing: CBC and IgG before each course.
+""")),
+    PromptExample('anti_tnf', (('anti-tnf', None),), _example("""
+INPUT:
+Medication: Infliximab
+Primary diagnosis: Crohn's disease of small and large intestine
+Home meds: Azathioprine 100 mg PO daily
+Records: 70 kg. QuantiFERON negative. HBsAg negative. Induction 5 mg/kg at weeks 0, 2 and 6.
+
+OUTPUT:
+1. Problem list / DTPs
+  - Moderate-severe disease needing anti-TNF induction.
+  - Risk of infusion reactions, serious infections and TB reactivation.
+2. Goals (SMART)
+  - Primary: Clinical remission (CDAI <150) by week 14.
+  - Safety: No serious infection or severe infusion reaction.
+  - Process: Induction doses given on schedule, then every 8 weeks.
+3. Pharmacist interventions / plan
+  - Verify 5 mg/kg (350 mg) at weeks 0, 2, 6, then every 8 weeks; infuse over at least 2 hours.
+  - Confirm negative TB and hepatitis B screening; avoid live vaccines.
+  - Counsel on infection symptoms; review azathioprine combination risks.
+4. Monitoring plan & lab schedule
+  - Baseline: TB, hepatitis B, CBC, LFTs. During: vitals per protocol. Ongoing: CBC and LFTs every 8 weeks, trough level if response fades.
+""")),
+    PromptExample('iv_iron', (('iv-iron', None),), _example("""
+INPUT:
+Medication: Iron sucrose
+Primary diagnosis: Iron deficiency anemia
+Home meds: Ferrous sulfate 325 mg PO daily (not tolerated)
+Records: Hgb 8.9 g/dL, ferritin 6 ng/mL, TSAT 5%. Plan 200 mg IV x 5 doses.
+
+OUTPUT:
+1. Problem list / DTPs
+  - Iron deficiency anemia with oral iron intolerance.
+  - Risk of hypersensitivity and hypotension with infusion.
+2. Goals (SMART)
+  - Primary: Hgb up by 2 g/dL and ferritin >100 ng/mL within 8 weeks.
+  - Safety: No hypersensitivity reaction or hypotension.
+  - Process: All 5 doses given within 14 days.
+3. Pharmacist interventions / plan
+  - Verify 200 mg IV over 2-5 min (or diluted over 15 min) x 5 doses, 1000 mg total.
+  - Stop oral iron during IV course; assess source of iron loss.
+  - Educate on reaction symptoms and dark stools from prior oral iron.
+4. Monitoring plan & lab schedule
+  - Baseline: CBC, ferritin, TSAT. During: vitals, observe 30 min after each dose. Post: CBC and iron studies at 4-8 weeks.
+""")),
+]
+
+def diagnosis_category(diagnosis: str) -> Optional[str]:
+    """The ICD-10 category of a diagnosis code, e.g. 'G70' for 'G70.00', or None if it isn't a code."""
+    match = ICD10_CATEGORY_PATTERN.match((diagnosis or "").strip().upper())
+    return match.group(1) if match else None
+
+class ExampleIndex:
+    """Finds the example for a medication and diagnosis with a few dictionary lookups, most specific first:
+    the drug with the diagnosis, its class with the diagnosis, then the drug or class alone."""
+
+    def __init__(self, examples: List[PromptExample]):
+        self.examples: Dict[Tuple[str, Optional[str]], PromptExample] = {}
+        for example in examples:
+            for key in example.keys:
+                self.examples.setdefault(key, example)
+
+    @staticmethod
+    def medication_keys(medication: str) -> List[str]:
+        normalized = normalize_medication(medication)
+        if not normalized:
+            return []
+        # Biosimilar suffixes and trailing words such as "rituximab abbs" still match on the first word
+        names = [normalized, normalized.split()[0]]
+        keys = []
+        for name in names:
+            for key in (name, MEDICATION_CLASSES.get(name)):
+                if key and key not in keys:
+                    keys.append(key)
+        return keys
+
+    def lookup(self, medication: str, diagnosis: str) -> Optional[PromptExample]:
+        keys = self.medication_keys(medication)
+        category = diagnosis_category(diagnosis)
+        for candidate in ([(key, category) for key in keys] if category else []) + [(key, None) for key in keys]:
+            example = self.examples.get(candidate)
+            if example is not None:
+                return example
+        return None
+
+EXAMPLE_INDEX = ExampleIndex(EXAMPLES)
@@ -0,0 +1,109 @@
+import contextlib
+import contextvars
+import itertools
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+# Response header and cookie handing a client the WAL position of its latest write. The client sends it back on
+# later requests, whichever worker or instance serves them, so its reads see its own writes.
+LSN_HEADER = 'X-Store-LSN'
+LSN_COOKIE = 'store_lsn'
+
+def parse_lsn(lsn: str) -> int:
+    """Turn a PostgreSQL LSN such as '16/B374D848' into a comparable integer."""
+    high, low = lsn.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+class StoreSession:
+    """What the store knows of the client making the current request: the LSN its latest write ended at, as the
+    client echoed it back, and the LSN of any write made during this request, to hand back to the client."""
+
+    def __init__(self, lsn: Optional[str] = None):
+        self.required_lsn: Optional[int] = None
+        self.written_lsn: Optional[str] = None
+        if lsn:
+            try:
+                self.required_lsn = parse_lsn(lsn)
+            except ValueError:
+                # A mangled value only costs the client its read-your-writes guarantee
+                pass
+
+    def record_write(self, lsn: str):
+        """Remember where a write of this request ended, so this request's later reads wait for it too."""
+        self.written_lsn = lsn
+        self.required_lsn = max(self.required_lsn or 0, parse_lsn(lsn))
+
+# StoreSession of the current request, so its reads can see the client's own writes
+current_session = contextvars.ContextVar('store_session', default=None)
+
+# Set while reads must see every committed write, e.g. results cached for longer than replicas may lag
+primary_reads = contextvars.ContextVar('primary_reads', default=False)
+
+@contextlib.contextmanager
+def reading_from_primary():
+    """Send the reads made inside the block to the primary, whatever the replicas' lag."""
+    token = primary_reads.set(True)
+    try:
+        yield
+    finally:
+        primary_reads.reset(token)
+
+class ReplicaStatus(NamedTuple):
+    checked_at: float  # Monotonic time of the check
+    lag: float         # Seconds the replica's replay is behind the primary
+    replay_lsn: int
+
+class ReplicaRouter:
+    """Chooses the read replica for a read. Replicas are used round-robin while their replication lag is within
+    max_lag; a replica that fails is skipped for retry_after seconds, and reads fall back to the primary when
+    no replica qualifies. Reads given the LSN of a session's write only go to replicas that have replayed it."""
+
+    def __init__(self, urls: List[str], max_lag: float, check_interval: float = 1.0, retry_after: float = 30.0):
+        self.urls = list(urls)
+        self.max_lag = max_lag                # Staleness allowed for reads without a session write to wait for
+        self.check_interval = check_interval  # Seconds a replica's lag is trusted before checking it again
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+        self._statuses: Dict[str, ReplicaStatus] = {}
+        self._down_until: Dict[str, float] = {}
+
+    def candidates(self) -> List[str]:
+        """Healthy replicas, starting from the next one in round-robin order."""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [url for url in self.urls if self._down_until.get(url, 0) <= now]
+        if not healthy:
+            return []
+        start = next(self._next) % len(healthy)
+        return healthy[start:] + healthy[:start]
+
+    def mark_down(self, url: str):
+        """Stop routing to a replica that failed until retry_after passes."""
+        with self._lock:
+            self._down_until[url] = time.monotonic() + self.retry_after
+            self._statuses.pop(url, None)
+
+    def needs_check(self, url: str, required_lsn: Optional[int]) -> bool:
+        """Whether the replica's lag must be queried before it can serve a read."""
+        status = self._statuses.get(url)
+        if status is None or time.monotonic() - status.checked_at > self.check_interval:
+            return True
+        # A cached status that's behind the session may have caught up since
+        return required_lsn is not None and status.replay_lsn < required_lsn
+
+    def update(self, url: str, lag: float, replay_lsn: str):
+        with self._lock:
+            self._statuses[url] = ReplicaStatus(time.monotonic(), lag, parse_lsn(replay_lsn))
+            self._down_until.pop(url, None)
+
+    def rejection(self, url: str, required_lsn: Optional[int]) -> Optional[str]:
+        """Why the replica can't serve the read, or None if it can."""
+        status = self._statuses.get(url)
+        if status is None:
+            return 'unknown'
+        if required_lsn is not None:
+            # Replicas that replayed the session's writes are fresh enough for it, whatever their lag
+            return None if status.replay_lsn >= required_lsn else 'behind_session'
+        return 'stale' if status.lag > self.max_lag else None
@@ -0,0 +1,582 @@
+import functools
+import itertools
+import queue
+import time
+from datetime import datetime
+from typing import Dict
+from flask import Blueprint, Response, current_app, g, render_template, request, jsonify, stream_with_context
+from werkzeug.local import LocalProxy
+from app import metrics
+from app.admission import client_identity
+from app.api import (
+    CHANGES_FAILED, CHANGES_PAGE_SIZE, CONNECTED_EVENT, EVENT_STREAM_HEADERS, GENERATION_FAILED, KEEPALIVE_EVENT,
+    NO_CACHE_HEADERS, STREAM_KEEPALIVE, SUBMISSION_FAILED, VALIDATION_FAILED, Reply, admission_rejected,
+    change_event, changes_body, check_order_input, failed, generated, input_handler, minimal_order,
+    parse_changes_args, parse_changes_cursor, prefers_minimal, stats_event, stream_resume_cursor, streams_busy,
+    submitted, validated
+)
+from app.care_plan_sections import query_terms
+from app.compression import compress_response
+from app.csv_generator import CSVGenerator
+from app.data_store import DataStore
+from app.export_formats import EXPORT_FORMATS
+from app.factory import get_resources
+from app.pagination import clamp_page_size, decode_position, encode_position, normalize_date
+from app.replicas import LSN_COOKIE, LSN_HEADER, StoreSession, current_session
+
+bp = Blueprint('care_plan', __name__)
+
+# Resources of the app handling the current request
+store = LocalProxy(lambda: get_resources().store)
+export_cache = LocalProxy(lambda: get_resources().export_cache)
+stats_broadcaster = LocalProxy(lambda: get_resources().stats_broadcaster)
+profiler = LocalProxy(lambda: get_resources().profiler)
+
+# Orders read per change feed query while exporting everything after an export cursor
+EXPORT_CHANGES_PAGE_SIZE = 1000
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.request_started = time.perf_counter()
+    metrics.HTTP_REQUESTS_IN_FLIGHT.inc(1, g.request_route)
+
+    # Profile this request if an admin asked for it with X-Profile: 1 or ?profile=1, or if it's sampled
+    requested = request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1'
+    g.profile = profiler.start(request.method, request.path, requested, request.headers.get('X-Admin-Token'))
+
+    g.return_minimal = prefers_minimal(request.headers.get('Prefer', ''))
+
+    # Reads from replicas see the writes this client made, wherever they were served
+    lsn = request.headers.get(LSN_HEADER) or request.cookies.get(LSN_COOKIE)
+    g.store_session = current_session.set(StoreSession(lsn))
+
+@bp.after_app_request
+def record_request_duration(response):
+    if 'request_started' in g:
+        metrics.HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - g.request_started, request.method, g.request_route, response.status_code
+        )
+    if g.get('profile'):
+        report = profiler.finish(g.pop('profile'), response.status_code)
+        response.headers['X-Profile-Id'] = report.profile_id
+    return response
+
+@bp.after_app_request
+def hand_back_store_lsn(response):
+    # Clients echo the header, browsers the cookie, on the requests that follow a write
+    session = current_session.get()
+    if session is not None and session.written_lsn:
+        response.headers[LSN_HEADER] = session.written_lsn
+        response.set_cookie(LSN_COOKIE, session.written_lsn, httponly=True, samesite='Lax')
+    return response
+
+@bp.after_app_request
+def compress(response):
+    # Registered last so it runs first, inside the request timing and profile
+    if g.get('return_minimal_applied'):
+        response.headers['Preference-Applied'] = 'return=minimal'
+    min_size = current_app.config['COMPRESSION_MIN_SIZE']
+    if min_size:
+        response = compress_response(request, response, min_size)
+    return response
+
+@bp.teardown_app_request
+def finish_request(exception=None):
+    if 'request_route' in g:
+        metrics.HTTP_REQUESTS_IN_FLIGHT.dec(1, g.request_route)
+    if 'store_session' in g:
+        current_session.reset(g.pop('store_session'))
+
+    # Requests that failed before after_request still release the profiler
+    if g.get('profile'):
+        profiler.finish(g.pop('profile'), 500)
+
+@bp.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """List captured request profiles, newest first. Admins only."""
+    if not profiler.is_admin(request.headers.get('X-Admin-Token')):
+        return jsonify({'errors': ['Admin token required.']}), 403
+    return jsonify({'profiles': profiler.store.list()}), 200
+
+@bp.route('/admin/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id: str):
+    """Get a captured request profile with its cProfile statistics and spans. Admins only."""
+    if not profiler.is_admin(request.headers.get('X-Admin-Token')):
+        return jsonify({'errors': ['Admin token required.']}), 403
+    report = profiler.store.get(profile_id)
+    if report is None:
+        return jsonify({'errors': ['Profile not found.']}), 404
+    return jsonify(report.to_dict()), 200
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Expose metrics in the Prometheus text format."""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/healthz', methods=['GET'])
+def liveness():
+    """Liveness probe: the process is up and serving requests."""
+    return jsonify({'status': 'ok'}), 200
+
+@bp.route('/readyz', methods=['GET'])
+def readiness():
+    """Readiness probe: the store is reachable and its schema has been migrated."""
+    try:
+        store.get_version()
+    except Exception:
+        return jsonify({'status': 'unavailable'}), 503
+    return jsonify({'status': 'ready'}), 200
+
+@bp.route('/')
+def index():
+    """Render the main form."""
+    return render_template('index.html')
+
+def echo_order(order: Dict, keep=()) -> Dict:
+    """Return an order for a response, without the echoed large fields if the client asked for a minimal response."""
+    if not g.get('return_minimal'):
+        return order
+    g.return_minimal_applied = True
+    return minimal_order(order, keep)
+
+def respond(reply: Reply):
+    """Render a reply shared with the ASGI app as a Flask response."""
+    body, status, headers = reply
+    return jsonify(body), status, headers
+
+def admission_controlled(endpoint: str):
+    """Only run the view if the client is within its rate limit and an LLM slot frees up in time, else respond 429."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            admission = get_resources().admission
+            client = client_identity(request.headers.get('X-API-Key'), request.remote_addr)
+            decision = admission.acquire(endpoint, client)
+            if not decision.admitted:
+                return respond(admission_rejected(decision))
+            try:
+                return view(*args, **kwargs)
+            finally:
+                admission.release()
+        return wrapper
+    return decorator
+
+def stream_slot_limited(view):
+    """Only open the stream if fewer than STREAM_MAX_CONNECTIONS are open in this worker, else respond 503.
+    The slot is freed when the server closes the response, however the stream ends."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        slots = get_resources().stream_slots
+        if not slots.acquire(0):
+            return respond(streams_busy())
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            slots.release()
+            raise
+        response.call_on_close(slots.release)
+        return response
+    return wrapper
+
+def validate_order_data(data: Dict):
+    # sanitize input, and if basic input validation fails, return error response
+    sanitized_data, input_errors = check_order_input(data)
+    if input_errors:
+        return False, input_errors, sanitized_data
+
+    # If order validation fails, return error response
+    order_warnings = store.validate_order(sanitized_data)
+    if order_warnings:
+        return True, order_warnings, sanitized_data
+
+    # If validation passes, return sanitized input
+    return True, None, sanitized_data
+
+@bp.route('/care-plan/validate', methods=['POST'])
+def validate_order():
+    """Validate order data."""
+    try:
+        data = request.json
+
+        # validate data
+        valid, validations, sanitized_data = validate_order_data(data)
+
+        # If validation errors exist return error response
+        if not valid:
+            return jsonify({
+                'errors': validations
+            }), 400
+
+        # Return success response along with warnings
+        return respond(validated(sanitized_data, validations, echo_order))
+    except Exception as e:
+        return respond(failed(VALIDATION_FAILED))
+
+@bp.route('/care-plan/generate', methods=['POST'])
+@admission_controlled('generate')
+def generate_care_plan():
+    """Generate care plan using LLM."""
+    try:
+        data = request.json
+
+        # Generate care plan using LLM
+        care_plan = get_resources().care_plan_generator.generate_care_plan_with_llm(data)
+
+        # Return the full order with the generated care plan
+        return respond(generated(data, care_plan, echo_order))
+
+    except Exception as e:
+        return respond(failed(GENERATION_FAILED))
+
+@bp.route('/care-plan/submit', methods=['POST'])
+def submit_order():
+    """Persist Full Validated Order with Care Plan in Internal Data Storage."""
+    try:
+        data = request.json
+
+        # Persist the patient data
+        store.add_patient(
+            data['patient_mrn'],
+            data['patient_first_name'],
+            data['patient_last_name']
+        )
+
+        # Persist the provider data
+        store.add_provider(
+            data['provider_npi'],
+            data['provider_name']
+        )
+
+        # Persist the order data
+        store.add_order(data)
+        stats_broadcaster.notify_change()
+
+        # Return the full order in the response
+        return respond(submitted(data, echo_order))
+
+    except Exception as e:
+        return respond(failed(SUBMISSION_FAILED))
+
+@bp.route('/care-plan/orders', methods=['GET'])
+def export_orders():
+    """Export all orders to a CSV file, or only orders after a `since` order id or timestamp."""
+    try:
+        since = request.args.get('since')
+        # Formats other than plain CSV are streamed straight from the store
+        export_format = request.args.get('format', 'csv')
+        # Archived orders are read from their files on demand, so those exports are always streamed
+        include_archived = request.args.get('archived') == '1'
+        # Exports that leave out some large text columns are streamed too, the cached artifact has them all
+        text_fields = parse_text_fields(request.args.get('text'))
+        if export_format != 'csv' or include_archived or text_fields is not None:
+            return stream_export(export_format, since, include_archived, text_fields)
+        if since:
+            return export_orders_since(since)
+
+        # If the client already has the export for the current store version, skip rebuilding it
+        version = store.get_version()
+        etag = export_cache.etag_for(version)
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+
+        artifact = export_cache.get(version)
+        if artifact is None:
+            # Retrieve all persisted orders
+            orders = store.export_orders()
+
+            # If no orders exist in internal data storage return Not Found response
+            if not orders:
+                return jsonify({'error': 'No orders to export'}), 404
+
+            # Write orders to a csv file
+            csv_generator = CSVGenerator()
+            csv_generator.write_data(orders)
+            artifact = csv_generator.get_bytes()
+            metrics.EXPORT_ROWS.inc(len(orders), 'csv')
+
+            # Only cache the artifact if no write happened while it was being built
+            if store.get_version() == version:
+                export_cache.put(version, artifact)
+
+        # Return the csv file as response, requiring clients to revalidate with the ETag
+        response = CSVGenerator.send_artifact(artifact)
+        metrics.EXPORT_BYTES.inc(len(artifact), 'csv')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': 'Export failed due to an internal error'}), 500
+
+def parse_text_fields(value: str = None):
+    """Large text fields named in a comma-separated parameter, () for 'none', or None if it wasn't given."""
+    if value is None:
+        return None
+    if value.strip().lower() in ('', 'none'):
+        return ()
+    return tuple(DataStore.validate_text_fields([field.strip() for field in value.split(',')]))
+
+def export_orders_since(since: str):
+    # X-Export-Cursor is a change feed cursor, which resumes every shard after its own last exported order.
+    # An all-digit since is an order id and an ISO timestamp exports orders after it; both hand out a change
+    # feed cursor taken before the export, so later orders may repeat but are never skipped.
+    if since.isdigit():
+        cursor = store.get_change_cursor()
+        orders = store.export_orders(since_order_id=int(since))
+    else:
+        try:
+            since_timestamp = normalize_date(since)
+        except ValueError:
+            since_timestamp = None
+        if since_timestamp is not None:
+            cursor = store.get_change_cursor()
+            orders = store.export_orders(since_timestamp=since_timestamp)
+        else:
+            error = 'since must be an export cursor, an order id or an ISO timestamp'
+            cursor = decode_position(since, error)
+            orders = []
+            while True:
+                changes = store.get_changes(cursor, EXPORT_CHANGES_PAGE_SIZE, 0)
+                orders.extend(change.order for change in changes)
+                if changes:
+                    cursor = changes[-1].cursor
+                if len(changes) < EXPORT_CHANGES_PAGE_SIZE:
+                    break
+
+    # If there are no new orders return No Content with the cursor to resume from
+    if not orders:
+        response = current_app.response_class(status=204)
+        response.headers['X-Export-Cursor'] = encode_position(cursor)
+        return response
+
+    csv_generator = CSVGenerator()
+    csv_generator.write_data(orders)
+    metrics.EXPORT_ROWS.inc(len(orders), 'csv')
+    response = csv_generator.prepare_for_download()
+    metrics.EXPORT_BYTES.inc(response.content_length or 0, 'csv')
+    response.headers['X-Export-Cursor'] = encode_position(cursor)
+    return response
+
+def stream_export(export_format: str, since: str = None, include_archived: bool = False, text_fields=None):
+    # If the format isn't supported return error response
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported export format. Supported formats: {", ".join(EXPORT_FORMATS)}'}), 400
+    if since and not since.isdigit():
+        return jsonify({'error': 'since must be an order id for streamed exports'}), 400
+
+    # Peek at the first row so an empty export can still get a proper status code
+    since_order_id = int(since) if since else None
+    if text_fields is None:
+        text_fields = DataStore.LARGE_TEXT_FIELDS
+    orders = store.iter_orders(since_order_id=since_order_id, text_fields=text_fields)
+    if include_archived:
+        # Archive files hold every field, so the unrequested text is dropped as they're read
+        left_out = set(DataStore.LARGE_TEXT_FIELDS) - set(text_fields)
+        archived = ({k: v for k, v in order.items() if k not in left_out}
+                    for order in store.iter_archived_orders(since_order_id))
+        orders = itertools.chain(archived, orders)
+    first_order = next(orders, None)
+    if first_order is None:
+        if since:
+            return current_app.response_class(status=204)
+        return jsonify({'error': 'No orders to export'}), 404
+
+    serializer = EXPORT_FORMATS[export_format]
+    rows = metrics.count_export_rows(itertools.chain([first_order], orders), export_format)
+    response = Response(
+        stream_with_context(metrics.count_export_bytes(serializer.serializer(rows), export_format)),
+        mimetype=serializer.mimetype
+    )
+    filename = f'care_plans_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{serializer.extension}'
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+@bp.route('/care-plan/orders/list', methods=['GET'])
+def list_orders():
+    """List orders newest-first with keyset pagination and optional filters."""
+    try:
+        args = request.args
+        limit = clamp_page_size(args.get('limit', type=int))
+        start_date = normalize_date(args.get('start_date'))
+        end_date = normalize_date(args.get('end_date'))
+        include_text = args.get('include_text', 'false').lower() == 'true'
+
+        page = store.list_orders(
+            limit,
+            cursor=args.get('cursor'),
+            provider_npi=args.get('provider_npi'),
+            patient_mrn=args.get('patient_mrn'),
+            medication=args.get('medication'),
+            start_date=start_date,
+            end_date=end_date,
+            include_text=include_text
+        )
+        return jsonify(page), 200
+    except ValueError as e:
+        return jsonify({'errors': [str(e)]}), 400
+    except Exception as e:
+        return jsonify({'errors': ['Failed to list orders due to an internal error.']}), 500
+
+@bp.route('/care-plan/orders/search', methods=['GET'])
+def search_orders():
+    """Full-text search over diagnoses, clinical notes and care plans, ranked and paginated."""
+    try:
+        args = request.args
+        limit = clamp_page_size(args.get('limit', type=int))
+        offset = max(args.get('offset', 0, type=int), 0)
+        include_text = args.get('include_text', 'false').lower() == 'true'
+
+        results = store.search_orders(args.get('q', ''), limit, offset=offset, include_text=include_text)
+        return jsonify(results), 200
+    except ValueError as e:
+        return jsonify({'errors': [str(e)]}), 400
+    except Exception as e:
+        return jsonify({'errors': ['Search failed due to an internal error.']}), 500
+
+@bp.route('/care-plan/plans/query', methods=['GET'])
+def query_care_plans():
+    """Find orders whose care plan `section` mentions every word of `q`, newest first, with a total count."""
+    try:
+        args = request.args
+        limit = clamp_page_size(args.get('limit', type=int))
+        offset = max(args.get('offset', 0, type=int), 0)
+
+        results = store.query_care_plans(args.get('section', ''), query_terms(args.get('q', '')), limit, offset=offset)
+        return jsonify(results), 200
+    except ValueError as e:
+        return jsonify({'errors': [str(e)]}), 400
+    except Exception as e:
+        return jsonify({'errors': ['Care plan query failed due to an internal error.']}), 500
+
+@bp.route('/care-plan/orders/<int:order_id>/details', methods=['GET'])
+def get_order_details(order_id: int):
+    """Get an order's large text fields, all of them or those named in `fields`."""
+    try:
+        fields = parse_text_fields(request.args.get('fields'))
+        details = store.get_order_details([order_id], DataStore.LARGE_TEXT_FIELDS if fields is None else fields)
+        if order_id not in details:
+            return jsonify({'errors': [f'Order {order_id} not found']}), 404
+        return jsonify({'order_id': order_id, **details[order_id]}), 200
+    except ValueError as e:
+        return jsonify({'errors': [str(e)]}), 400
+    except Exception as e:
+        return jsonify({'errors': ['Failed to load order details due to an internal error.']}), 500
+
+@bp.route('/care-plan/patients/<mrn>/history', methods=['GET'])
+def get_patient_history(mrn: str):
+    """Get a patient's previous orders and care plans newest-first with a summary."""
+    try:
+        # If the MRN is malformed return error response
+        valid, error = input_handler.validate_mrn(mrn, input_handler.FIELD_TO_LABEL_MAP["patient_mrn"])
+        if not valid:
+            return jsonify({'errors': [error]}), 400
+
+        limit = clamp_page_size(request.args.get('limit', type=int))
+        return jsonify(store.get_patient_history(mrn, limit)), 200
+    except Exception as e:
+        return jsonify({'errors': ['Failed to load patient history due to an internal error.']}), 500
+
+@bp.route('/care-plan/analytics', methods=['GET'])
+def get_analytics():
+    """Get order counts per time bucket and top medications, providers and diagnoses over a date range."""
+    try:
+        args = request.args
+        analytics = store.get_analytics(
+            start_date=normalize_date(args.get('start_date')),
+            end_date=normalize_date(args.get('end_date')),
+            bucket=args.get('bucket', 'day'),
+            top_n=min(max(args.get('top', 10, type=int), 1), 100)
+        )
+        return jsonify(analytics), 200
+    except ValueError as e:
+        return jsonify({'errors': [str(e)]}), 400
+    except Exception as e:
+        return jsonify({'errors': ['Failed to load analytics due to an internal error.']}), 500
+
+@bp.route('/care-plan/stats', methods=['GET'])
+def get_stats():
+    """Get statistics about stored data."""
+    # Prevent caching of stats
+    return jsonify(store.get_stats()), 200, NO_CACHE_HEADERS
+
+@bp.route('/care-plan/stats/stream', methods=['GET'])
+@stream_slot_limited
+def stream_stats():
+    """Stream statistics as server-sent events whenever stored data changes."""
+    # The stream outlives the request context, so hold on to the broadcaster itself
+    broadcaster = get_resources().stats_broadcaster
+    subscription = broadcaster.subscribe()
+
+    def events():
+        try:
+            while True:
+                try:
+                    yield stats_event(subscription.get(timeout=STREAM_KEEPALIVE))
+                except queue.Empty:
+                    yield KEEPALIVE_EVENT
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return Response(events(), mimetype='text/event-stream', headers=EVENT_STREAM_HEADERS)
+
+@bp.route('/care-plan/changes', methods=['GET'])
+def get_changes():
+    """Long-poll for orders persisted after the `after` cursor."""
+    try:
+        after, limit, timeout = parse_changes_args(request.args)
+        changes = store.get_changes(parse_changes_cursor(after), limit, timeout)
+        return jsonify(changes_body(changes, after)), 200
+    except ValueError as e:
+        return respond(failed(str(e), 400))
+    except Exception as e:
+        return respond(failed(CHANGES_FAILED))
+
+@bp.route('/care-plan/changes/stream', methods=['GET'])
+@stream_slot_limited
+def stream_changes():
+    """Stream persisted orders as server-sent events, resuming after `after` or the Last-Event-ID header.
+    New orders come from the process's change broadcaster; the store is only read to catch up."""
+    # The stream outlives the request context, so hold on to the store and broadcaster themselves
+    feed_store = get_resources().store
+    broadcaster = get_resources().change_broadcaster
+    # Subscribing before the first read means no batch published meanwhile is missed
+    subscription = broadcaster.subscribe()
+    try:
+        after = stream_resume_cursor(request.headers, request.args)
+        # Reading the first page here turns a cursor the store doesn't recognize into a 400
+        pending = feed_store.get_changes(after, CHANGES_PAGE_SIZE, 0)
+    except ValueError as e:
+        broadcaster.unsubscribe(subscription)
+        return respond(failed(str(e), 400))
+    except BaseException:
+        broadcaster.unsubscribe(subscription)
+        raise
+
+    def events(cursor, changes):
+        try:
+            # Servers send the headers with the first chunk, so don't hold them back until an order arrives
+            yield CONNECTED_EVENT
+            while True:
+                for change in changes:
+                    cursor = change.cursor
+                    yield change_event(change)
+                if len(changes) == CHANGES_PAGE_SIZE:
+                    # Still catching up on a backlog
+                    changes = feed_store.get_changes(cursor, CHANGES_PAGE_SIZE, 0)
+                    continue
+                try:
+                    batch = subscription.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield KEEPALIVE_EVENT
+                    changes = []
+                    continue
+                # A batch that doesn't follow on from this stream's cursor means some were replaced unread
+                changes = batch.changes if batch.after == cursor else feed_store.get_changes(cursor, CHANGES_PAGE_SIZE, 0)
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return Response(events(after, pending), mimetype='text/event-stream', headers=EVENT_STREAM_HEADERS)
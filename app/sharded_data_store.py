@@ -0,0 +1,327 @@
+import heapq
+import itertools
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from app.analytics import DIMENSIONS, top_counts
+from app.data_store import Change, DataStore
+from app.pagination import decode_position, encode_cursor, encode_position
+
+def shard_index(mrn: str, shard_count: int) -> int:
+    """The shard a patient's data lives on. A stable hash, so every process routes the same way."""
+    return zlib.crc32(mrn.encode('utf-8')) % shard_count
+
+def _order_time(order: Dict):
+    return order.get('timestamp'), order['order_id']
+
+class ShardedDataStore(DataStore):
+    """Spreads patients and their orders over several stores by a hash of the MRN, with providers kept in one
+    registry store so NPI and name uniqueness is checked globally. Reads spanning patients query every shard
+    in parallel and merge the results.
+
+    Order ids are interleaved, a shard's order n getting the id n * shards + shard index, so they're unique
+    across shards but only ordered by time within a shard. Cursors that resume a read across shards therefore
+    hold a position per shard rather than one global id. The shard list's order must never change."""
+
+    # Seconds between checks while a change feed request waits for new orders
+    CHANGES_POLL_INTERVAL = 0.5
+
+    def __init__(self, shards: List[DataStore], registry: Optional[DataStore] = None):
+        if not shards:
+            raise ValueError("At least one shard is required")
+        self.shards = list(shards)
+        self.registry = registry if registry is not None else self.shards[0]
+        self.stores = list({id(store): store for store in [self.registry, *self.shards]}.values())
+        self.similarity_threshold = self.shards[0].similarity_threshold
+        self.executor = ThreadPoolExecutor(max_workers=len(self.stores), thread_name_prefix='shard')
+
+    def shard_for(self, mrn: str) -> DataStore:
+        return self.shards[shard_index(mrn, len(self.shards))]
+
+    def global_id(self, index: int, order_id: int) -> int:
+        return order_id * len(self.shards) + index
+
+    def local_id(self, order_id: int) -> Tuple[int, int]:
+        """Split a global order id into its shard index and the shard's own id."""
+        return order_id % len(self.shards), order_id // len(self.shards)
+
+    def local_after(self, index: int, order_id: Optional[int]) -> Optional[int]:
+        """The shard's own id whose later orders are exactly its orders after a global id."""
+        if order_id is None:
+            return None
+        return (order_id - index) // len(self.shards)
+
+    def _globalize(self, index: int, order: Dict) -> Dict:
+        return {**order, 'order_id': self.global_id(index, order['order_id'])}
+
+    def _globalize_all(self, index: int, orders: Iterator[Dict]) -> Iterator[Dict]:
+        for order in orders:
+            yield self._globalize(index, order)
+
+    def _scatter(self, call: Callable[[int, DataStore], object], stores: Optional[List[DataStore]] = None) -> List:
+        """Run call(index, store) on every shard (or the given stores) in parallel, returning results in order."""
+        stores = self.shards if stores is None else stores
+        return list(self.executor.map(call, range(len(stores)), stores))
+
+    def validate_provider(self, npi: str, name: str) -> Dict:
+        return self.registry.validate_provider(npi, name)
+
+    def add_provider(self, npi: str, name: str):
+        self.registry.add_provider(npi, name)
+
+    def validate_patient(self, mrn: str, first_name: str, last_name: str) -> Dict:
+        return self.shard_for(mrn).validate_patient(mrn, first_name, last_name)
+
+    def add_patient(self, mrn: str, first_name: str, last_name: str):
+        self.shard_for(mrn).add_patient(mrn, first_name, last_name)
+
+    def check_duplicate_order(self, mrn: str, medication: str) -> bool:
+        return self.shard_for(mrn).check_duplicate_order(mrn, medication)
+
+    def find_similar_orders(self, mrn: str, medication: str, threshold: float) -> List[Dict]:
+        return self.shard_for(mrn).find_similar_orders(mrn, medication, threshold)
+
+    def add_order(self, order_data: Dict):
+        index = shard_index(order_data['patient_mrn'], len(self.shards))
+        shard = self.shards[index]
+        # Orders reference their provider, so the shard keeps a copy of the registry's row
+        if shard is not self.registry:
+            shard.add_provider(order_data['provider_npi'], order_data['provider_name'])
+        shard.add_order(order_data)
+        if 'order_id' in order_data:
+            order_data['order_id'] = self.global_id(index, order_data['order_id'])
+
+    def export_orders(self, since_order_id: Optional[int] = None, since_timestamp: Optional[str] = None,
+                      text_fields: Sequence[str] = DataStore.LARGE_TEXT_FIELDS) -> List[Dict]:
+        exports = self._scatter(lambda index, shard: [
+            self._globalize(index, order)
+            for order in shard.export_orders(self.local_after(index, since_order_id), since_timestamp, text_fields)
+        ])
+        return list(heapq.merge(*exports, key=_order_time))
+
+    def iter_orders(self, since_order_id: Optional[int] = None, batch_size: int = 1000,
+                    text_fields: Sequence[str] = DataStore.LARGE_TEXT_FIELDS) -> Iterator[Dict]:
+        # Each shard streams oldest-first, so merging them keeps only a batch per shard in memory
+        streams = [
+            self._globalize_all(index, shard.iter_orders(self.local_after(index, since_order_id), batch_size, text_fields))
+            for index, shard in enumerate(self.shards)
+        ]
+        yield from heapq.merge(*streams, key=_order_time)
+
+    def get_order_details(self, order_ids: List[int], fields: Sequence[str] = DataStore.LARGE_TEXT_FIELDS) -> Dict[int, Dict]:
+        by_shard = {}
+        for order_id in order_ids:
+            index, local_id = self.local_id(order_id)
+            by_shard.setdefault(index, []).append(local_id)
+        details = {}
+        for index, local_ids in by_shard.items():
+            for local_id, text in self.shards[index].get_order_details(local_ids, fields).items():
+                details[self.global_id(index, local_id)] = text
+        return details
+
+    def get_changes(self, after: Optional[List], limit: int, timeout: float) -> List[Change]:
+        """Get orders added after a cursor, merged oldest-first. The cursor is a list of [shard index, that
+        shard's cursor] pairs, so a shard that falls behind the others still resumes after its own last order.
+        Shards are polled, since waiting on each would tie up a thread per shard."""
+        positions = self.shard_positions(after, "Invalid change feed cursor")
+        deadline = time.monotonic() + timeout
+        while True:
+            pages = self._scatter(lambda index, shard: [
+                (index, change) for change in shard.get_changes(positions.get(index), limit, 0)
+            ])
+            merged = itertools.islice(heapq.merge(*pages, key=lambda item: _order_time(item[1].order)), limit)
+            changes = []
+            for index, change in merged:
+                positions[index] = change.cursor
+                changes.append(Change(self.shard_cursor(positions), self._globalize(index, change.order)))
+            if changes or time.monotonic() >= deadline:
+                return changes
+            time.sleep(min(self.CHANGES_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+
+    def get_change_cursor(self) -> List:
+        return self.shard_cursor(dict(enumerate(self._scatter(lambda index, shard: shard.get_change_cursor()))))
+
+    def shard_positions(self, cursor: Optional[List], error: str) -> Dict[int, Any]:
+        """Split a cursor of [shard index, position] pairs. Shards it leaves out start from the beginning."""
+        if cursor is None:
+            return {}
+        try:
+            positions = {index: position for index, position in cursor}
+        except (TypeError, ValueError):
+            raise ValueError(error)
+        if not all(isinstance(index, int) and 0 <= index < len(self.shards) for index in positions):
+            raise ValueError(error)
+        return positions
+
+    @staticmethod
+    def shard_cursor(positions: Dict[int, Any]) -> List:
+        return [[index, position] for index, position in sorted(positions.items())]
+
+    def get_version(self) -> int:
+        """The sum of every store's version, which changes whenever any of them does."""
+        return sum(self._scatter(lambda index, store: store.get_version(), self.stores))
+
+    def get_stats(self) -> Dict:
+        stats = dict(zip(map(id, self.stores), self._scatter(lambda index, store: store.get_stats(), self.stores)))
+        shard_stats = [stats[id(shard)] for shard in self.shards]
+        total_orders = sum(shard['total_orders'] for shard in shard_stats)
+        # Shards don't report text sizes, so their ratios are weighted by order count
+        compression_ratio = 1.0
+        if total_orders:
+            compression_ratio = round(sum(
+                shard['text_compression_ratio'] * shard['total_orders'] for shard in shard_stats
+            ) / total_orders, 2)
+        return {
+            'total_orders': total_orders,
+            'total_patients': sum(shard['total_patients'] for shard in shard_stats),
+            'total_providers': stats[id(self.registry)]['total_providers'],
+            'text_compression_ratio': compression_ratio
+        }
+
+    def list_orders(self, limit: int, cursor: Optional[str] = None, provider_npi: Optional[str] = None,
+                    patient_mrn: Optional[str] = None, medication: Optional[str] = None,
+                    start_date: Optional[str] = None, end_date: Optional[str] = None,
+                    include_text: bool = False) -> Dict:
+        """List orders newest-first using keyset pagination on (timestamp, order_id). The cursor holds each
+        shard's own keyset cursor, so every shard resumes right after the last of its orders listed."""
+        error = "Invalid pagination cursor"
+        cursors = self.shard_positions(decode_position(cursor, error) if cursor else None, error)
+
+        # One patient's orders are all on their shard
+        indexes = [shard_index(patient_mrn, len(self.shards))] if patient_mrn else list(range(len(self.shards)))
+        pages = dict(zip(indexes, self._scatter(
+            lambda position, shard: shard.list_orders(limit, cursors.get(indexes[position]), provider_npi, patient_mrn,
+                                                      medication, start_date, end_date, include_text),
+            [self.shards[index] for index in indexes]
+        )))
+
+        tagged = [[(index, order) for order in page['orders']] for index, page in pages.items()]
+        merged = list(itertools.islice(
+            heapq.merge(*tagged, key=lambda item: _order_time(item[1]), reverse=True), limit
+        ))
+        listed = {}
+        for index, order in merged:
+            listed[index] = listed.get(index, 0) + 1
+            cursors[index] = encode_cursor(order['timestamp'], order['order_id'])
+
+        # More remain if a shard has orders left on its page, or listed its whole page and has another
+        has_more = any(
+            listed.get(index, 0) < len(page['orders']) or page['next_cursor'] is not None
+            for index, page in pages.items()
+        )
+        return {
+            'orders': [self._globalize(index, order) for index, order in merged],
+            'next_cursor': encode_position(self.shard_cursor(cursors)) if has_more else None
+        }
+
+    def get_patient_history(self, mrn: str, limit: int) -> Dict:
+        index = shard_index(mrn, len(self.shards))
+        history = self.shards[index].get_patient_history(mrn, limit)
+        return {**history, 'orders': [self._globalize(index, order) for order in history['orders']]}
+
+    def search_orders(self, query: str, limit: int, offset: int = 0, include_text: bool = False) -> Dict:
+        """Search every shard for the first offset + limit matches and merge them by rank. Ranks are computed
+        per shard, so they're only comparable while shards hold similar orders."""
+        results = self._scatter(lambda index, shard: shard.search_orders(query, offset + limit, 0, include_text))
+        merged = sorted(
+            (self._globalize(index, order) for index, result in enumerate(results) for order in result['orders']),
+            key=lambda order: (-order['rank'], order['order_id'])
+        )
+
+        has_more = len(merged) > offset + limit or any(result['next_offset'] is not None for result in results)
+        return {'orders': merged[offset:offset + limit], 'next_offset': offset + limit if has_more else None}
+
+    def query_care_plans(self, section: str, terms: Sequence[str], limit: int, offset: int = 0) -> Dict:
+        """Query every shard for its newest offset + limit matches and merge them newest-first."""
+        results = self._scatter(lambda index, shard: shard.query_care_plans(section, terms, offset + limit, 0))
+        pages = [[self._globalize(index, order) for order in result['orders']] for index, result in enumerate(results)]
+        merged = list(itertools.islice(heapq.merge(*pages, key=_order_time, reverse=True), offset + limit))
+
+        total = sum(result['total'] for result in results)
+        next_offset = offset + limit if total > offset + limit else None
+        return {'total': total, 'orders': merged[offset:offset + limit], 'next_offset': next_offset}
+
+    def get_analytics(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                      bucket: str = 'day', top_n: int = 10) -> Dict:
+        """Add up every shard's analytics. A key outside a shard's top_n misses that shard's count, so
+        breakdowns near the cutoff can be undercounted."""
+        results = self._scatter(lambda index, shard: shard.get_analytics(start_date, end_date, bucket, top_n))
+
+        series = {}
+        for result in results:
+            for point in result['series']:
+                series[point['period']] = series.get(point['period'], 0) + point['orders']
+        merged = {
+            'bucket': bucket,
+            'total_orders': sum(result['total_orders'] for result in results),
+            'series': [{'period': period, 'orders': count} for period, count in sorted(series.items())],
+        }
+        for response_key in DIMENSIONS.values():
+            counts = {}
+            for result in results:
+                for item in result[response_key]:
+                    counts[item['key']] = counts.get(item['key'], 0) + item['count']
+            merged[response_key] = top_counts(counts, top_n)
+        return merged
+
+    def consume_rate_limit(self, key: str, capacity: float, refill_rate: float, cost: float = 1.0) -> float:
+        return self.registry.consume_rate_limit(key, capacity, refill_rate, cost)
+
+    def migrate(self):
+        for store in self.stores:
+            store.migrate()
+
+    def open_pool(self, min_size: int, max_size: int):
+        for store in self.stores:
+            store.open_pool(min_size, max_size)
+
+    def ensure_partitions(self):
+        for shard in self.shards:
+            shard.ensure_partitions()
+
+    def prune_rate_limits(self, capacity: float, refill_rate: float) -> int:
+        return self.registry.prune_rate_limits(capacity, refill_rate)
+
+    def archive_orders(self, retention_months: int) -> List[Dict]:
+        return [archive for shard in self.shards for archive in shard.archive_orders(retention_months)]
+
+    def iter_archived_orders(self, since_order_id: Optional[int] = None) -> Iterator[Dict]:
+        streams = [
+            self._globalize_all(index, shard.iter_archived_orders(self.local_after(index, since_order_id)))
+            for index, shard in enumerate(self.shards)
+        ]
+        yield from heapq.merge(*streams, key=_order_time)
+
+    def iter_providers(self, limit: int) -> Iterator[Dict]:
+        yield from self.registry.iter_providers(limit)
+
+    def iter_patients(self, limit: int) -> Iterator[Dict]:
+        yield from itertools.islice(itertools.chain.from_iterable(
+            shard.iter_patients(limit) for shard in self.shards
+        ), limit)
+
+    def listen_identity_changes(self, on_change: Callable[[Optional[Dict]], None], stop):
+        """Follow the identity changes of every store, each on its own thread, until stop is set."""
+        threads = [
+            threading.Thread(target=store.listen_identity_changes, args=(on_change, stop), daemon=True)
+            for store in self.stores[1:]
+        ]
+        for thread in threads:
+            thread.start()
+        self.stores[0].listen_identity_changes(on_change, stop)
+        for thread in threads:
+            thread.join()
+
+    def compress_text(self) -> Dict:
+        """Train a dictionary on every shard. Reports the last shard's dictionary and the total recompressed."""
+        results = [shard.compress_text() for shard in self.shards]
+        dictionary_ids = [result['dictionary_id'] for result in results if result['dictionary_id'] is not None]
+        return {
+            'dictionary_id': dictionary_ids[-1] if dictionary_ids else None,
+            'recompressed': sum(result['recompressed'] for result in results)
+        }
+
+    def parse_care_plans(self) -> int:
+        return sum(shard.parse_care_plans() for shard in self.shards)
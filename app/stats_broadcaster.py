@@ -0,0 +1,108 @@
+import asyncio
+import queue
+import threading
+from typing import Dict, Optional
+from app.data_store import DataStore
+
+class StatsBroadcaster:
+    """Computes store stats once per change and fans them out to every subscriber."""
+
+    def __init__(self, store: DataStore, check_interval: float = 2.0):
+        self.store = store
+        self.check_interval = check_interval  # Seconds between checks for writes made by other processes
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._changed = threading.Event()
+        self._latest: Optional[Dict] = None
+        self._version = None
+        self._thread = None
+
+    def subscribe(self, subscription=None):
+        """Register a subscriber. The returned queue, or the given AsyncSubscription, always holds only the
+        newest stats."""
+        subscription = subscription or queue.Queue(maxsize=1)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._latest is not None:
+                publish_latest(subscription, self._latest)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stats-broadcaster', daemon=True)
+                self._thread.start()
+        self._changed.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscriber."""
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def notify_change(self):
+        """Signal that the store was written to, so stats are recomputed right away."""
+        self._changed.set()
+
+    def _run(self):
+        while True:
+            self._changed.wait(self.check_interval)
+            self._changed.clear()
+
+            # Nobody is listening, so don't touch the store at all
+            with self._lock:
+                if not self._subscribers:
+                    continue
+            try:
+                self._refresh()
+            except Exception:
+                # Keep serving the last known stats until the store is reachable again
+                continue
+
+    def _refresh(self):
+        version = self.store.get_version()
+        if version == self._version and self._latest is not None:
+            return
+        stats = self.store.get_stats()
+
+        with self._lock:
+            self._version = version
+            self._latest = stats
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            publish_latest(subscription, stats)
+
+class AsyncSubscription:
+    """A subscriber on an event loop, so streams served by coroutines wait for broadcasts without a thread.
+    Create it on the loop that reads it."""
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=1)
+
+    def publish(self, value):
+        # Called from the broadcaster's thread
+        try:
+            self._loop.call_soon_threadsafe(self._replace, value)
+        except RuntimeError:
+            # The event loop has closed
+            pass
+
+    def _replace(self, value):
+        if not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(value)
+
+    async def get(self, timeout: float):
+        """Wait up to timeout seconds for the next value. Raises asyncio.TimeoutError if none arrives."""
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+def publish_latest(subscription, value):
+    """Put a value in a subscriber's one-slot queue, replacing any value it hasn't consumed yet."""
+    if isinstance(subscription, AsyncSubscription):
+        subscription.publish(value)
+        return
+    try:
+        subscription.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        subscription.put_nowait(value)
+    except queue.Full:
+        pass
@@ -0,0 +1,165 @@
+import hashlib
+import struct
+import threading
+import zlib
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Stored blobs start with a header: the codec, then the id of the dictionary they were compressed with (0 for none)
+RAW, ZLIB, ZSTD = 0, 1, 2
+HEADER = struct.Struct('>BI')
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+DICTIONARY_SIZE = 32 * 1024  # zlib only uses the last 32 KiB of a preset dictionary
+MIN_DICTIONARY_SAMPLES = 64
+
+def blob_hash(text: str) -> bytes:
+    """Content address of a text: the SHA-256 of its UTF-8 encoding, as PostgreSQL's SHA256() computes it."""
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+def train_dictionary(samples: List[str], size: int = DICTIONARY_SIZE) -> bytes:
+    """Build a compression dictionary from sample texts. zstd trains one when zstandard is installed;
+    otherwise the lines shared by the most samples make a zlib preset dictionary."""
+    encoded = [sample.encode('utf-8') for sample in samples if sample]
+    if zstandard is not None and len(encoded) >= MIN_DICTIONARY_SAMPLES:
+        try:
+            return zstandard.train_dictionary(size, encoded).as_bytes()
+        except zstandard.ZstdError:
+            # Too little variety to train on, fall back to shared lines
+            pass
+    counts = Counter(line for sample in encoded for line in set(sample.splitlines(keepends=True)))
+    # zlib finds matches in the end of the dictionary cheapest, so the most common lines go last
+    common = [line for line, count in sorted(counts.items(), key=lambda item: (item[1], item[0])) if count > 1]
+    return b''.join(common)[-size:]
+
+class TextCodec:
+    """Compresses text with zstd when zstandard is installed, else zlib, optionally with a trained dictionary.
+    Blobs are self-describing, so those written with another codec or an older dictionary stay readable."""
+
+    def __init__(self, dictionary_loader: Optional[Callable[[int], Optional[bytes]]] = None):
+        self.dictionary_loader = dictionary_loader  # Looks up dictionaries this process hasn't seen yet
+        self.dictionaries: Dict[int, bytes] = {}
+        self.dictionary_id = 0  # Dictionary new blobs are compressed with, 0 for none
+        self._zstd_dictionaries = {}
+        self._lock = threading.Lock()
+
+    def use_dictionary(self, dictionary_id: int, data: bytes):
+        """Compress new blobs with a dictionary. Blobs written with earlier ones can still be read."""
+        with self._lock:
+            self.dictionaries[dictionary_id] = data
+            self.dictionary_id = dictionary_id
+
+    def compress(self, text: str) -> bytes:
+        raw = text.encode('utf-8')
+        dictionary_id = self.dictionary_id
+        dictionary = self.dictionaries.get(dictionary_id)
+        if zstandard is not None:
+            codec = ZSTD
+            compressed = self._zstd_compressor(dictionary_id, dictionary).compress(raw)
+        else:
+            codec = ZLIB
+            compressor = zlib.compressobj(ZLIB_LEVEL, zdict=dictionary) if dictionary else zlib.compressobj(ZLIB_LEVEL)
+            compressed = compressor.compress(raw) + compressor.flush()
+
+        # Short texts can grow when compressed, those are kept as they are
+        if len(compressed) >= len(raw):
+            return HEADER.pack(RAW, 0) + raw
+        return HEADER.pack(codec, dictionary_id if dictionary else 0) + compressed
+
+    def decompress(self, blob: bytes) -> str:
+        codec, dictionary_id = HEADER.unpack_from(blob)
+        data = bytes(blob[HEADER.size:])
+        dictionary = self._dictionary(dictionary_id) if dictionary_id else None
+        if codec == RAW:
+            raw = data
+        elif codec == ZLIB:
+            decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+            raw = decompressor.decompress(data) + decompressor.flush()
+        elif codec == ZSTD:
+            if zstandard is None:
+                raise RuntimeError("Text was compressed with zstd, install zstandard to read it")
+            raw = self._zstd_decompressor(dictionary_id, dictionary).decompress(data)
+        else:
+            raise ValueError(f"Unknown text codec {codec}")
+        return raw.decode('utf-8')
+
+    def _dictionary(self, dictionary_id: int) -> bytes:
+        if dictionary_id not in self.dictionaries and self.dictionary_loader is not None:
+            data = self.dictionary_loader(dictionary_id)
+            if data is not None:
+                with self._lock:
+                    self.dictionaries.setdefault(dictionary_id, data)
+        if dictionary_id not in self.dictionaries:
+            raise ValueError(f"Unknown text dictionary {dictionary_id}")
+        return self.dictionaries[dictionary_id]
+
+    def _zstd_dictionary(self, dictionary_id: int, dictionary: Optional[bytes]):
+        if not dictionary:
+            return None
+        # Digesting a dictionary is slow, so it's done once per dictionary
+        if dictionary_id not in self._zstd_dictionaries:
+            self._zstd_dictionaries[dictionary_id] = zstandard.ZstdCompressionDict(dictionary)
+        return self._zstd_dictionaries[dictionary_id]
+
+    def _zstd_compressor(self, dictionary_id: int, dictionary: Optional[bytes]):
+        # Compressors aren't thread-safe, so each call gets its own
+        zstd_dictionary = self._zstd_dictionary(dictionary_id, dictionary)
+        if zstd_dictionary is None:
+            return zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=zstd_dictionary)
+
+    def _zstd_decompressor(self, dictionary_id: int, dictionary: Optional[bytes]):
+        zstd_dictionary = self._zstd_dictionary(dictionary_id, dictionary)
+        if zstd_dictionary is None:
+            return zstandard.ZstdDecompressor()
+        return zstandard.ZstdDecompressor(dict_data=zstd_dictionary)
+
+class TextBlobStore:
+    """In-memory content-addressed store of compressed texts. Each distinct text is kept once, however many
+    orders reference it. Once enough distinct texts are stored, a dictionary is trained from them."""
+
+    TRAINING_SAMPLES = 256
+
+    def __init__(self, codec: Optional[TextCodec] = None):
+        self.codec = codec or TextCodec()
+        self.blobs: Dict[bytes, bytes] = {}  # Hash -> compressed text
+        self.referenced_bytes = 0  # Size of every stored reference's text, uncompressed
+        self.stored_bytes = 0      # Size of the distinct compressed blobs
+        self._samples = []
+        self._lock = threading.Lock()
+
+    def put(self, text: Optional[str]) -> Optional[bytes]:
+        """Store a text, returning its hash to reference it by."""
+        if text is None:
+            return None
+        key = blob_hash(text)
+        with self._lock:
+            self.referenced_bytes += len(text.encode('utf-8'))
+            if key in self.blobs:
+                return key
+            blob = self.codec.compress(text)
+            self.blobs[key] = blob
+            self.stored_bytes += len(blob)
+            if not self.codec.dictionary_id:
+                self._samples.append(text)
+                if len(self._samples) >= self.TRAINING_SAMPLES:
+                    self.codec.use_dictionary(1, train_dictionary(self._samples))
+                    self._samples = []
+        return key
+
+    def get(self, key: Optional[bytes]) -> Optional[str]:
+        if key is None:
+            return None
+        return self.codec.decompress(self.blobs[key])
+
+    def compression_ratio(self) -> float:
+        """Referenced text size over stored size, so deduplication counts as well as compression."""
+        if not self.stored_bytes:
+            return 1.0
+        return round(self.referenced_bytes / self.stored_bytes, 2)
@@ -0,0 +1,58 @@
+import math
+import re
+from typing import Dict, List, Tuple
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'in', 'is',
+    'it', 'of', 'on', 'or', 'that', 'the', 'to', 'was', 'were', 'with'
+})
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase search terms, dropping stop words."""
+    if not text:
+        return []
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+class InvertedIndex:
+    """Incrementally maintained term -> document postings with tf-idf ranking."""
+
+    def __init__(self):
+        self.postings = {}  # Term -> {document id -> term frequency}
+        self.document_count = 0
+
+    def add(self, doc_id: int, text: str):
+        """Index a document. Each document id should only be added once."""
+        frequencies = {}
+        for term in tokenize(text):
+            frequencies[term] = frequencies.get(term, 0) + 1
+
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+        self.document_count += 1
+
+    def search(self, query: str) -> List[Tuple[int, float]]:
+        """Return (document id, score) pairs for documents containing every query term, best first."""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        # Intersect starting from the rarest term so the candidate set stays small
+        term_postings = sorted((self.postings.get(term, {}) for term in terms), key=len)
+        if not term_postings[0]:
+            return []
+        candidates = set(term_postings[0])
+        for postings in term_postings[1:]:
+            candidates.intersection_update(postings)
+            if not candidates:
+                return []
+
+        scores: Dict[int, float] = {}
+        for postings in term_postings:
+            idf = math.log(1 + self.document_count / len(postings))
+            for doc_id in candidates:
+                scores[doc_id] = scores.get(doc_id, 0.0) + (1 + math.log(postings[doc_id])) * idf
+
+        # Ties go to the newest document
+        return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
@@ -0,0 +1,4 @@
+"""ASGI entry point, e.g. `uvicorn asgi:app --workers 4`. Run `flask --app server migrate` once per deployment first."""
+from app.asgi import create_asgi_app
+
+app = create_asgi_app()
@@ -0,0 +1,74 @@
+"""Measure cold-start time: importing the app, per-worker initialization and the first request.
+
+Usage:
+    python benchmarks/bench_cold_start.py --runs 5 --budget 0.5
+
+Each run is a fresh interpreter that goes through the gunicorn phases: the master imports the app and preloads
+modules, then a worker initializes its resources and serves its first request. Scale-out and worker restarts
+only pay for the worker phase, which must stay within the budget (median, seconds).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# Runs in a fresh interpreter and prints the phase timings as JSON
+PROBE = """
+import json, time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+from app.factory import init_worker, preload_modules
+preload_modules(server.app)
+preloaded = time.perf_counter()
+init_worker(server.app)
+initialized = time.perf_counter()
+response = server.app.test_client().get('/readyz')
+ready = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'preload': preloaded - imported,
+    'init_worker': initialized - preloaded,
+    'first_request': ready - initialized,
+    'worker_ready': ready - preloaded,
+    'total': ready - start,
+    'status': response.status_code,
+}))
+"""
+
+PHASES = ('import', 'preload', 'init_worker', 'first_request', 'worker_ready', 'total')
+
+def run_probe() -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=ROOT, env=os.environ.copy(),
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=0.5, help='median seconds allowed from fork until a worker is ready')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    runs = [run_probe() for _ in range(args.runs)]
+    medians = {phase: round(statistics.median(run[phase] for run in runs), 4) for phase in PHASES}
+    within_budget = medians['worker_ready'] <= args.budget and all(run['status'] == 200 for run in runs)
+
+    if args.json:
+        print(json.dumps({'runs': args.runs, 'budget': args.budget, 'median': medians,
+                          'within_budget': within_budget}, indent=2))
+    else:
+        for phase in PHASES:
+            print(f"{phase:<15}{medians[phase]:>8.3f}s")
+        print(f"{'budget':<15}{args.budget:>8.3f}s  {'OK' if within_budget else 'EXCEEDED'}")
+    return 0 if within_budget else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""Compare size and throughput of the order export formats.
+
+Usage:
+    python benchmarks/bench_export_formats.py --orders 5000
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.csv_generator import CSVGenerator
+from app.export_formats import EXPORT_FORMATS
+from app.in_memory_data_store import InMemoryDataStore
+from synthetic import iter_orders
+
+def build_store(order_count: int, seed: int = 7) -> InMemoryDataStore:
+    # Orders with multi-KB care plans and clinical notes
+    store = InMemoryDataStore()
+    for order in iter_orders(order_count, seed=seed):
+        store.add_order(order)
+    return store
+
+def measure(name: str, produce) -> dict:
+    start = time.perf_counter()
+    size = sum(len(chunk) for chunk in produce())
+    elapsed = time.perf_counter() - start
+    return {'format': name, 'bytes': size, 'seconds': round(elapsed, 4)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    store = build_store(args.orders)
+
+    def buffered_csv():
+        # The original in-memory CSVGenerator path
+        generator = CSVGenerator()
+        generator.write_data(store.export_orders())
+        yield generator.get_bytes()
+
+    results = [measure('csv (CSVGenerator)', buffered_csv)]
+    for name, export_format in EXPORT_FORMATS.items():
+        results.append(measure(name, lambda: export_format.serializer(store.iter_orders())))
+
+    baseline_size = results[0]['bytes']
+    for result in results:
+        result['size_ratio'] = round(result['bytes'] / baseline_size, 3)
+        result['orders_per_second'] = round(args.orders / result['seconds']) if result['seconds'] else None
+
+    if args.json:
+        print(json.dumps({'orders': args.orders, 'results': results}, indent=2))
+        return
+
+    print(f"{'format':<20}{'bytes':>14}{'ratio':>8}{'seconds':>10}{'orders/s':>12}")
+    for result in results:
+        print(f"{result['format']:<20}{result['bytes']:>14}{result['size_ratio']:>8}"
+              f"{result['seconds']:>10}{result['orders_per_second']:>12}")
+
+if __name__ == '__main__':
+    main()
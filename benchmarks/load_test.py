@@ -0,0 +1,255 @@
+"""Replay order payloads through validate -> generate -> submit against a running server.
+
+Start the server with the offline LLM stand-in, then drive it at one or more arrival rates:
+    CARE_PLAN_GENERATOR=offline OFFLINE_LLM_LATENCY=2 RATE_LIMIT_BURST=0 gunicorn -w 4 --threads 8 server:app
+    python benchmarks/load_test.py --url http://localhost:8000 --rates 2,5,10,20 --duration 30 --concurrency 64
+
+Payloads are read from a JSONL file of order objects (--payloads, default requests.jsonl). Lines that aren't
+orders are skipped, and synthetic orders are used when the file has none. Every replayed payload is mutated
+(new MRN, names and optionally medication) so the store keeps growing instead of flagging duplicates. Each
+session sends its own X-API-Key, so per-client rate limits don't throttle the run; 429s are counted apart from errors.
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from synthetic import MEDICATIONS, generate_orders
+
+ENDPOINTS = ('validate', 'generate', 'submit')
+ORDER_FIELDS = ('patient_mrn', 'provider_npi', 'medication')
+
+def load_payloads(path: Path, fallback_count: int = 200) -> List[Dict]:
+    """Read order payloads from a JSONL file, falling back to synthetic orders."""
+    payloads = []
+    if path.exists():
+        with open(path) as payload_file:
+            for line in payload_file:
+                try:
+                    payload = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(payload, dict) and all(field in payload for field in ORDER_FIELDS):
+                    payloads.append(payload)
+    if not payloads:
+        print(f"No order payloads in {path}, using {fallback_count} synthetic orders", file=sys.stderr)
+        payloads = generate_orders(fallback_count, include_care_plan=False)
+    return payloads
+
+def mutate(payload: Dict, rng: random.Random, duplicate_ratio: float) -> Dict:
+    """Return a copy of a payload for a new patient. A duplicate_ratio share keep the original patient."""
+    order = {key: value for key, value in payload.items() if key != 'care_plan'}
+    if rng.random() >= duplicate_ratio:
+        order['patient_mrn'] = f"{rng.randrange(10 ** 6):06d}"
+        order['patient_last_name'] = f"{order.get('patient_last_name', 'Patient')}{rng.randrange(1000)}"
+        if rng.random() < 0.5:
+            order['medication'] = rng.choice(MEDICATIONS)
+    return order
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+class Recorder:
+    """Thread-safe collection of per-endpoint latencies and outcomes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.rejected = defaultdict(int)  # 429s: admission control turned the request away
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.lags = []  # Seconds sessions waited for a free worker after their scheduled arrival
+        self.completed_sessions = 0
+
+    def record(self, endpoint: str, latency: float, status: int, ok: bool):
+        with self._lock:
+            self.latencies[endpoint].append(latency)
+            self.statuses[endpoint][status] += 1
+            if status == 429:
+                self.rejected[endpoint] += 1
+            elif not ok:
+                self.errors[endpoint] += 1
+
+    def record_session(self, lag: float, completed: bool):
+        with self._lock:
+            self.lags.append(lag)
+            if completed:
+                self.completed_sessions += 1
+
+def post(base_url: str, endpoint: str, payload: Dict, timeout: float, recorder: Recorder, api_key: str):
+    request = urllib.request.Request(
+        f"{base_url}/care-plan/{endpoint}",
+        data=json.dumps(payload).encode('utf-8'),
+        headers={'Content-Type': 'application/json', 'X-API-Key': api_key},
+        method='POST'
+    )
+    start = time.perf_counter()
+    status, body = 0, None
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status = response.status
+            body = json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError, ValueError):
+        status = 0  # Connection refused, reset or timed out
+    latency = time.perf_counter() - start
+
+    # A 400 from validate is an expected outcome for invalid payloads, not a server error
+    ok = status == 200 or (endpoint == 'validate' and status == 400)
+    recorder.record(endpoint, latency, status, ok)
+    return status, body
+
+def run_session(base_url: str, order: Dict, scheduled: float, timeout: float, recorder: Recorder, api_key: str):
+    lag = time.perf_counter() - scheduled
+    status, body = post(base_url, 'validate', order, timeout, recorder, api_key)
+    if status != 200:
+        recorder.record_session(lag, False)
+        return
+    status, body = post(base_url, 'generate', body['sanitized_data'], timeout, recorder, api_key)
+    if status != 200:
+        recorder.record_session(lag, False)
+        return
+    status, _ = post(base_url, 'submit', body['full_order'], timeout, recorder, api_key)
+    recorder.record_session(lag, status == 200)
+
+def run_step(base_url: str, payloads: List[Dict], rate: float, duration: float, concurrency: int,
+             duplicate_ratio: float, timeout: float, rng: random.Random) -> Dict:
+    """Offer sessions at a Poisson arrival rate for duration seconds and summarize the outcome."""
+    recorder = Recorder()
+    started = time.perf_counter()
+    offered = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        next_arrival = started
+        while next_arrival - started < duration:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            order = mutate(rng.choice(payloads), rng, duplicate_ratio)
+            # One client per session, so the server's per-client rate limit isn't what's measured
+            api_key = f"load-test-{rate}-{offered}"
+            executor.submit(run_session, base_url, order, next_arrival, timeout, recorder, api_key)
+            offered += 1
+            next_arrival += rng.expovariate(rate)
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        latencies = sorted(recorder.latencies[endpoint])
+        count = len(latencies)
+        endpoints[endpoint] = {
+            'requests': count,
+            'throughput': round(count / elapsed, 2),
+            'error_rate': round(recorder.errors[endpoint] / count, 4) if count else None,
+            'rejected_rate': round(recorder.rejected[endpoint] / count, 4) if count else None,
+            'statuses': dict(recorder.statuses[endpoint]),
+            'p50': _round(percentile(latencies, 0.50)),
+            'p95': _round(percentile(latencies, 0.95)),
+            'p99': _round(percentile(latencies, 0.99)),
+        }
+    lags = sorted(recorder.lags)
+    return {
+        'offered_rate': rate,
+        'offered_sessions': offered,
+        'completed_sessions': recorder.completed_sessions,
+        'session_throughput': round(recorder.completed_sessions / elapsed, 2),
+        'elapsed': round(elapsed, 2),
+        'queue_lag_p95': _round(percentile(lags, 0.95)),
+        'endpoints': endpoints,
+    }
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 4) if value is not None else None
+
+def find_saturation(steps: List[Dict], slo: float, max_error_rate: float) -> Optional[Dict]:
+    """Return the first step that missed its offered rate, the p95 latency objective or the error budget."""
+    for step in steps:
+        reasons = []
+        if step['session_throughput'] < 0.9 * step['offered_rate']:
+            reasons.append('throughput below 90% of offered rate')
+        for endpoint, summary in step['endpoints'].items():
+            if summary['p95'] is not None and summary['p95'] > slo:
+                reasons.append(f'{endpoint} p95 above {slo}s')
+            if summary['error_rate'] is not None and summary['error_rate'] > max_error_rate:
+                reasons.append(f'{endpoint} error rate above {max_error_rate:.0%}')
+            if summary['rejected_rate'] is not None and summary['rejected_rate'] > max_error_rate:
+                reasons.append(f'{endpoint} 429 rate above {max_error_rate:.0%}')
+        if reasons:
+            return {'offered_rate': step['offered_rate'], 'reasons': reasons}
+    return None
+
+def print_step(step: Dict):
+    print(f"rate {step['offered_rate']}/s: {step['completed_sessions']}/{step['offered_sessions']} sessions completed, "
+          f"{step['session_throughput']}/s, queue lag p95 {step['queue_lag_p95']}s", file=sys.stderr)
+    print(f"  {'endpoint':<10}{'req':>7}{'req/s':>9}{'err':>8}{'429':>8}{'p50':>9}{'p95':>9}{'p99':>9}",
+          file=sys.stderr)
+    for endpoint, summary in step['endpoints'].items():
+        error_rate = f"{summary['error_rate']:.1%}" if summary['error_rate'] is not None else '-'
+        rejected_rate = f"{summary['rejected_rate']:.1%}" if summary['rejected_rate'] is not None else '-'
+        print(f"  {endpoint:<10}{summary['requests']:>7}{summary['throughput']:>9}{error_rate:>8}{rejected_rate:>8}"
+              f"{summary['p50'] or '-':>9}{summary['p95'] or '-':>9}{summary['p99'] or '-':>9}", file=sys.stderr)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8000', help='base URL of the running server')
+    parser.add_argument('--payloads', default=str(Path(__file__).parent.parent / 'requests.jsonl'),
+                        help='JSONL file of order payloads')
+    parser.add_argument('--rates', default='5', help='comma-separated session arrival rates per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per rate step')
+    parser.add_argument('--concurrency', type=int, default=32, help='maximum sessions in flight')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.05,
+                        help='share of replayed payloads that keep their original patient')
+    parser.add_argument('--timeout', type=float, default=60, help='per-request timeout in seconds')
+    parser.add_argument('--slo', type=float, default=5.0, help='p95 latency objective per endpoint in seconds')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON results to this file (default: stdout)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    payloads = load_payloads(Path(args.payloads))
+    base_url = args.url.rstrip('/')
+
+    steps = []
+    for rate in (float(rate) for rate in args.rates.split(',')):
+        step = run_step(base_url, payloads, rate, args.duration, args.concurrency,
+                        args.duplicate_ratio, args.timeout, rng)
+        print_step(step)
+        steps.append(step)
+
+    saturation = find_saturation(steps, args.slo, args.max_error_rate)
+    if saturation:
+        print(f"Saturated at {saturation['offered_rate']}/s: {'; '.join(saturation['reasons'])}", file=sys.stderr)
+
+    report = {
+        'url': base_url,
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'payloads': len(payloads),
+        'steps': steps,
+        'saturation': saturation,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""Micro-benchmarks for the store, validation, prompt and CSV export hot paths.
+
+Usage:
+    python benchmarks/run_benchmarks.py --orders 10000,100000 --output results.json
+    python benchmarks/run_benchmarks.py --orders 10000 --baseline baseline.json --threshold 0.15
+    python benchmarks/run_benchmarks.py --orders 10000 --output baseline.json   # record a new baseline
+
+The PostgreSQL backend is benchmarked when BENCHMARK_DATABASE_URL is set. Use a scratch database:
+the benchmark inserts every synthetic order.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.csv_generator import CSVGenerator
+from app.in_memory_data_store import InMemoryDataStore
+from app.input_validations import InputHandler
+from app.prompt import generate_prompt
+from synthetic import generate_orders
+
+DEFAULT_THRESHOLD = 0.15
+LOOKUP_COUNT = 10000      # check_duplicate_order calls per run
+SAMPLE_COUNT = 2000       # Orders pushed through validation and prompt generation per run
+MEMORY_SAMPLE = 2000      # Operations traced with tracemalloc per benchmark
+
+def create_backends(order_count: int) -> Dict[str, Callable]:
+    """Return factories for the store backends available in this environment."""
+    backends = {'memory': InMemoryDataStore}
+    database_url = os.environ.get('BENCHMARK_DATABASE_URL')
+    if database_url:
+        from app.postgres_data_store import PostgreSQLDataStore
+        backends['postgres'] = lambda: PostgreSQLDataStore(database_url)
+    return backends
+
+def measure(run: Callable[[int], None], ops: int, memory: bool) -> Dict:
+    """Time ops operations, then trace the peak memory of a smaller run."""
+    start = time.perf_counter()
+    run(ops)
+    seconds = time.perf_counter() - start
+    result = {'ops': ops, 'seconds': round(seconds, 4),
+              'ops_per_second': round(ops / seconds, 1) if seconds else None}
+
+    if memory:
+        # tracemalloc slows allocation down, so it is kept out of the timed run
+        sample = min(ops, MEMORY_SAMPLE)
+        tracemalloc.start()
+        try:
+            run(sample)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result['peak_memory_bytes'] = peak
+        result['peak_memory_bytes_per_op'] = round(peak / sample, 1)
+    return result
+
+def bench_backend(backend: str, create_store: Callable, orders: List[Dict], memory: bool) -> List[Dict]:
+    results = []
+    rng = random.Random(1)
+
+    def record(benchmark: str, run: Callable[[int], None], ops: int):
+        result = {'benchmark': f'{backend}.{benchmark}', 'orders': len(orders)}
+        result.update(measure(run, ops, memory))
+        results.append(result)
+        print(f"  {result['benchmark']:<40}{result['ops_per_second'] or 0:>14,.0f} ops/s", file=sys.stderr)
+
+    # Loading: every order goes through add_order once; the memory pass uses a throwaway store
+    store = None
+
+    def add_orders(count: int):
+        nonlocal store
+        target = create_store()
+        for order in orders[:count]:
+            target.add_order(dict(order))
+        if store is None:
+            store = target
+
+    record('add_order', add_orders, len(orders))
+
+    # Duplicate checks: half the lookups hit an existing (MRN, medication) pair, half miss
+    lookups = []
+    for i in range(LOOKUP_COUNT):
+        order = rng.choice(orders)
+        medication = order['medication'] if i % 2 == 0 else f"Unlisted drug {i}"
+        lookups.append((order['patient_mrn'], medication))
+
+    def check_duplicates(count: int):
+        for i in range(count):
+            store.check_duplicate_order(*lookups[i % LOOKUP_COUNT])
+
+    record('check_duplicate_order', check_duplicates, LOOKUP_COUNT)
+
+    # CSV export of the whole store; one op is one order written
+    exported = store.export_orders()
+
+    def write_csv(count: int):
+        CSVGenerator().write_data(exported[:count])
+
+    record('csv.write_data', write_csv, len(exported))
+    return results
+
+def bench_request_path(orders: List[Dict], memory: bool) -> List[Dict]:
+    """Benchmark the backend-independent request path: input validation and prompt generation."""
+    sample = [dict(order) for order in orders[:SAMPLE_COUNT]]
+    results = []
+
+    def validate(count: int):
+        for i in range(count):
+            data = InputHandler.sanitize_input(sample[i % len(sample)])
+            InputHandler.validate_input(data)
+
+    def prompts(count: int):
+        for i in range(count):
+            generate_prompt(sample[i % len(sample)])
+
+    for benchmark, run in (('input.validate_input', validate), ('prompt.generate_prompt', prompts)):
+        result = {'benchmark': benchmark, 'orders': len(orders)}
+        result.update(measure(run, len(sample), memory))
+        results.append(result)
+        print(f"  {benchmark:<40}{result['ops_per_second'] or 0:>14,.0f} ops/s", file=sys.stderr)
+    return results
+
+def compare(results: List[Dict], baseline: List[Dict], threshold: float) -> List[str]:
+    """Return a description of every benchmark that regressed beyond the threshold."""
+    previous = {(r['benchmark'], r['orders']): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['benchmark'], result['orders']))
+        if before is None:
+            continue
+        name = f"{result['benchmark']} @ {result['orders']} orders"
+        if before.get('ops_per_second') and result.get('ops_per_second') is not None:
+            change = result['ops_per_second'] / before['ops_per_second'] - 1
+            result['throughput_change'] = round(change, 4)
+            if change < -threshold:
+                regressions.append(f"{name}: throughput {change:+.1%} "
+                                   f"({before['ops_per_second']:,.0f} -> {result['ops_per_second']:,.0f} ops/s)")
+        if before.get('peak_memory_bytes') and result.get('peak_memory_bytes') is not None:
+            change = result['peak_memory_bytes'] / before['peak_memory_bytes'] - 1
+            result['memory_change'] = round(change, 4)
+            if change > threshold:
+                regressions.append(f"{name}: peak memory {change:+.1%} "
+                                   f"({before['peak_memory_bytes']:,} -> {result['peak_memory_bytes']:,} bytes)")
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', default='10000', help='comma-separated order counts (10k-1M)')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1,
+                        help='share of orders repeating an earlier patient and medication')
+    parser.add_argument('--backends', help='comma-separated backends to run (default: all available)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc passes')
+    parser.add_argument('--output', help='write JSON results to this file (default: stdout)')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed relative regression before failing (default: 0.15)')
+    args = parser.parse_args()
+
+    order_counts = [int(count) for count in args.orders.split(',')]
+    results = []
+    for order_count in order_counts:
+        print(f"{order_count:,} orders (duplicate ratio {args.duplicate_ratio}):", file=sys.stderr)
+        orders = generate_orders(order_count, args.duplicate_ratio)
+        backends = create_backends(order_count)
+        selected = args.backends.split(',') if args.backends else list(backends)
+        for backend in selected:
+            if backend not in backends:
+                parser.error(f"backend {backend!r} is not available")
+            results.extend(bench_backend(backend, backends[backend], orders, not args.no_memory))
+        results.extend(bench_request_path(orders, not args.no_memory))
+
+    regressions: Optional[List[str]] = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file)['results'], args.threshold)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'duplicate_ratio': args.duplicate_ratio,
+            'threshold': args.threshold,
+        },
+        'results': results,
+    }
+    if regressions is not None:
+        report['regressions'] = regressions
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+    if regressions:
+        print("Regressions beyond threshold:", file=sys.stderr)
+        for regression in regressions:
+            print(f"  {regression}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
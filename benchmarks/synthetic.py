@@ -0,0 +1,104 @@
+"""Synthetic order generator with realistic field sizes for benchmarks and load tests."""
+import random
+from typing import Dict, Iterator, List
+
+MEDICATIONS = [
+    'IVIG', 'Rituximab', 'Eculizumab', 'Prednisone', 'Methotrexate', 'Infliximab', 'Ocrelizumab',
+    'Natalizumab', 'Tocilizumab', 'Adalimumab', 'Warfarin', 'Apixaban', 'Enoxaparin', 'Vancomycin',
+]
+DIAGNOSES = [
+    'Generalized myasthenia gravis', 'Chronic inflammatory demyelinating polyneuropathy',
+    'Rheumatoid arthritis', 'Relapsing multiple sclerosis', 'Deep vein thrombosis',
+    'Neuromyelitis optica spectrum disorder', 'Crohn disease', 'Primary immunodeficiency',
+]
+FIRST_NAMES = ['Alex', 'Jordan', 'Sam', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn']
+LAST_NAMES = ['Smith', 'Garcia', 'Nguyen', 'Patel', 'Kim', 'Johnson', 'Brown', 'Lopez', 'Chen', 'Davis']
+
+CLINICAL_SENTENCES = [
+    "Vitals: BP 128/78, HR 78, RR 16, SpO2 98% RA, Temp 36.7C.",
+    "Labs: CBC WNL; BMP: Na 138, K 4.1, Cl 101, HCO3 24, BUN 12, SCr 0.78, eGFR >90 mL/min/1.73m2.",
+    "Exam: bilateral ptosis, fatigable proximal weakness (4/5), no respiratory distress.",
+    "Baseline FVC 2.8 L (predicted 4.0 L; ~70% predicted).",
+    "Patient reports improvement in speech and proximal strength with fewer fatigability episodes.",
+    "No thrombotic events or renal issues reported since last visit.",
+    "Premedicated with acetaminophen 650 mg PO and diphenhydramine 25 mg PO 30 minutes pre-infusion.",
+    "Infusion started at 0.5 mL/kg/hr for 30 minutes then titrated per tolerance.",
+    "Transient mild headache at 2 hours resolved after slowing the infusion rate.",
+    "Neurology follow-up in 4 weeks to consider repeat course versus thymectomy timing.",
+]
+CARE_PLAN_SECTIONS = [
+    "Problem list / Drug therapy problems (DTPs)",
+    "Goals (SMART)",
+    "Pharmacist interventions / plan",
+    "Monitoring plan & lab schedule",
+]
+
+# Long texts are drawn from a fixed pool and shared between orders, so a million orders don't need
+# a million distinct multi-KB strings in memory
+TEXT_POOL_SIZE = 64
+
+def _paragraph(rng: random.Random, min_chars: int, max_chars: int) -> str:
+    target = rng.randint(min_chars, max_chars)
+    sentences = []
+    length = 0
+    while length < target:
+        sentence = rng.choice(CLINICAL_SENTENCES)
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return "\n".join(sentences)
+
+def _care_plan(rng: random.Random) -> str:
+    sections = []
+    for number, title in enumerate(CARE_PLAN_SECTIONS, start=1):
+        sections.append(f"{number}. {title}\n" + "\n".join(
+            f"  - {sentence}" for sentence in rng.sample(CLINICAL_SENTENCES, rng.randint(4, 8))
+        ))
+    return "\n\n".join(sections * 2)
+
+def build_text_pool(seed: int = 0) -> Dict[str, List[str]]:
+    """Build pools of patient records (2-6 KB), medication histories and care plans (4-8 KB)."""
+    rng = random.Random(seed)
+    return {
+        'patient_records': [_paragraph(rng, 2000, 6000) for _ in range(TEXT_POOL_SIZE)],
+        'medication_history': [_paragraph(rng, 150, 500) for _ in range(TEXT_POOL_SIZE)],
+        'care_plan': [_care_plan(rng) for _ in range(TEXT_POOL_SIZE)],
+    }
+
+def iter_orders(count: int, duplicate_ratio: float = 0.1, seed: int = 0,
+                include_care_plan: bool = True) -> Iterator[Dict]:
+    """Yield synthetic orders. A duplicate_ratio share of them repeat an earlier (MRN, medication) pair."""
+    rng = random.Random(seed)
+    pool = build_text_pool(seed)
+    patient_count = max(count // 3, 1)
+    provider_count = max(count // 50, 1)
+    previous = []
+
+    for i in range(count):
+        if previous and rng.random() < duplicate_ratio:
+            mrn_index, medication = rng.choice(previous)
+        else:
+            mrn_index, medication = rng.randrange(patient_count), rng.choice(MEDICATIONS)
+            if len(previous) < 100000:
+                previous.append((mrn_index, medication))
+
+        provider_index = rng.randrange(provider_count)
+        order = {
+            'patient_first_name': FIRST_NAMES[mrn_index % len(FIRST_NAMES)],
+            'patient_last_name': f"{LAST_NAMES[(mrn_index // len(FIRST_NAMES)) % len(LAST_NAMES)]}{mrn_index}",
+            'patient_mrn': f"{mrn_index % 10 ** 6:06d}",
+            'provider_name': f"Dr. Provider {provider_index}",
+            'provider_npi': f"{1000000000 + provider_index}",
+            'primary_diagnosis': DIAGNOSES[mrn_index % len(DIAGNOSES)],
+            'medication': medication,
+            'additional_diagnoses': 'Hypertension (well controlled), GERD',
+            'medication_history': rng.choice(pool['medication_history']),
+            'patient_records': rng.choice(pool['patient_records']),
+        }
+        if include_care_plan:
+            order['care_plan'] = rng.choice(pool['care_plan'])
+        yield order
+
+def generate_orders(count: int, duplicate_ratio: float = 0.1, seed: int = 0,
+                    include_care_plan: bool = True) -> List[Dict]:
+    """Return a list of synthetic orders."""
+    return list(iter_orders(count, duplicate_ratio, seed, include_care_plan))
@@ -0,0 +1,26 @@
+"""Gunicorn settings, loaded automatically by `gunicorn server:app`."""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Each open server-sent event stream holds a thread, STREAM_MAX_CONNECTIONS of them at most
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+# Importing the app has no side effects, so load it once in the master and fork workers from a warm interpreter
+preload_app = True
+
+def on_starting(server):
+    # Metrics files left by an earlier run would add its counts to this one's
+    from app.metrics import REGISTRY
+    REGISTRY.clear()
+
+def when_ready(server):
+    # Import heavy modules once, before the first fork, so workers don't each pay for it
+    from app.factory import preload_modules
+    preload_modules(server.app.wsgi())
+
+def post_fork(server, worker):
+    # Connection pools and API clients are created in each worker, never shared across a fork
+    from app.factory import init_worker
+    init_worker(worker.app.wsgi())
@@ -1,7 +1,8 @@
 // App State variables
 const AppState = {
     currentCarePlan: '',
-    statsRefreshInterval: null
+    statsRefreshInterval: null,
+    statsStream: null
 };
 
 // DOM elements
@@ -95,9 +96,10 @@ const APIClient = {
 
     // submit order API call
     async submitOrder(order) {
+        // The response body isn't used on success, so skip echoing the care plan back
         const response = await fetch('/care-plan/submit', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'Prefer': 'return=minimal' },
             body: JSON.stringify(order)
         });
 
@@ -266,6 +268,39 @@ const StatsManager = {
         }
     },
 
+    // subscribe to server-pushed stats, falling back to polling if streaming isn't available
+    startStream(fallbackIntervalMs = 5000) {
+        if (!window.EventSource) {
+            this.startAutoRefresh(fallbackIntervalMs);
+            return;
+        }
+
+        this.stopStream();
+        const stream = new EventSource('/care-plan/stats/stream');
+        stream.onmessage = (event) => UI.updateStats(JSON.parse(event.data));
+        stream.onerror = () => {
+            // stop streaming and poll instead if the connection can't be (re)established
+            if (stream.readyState === EventSource.CLOSED) {
+                this.stopStream();
+                this.startAutoRefresh(fallbackIntervalMs);
+            }
+        };
+        AppState.statsStream = stream;
+    },
+
+    // closes the stats stream
+    stopStream() {
+        if (AppState.statsStream) {
+            AppState.statsStream.close();
+            AppState.statsStream = null;
+        }
+    },
+
+    // whether stats are currently pushed by the server
+    isStreaming() {
+        return AppState.statsStream !== null;
+    },
+
     // creates interval that calls load function every intervalMs milliseconds
     startAutoRefresh(intervalMs = 2000) {
         this.stopAutoRefresh();
@@ -426,7 +461,9 @@ const EventHandlers = {
             const fullOrder = await CarePlanService.generateCarePlan(sanitizedData);
             if (fullOrder) {
                 await CarePlanService.submitOrder(fullOrder);
-                await StatsManager.load();
+                if (!StatsManager.isStreaming()) {
+                    await StatsManager.load();
+                }
             }
         }
         
@@ -451,10 +488,10 @@ const EventHandlers = {
 };
 
 function initializeApp() {
-    // initialize stats and setup fetch stats auto-refresh
+    // initialize stats and subscribe to stats updates
     UI.setStatsLoading();
     StatsManager.load();
-    StatsManager.startAutoRefresh(5000);
+    StatsManager.startStream(5000);
 
     // Register event listeners
     DOM.validateBtn().addEventListener('click', EventHandlers.handleValidate);
@@ -465,6 +502,7 @@ function initializeApp() {
 
     // Clean up on page unload
     window.addEventListener('beforeunload', () => {
+        StatsManager.stopStream();
         StatsManager.stopAutoRefresh();
     });
 }
@@ -0,0 +1,146 @@
+import pytest
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest.mock import MagicMock
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.admission import AdmissionController, FairSemaphore, client_identity, refill_tokens
+from app.in_memory_data_store import InMemoryDataStore
+
+class TestRefillTokens:
+
+    def test_refill_is_capped_at_capacity(self):
+        """Test buckets refill at the given rate up to their capacity."""
+        assert refill_tokens(1, 2, capacity=5, refill_rate=0.5) == 2
+        assert refill_tokens(4, 100, capacity=5, refill_rate=0.5) == 5
+
+class TestClientIdentity:
+
+    def test_api_key_is_hashed(self):
+        """Test clients with an API key are keyed by its hash, others by IP."""
+        identity = client_identity('secret-key', '10.0.0.1')
+
+        assert identity.startswith('key:')
+        assert 'secret-key' not in identity
+        assert client_identity(None, '10.0.0.1') == 'ip:10.0.0.1'
+
+class TestFairSemaphore:
+
+    def test_rejects_when_full_and_not_waiting(self):
+        """Test a full semaphore rejects immediately without a timeout."""
+        semaphore = FairSemaphore(1, max_waiters=4)
+
+        assert semaphore.acquire(0)
+        assert not semaphore.acquire(0)
+        semaphore.release()
+        assert semaphore.acquire(0)
+
+    def test_waiters_are_served_in_arrival_order(self):
+        """Test freed slots go to the longest-waiting request."""
+        semaphore = FairSemaphore(1, max_waiters=4)
+        semaphore.acquire(0)
+        order = []
+
+        def wait(name):
+            if semaphore.acquire(5):
+                order.append(name)
+                semaphore.release()
+
+        threads = []
+        for name in ('first', 'second', 'third'):
+            thread = threading.Thread(target=wait, args=(name,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.05)
+        semaphore.release()
+        for thread in threads:
+            thread.join()
+
+        assert order == ['first', 'second', 'third']
+
+    def test_queue_length_is_bounded(self):
+        """Test requests beyond the waiter limit are rejected instead of queued."""
+        semaphore = FairSemaphore(1, max_waiters=0)
+        semaphore.acquire(0)
+
+        assert not semaphore.acquire(1)
+
+class TestAdmissionController:
+
+    def create_controller(self, store=None, capacity=2, refill_rate=0.001, max_concurrency=1, max_wait=0):
+        return AdmissionController(store or InMemoryDataStore(), capacity, refill_rate, max_concurrency,
+                                   max_wait, max_queue=4)
+
+    def test_rate_limits_each_client(self):
+        """Test a client is rejected with a retry delay once its bucket is empty, without affecting others."""
+        controller = self.create_controller(max_concurrency=10)
+
+        assert controller.acquire('generate', 'ip:1').admitted
+        assert controller.acquire('generate', 'ip:1').admitted
+        decision = controller.acquire('generate', 'ip:1')
+
+        assert not decision.admitted
+        assert decision.reason == 'rate_limited'
+        assert decision.retry_after > 0
+        assert controller.acquire('generate', 'ip:2').admitted
+
+    def test_rejects_when_all_slots_are_busy(self):
+        """Test requests are rejected as overloaded when no LLM slot frees up in time."""
+        controller = self.create_controller(capacity=10)
+
+        assert controller.acquire('generate', 'ip:1').admitted
+        decision = controller.acquire('generate', 'ip:2')
+        assert decision.reason == 'overloaded'
+
+        controller.release()
+        assert controller.acquire('generate', 'ip:2').admitted
+
+    def test_overloaded_requests_keep_their_tokens(self):
+        """Test a request rejected for want of a slot doesn't spend one of the client's tokens."""
+        controller = self.create_controller(capacity=1)
+
+        assert controller.acquire('generate', 'ip:1').admitted
+        assert controller.acquire('generate', 'ip:2').reason == 'overloaded'
+        assert controller.acquire('generate', 'ip:2').reason == 'overloaded'
+
+        controller.release()
+        assert controller.acquire('generate', 'ip:2').admitted
+
+    def test_rate_limited_requests_are_rejected_at_once(self):
+        """Test a client with an empty bucket is rejected without waiting and without keeping its slot."""
+        controller = self.create_controller(capacity=1, refill_rate=1, max_wait=5)
+        assert controller.acquire('generate', 'ip:1').admitted
+        controller.release()
+
+        started = time.perf_counter()
+        decision = controller.acquire('generate', 'ip:1')
+
+        assert decision.reason == 'rate_limited'
+        assert 0 < decision.retry_after <= 1
+        assert time.perf_counter() - started < 0.5
+        assert controller.slots.in_use == 0
+
+    def test_rate_limited_requests_never_queue(self):
+        """Test a client over its limit is turned away before queueing for a slot, leaving the queue to others."""
+        controller = self.create_controller(capacity=1, refill_rate=0.001, max_concurrency=1, max_wait=5)
+        assert controller.acquire('generate', 'ip:2').admitted
+        controller.release()
+        assert controller.acquire('generate', 'ip:1').admitted
+
+        started = time.perf_counter()
+        decision = controller.acquire('generate', 'ip:2')
+
+        assert decision.reason == 'rate_limited'
+        assert time.perf_counter() - started < 0.5
+        assert not controller.slots._waiters
+
+    def test_fails_open_when_limiter_store_errors(self):
+        """Test requests are admitted when the shared limiter state can't be reached."""
+        store = MagicMock()
+        store.consume_rate_limit.side_effect = Exception("connection refused")
+        controller = self.create_controller(store=store)
+
+        assert controller.acquire('generate', 'ip:1').admitted
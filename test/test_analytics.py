@@ -0,0 +1,53 @@
+import pytest
+import sys
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.analytics import DailyAggregates, bucket_start, validate_bucket
+
+def make_order(timestamp, medication='IVIG', npi='1', diagnosis='Myasthenia gravis'):
+    return {'timestamp': timestamp, 'medication': medication, 'provider_npi': npi, 'primary_diagnosis': diagnosis}
+
+class TestDailyAggregates:
+
+    def test_bucket_start(self):
+        """Test days are mapped to the first day of their bucket."""
+        day = date(2025, 1, 8)  # Wednesday
+        assert bucket_start(day, 'day') == day
+        assert bucket_start(day, 'week') == date(2025, 1, 6)
+        assert bucket_start(day, 'month') == date(2025, 1, 1)
+
+    def test_validate_bucket_rejects_unknown_bucket(self):
+        """Test unsupported bucket names raise ValueError."""
+        with pytest.raises(ValueError, match="bucket must be one of"):
+            validate_bucket('year')
+
+    def test_query_buckets_and_breakdowns(self):
+        """Test querying aggregates groups days into buckets and ranks breakdowns."""
+        aggregates = DailyAggregates()
+        aggregates.record(make_order('2025-01-06T09:00:00', medication='IVIG'))
+        aggregates.record(make_order('2025-01-07T09:00:00', medication='IVIg 10%', npi='2'))
+        aggregates.record(make_order('2025-01-14T09:00:00', medication='Rituximab', diagnosis='CIDP'))
+
+        result = aggregates.query(bucket='week')
+        assert result['total_orders'] == 3
+        assert result['series'] == [
+            {'period': '2025-01-06', 'orders': 2},
+            {'period': '2025-01-13', 'orders': 1}
+        ]
+        assert result['by_medication'] == [{'key': 'ivig', 'count': 2}, {'key': 'rituximab', 'count': 1}]
+        assert result['by_provider'][0] == {'key': '1', 'count': 2}
+        assert result['top_diagnoses'][0] == {'key': 'myasthenia gravis', 'count': 2}
+
+    def test_query_date_range_and_top_n(self):
+        """Test querying only counts days in [start_date, end_date) and limits breakdowns."""
+        aggregates = DailyAggregates()
+        aggregates.record(make_order('2025-01-06T09:00:00', medication='IVIG'))
+        aggregates.record(make_order('2025-01-07T09:00:00', medication='Aspirin'))
+        aggregates.record(make_order('2025-01-08T09:00:00', medication='Warfarin'))
+
+        result = aggregates.query('2025-01-07T00:00:00', '2025-01-08T00:00:00', top_n=1)
+        assert result['total_orders'] == 1
+        assert result['by_medication'] == [{'key': 'aspirin', 'count': 1}]
@@ -0,0 +1,228 @@
+import asyncio
+import gzip
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.asgi import create_asgi_app, wsgi_environ
+
+ORDER = {
+    'patient_mrn': '123456', 'patient_first_name': 'Jane', 'patient_last_name': 'Doe',
+    'provider_npi': '1234567893', 'provider_name': 'Dr. Smith', 'medication': 'IVIG',
+    'primary_diagnosis': 'G70.00', 'additional_diagnoses': '', 'medication_history': '',
+    'patient_records': 'records', 'care_plan': 'plan',
+}
+
+def call(app, method, path, body=b'', headers=(), query=b''):
+    """Run one request through the ASGI app. Returns the status, headers and body."""
+    async def run():
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(3600)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': query, 'http_version': '1.1',
+            'headers': [(k.lower().encode(), v.encode()) for k, v in headers], 'client': ('127.0.0.1', 5000),
+            'server': ('testserver', 80), 'scheme': 'http', 'root_path': '',
+        }
+        await app(scope, receive, send)
+        return sent
+
+    sent = asyncio.run(run())
+    start = sent[0]
+    return (
+        start['status'],
+        {k.decode(): v.decode() for k, v in start['headers']},
+        b''.join(message.get('body', b'') for message in sent[1:])
+    )
+
+def stream(app, path, chunks, query=b'', during=None):
+    """Open an event stream through the ASGI app and disconnect once it has sent the given number of body chunks.
+    during, if given, is called on the event loop's thread once the stream is open. Returns the status, headers,
+    the chunks, and whether the stream's slot was given back."""
+    async def run():
+        sent = []
+        enough = asyncio.Event()
+
+        async def receive():
+            await enough.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if message['type'] == 'http.response.start' and during is not None:
+                during()
+            if len([m for m in sent if m.get('body')]) >= chunks:
+                enough.set()
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': query, 'http_version': '1.1',
+            'headers': [], 'client': ('127.0.0.1', 5000), 'server': ('testserver', 80), 'scheme': 'http',
+        }
+        await asyncio.wait_for(app(scope, receive, send), 5)
+        return sent
+
+    sent = asyncio.run(run())
+    start = sent[0]
+    bodies = [message['body'] for message in sent[1:] if message.get('body')]
+    return start['status'], {k.decode(): v.decode() for k, v in start['headers']}, bodies, \
+        app.resources.stream_slots.in_use == 0
+
+class TestAsgiApp:
+
+    def setup_method(self):
+        self.app = create_asgi_app({
+            'DATABASE_URL': None, 'CARE_PLAN_GENERATOR': 'offline', 'RATE_LIMIT_BURST': 0,
+        })
+
+    def test_submit_then_stats(self):
+        """Test an order submitted through the native route shows up in the stats."""
+        status, _, body = call(self.app, 'POST', '/care-plan/submit', json.dumps(ORDER).encode(),
+                               [('Content-Type', 'application/json')])
+        assert status == 200
+        assert json.loads(body)['full_order']['care_plan'] == 'plan'
+
+        status, headers, body = call(self.app, 'GET', '/care-plan/stats')
+        assert status == 200
+        assert json.loads(body)['total_orders'] == 1
+        assert headers['cache-control'] == 'no-cache, no-store, must-revalidate'
+
+    def test_submit_with_minimal_response(self):
+        """Test Prefer: return=minimal leaves out the echoed large fields."""
+        status, headers, body = call(self.app, 'POST', '/care-plan/submit', json.dumps(ORDER).encode(),
+                                     [('Prefer', 'return=minimal')])
+
+        assert status == 200
+        assert 'care_plan' not in json.loads(body)['full_order']
+        assert headers['preference-applied'] == 'return=minimal'
+
+    def test_validate_rejects_invalid_input(self):
+        """Test validation errors return 400 like the Flask route."""
+        status, _, body = call(self.app, 'POST', '/care-plan/validate', json.dumps({**ORDER, 'patient_mrn': 'x'}).encode())
+
+        assert status == 400
+        assert json.loads(body)['errors']
+
+    def test_generate_uses_async_generator(self):
+        """Test the generate route awaits the async offline generator."""
+        self.app.resources.care_plan_generator.latency = 0
+
+        status, _, body = call(self.app, 'POST', '/care-plan/generate', json.dumps(ORDER).encode())
+
+        assert status == 200
+        assert 'Offline stand-in' in json.loads(body)['full_order']['care_plan']
+
+    def test_generate_rejected_when_overloaded(self):
+        """Test generate returns 429 with Retry-After when no LLM slot frees up in time."""
+        self.app.flask_app.config.update({'ASYNC_LLM_MAX_CONCURRENCY': 0, 'ADMISSION_MAX_WAIT': 0})
+
+        status, headers, _ = call(self.app, 'POST', '/care-plan/generate', json.dumps(ORDER).encode())
+
+        assert status == 429
+        assert int(headers['retry-after']) >= 1
+
+    def test_large_responses_are_compressed(self):
+        """Test native responses are gzipped when the client accepts it."""
+        order = {**ORDER, 'patient_records': 'x' * 4096}
+
+        _, headers, body = call(self.app, 'POST', '/care-plan/submit', json.dumps(order).encode(),
+                                [('Accept-Encoding', 'gzip')])
+
+        assert headers['content-encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(body))['full_order']['patient_records'] == 'x' * 4096
+
+    def test_other_routes_go_through_flask(self):
+        """Test routes without a native handler are served by the Flask app."""
+        call(self.app, 'POST', '/care-plan/submit', json.dumps(ORDER).encode())
+
+        status, _, body = call(self.app, 'GET', '/care-plan/orders/list', query=b'limit=5')
+
+        assert status == 200
+        assert len(json.loads(body)['orders']) == 1
+
+    def test_unknown_route_returns_404(self):
+        """Test the Flask app's 404 is passed through."""
+        status, _, _ = call(self.app, 'GET', '/missing')
+
+        assert status == 404
+
+    def test_change_stream_is_served_natively(self):
+        """Test the change stream runs as a coroutine, sending the backlog and then broadcast orders."""
+        call(self.app, 'POST', '/care-plan/submit', json.dumps(ORDER).encode())
+        store = self.app.flask_app.extensions['care_plan'].store
+        self.app.executor.shutdown()
+
+        status, headers, bodies, released = stream(
+            self.app, '/care-plan/changes/stream', 3,
+            during=lambda: store.add_order({**ORDER, 'medication': 'Rituximab'})
+        )
+
+        assert status == 200
+        assert headers['content-type'] == 'text/event-stream; charset=utf-8'
+        assert bodies[0] == b': connected\n\n'
+        assert b'IVIG' in bodies[1]
+        assert b'Rituximab' in bodies[2]
+        assert released
+
+    def test_stats_stream_is_served_natively(self):
+        """Test the stats stream pushes the current stats without the Flask thread pool."""
+        self.app.executor.shutdown()
+
+        status, _, bodies, released = stream(self.app, '/care-plan/stats/stream', 1)
+
+        assert status == 200
+        assert json.loads(bodies[0].decode()[len('data: '):])['total_orders'] == 0
+        assert released
+
+    def test_streams_beyond_the_limit_get_503(self):
+        """Test streams past ASYNC_STREAM_MAX_CONNECTIONS are refused, and bad cursors give their slot back."""
+        self.app.flask_app.config['ASYNC_STREAM_MAX_CONNECTIONS'] = 0
+        status, headers, _ = call(self.app, 'GET', '/care-plan/stats/stream')
+        assert status == 503
+        assert headers['retry-after'] == '5'
+
+        self.app = create_asgi_app({'DATABASE_URL': None, 'CARE_PLAN_GENERATOR': 'offline'})
+        status, _, _ = call(self.app, 'GET', '/care-plan/changes/stream', query=b'after=bad')
+        assert status == 400
+        assert self.app.resources.stream_slots.in_use == 0
+
+    def test_lifespan_startup_and_shutdown(self):
+        """Test the lifespan protocol initializes and closes the worker's resources."""
+        async def run():
+            messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+            sent = []
+
+            async def receive():
+                return messages.pop(0)
+
+            async def send(message):
+                sent.append(message['type'])
+
+            await self.app({'type': 'lifespan'}, receive, send)
+            return sent
+
+        assert asyncio.run(run()) == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+
+class TestWsgiEnviron:
+
+    def test_headers_and_query(self):
+        """Test the environ carries the path, query string and headers of the scope."""
+        environ = wsgi_environ({
+            'method': 'GET', 'path': '/care-plan/orders', 'query_string': b'since=3',
+            'headers': [(b'content-type', b'application/json'), (b'x-api-key', b'a'), (b'x-api-key', b'b')],
+        }, b'{}')
+
+        assert environ['PATH_INFO'] == '/care-plan/orders'
+        assert environ['QUERY_STRING'] == 'since=3'
+        assert environ['CONTENT_TYPE'] == 'application/json'
+        assert environ['CONTENT_LENGTH'] == '2'
+        assert environ['HTTP_X_API_KEY'] == 'a,b'
@@ -0,0 +1,159 @@
+import asyncio
+import pytest
+import sys
+import threading
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+sys.modules['psycopg'] = Mock()
+sys.modules['psycopg.rows'] = Mock()
+
+from app.admission import AsyncFairSemaphore
+from app.async_data_store import AsyncInMemoryDataStore
+from app.async_postgres_data_store import AsyncPostgreSQLDataStore
+from app.in_memory_data_store import InMemoryDataStore
+
+ORDER = {
+    'patient_mrn': '123456', 'patient_first_name': 'Jane', 'patient_last_name': 'Doe',
+    'provider_npi': '1234567893', 'provider_name': 'Dr. Smith', 'medication': 'IVIG',
+    'primary_diagnosis': 'G70.00', 'additional_diagnoses': '', 'medication_history': '',
+    'patient_records': 'records', 'care_plan': 'plan',
+}
+
+class TestAsyncInMemoryDataStore:
+
+    def setup_method(self):
+        self.sync_store = InMemoryDataStore()
+        self.store = AsyncInMemoryDataStore(self.sync_store)
+
+    def test_shares_data_with_sync_store(self):
+        """Test writes through the async view are visible to the sync store and the reverse."""
+        async def scenario():
+            await self.store.add_patient('123456', 'Jane', 'Doe')
+            await self.store.add_provider('1234567893', 'Dr. Smith')
+            await self.store.add_order(dict(ORDER))
+            return await self.store.get_stats()
+
+        stats = asyncio.run(scenario())
+
+        assert stats == self.sync_store.get_stats()
+        assert stats['total_orders'] == 1
+
+    def test_validate_order_reports_duplicate(self):
+        """Test validate_order warns about an identical order added through the sync store."""
+        self.sync_store.add_patient('123456', 'Jane', 'Doe')
+        self.sync_store.add_provider('1234567893', 'Dr. Smith')
+        self.sync_store.add_order(dict(ORDER))
+
+        warnings = asyncio.run(self.store.validate_order(dict(ORDER)))
+
+        assert warnings == self.sync_store.validate_order(dict(ORDER))
+        assert len(warnings) == 1
+
+    def test_get_changes_times_out_without_orders(self):
+        """Test get_changes returns no orders once the timeout passes."""
+        assert asyncio.run(self.store.get_changes(None, 10, 0.05)) == []
+
+    def test_get_changes_wakes_up_on_new_order(self):
+        """Test a waiting get_changes returns an order added from another thread."""
+        threading.Timer(0.05, self.sync_store.add_order, args=(dict(ORDER),)).start()
+
+        changes = asyncio.run(self.store.get_changes(None, 10, 5))
+
+        assert [change.order['order_id'] for change in changes] == [1]
+
+class TestAsyncFairSemaphore:
+
+    def test_waiters_are_served_in_arrival_order(self):
+        """Test freed slots go to waiters in the order they arrived."""
+        async def scenario():
+            slots = AsyncFairSemaphore(1, 10)
+            assert await slots.acquire(0)
+            served = []
+
+            async def waiter(name):
+                await slots.acquire(1)
+                served.append(name)
+                slots.release()
+
+            tasks = [asyncio.ensure_future(waiter(name)) for name in ('a', 'b', 'c')]
+            await asyncio.sleep(0)
+            slots.release()
+            await asyncio.gather(*tasks)
+            return served, slots.in_use
+
+        assert asyncio.run(scenario()) == (['a', 'b', 'c'], 0)
+
+    def test_acquire_times_out_and_leaves_queue(self):
+        """Test a waiter that times out doesn't take the next freed slot."""
+        async def scenario():
+            slots = AsyncFairSemaphore(1, 10)
+            await slots.acquire(0)
+            acquired = await slots.acquire(0.01)
+            slots.release()
+            return acquired, slots.in_use
+
+        assert asyncio.run(scenario()) == (False, 0)
+
+    def test_full_queue_rejects_immediately(self):
+        """Test acquire fails without waiting when the queue is full."""
+        async def scenario():
+            slots = AsyncFairSemaphore(1, 0)
+            await slots.acquire(0)
+            return await slots.acquire(10)
+
+        assert asyncio.run(scenario()) is False
+
+class TestAsyncPostgreSQLDataStore:
+
+    def mock_connection(self, mock_connect, fetchone=None, fetchall=None):
+        mock_cursor = MagicMock()
+        mock_cursor.execute = AsyncMock()
+        mock_cursor.fetchone = AsyncMock(return_value=fetchone)
+        mock_cursor.fetchall = AsyncMock(return_value=fetchall or [])
+        mock_conn = MagicMock()
+        mock_conn.__aenter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__aenter__.return_value = mock_cursor
+        mock_conn.commit = AsyncMock()
+        mock_connect.return_value = mock_conn
+        return mock_conn, mock_cursor
+
+    def test_init_requires_database_url(self):
+        """Test initialization without a database URL raises ValueError."""
+        with pytest.raises(ValueError):
+            AsyncPostgreSQLDataStore(database_url=None)
+
+    @patch('app.async_postgres_data_store.psycopg.AsyncConnection.connect', new_callable=AsyncMock)
+    def test_add_order_shares_sync_statement(self, mock_connect):
+        """Test add_order runs the sync store's insert with the same parameters, then commits."""
+        from app.postgres_data_store import PostgreSQLDataStore
+        mock_conn, mock_cursor = self.mock_connection(mock_connect)
+
+        store = AsyncPostgreSQLDataStore(database_url='postgresql://test')
+        asyncio.run(store.add_order(dict(ORDER)))
+
+        mock_cursor.execute.assert_awaited_once_with(
+            PostgreSQLDataStore.INSERT_ORDER_SQL, PostgreSQLDataStore.order_params(ORDER, store.codec)
+        )
+        mock_conn.commit.assert_awaited_once()
+
+    @patch('app.async_postgres_data_store.psycopg.AsyncConnection.connect', new_callable=AsyncMock)
+    def test_validate_provider_conflict(self, mock_connect):
+        """Test validate_provider reports an NPI registered under another name."""
+        self.mock_connection(mock_connect, fetchone={'name': 'Dr. Jones', 'name_normalized': 'dr. jones'})
+
+        result = asyncio.run(AsyncPostgreSQLDataStore(database_url='postgresql://test').validate_provider('1234567893', 'Dr. Smith'))
+
+        assert result['conflict'] is True
+        assert 'Dr. Jones' in result['message']
+
+    @patch('app.async_postgres_data_store.psycopg.AsyncConnection.connect', new_callable=AsyncMock)
+    def test_consume_rate_limit_returns_wait(self, mock_connect):
+        """Test consume_rate_limit returns the seconds until enough tokens refill."""
+        self.mock_connection(mock_connect, fetchone=(0.5, False))
+
+        wait = asyncio.run(AsyncPostgreSQLDataStore(database_url='postgresql://test').consume_rate_limit('k', 5, 0.5))
+
+        assert wait == pytest.approx(1.0)
@@ -0,0 +1,135 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.cached_data_store import CachedDataStore, IdentityCache
+from app.in_memory_data_store import InMemoryDataStore
+from app.replicas import primary_reads
+
+class CountingStore(InMemoryDataStore):
+    """In-memory store counting the validations that reach it."""
+
+    def __init__(self):
+        super().__init__()
+        self.lookups = 0
+        self.replica_lookups = 0
+
+    def validate_provider(self, npi: str, name: str):
+        self.lookups += 1
+        self.replica_lookups += not primary_reads.get()
+        return super().validate_provider(npi, name)
+
+    def validate_patient(self, mrn: str, first_name: str, last_name: str):
+        self.lookups += 1
+        self.replica_lookups += not primary_reads.get()
+        return super().validate_patient(mrn, first_name, last_name)
+
+class TestCachedDataStore:
+
+    def setup_method(self):
+        self.inner = CountingStore()
+        self.store = CachedDataStore(self.inner)
+
+    def test_repeated_validation_is_cached(self):
+        """Test the second identical validation doesn't reach the inner store."""
+        self.inner.add_provider('1234567893', 'Dr. Smith')
+
+        assert self.store.validate_provider('1234567893', 'Dr. Jones')['conflict'] is True
+        assert self.store.validate_provider('1234567893', 'Dr. Jones')['conflict'] is True
+        assert self.store.validate_patient('123456', 'Jane', 'Doe')['conflict'] is False
+        assert self.store.validate_patient('123456', 'Jane', 'Doe')['conflict'] is False
+        assert self.inner.lookups == 2
+
+    def test_misses_are_loaded_from_the_primary(self):
+        """Test a miss isn't answered by a replica that may not have replayed the write just invalidated."""
+        self.store.validate_provider('1234567893', 'Dr. Smith')
+        self.store.validate_patient('123456', 'Jane', 'Doe')
+
+        assert self.inner.lookups == 2
+        assert self.inner.replica_lookups == 0
+        assert primary_reads.get() is False
+
+    def test_add_invalidates_affected_entries(self):
+        """Test adding a provider or patient drops the cached results it changes, and only those."""
+        self.store.validate_provider('1234567893', 'Dr. Smith')
+        self.store.validate_provider('9999999999', 'dr. smith ')
+        self.store.validate_provider('1111111111', 'Dr. Jones')
+        self.store.validate_patient('123456', 'Jane', 'Doe')
+
+        self.store.add_provider('1234567893', 'Dr. Smith')
+        self.store.add_patient('123456', 'John', 'Doe')
+
+        assert self.store.validate_provider('9999999999', 'dr. smith ')['conflict'] is True
+        assert self.store.validate_patient('123456', 'Jane', 'Doe')['conflict'] is True
+        assert self.store.validate_provider('1111111111', 'Dr. Jones')['conflict'] is False
+        assert self.inner.lookups == 6
+
+    def test_remote_changes_invalidate(self):
+        """Test notified writes by other processes drop matching entries, and a missed-changes signal drops all."""
+        self.store.validate_patient('123456', 'Jane', 'Doe')
+        self.store.validate_patient('654321', 'John', 'Doe')
+        self.inner.add_patient('123456', 'Janet', 'Doe')
+
+        self.store.on_identity_change({'op': 'INSERT', 'table': 'patients', 'row': {'mrn': '123456'}})
+
+        assert self.store.validate_patient('123456', 'Jane', 'Doe')['conflict'] is True
+        assert len(self.store.cache) == 2
+        self.store.on_identity_change(None)
+        assert len(self.store.cache) == 0
+
+    def test_warm_caches_stored_identities(self):
+        """Test warming caches every stored provider and patient as conflict-free."""
+        self.inner.add_provider('1234567893', 'Dr. Smith')
+        self.inner.add_patient('123456', 'Jane', 'Doe')
+
+        assert self.store.warm(100) == 2
+        assert self.store.validate_provider('1234567893', 'Dr. Smith') == {'conflict': False}
+        assert self.store.validate_patient('123456', 'Jane', 'Doe') == {'conflict': False}
+        assert self.inner.lookups == 0
+
+    def test_orders_are_delegated(self):
+        """Test order methods and validate_order go through to the inner store, using the cache for identities."""
+        self.inner.add_provider('1234567893', 'Dr. Smith')
+        order = {
+            'patient_mrn': '123456', 'patient_first_name': 'Jane', 'patient_last_name': 'Doe',
+            'provider_npi': '1234567893', 'provider_name': 'Dr. Jones', 'medication': 'IVIG',
+        }
+
+        assert len(self.store.validate_order(order)) == 1
+        assert len(self.store.validate_order(order)) == 1
+        assert self.inner.lookups == 2
+        assert self.store.similarity_threshold == self.inner.similarity_threshold
+        assert self.store.get_stats() == self.inner.get_stats()
+
+class TestIdentityCache:
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """Test the cache stays within its size by dropping the entry used least recently."""
+        cache = IdentityCache(max_size=2)
+        cache.put(('a',), {'conflict': False}, [('mrn', 'a')])
+        cache.put(('b',), {'conflict': False}, [('mrn', 'b')])
+        cache.get(('a',))
+        cache.put(('c',), {'conflict': False}, [('mrn', 'c')])
+
+        assert cache.get(('b',)) is None
+        assert cache.get(('a',)) == {'conflict': False}
+        assert len(cache) == 2
+
+    def test_expired_entry_is_a_miss(self):
+        """Test entries older than the TTL aren't returned."""
+        cache = IdentityCache(max_size=10, ttl=0.01)
+        cache.put(('a',), {'conflict': False}, [('mrn', 'a')])
+        time.sleep(0.02)
+
+        assert cache.get(('a',)) is None
+
+    def test_lookup_racing_an_invalidation_is_not_cached(self):
+        """Test a result read before an invalidation isn't cached after it."""
+        cache = IdentityCache(max_size=10)
+        generation = cache.generation
+        cache.invalidate([('mrn', 'a')])
+        cache.put(('a',), {'conflict': False}, [('mrn', 'a')], generation)
+
+        assert cache.get(('a',)) is None
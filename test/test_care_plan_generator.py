@@ -5,7 +5,8 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from app.care_plan_generator import CarePlanGenerator
+from app.care_plan_generator import CarePlanGenerator, OfflineCarePlanGenerator
+from app.prompt import DEFAULT_EXAMPLE, select_example
 
 class TestCarePlanGenerator:
 
@@ -31,15 +32,19 @@ class TestCarePlanGenerator:
         
         mock_response = MagicMock()
         mock_response.content = [MagicMock(text="Generated care plan")]
-        generator.client.messages.create = MagicMock(return_value=mock_response)
+        mock_stream = MagicMock()
+        mock_stream.text_stream = iter(["Generated ", "care plan"])
+        mock_stream.get_final_message.return_value = mock_response
+        generator.client.messages.stream = MagicMock()
+        generator.client.messages.stream.return_value.__enter__.return_value = mock_stream
         
         # Execute
         result = generator.generate_care_plan_with_llm({"patient": "data"})
         
         # Assert
         assert result == "Generated care plan"
-        mock_prompt.assert_called_once_with({"patient": "data"})
-        generator.client.messages.create.assert_called_once()
+        mock_prompt.assert_called_once_with({"patient": "data"}, DEFAULT_EXAMPLE)
+        generator.client.messages.stream.assert_called_once()
 
     @patch.dict('os.environ', {'ANTHROPIC_API_KEY': 'test-key'})
     @patch('app.care_plan_generator.generate_prompt')
@@ -48,8 +53,39 @@ class TestCarePlanGenerator:
         # Setup
         mock_prompt.return_value = "test prompt"
         generator = CarePlanGenerator()
-        generator.client.messages.create = MagicMock(side_effect=Exception("API Error"))
+        generator.client.messages.stream = MagicMock(side_effect=Exception("API Error"))
         
         # Execute & Assert
         with pytest.raises(RuntimeError, match="LLM call failed to return a valid response"):
-            generator.generate_care_plan_with_llm({"patient": "data"})
\ No newline at end of file
+            generator.generate_care_plan_with_llm({"patient": "data"})
+
+class TestOfflineCarePlanGenerator:
+
+    def test_example_is_selected_once(self):
+        """Test the example is looked up once per care plan, for both the prompt and the metrics."""
+        generator = OfflineCarePlanGenerator(latency=0)
+        with patch('app.care_plan_generator.select_example', wraps=select_example) as lookup:
+            generator.generate_care_plan_with_llm({
+                "patient_first_name": "Jane", "patient_last_name": "Doe", "patient_mrn": "123456",
+                "primary_diagnosis": "G70.00", "medication": "IVIG", "additional_diagnoses": "None",
+                "medication_history": "None", "patient_records": "None"
+            })
+
+        assert lookup.call_count == 1
+
+    def test_generate_care_plan_without_llm(self):
+        """Test the offline stand-in returns a templated care plan without an API key."""
+        generator = OfflineCarePlanGenerator(latency=0)
+        result = generator.generate_care_plan_with_llm({
+            "patient_first_name": "Jane", "patient_last_name": "Doe", "patient_mrn": "123456",
+            "primary_diagnosis": "Myasthenia gravis", "medication": "IVIG", "additional_diagnoses": "None",
+            "medication_history": "None", "patient_records": "None"
+        })
+
+        assert "MRN 123456" in result
+        assert "IVIG" in result
+
+    @patch.dict('os.environ', {'OFFLINE_LLM_LATENCY': '0.5'})
+    def test_latency_from_environment(self):
+        """Test the simulated latency is read from OFFLINE_LLM_LATENCY."""
+        assert OfflineCarePlanGenerator().latency == 0.5
@@ -0,0 +1,58 @@
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.care_plan_sections import parse_care_plan, query_terms, section_terms, validate_section
+
+CARE_PLAN = """Care plan for Jane Doe
+1. Problem list / Drug therapy problems (DTPs)
+   - Risk of infusion reactions.
+   - Risk of renal injury.
+2. Goals (SMART)
+   - Primary: Improved strength within 2 weeks.
+   - Safety: No AKI.
+**3. Pharmacist interventions / plan**
+   1. Dosing & Administration: 0.4 g/kg/day x 5 days.
+   2. Monitoring during infusion: vitals q15 min.
+## 4. Monitoring plan & lab schedule
+   - Baseline: CBC, BMP.
+   - Post-therapy: BMP at 3-7 days.
+"""
+
+class TestParseCarePlan:
+
+    def test_items_are_split_by_section(self):
+        """Test each numbered heading starts a section and its bullets become items, whatever the markdown."""
+        sections = parse_care_plan(CARE_PLAN)
+
+        assert sections['problems'] == ['Risk of infusion reactions.', 'Risk of renal injury.']
+        assert sections['goals'] == ['Primary: Improved strength within 2 weeks.', 'Safety: No AKI.']
+        assert sections['interventions'] == ['Dosing & Administration: 0.4 g/kg/day x 5 days.',
+                                             'Monitoring during infusion: vitals q15 min.']
+        assert sections['monitoring'] == ['Baseline: CBC, BMP.', 'Post-therapy: BMP at 3-7 days.']
+
+    def test_missing_sections_are_empty(self):
+        """Test a plan without headings, or no plan at all, has every section empty."""
+        empty = {'problems': [], 'goals': [], 'interventions': [], 'monitoring': []}
+
+        assert parse_care_plan("Plan") == empty
+        assert parse_care_plan(None) == empty
+
+    def test_section_terms_are_distinct_lowercase_words(self):
+        """Test the terms of a section are its words without duplicates or stop words."""
+        terms = section_terms(parse_care_plan(CARE_PLAN))
+
+        assert 'safety' in terms['goals']
+        assert 'renal' in terms['problems'] and 'renal' not in terms['monitoring']
+        assert 'bmp' in terms['monitoring'] and terms['monitoring'].count('bmp') == 1
+        assert 'at' not in terms['monitoring']
+
+    def test_query_validation(self):
+        """Test unknown sections and empty queries are rejected."""
+        assert query_terms('Renal Monitoring') == ['renal', 'monitoring']
+        with pytest.raises(ValueError, match="section must be one of"):
+            validate_section('summary')
+        with pytest.raises(ValueError, match="Care plan query is required"):
+            query_terms(' ')
@@ -0,0 +1,61 @@
+import pytest
+from unittest.mock import MagicMock
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.change_broadcaster import ChangeBroadcaster
+from app.data_store import Change
+from app.in_memory_data_store import InMemoryDataStore
+
+class TestChangeBroadcaster:
+
+    def test_subscriber_receives_new_orders_after_the_head(self):
+        """Test subscribers get each new order in a batch that follows on from the feed's head."""
+        store = InMemoryDataStore()
+        store.add_order({'patient_mrn': 'MRN123'})
+        broadcaster = ChangeBroadcaster(store, wait_timeout=0.05)
+        subscription = broadcaster.subscribe()
+        assert subscription.get(timeout=2) == (1, [])
+
+        store.add_order({'patient_mrn': 'MRN456'})
+        batch = subscription.get(timeout=2)
+
+        assert batch.after == 1
+        assert [change.order['patient_mrn'] for change in batch.changes] == ['MRN456']
+
+    def test_feed_read_once_per_batch_for_all_subscribers(self):
+        """Test one read of the change feed serves every subscriber."""
+        subscribed = threading.Event()
+        store = MagicMock()
+        store.get_change_cursor.return_value = 0
+        store.get_changes.side_effect = lambda after, limit, timeout: (
+            subscribed.wait(2) and [Change(1, {'order_id': 1})] if after == 0 else time.sleep(timeout) or [])
+        broadcaster = ChangeBroadcaster(store, wait_timeout=0.05)
+
+        subscriptions = [broadcaster.subscribe() for _ in range(3)]
+        subscribed.set()
+        for subscription in subscriptions:
+            batch = subscription.get(timeout=2)
+            # The empty batch announcing the head may still be there
+            if not batch.changes:
+                batch = subscription.get(timeout=2)
+            assert batch == (0, [Change(1, {'order_id': 1})])
+
+        assert [call.args[0] for call in store.get_changes.call_args_list].count(0) == 1
+
+    def test_no_store_access_without_subscribers(self):
+        """Test an idle broadcaster doesn't read the change feed."""
+        store = MagicMock()
+        store.get_change_cursor.return_value = 0
+        store.get_changes.side_effect = lambda after, limit, timeout: time.sleep(timeout) or []
+        broadcaster = ChangeBroadcaster(store, wait_timeout=0.01)
+
+        broadcaster.unsubscribe(broadcaster.subscribe())
+        time.sleep(0.1)
+        calls = store.get_changes.call_count
+        time.sleep(0.1)
+        assert store.get_changes.call_count == calls
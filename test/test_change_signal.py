@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+from unittest.mock import Mock
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.change_signal import ChangeSignal
+
+class TestChangeSignal:
+
+    def test_wait_wakes_on_notify_from_another_thread(self):
+        """Test a waiting thread returns once another thread notifies."""
+        signal = ChangeSignal()
+        generation = signal.generation
+        threading.Timer(0.05, signal.notify).start()
+
+        assert signal.wait(generation, 5) is True
+        assert signal.generation == generation + 1
+
+    def test_notify_before_wait_is_not_missed(self):
+        """Test a notify between reading the generation and waiting returns at once."""
+        signal = ChangeSignal()
+        generation = signal.generation
+        signal.notify()
+
+        assert signal.wait(generation, 0) is True
+
+    def test_wait_times_out_without_notify(self):
+        """Test wait reports False once the timeout passes."""
+        assert ChangeSignal().wait(0, 0.05) is False
+
+    def test_wait_async_wakes_on_notify_from_another_thread(self):
+        """Test waiting coroutines are woken on their own event loop."""
+        signal = ChangeSignal()
+
+        async def wait():
+            threading.Timer(0.05, signal.notify).start()
+            return await signal.wait_async(0, 5)
+
+        assert asyncio.run(wait()) is True
+        assert asyncio.run(signal.wait_async(1, 0.05)) is False
+
+    def test_start_is_called_once_on_first_wait(self):
+        """Test the listener is started by the first wait only."""
+        start = Mock()
+        signal = ChangeSignal(start)
+
+        start.assert_not_called()
+        signal.wait(0, 0)
+        signal.wait(0, 0)
+        start.assert_called_once()
@@ -0,0 +1,57 @@
+import gzip
+import pytest
+import sys
+from pathlib import Path
+from flask import Flask, Response, jsonify, request
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.compression import compress_response
+
+class TestCompressResponse:
+
+    def setup_method(self):
+        self.app = Flask(__name__)
+        self.body = {'care_plan': 'Monitor vitals every 15 minutes. ' * 200}
+
+    def compress(self, accept_encoding: str, response_factory, min_size: int = 1024):
+        with self.app.test_request_context(headers={'Accept-Encoding': accept_encoding}):
+            return compress_response(request, response_factory(), min_size)
+
+    def test_gzip_when_accepted(self):
+        """Test large JSON responses are gzip compressed for clients that accept gzip."""
+        response = self.compress('gzip', lambda: jsonify(self.body))
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.vary
+        assert gzip.decompress(response.get_data()) == jsonify_bytes(self.app, self.body)
+
+    def test_identity_when_not_accepted(self):
+        """Test responses are left as is when the client doesn't accept a supported encoding."""
+        response = self.compress('identity', lambda: jsonify(self.body))
+
+        assert 'Content-Encoding' not in response.headers
+
+    def test_small_responses_are_not_compressed(self):
+        """Test responses below the size threshold are left as is."""
+        response = self.compress('gzip', lambda: jsonify({'ok': True}))
+
+        assert 'Content-Encoding' not in response.headers
+
+    def test_streamed_responses_are_not_compressed(self):
+        """Test streamed responses are passed through untouched."""
+        response = self.compress('gzip', lambda: Response(iter([b'x' * 4096]), mimetype='text/plain'))
+
+        assert 'Content-Encoding' not in response.headers
+
+    def test_brotli_preferred_when_available(self):
+        """Test brotli is chosen over gzip when the client accepts both."""
+        brotli = pytest.importorskip('brotli')
+        response = self.compress('gzip, br', lambda: jsonify(self.body))
+
+        assert response.headers['Content-Encoding'] == 'br'
+        assert brotli.decompress(response.get_data()) == jsonify_bytes(self.app, self.body)
+
+def jsonify_bytes(app: Flask, body) -> bytes:
+    with app.app_context():
+        return jsonify(body).get_data()
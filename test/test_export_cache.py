@@ -0,0 +1,30 @@
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.export_cache import ExportCache
+
+class TestExportCache:
+
+    def test_get_returns_artifact_for_same_version(self):
+        """Test the cached artifact is only returned for the version it was built from."""
+        cache = ExportCache()
+        cache.put(3, b'csv')
+
+        assert cache.get(3) == b'csv'
+        assert cache.get(4) is None
+
+    def test_put_ignores_older_versions(self):
+        """Test an artifact built from an older version doesn't replace a newer one."""
+        cache = ExportCache()
+        cache.put(5, b'new')
+        cache.put(4, b'old')
+
+        assert cache.get(5) == b'new'
+        assert cache.get(4) is None
+
+    def test_etag_changes_with_version(self):
+        """Test each store version gets its own ETag."""
+        assert ExportCache.etag_for(1) != ExportCache.etag_for(2)
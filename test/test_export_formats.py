@@ -0,0 +1,48 @@
+import pytest
+import csv
+import gzip
+import io
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.export_formats import iter_csv, iter_gzip_csv, iter_ndjson, iter_parquet, ROWS_PER_CHUNK
+
+ORDERS = [
+    {'order_id': i, 'patient_first_name': f'Patient{i}', 'care_plan': 'Plan, with "quotes"\nand lines'}
+    for i in range(1, ROWS_PER_CHUNK * 2 + 2)
+]
+
+class TestExportFormats:
+
+    def test_iter_csv_streams_chunks(self):
+        """Test CSV export is yielded in several chunks that join into valid CSV."""
+        chunks = list(iter_csv(ORDERS))
+        assert len(chunks) == 3
+
+        rows = list(csv.DictReader(io.StringIO(b''.join(chunks).decode('utf-8'))))
+        assert len(rows) == len(ORDERS)
+        assert rows[0]['care_plan'] == ORDERS[0]['care_plan']
+
+    def test_iter_gzip_csv_matches_csv(self):
+        """Test gzip export decompresses to the plain CSV export."""
+        compressed = b''.join(iter_gzip_csv(ORDERS))
+        assert gzip.decompress(compressed) == b''.join(iter_csv(ORDERS))
+
+    def test_iter_ndjson_one_order_per_line(self):
+        """Test NDJSON export writes one JSON object per order."""
+        lines = b''.join(iter_ndjson(ORDERS)).decode('utf-8').splitlines()
+        assert len(lines) == len(ORDERS)
+        assert json.loads(lines[0])['order_id'] == 1
+
+    def test_iter_parquet_writes_row_groups(self):
+        """Test Parquet export writes one row group per batch."""
+        parquet = pytest.importorskip('pyarrow.parquet')
+
+        data = b''.join(iter_parquet(ORDERS, row_group_size=50))
+        parquet_file = parquet.ParquetFile(io.BytesIO(data))
+        assert parquet_file.metadata.num_row_groups == 5
+        table = parquet_file.read()
+        assert table.column('order_id').to_pylist() == [order['order_id'] for order in ORDERS]
@@ -0,0 +1,246 @@
+import json
+import pytest
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.factory import EXTENSION_KEY, create_app
+
+class TestCreateApp:
+
+    def setup_method(self):
+        self.app = create_app({'DATABASE_URL': None, 'CARE_PLAN_GENERATOR': 'offline'})
+        self.client = self.app.test_client()
+
+    def test_store_is_created_on_first_use(self):
+        """Test creating the app doesn't create the store."""
+        resources = self.app.extensions[EXTENSION_KEY]
+        assert resources._store is None
+
+        self.client.get('/care-plan/stats')
+
+        assert resources._store is not None
+
+    def test_liveness_and_readiness(self):
+        """Test the liveness and readiness probes report an in-memory store as ready."""
+        assert self.client.get('/healthz').status_code == 200
+        response = self.client.get('/readyz')
+
+        assert response.status_code == 200
+        assert response.get_json() == {'status': 'ready'}
+
+    def test_readiness_fails_when_store_is_unreachable(self):
+        """Test the readiness probe returns 503 when the store can't be queried."""
+        resources = self.app.extensions[EXTENSION_KEY]
+        with patch.object(resources.store, 'get_version', side_effect=Exception("connection refused")):
+            response = self.client.get('/readyz')
+
+        assert response.status_code == 503
+
+    def test_init_worker_creates_resources(self):
+        """Test per-worker initialization creates the store and the care plan generator."""
+        resources = self.app.extensions[EXTENSION_KEY]
+        resources.init_worker()
+
+        assert resources._store is not None
+        assert resources._care_plan_generator is not None
+
+    def test_init_worker_keeps_partitions_ensured(self):
+        """Test workers ensure the store's partitions at startup and then every PARTITION_CHECK_INTERVAL."""
+        import time
+        app = create_app({'DATABASE_URL': None, 'CARE_PLAN_GENERATOR': 'offline', 'PARTITION_CHECK_INTERVAL': 0.01})
+        resources = app.extensions[EXTENSION_KEY]
+        with patch.object(resources.store, 'ensure_partitions', side_effect=[Exception("database is down"), None, None]) as ensure:
+            resources.init_worker()
+            deadline = time.monotonic() + 2
+            while ensure.call_count < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        assert ensure.call_count >= 3
+
+    def test_init_worker_prunes_rate_limits(self):
+        """Test workers drop refilled rate limit buckets with the configured burst and refill rate."""
+        import time
+        app = create_app({'DATABASE_URL': None, 'CARE_PLAN_GENERATOR': 'offline', 'PARTITION_CHECK_INTERVAL': 0,
+                          'RATE_LIMIT_BURST': 5, 'RATE_LIMIT_PER_MINUTE': 30})
+        resources = app.extensions[EXTENSION_KEY]
+        with patch.object(resources.store, 'prune_rate_limits') as prune:
+            resources.init_worker()
+            deadline = time.monotonic() + 2
+            while not prune.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        prune.assert_called_once_with(5, 0.5)
+
+    def test_importing_server_skips_heavy_dependencies(self):
+        """Test importing the server module doesn't load the LLM SDK or database driver."""
+        script = "import json, sys, server; print(json.dumps([m for m in ('anthropic', 'psycopg') if m in sys.modules]))"
+        output = subprocess.run(
+            [sys.executable, '-c', script], cwd=Path(__file__).parent.parent,
+            capture_output=True, text=True, check=True
+        ).stdout
+
+        assert json.loads(output.strip().splitlines()[-1]) == []
+
+    def test_generate_is_rate_limited_per_client(self):
+        """Test generate answers 429 with Retry-After once a client's burst is used up."""
+        app = create_app({'DATABASE_URL': None, 'CARE_PLAN_GENERATOR': 'offline', 'RATE_LIMIT_BURST': 1,
+                          'RATE_LIMIT_PER_MINUTE': 1, 'ADMISSION_MAX_WAIT': 0})
+        app.extensions[EXTENSION_KEY].care_plan_generator.latency = 0
+        client = app.test_client()
+        order = {'patient_first_name': 'Jane', 'patient_last_name': 'Doe', 'patient_mrn': '123456',
+                 'primary_diagnosis': 'Myasthenia gravis', 'medication': 'IVIG', 'additional_diagnoses': 'None',
+                 'medication_history': 'None', 'patient_records': 'None'}
+
+        assert client.post('/care-plan/generate', json=order).status_code == 200
+        response = client.post('/care-plan/generate', json=order)
+
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) >= 1
+        assert client.post('/care-plan/generate', json=order, headers={'X-API-Key': 'other'}).status_code == 200
+
+    def test_export_with_archived_orders_is_streamed(self):
+        """Test exports asking for archived orders are streamed, and archive-orders keeps in-memory orders."""
+        resources = self.app.extensions[EXTENSION_KEY]
+        resources.store.add_order({
+            'patient_mrn': '123456', 'patient_first_name': 'Jane', 'patient_last_name': 'Doe',
+            'provider_npi': '1234567893', 'provider_name': 'Dr. Smith', 'medication': 'IVIG',
+            'primary_diagnosis': 'G70.00',
+        })
+
+        result = self.app.test_cli_runner().invoke(args=['archive-orders'])
+        response = self.client.get('/care-plan/orders?archived=1')
+
+        assert 'Archived 0 partitions.' in result.output
+        assert response.status_code == 200
+        assert response.is_streamed
+        assert b'IVIG' in response.get_data()
+
+    def test_export_cursor_resumes_every_shard(self):
+        """Test an incremental export resumed from X-Export-Cursor includes orders a lagging shard added."""
+        from app.in_memory_data_store import InMemoryDataStore
+        from app.sharded_data_store import ShardedDataStore, shard_index
+        store = ShardedDataStore([InMemoryDataStore(), InMemoryDataStore()])
+        self.app.extensions[EXTENSION_KEY]._store = store
+        mrns = {shard_index(f'{n:06d}', 2): f'{n:06d}' for n in range(10)}
+
+        def add(mrn: str, medication: str):
+            store.add_order({'patient_mrn': mrn, 'patient_first_name': 'Jane', 'patient_last_name': 'Doe',
+                             'provider_npi': '1234567893', 'provider_name': 'Dr. Smith', 'medication': medication,
+                             'primary_diagnosis': 'G70.00'})
+
+        for n in range(4):
+            add(mrns[1], f'Early {n}')
+        first = self.client.get('/care-plan/orders?since=0')
+        add(mrns[0], 'Late')
+        second = self.client.get(f"/care-plan/orders?since={first.headers['X-Export-Cursor']}")
+        third = self.client.get(f"/care-plan/orders?since={second.headers['X-Export-Cursor']}")
+
+        assert first.status_code == 200 and b'Early 3' in first.get_data()
+        assert second.status_code == 200
+        assert b'Late' in second.get_data() and b'Early' not in second.get_data()
+        assert third.status_code == 204
+        assert self.client.get('/care-plan/orders?since=not-a-cursor').status_code == 400
+
+    def test_order_details_are_loaded_on_demand(self):
+        """Test listed orders leave out the large text, which the details route and exports can include."""
+        resources = self.app.extensions[EXTENSION_KEY]
+        resources.store.add_order({
+            'patient_mrn': '123456', 'patient_first_name': 'Jane', 'patient_last_name': 'Doe',
+            'provider_npi': '1234567893', 'provider_name': 'Dr. Smith', 'medication': 'IVIG',
+            'primary_diagnosis': 'G70.00', 'patient_records': 'Notes', 'care_plan': 'Plan',
+        })
+
+        listed = self.client.get('/care-plan/orders/list').get_json()['orders'][0]
+        details = self.client.get('/care-plan/orders/1/details?fields=care_plan').get_json()
+        export = self.client.get('/care-plan/orders?format=ndjson&text=care_plan').get_data()
+
+        assert 'care_plan' not in listed
+        assert details == {'order_id': 1, 'care_plan': 'Plan'}
+        assert json.loads(export)['care_plan'] == 'Plan'
+        assert json.loads(export)['patient_records'] is None
+        assert self.client.get('/care-plan/orders/2/details').status_code == 404
+        assert self.client.get('/care-plan/orders/1/details?fields=patient_mrn').status_code == 400
+
+    def test_care_plans_are_queried_by_section(self):
+        """Test the care plan query route matches words within one section of the stored plans."""
+        resources = self.app.extensions[EXTENSION_KEY]
+        for care_plan in ("Goals (SMART)\n- Safety: No AKI\nMonitoring plan & lab schedule\n- Renal panel weekly",
+                          "Goals (SMART)\n- Primary: Improved strength\nMonitoring plan & lab schedule\n- CBC"):
+            resources.store.add_order({
+                'patient_mrn': '123456', 'patient_first_name': 'Jane', 'patient_last_name': 'Doe',
+                'provider_npi': '1234567893', 'provider_name': 'Dr. Smith', 'medication': 'IVIG',
+                'primary_diagnosis': 'G70.00', 'care_plan': care_plan,
+            })
+
+        renal = self.client.get('/care-plan/plans/query?section=monitoring&q=renal').get_json()
+        safety = self.client.get('/care-plan/plans/query?section=goals&q=Safety').get_json()
+
+        assert renal['total'] == 1
+        assert renal['orders'][0]['care_plan_sections']['monitoring'] == ['Renal panel weekly']
+        assert 'care_plan' not in renal['orders'][0]
+        assert [order['order_id'] for order in safety['orders']] == [1]
+        assert self.client.get('/care-plan/plans/query?section=goals&q=renal').get_json()['total'] == 0
+        assert self.client.get('/care-plan/plans/query?section=summary&q=renal').status_code == 400
+        assert self.client.get('/care-plan/plans/query?section=goals').status_code == 400
+
+    def test_streams_beyond_the_limit_get_503(self):
+        """Test a worker serves at most STREAM_MAX_CONNECTIONS streams and frees a slot when one closes."""
+        app = create_app({'DATABASE_URL': None, 'CARE_PLAN_GENERATOR': 'offline', 'STREAM_MAX_CONNECTIONS': 1})
+        client = app.test_client()
+
+        stream = client.get('/care-plan/changes/stream', buffered=False)
+        rejected = client.get('/care-plan/stats/stream', buffered=False)
+        assert stream.status_code == 200
+        assert rejected.status_code == 503
+        assert rejected.headers['Retry-After'] == '5'
+
+        stream.close()
+        reopened = client.get('/care-plan/stats/stream', buffered=False)
+        assert reopened.status_code == 200
+        reopened.close()
+
+    def test_rejected_stream_frees_its_slot(self):
+        """Test a stream refused for a bad cursor doesn't keep its slot."""
+        app = create_app({'DATABASE_URL': None, 'CARE_PLAN_GENERATOR': 'offline', 'STREAM_MAX_CONNECTIONS': 1})
+        client = app.test_client()
+
+        with client.get('/care-plan/changes/stream?after=bad') as response:
+            assert response.status_code == 400
+        assert app.extensions[EXTENSION_KEY].stream_slots.in_use == 0
+
+    def test_change_stream_delivers_broadcast_orders(self):
+        """Test an open change stream sends the backlog, then orders the broadcaster publishes."""
+        resources = self.app.extensions[EXTENSION_KEY]
+        resources.store.add_order({'patient_mrn': 'MRN123'})
+
+        response = self.client.get('/care-plan/changes/stream', buffered=False)
+        events = iter(response.response)
+        assert next(events) == b': connected\n\n'
+        assert b'"MRN123"' in next(events)
+
+        resources.store.add_order({'patient_mrn': 'MRN456'})
+        assert b'"MRN456"' in next(events)
+        response.close()
+
+    def test_write_lsn_is_handed_back_and_echoed(self):
+        """Test a write's LSN goes back to the client, and the LSN it echoes holds back its next reads."""
+        from app.replicas import current_session
+        resources = self.app.extensions[EXTENSION_KEY]
+        order = {
+            'patient_mrn': '123456', 'patient_first_name': 'Jane', 'patient_last_name': 'Doe',
+            'provider_npi': '1234567893', 'provider_name': 'Dr. Smith', 'medication': 'IVIG',
+        }
+        with patch.object(resources.store, 'add_order', side_effect=lambda data: current_session.get().record_write('0/2A')):
+            response = self.client.post('/care-plan/submit', json=order)
+        assert response.headers['X-Store-LSN'] == '0/2A'
+        assert 'store_lsn=0/2A' in response.headers['Set-Cookie']
+
+        required = []
+        with patch.object(resources.store, 'get_stats', side_effect=lambda: required.append(current_session.get().required_lsn) or {}):
+            response = self.client.get('/care-plan/stats', headers={'X-Store-LSN': '0/2A'})
+        assert required == [0x2A]
+        assert 'X-Store-LSN' not in response.headers
@@ -1,6 +1,7 @@
 import pytest
 from unittest.mock import patch
 import sys
+import time
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -125,6 +126,36 @@ class TestInMemoryDataStore:
         orders = store.export_orders()
         assert len(orders) == 2
 
+    def test_large_text_is_stored_apart(self):
+        """Test order rows leave out the large text, which exports and get_order_details load on demand."""
+        store = InMemoryDataStore()
+        store.add_order({'patient_mrn': 'MRN123', 'care_plan': 'Plan', 'patient_records': 'Notes',
+                         'medication_history': 'None'})
+
+        assert 'care_plan' not in store.orders[0]
+        assert store.export_orders()[0]['care_plan'] == 'Plan'
+        assert store.export_orders(text_fields=('care_plan',))[0]['care_plan'] == 'Plan'
+        assert 'patient_records' not in store.export_orders(text_fields=('care_plan',))[0]
+        assert 'care_plan' not in next(store.iter_orders(text_fields=()))
+        assert store.get_order_details([1, 2], ('patient_records',)) == {1: {'patient_records': 'Notes'}}
+
+    def test_repeated_text_is_deduplicated(self):
+        """Test text resubmitted with every order of a patient is stored once and reported in the stats."""
+        store = InMemoryDataStore()
+        records = 'SCr 0.8, no prior infusion reactions. ' * 50
+        for medication in ('IVIG', 'Aspirin'):
+            store.add_order({'patient_mrn': 'MRN123', 'medication': medication, 'patient_records': records})
+
+        assert store.order_details[1]['patient_records'] == store.order_details[2]['patient_records']
+        assert [order['patient_records'] for order in store.export_orders()] == [records, records]
+        assert store.get_stats()['text_compression_ratio'] > 2
+
+    def test_get_order_details_rejects_unknown_fields(self):
+        """Test asking for a field that isn't large text raises ValueError."""
+        store = InMemoryDataStore()
+        with pytest.raises(ValueError, match="Unknown text fields: patient_mrn"):
+            store.get_order_details([1], ('patient_mrn',))
+
     def test_get_stats(self):
         """Test getting statistics."""
         store = InMemoryDataStore()
@@ -135,4 +166,248 @@ class TestInMemoryDataStore:
         stats = store.get_stats()
         assert stats['total_orders'] == 1
         assert stats['total_patients'] == 1
-        assert stats['total_providers'] == 1
\ No newline at end of file
+        assert stats['total_providers'] == 1
+
+    def test_list_orders_paginates_newest_first(self):
+        """Test listing orders walks pages newest-first with a cursor."""
+        store = InMemoryDataStore()
+        for i in range(5):
+            store.add_order({'patient_mrn': 'MRN123', 'medication': f'Med{i}'})
+
+        first_page = store.list_orders(2)
+        assert [o['order_id'] for o in first_page['orders']] == [5, 4]
+        assert first_page['next_cursor'] is not None
+
+        second_page = store.list_orders(2, cursor=first_page['next_cursor'])
+        assert [o['order_id'] for o in second_page['orders']] == [3, 2]
+
+        last_page = store.list_orders(2, cursor=second_page['next_cursor'])
+        assert [o['order_id'] for o in last_page['orders']] == [1]
+        assert last_page['next_cursor'] is None
+
+    def test_list_orders_cursor_is_found_by_order_id(self):
+        """Test a page starts right after the cursor's order even when ids aren't list positions."""
+        store = InMemoryDataStore()
+        for i in range(5):
+            store.add_order({'patient_mrn': 'MRN123', 'medication': f'Med{i}'})
+        # Leave a gap in the ids, as removed orders would
+        del store.orders[1:3], store.order_ids[1:3]
+
+        pages = [store.list_orders(1)]
+        while pages[-1]['next_cursor']:
+            pages.append(store.list_orders(1, cursor=pages[-1]['next_cursor']))
+
+        assert [o['order_id'] for page in pages for o in page['orders']] == [5, 4, 1]
+
+    def test_list_orders_filters_and_excludes_text(self):
+        """Test listing orders with filters and without large text fields."""
+        store = InMemoryDataStore()
+        store.add_order({'patient_mrn': 'MRN123', 'provider_npi': '1', 'medication': 'Aspirin', 'care_plan': 'Plan'})
+        store.add_order({'patient_mrn': 'MRN456', 'provider_npi': '2', 'medication': 'IVIG', 'care_plan': 'Plan'})
+
+        page = store.list_orders(10, medication='aspirin', include_text=False)
+        assert len(page['orders']) == 1
+        assert page['orders'][0]['patient_mrn'] == 'MRN123'
+        assert 'care_plan' not in page['orders'][0]
+
+        page = store.list_orders(10, provider_npi='2', patient_mrn='MRN456')
+        assert [o['order_id'] for o in page['orders']] == [2]
+
+    def test_list_orders_date_range(self):
+        """Test listing orders restricted to a date range."""
+        store = InMemoryDataStore()
+        store.orders = [
+            {'order_id': 1, 'timestamp': '2025-01-01T10:00:00'},
+            {'order_id': 2, 'timestamp': '2025-01-02T10:00:00'},
+            {'order_id': 3, 'timestamp': '2025-01-03T10:00:00'},
+        ]
+
+        page = store.list_orders(10, start_date='2025-01-02T00:00:00', end_date='2025-01-03T00:00:00')
+        assert [o['order_id'] for o in page['orders']] == [2]
+
+    def test_get_patient_history(self):
+        """Test patient history returns the patient's orders newest-first with a summary."""
+        store = InMemoryDataStore()
+        store.add_order({'patient_mrn': 'MRN123', 'medication': 'Aspirin', 'provider_npi': '2', 'provider_name': 'Dr. Jones'})
+        store.add_order({'patient_mrn': 'MRN456', 'medication': 'IVIG', 'provider_npi': '1', 'provider_name': 'Dr. Smith'})
+        store.add_order({'patient_mrn': 'MRN123', 'medication': 'IVIG', 'provider_npi': '1', 'provider_name': 'Dr. Smith'})
+
+        history = store.get_patient_history('MRN123', 10)
+        assert [o['order_id'] for o in history['orders']] == [3, 1]
+        assert history['summary']['total_orders'] == 2
+        assert history['summary']['medications'] == ['Aspirin', 'IVIG']
+        assert history['summary']['providers'] == [
+            {'npi': '1', 'name': 'Dr. Smith'},
+            {'npi': '2', 'name': 'Dr. Jones'}
+        ]
+        assert history['summary']['last_order_date'] == store.orders[2]['timestamp']
+
+        assert [o['order_id'] for o in store.get_patient_history('MRN123', 1)['orders']] == [3]
+
+    def test_get_patient_history_unknown_patient(self):
+        """Test patient history for a patient without orders."""
+        store = InMemoryDataStore()
+        history = store.get_patient_history('MRN999', 10)
+        assert history['orders'] == []
+        assert history['summary']['total_orders'] == 0
+        assert history['summary']['last_order_date'] is None
+
+    def test_search_orders(self):
+        """Test searching orders by care plan and clinical note content."""
+        store = InMemoryDataStore()
+        store.add_order({'patient_mrn': 'MRN123', 'care_plan': 'Monitor for thrombosis', 'patient_records': 'SCr 0.8'})
+        store.add_order({'patient_mrn': 'MRN456', 'care_plan': 'Monitor renal function', 'patient_records': 'Elevated SCr'})
+        store.add_order({'patient_mrn': 'MRN789', 'primary_diagnosis': 'Deep vein thrombosis'})
+
+        results = store.search_orders('thrombosis', 1, include_text=False)
+        assert len(results['orders']) == 1
+        assert 'care_plan' not in results['orders'][0]
+        assert results['next_offset'] == 1
+
+        results = store.search_orders('thrombosis', 1, offset=1)
+        assert results['next_offset'] is None
+
+        results = store.search_orders('scr', 10)
+        assert sorted(o['order_id'] for o in results['orders']) == [1, 2]
+
+    def test_search_orders_empty_query_raises_error(self):
+        """Test searching with an empty query raises ValueError."""
+        store = InMemoryDataStore()
+        with pytest.raises(ValueError, match="Search query is required"):
+            store.search_orders('  ', 10)
+
+    def test_validate_order_warns_on_near_duplicate_medication(self):
+        """Test order validation warns when a normalized medication is similar to a previous order."""
+        store = InMemoryDataStore()
+        store.add_order({'patient_mrn': 'MRN123', 'medication': 'IVIG'})
+
+        data = {
+            'provider_npi': '123',
+            'provider_name': 'Dr. Smith',
+            'patient_mrn': 'MRN123',
+            'patient_first_name': 'John',
+            'patient_last_name': 'Doe',
+            'medication': 'Immune Globulin 10%'
+        }
+
+        warnings = store.validate_order(data)
+        assert len(warnings) == 1
+        assert 'with medication IVIG' in warnings[0]
+
+    def test_validate_order_similarity_threshold_is_configurable(self):
+        """Test a stricter threshold ignores loosely similar medications."""
+        store = InMemoryDataStore(similarity_threshold=0.9)
+        store.add_order({'patient_mrn': 'MRN123', 'medication': 'Aspirin'})
+
+        assert store.find_similar_orders('MRN123', 'Asprin', store.similarity_threshold) == []
+        assert len(store.find_similar_orders('MRN123', 'Asprin', 0.5)) == 1
+
+    def test_export_orders_since(self):
+        """Test incremental export returns only orders after the cursor."""
+        store = InMemoryDataStore()
+        store.add_order({'patient_mrn': 'MRN123'})
+        store.add_order({'patient_mrn': 'MRN456'})
+        store.add_order({'patient_mrn': 'MRN789'})
+
+        assert [o['order_id'] for o in store.export_orders(since_order_id=1)] == [2, 3]
+        assert store.export_orders(since_order_id=3) == []
+        since_timestamp = store.orders[1]['timestamp']
+        assert [o['order_id'] for o in store.export_orders(since_timestamp=since_timestamp)] == [3]
+
+    def test_get_version_changes_on_writes(self):
+        """Test the store version changes on every write."""
+        store = InMemoryDataStore()
+        versions = [store.get_version()]
+        store.add_provider('123', 'Dr. Smith')
+        versions.append(store.get_version())
+        store.add_patient('MRN123', 'John', 'Doe')
+        versions.append(store.get_version())
+        store.add_order({'patient_mrn': 'MRN123'})
+        versions.append(store.get_version())
+
+        assert versions == sorted(set(versions))
+        store.add_provider('123', 'Dr. Smith')
+        assert store.get_version() == versions[-1]
+
+    def test_iter_orders(self):
+        """Test streaming orders oldest-first from an order id."""
+        store = InMemoryDataStore()
+        store.add_order({'patient_mrn': 'MRN123'})
+        store.add_order({'patient_mrn': 'MRN456'})
+
+        assert [o['order_id'] for o in store.iter_orders()] == [1, 2]
+        assert [o['order_id'] for o in store.iter_orders(since_order_id=1)] == [2]
+
+    def test_get_analytics(self):
+        """Test analytics are maintained as orders are added."""
+        store = InMemoryDataStore()
+        store.add_order({'patient_mrn': 'MRN123', 'medication': 'IVIG', 'provider_npi': '1', 'primary_diagnosis': 'MG'})
+        store.add_order({'patient_mrn': 'MRN456', 'medication': 'IVIG', 'provider_npi': '2', 'primary_diagnosis': 'MG'})
+
+        analytics = store.get_analytics(bucket='month')
+        assert analytics['total_orders'] == 2
+        assert analytics['by_medication'] == [{'key': 'ivig', 'count': 2}]
+        assert len(analytics['by_provider']) == 2
+
+    def test_get_changes_returns_orders_after_cursor(self):
+        """Test the change feed returns orders after the cursor without waiting."""
+        store = InMemoryDataStore()
+        store.add_order({'patient_mrn': 'MRN123'})
+        store.add_order({'patient_mrn': 'MRN456'})
+
+        changes = store.get_changes(None, 10, timeout=0)
+        assert [(change.cursor, change.order['patient_mrn']) for change in changes] == [(1, 'MRN123'), (2, 'MRN456')]
+        assert [change.order['order_id'] for change in store.get_changes(1, 10, timeout=0)] == [2]
+        assert store.get_changes(2, 10, timeout=0) == []
+        assert store.get_change_cursor() == 2
+
+    def test_get_changes_waits_for_new_order(self):
+        """Test the change feed wakes up when an order is added while waiting."""
+        import threading
+        store = InMemoryDataStore()
+        threading.Timer(0.05, lambda: store.add_order({'patient_mrn': 'MRN123'})).start()
+
+        changes = store.get_changes(None, 10, timeout=5)
+        assert [change.order['order_id'] for change in changes] == [1]
+
+    def test_consume_rate_limit(self):
+        """Test tokens are taken until the bucket is empty, then a wait time is returned."""
+        store = InMemoryDataStore()
+        assert store.consume_rate_limit('generate:ip:1', capacity=2, refill_rate=1) == 0
+        assert store.consume_rate_limit('generate:ip:1', capacity=2, refill_rate=1) == 0
+
+        retry_after = store.consume_rate_limit('generate:ip:1', capacity=2, refill_rate=1)
+        assert 0 < retry_after <= 1
+        assert store.consume_rate_limit('generate:ip:2', capacity=2, refill_rate=1) == 0
+
+    def test_prune_rate_limits(self):
+        """Test only buckets that have refilled completely are dropped."""
+        store = InMemoryDataStore()
+        store.consume_rate_limit('generate:ip:1', capacity=2, refill_rate=1000)
+        store.consume_rate_limit('generate:ip:2', capacity=2, refill_rate=0.001)
+        time.sleep(0.01)
+
+        assert store.prune_rate_limits(capacity=2, refill_rate=1000) == 2
+        store.consume_rate_limit('generate:ip:2', capacity=2, refill_rate=0.001)
+        assert store.prune_rate_limits(capacity=2, refill_rate=0.001) == 0
+        assert list(store.rate_limits) == ['generate:ip:2']
+
+    def test_query_care_plans(self):
+        """Test care plans are found by every term of one section, newest first and paginated."""
+        store = InMemoryDataStore()
+        plans = [
+            "Monitoring plan & lab schedule\n- Renal panel weekly",
+            "Monitoring plan & lab schedule\n- CBC and renal panel",
+            "Problem list\n- Renal injury risk\nMonitoring plan & lab schedule\n- CBC",
+        ]
+        for plan in plans:
+            store.add_order({'patient_mrn': 'MRN123', 'care_plan': plan})
+
+        first = store.query_care_plans('monitoring', ['renal', 'panel'], limit=1)
+        second = store.query_care_plans('monitoring', ['renal', 'panel'], limit=1, offset=1)
+
+        assert first['total'] == 2
+        assert [o['order_id'] for o in first['orders'] + second['orders']] == [2, 1]
+        assert first['next_offset'] == 1 and second['next_offset'] is None
+        assert first['orders'][0]['care_plan_sections']['monitoring'] == ['CBC and renal panel']
+        assert store.query_care_plans('monitoring', ['renal', 'weekly', 'cbc'], limit=5)['total'] == 0
@@ -0,0 +1,37 @@
+import pytest
+import sys
+from datetime import datetime
+from pathlib import Path
+from flask import Flask, jsonify, request
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.json_provider import install_json_provider
+
+orjson = pytest.importorskip('orjson')
+
+class TestOrjsonProvider:
+
+    def setup_method(self):
+        self.app = Flask(__name__)
+        self.default_app = Flask(__name__)
+        assert install_json_provider(self.app) == 'orjson'
+
+    def test_response_matches_default_provider(self):
+        """Test orjson responses decode to the same value as the stdlib provider's, dates included."""
+        payload = {'order_id': 1, 'care_plan': 'Plan ✓', 'timestamp': datetime(2026, 1, 2, 3, 4, 5)}
+        with self.app.app_context():
+            fast = jsonify(payload).get_json()
+        with self.default_app.app_context():
+            default = jsonify(payload).get_json()
+
+        assert fast == default
+
+    def test_loads_parses_request_bodies(self):
+        """Test request JSON is parsed by the provider."""
+        with self.app.test_request_context(json={'medication': 'IVIG'}):
+            assert request.get_json() == {'medication': 'IVIG'}
+
+    def test_dumps_with_stdlib_options_falls_back(self):
+        """Test options only the stdlib encoder understands still work."""
+        assert self.app.json.dumps({'a': 1}, indent=2) == '{\n  "a": 1\n}'
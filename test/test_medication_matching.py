@@ -0,0 +1,36 @@
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.medication_matching import MedicationIndex, normalize_medication, similarity
+
+class TestMedicationMatching:
+
+    def test_normalize_medication_synonyms_and_strengths(self):
+        """Test normalization maps strengths, forms and synonyms onto one name."""
+        assert normalize_medication("IVIG") == "ivig"
+        assert normalize_medication("IVIg 10%") == "ivig"
+        assert normalize_medication("Immune Globulin (Human) 10% IV") == "ivig"
+        assert normalize_medication("Aspirin 81 mg tablet") == "aspirin"
+        assert normalize_medication("") == ""
+
+    def test_similarity(self):
+        """Test trigram similarity of normalized names."""
+        assert similarity("aspirin", "aspirin") == 1.0
+        assert similarity("aspirin", "asprin") >= 0.5
+        assert similarity("warfarin", "heparin") < 0.5
+        assert similarity("", "aspirin") == 0.0
+
+    def test_index_finds_near_duplicates_for_patient_only(self):
+        """Test the index only returns the patient's similar medications."""
+        index = MedicationIndex()
+        index.add('MRN123', 'Immune Globulin 10%')
+        index.add('MRN123', 'Warfarin')
+        index.add('MRN456', 'IVIG')
+
+        matches = index.find_similar('MRN123', 'IVIg', 0.5)
+        assert matches == [{'medication': 'Immune Globulin 10%', 'similarity': 1.0}]
+        assert index.find_similar('MRN789', 'IVIG', 0.5) == []
+        assert index.find_similar('MRN123', 'Heparin', 0.5) == []
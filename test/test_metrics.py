@@ -0,0 +1,127 @@
+import json
+import os
+import pytest
+import subprocess
+from unittest.mock import MagicMock
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app import metrics
+from app.metrics import MetricsRegistry, instrument_store, record_llm_usage
+from app.in_memory_data_store import InMemoryDataStore
+
+def sample_count(histogram, *label_values):
+    series = histogram._values.get(label_values)
+    return series[2] if series else 0
+
+class TestMetrics:
+
+    def test_histogram_renders_cumulative_buckets(self):
+        """Test histograms render cumulative bucket counts, sum and count."""
+        registry = MetricsRegistry()
+        histogram = registry.histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1))
+        histogram.observe(0.05, '/a')
+        histogram.observe(0.5, '/a')
+        histogram.observe(5, '/a')
+
+        output = registry.render()
+        assert '# TYPE latency_seconds histogram' in output
+        assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in output
+        assert 'latency_seconds_bucket{route="/a",le="1"} 2' in output
+        assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in output
+        assert 'latency_seconds_count{route="/a"} 3' in output
+
+    def test_counter_and_gauge(self):
+        """Test counters accumulate and gauges go up and down."""
+        registry = MetricsRegistry()
+        counter = registry.counter('rows_total', 'Rows.', ('format',))
+        gauge = registry.gauge('in_flight', 'In flight.')
+        counter.inc(3, 'csv')
+        counter.inc(2, 'csv')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+
+        output = registry.render()
+        assert 'rows_total{format="csv"} 5' in output
+        assert 'in_flight 1' in output
+
+    def test_instrument_store_times_methods_and_counts_errors(self):
+        """Test instrumented stores record per-method timings and errors."""
+        store = instrument_store(InMemoryDataStore())
+        before = sample_count(metrics.DATASTORE_OPERATION_DURATION, 'get_stats')
+        store.get_stats()
+        assert sample_count(metrics.DATASTORE_OPERATION_DURATION, 'get_stats') == before + 1
+
+        errors_before = metrics.DATASTORE_OPERATION_ERRORS._values.get(('search_orders',), 0)
+        with pytest.raises(ValueError):
+            store.search_orders('', 10)
+        assert metrics.DATASTORE_OPERATION_ERRORS._values[('search_orders',)] == errors_before + 1
+
+        # Generators keep streaming lazily
+        assert list(store.iter_orders()) == []
+
+    def test_record_llm_usage(self):
+        """Test LLM latency and token counts are recorded."""
+        usage = MagicMock(input_tokens=100, output_tokens=50, cache_read_input_tokens=None,
+                          cache_creation_input_tokens=0)
+        input_before = metrics.LLM_TOKENS._values.get(('input',), 0)
+        calls_before = sample_count(metrics.LLM_REQUEST_DURATION)
+
+        record_llm_usage(usage, 2.0, 0.4)
+
+        assert metrics.LLM_TOKENS._values[('input',)] == input_before + 100
+        assert sample_count(metrics.LLM_REQUEST_DURATION) == calls_before + 1
+
+    def test_record_llm_usage_per_example(self):
+        """Test prompt tokens and latency are also recorded under the prompt's example."""
+        usage = MagicMock(input_tokens=800, output_tokens=50, cache_read_input_tokens=None,
+                          cache_creation_input_tokens=None)
+
+        record_llm_usage(usage, 1.5, example='anti_tnf')
+
+        assert metrics.LLM_PROMPT_TOKENS._values[('anti_tnf',)][1] >= 800
+        assert metrics.LLM_REQUEST_DURATION_BY_EXAMPLE._values[('anti_tnf',)][2] >= 1
+        assert 'llm_prompt_tokens_bucket{example="anti_tnf",le="1000"}' in '\n'.join(metrics.LLM_PROMPT_TOKENS.render())
+
+    def test_multiprocess_render_sums_every_worker(self, tmp_path):
+        """Test with a shared directory each worker renders every worker's metrics, less the gauges of exited ones."""
+        def registry():
+            registry = MetricsRegistry(str(tmp_path))
+            registry.counter('rows_total', 'Rows.', ('format',))
+            registry.gauge('in_flight', 'In flight.')
+            registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+            return registry
+
+        # A worker that has exited, and one still running
+        script = ("import sys; sys.path.insert(0, sys.argv[2]); from app.metrics import MetricsRegistry; "
+                  "r = MetricsRegistry(sys.argv[1]); r.counter('rows_total', 'Rows.', ('format',)).inc(2, 'csv'); "
+                  "r.gauge('in_flight', 'In flight.').inc(5); r.histogram('latency_seconds', 'Latency.', "
+                  "buckets=(0.1, 1)).observe(0.5); r.flush()")
+        subprocess.run([sys.executable, '-c', script, str(tmp_path), str(Path(__file__).parent.parent)], check=True)
+        running = registry()
+        running._metrics['in_flight'].inc(1)
+        (tmp_path / f'{os.getppid()}.json').write_text(json.dumps(running.snapshot()))
+
+        this = registry()
+        this._metrics['rows_total'].inc(3, 'csv')
+        this._metrics['latency_seconds'].observe(0.05)
+        output = this.render()
+
+        assert 'rows_total{format="csv"} 5' in output
+        assert 'in_flight 1' in output
+        assert 'latency_seconds_bucket{le="0.1"} 1' in output
+        assert 'latency_seconds_bucket{le="1"} 2' in output
+        assert 'latency_seconds_count 2' in output
+
+    def test_without_a_directory_render_is_per_process(self):
+        """Test flushing is a no-op and render reports only this process without PROMETHEUS_MULTIPROC_DIR."""
+        registry = MetricsRegistry()
+        registry.counter('rows_total', 'Rows.').inc(1)
+        registry.flush()
+        registry.start_flushing(0.01)
+
+        assert 'rows_total 1' in registry.render()
+        assert registry._flushing_pid is None
@@ -0,0 +1,38 @@
+import gzip
+import pytest
+import sys
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.order_archive import archive_path, read_archive, write_archive
+
+class TestOrderArchive:
+
+    def test_round_trip(self, tmp_path):
+        """Test archived orders read back with their timestamps as datetimes."""
+        orders = [
+            {'order_id': 1, 'timestamp': datetime(2023, 1, 5, 10, 0), 'medication': 'IVIG'},
+            {'order_id': 2, 'timestamp': datetime(2023, 1, 6, 11, 30), 'medication': 'Rituximab'},
+        ]
+        path = archive_path(str(tmp_path), 'orders_2023_01')
+
+        assert write_archive(path, orders) == (2, 2)
+        assert list(read_archive(path)) == orders
+
+    def test_file_is_compressed_ndjson(self, tmp_path):
+        """Test the archive is gzip-compressed with one order per line and no partial file left behind."""
+        path = archive_path(str(tmp_path), 'orders_2023_01')
+        write_archive(path, [{'order_id': 1, 'timestamp': None}])
+
+        with gzip.open(path, 'rt') as archive:
+            assert archive.read().count('\n') == 1
+        assert [p.name for p in tmp_path.iterdir()] == ['orders_2023_01.ndjson.gz']
+
+    def test_read_since_order_id(self, tmp_path):
+        """Test reading only the orders after an order id."""
+        path = archive_path(str(tmp_path), 'orders_2023_01')
+        write_archive(path, [{'order_id': i, 'timestamp': None} for i in range(1, 6)])
+
+        assert [order['order_id'] for order in read_archive(path, since_order_id=3)] == [4, 5]
@@ -0,0 +1,33 @@
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.pagination import encode_cursor, decode_cursor, clamp_page_size, normalize_date, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+class TestPagination:
+
+    def test_cursor_round_trip(self):
+        """Test a cursor decodes to the position it was encoded from."""
+        cursor = encode_cursor('2025-01-08T12:00:00', 42)
+        assert decode_cursor(cursor) == ('2025-01-08T12:00:00', 42)
+
+    def test_decode_invalid_cursor_raises_error(self):
+        """Test decoding a malformed cursor raises ValueError."""
+        with pytest.raises(ValueError, match="Invalid pagination cursor"):
+            decode_cursor('not-a-cursor')
+
+    def test_clamp_page_size(self):
+        """Test page sizes are clamped to the supported range."""
+        assert clamp_page_size(None) == DEFAULT_PAGE_SIZE
+        assert clamp_page_size(0) == DEFAULT_PAGE_SIZE
+        assert clamp_page_size(10) == 10
+        assert clamp_page_size(MAX_PAGE_SIZE + 1) == MAX_PAGE_SIZE
+
+    def test_normalize_date(self):
+        """Test date filters are normalized to ISO datetimes."""
+        assert normalize_date('2025-01-08') == '2025-01-08T00:00:00'
+        assert normalize_date(None) is None
+        with pytest.raises(ValueError):
+            normalize_date('yesterday')
@@ -1,3 +1,4 @@
+import json
 import pytest
 from unittest.mock import patch, MagicMock, Mock
 import sys
@@ -9,20 +10,36 @@ sys.modules['psycopg'] = Mock()
 sys.modules['psycopg.rows'] = Mock()
 
 from app.postgres_data_store import PostgreSQLDataStore
+from app.text_blobs import TextCodec
 
 
 class TestPostgreSQLDataStore:
 
     @patch('app.postgres_data_store.psycopg.connect')
     def test_init_with_database_url(self, mock_connect):
-        """Test initialization with database URL."""
+        """Test initialization with database URL doesn't connect."""
         mock_conn = MagicMock()
         mock_connect.return_value = mock_conn
         
         store = PostgreSQLDataStore(database_url='postgresql://test')
         
         assert store.database_url == 'postgresql://test'
-        mock_connect.assert_called()
+        mock_connect.assert_not_called()
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_migrate_creates_schema(self, mock_connect):
+        """Test migrate runs the schema DDL in a single statement."""
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+        store.migrate()
+
+        assert mock_cursor.execute.call_count == 1
+        assert 'CREATE TABLE IF NOT EXISTS orders' in mock_cursor.execute.call_args[0][0]
 
     def test_init_without_database_url_raises_error(self):
         """Test initialization without database URL raises ValueError."""
@@ -136,7 +153,7 @@ class TestPostgreSQLDataStore:
         store = PostgreSQLDataStore(database_url='postgresql://test')
         store.add_provider('1234567890', 'Dr. Smith')
         
-        assert mock_cursor.execute.call_count == 2
+        assert mock_cursor.execute.call_count == 1
         mock_conn.commit.assert_called()
 
     @patch('app.postgres_data_store.psycopg.connect')
@@ -160,14 +177,50 @@ class TestPostgreSQLDataStore:
         }
         store.add_order(order_data)
         
-        assert mock_cursor.execute.call_count == 2
+        assert mock_cursor.execute.call_count == 1
+        assert 'INSERT INTO order_details' in mock_cursor.execute.call_args[0][0]
         mock_conn.commit.assert_called()
 
+    def test_order_params_reference_text_by_hash(self):
+        """Test order text is passed compressed with its content hash, and the same text gets the same hash."""
+        codec = TextCodec()
+        records = 'Prior IVIG course tolerated. ' * 20
+        params = PostgreSQLDataStore.order_params({
+            'patient_mrn': '123456', 'patient_first_name': 'John', 'patient_last_name': 'Doe',
+            'provider_npi': '1234567890', 'provider_name': 'Dr. Smith', 'medication': 'IVIG',
+            'primary_diagnosis': 'G70.00', 'medication_history': records, 'patient_records': records,
+        }, codec)
+
+        medication_history_blob, patient_records_blob, care_plan_blob = params[9:13], params[13:17], params[17:21]
+        assert medication_history_blob == patient_records_blob
+        assert codec.decompress(patient_records_blob[3]) == records
+        assert patient_records_blob[2] < patient_records_blob[1]
+        assert params[21:24] == (medication_history_blob[0], patient_records_blob[0], care_plan_blob[0])
+        assert params[24:26] == (records, '')
+        assert json.loads(params[27]) == {'problems': [], 'goals': [], 'interventions': [], 'monitoring': []}
+
+    def test_text_in_two_fields_counts_two_references(self):
+        """Test a text an order holds in two fields gains a reference per field, as archiving takes one per field."""
+        records = 'Prior IVIG course tolerated. ' * 20
+        params = PostgreSQLDataStore.order_params({
+            'patient_mrn': '123456', 'patient_first_name': 'John', 'patient_last_name': 'Doe',
+            'provider_npi': '1234567890', 'provider_name': 'Dr. Smith', 'medication': 'IVIG',
+            'primary_diagnosis': 'G70.00', 'medication_history': records, 'patient_records': records,
+            'care_plan': 'Plan',
+        }, TextCodec())
+        blob_hashes = [params[9], params[13], params[17]]
+        assert blob_hashes.count(params[9]) == 2
+
+        new_blobs = PostgreSQLDataStore.INSERT_ORDER_SQL.split('new_blobs AS')[1].split('INSERT INTO order_details')[0]
+        assert 'COUNT(*)' in new_blobs and 'GROUP BY hash' in new_blobs
+        assert 'ref_count = blob.ref_count + EXCLUDED.ref_count' in new_blobs
+        assert 'DISTINCT' not in new_blobs
+
     @patch('app.postgres_data_store.psycopg.connect')
     def test_get_stats(self, mock_connect):
         """Test getting statistics."""
         mock_cursor = MagicMock()
-        mock_cursor.fetchone.side_effect = [(5,), (3,), (2,)]
+        mock_cursor.fetchone.side_effect = [(5,), (3,), (2,), (3.5,)]
         mock_conn = MagicMock()
         mock_conn.__enter__.return_value = mock_conn
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
@@ -178,4 +231,488 @@ class TestPostgreSQLDataStore:
         
         assert stats['total_orders'] == 5
         assert stats['total_patients'] == 3
-        assert stats['total_providers'] == 2
\ No newline at end of file
+        assert stats['total_providers'] == 2
+        assert stats['text_compression_ratio'] == 3.5
+
+    def replica_connections(self, mock_connect, replica_status=(0, '0/100')):
+        # Separate connections per URL, so tests can tell which one served a query
+        connections = {}
+        def connect(url, **kwargs):
+            if url not in connections:
+                cursor = MagicMock()
+                if url == 'postgresql://primary':
+                    cursor.fetchone.side_effect = [('0/200',), None]
+                else:
+                    cursor.fetchone.return_value = replica_status
+                conn = MagicMock()
+                conn.__enter__.return_value = conn
+                conn.cursor.return_value.__enter__.return_value = cursor
+                connections[url] = conn
+            return connections[url]
+        mock_connect.side_effect = connect
+        return connections
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_reads_go_to_fresh_replica(self, mock_connect):
+        """Test replica-eligible reads are served by a replica within the lag limit."""
+        connections = self.replica_connections(mock_connect)
+        store = PostgreSQLDataStore(database_url='postgresql://primary', replica_urls=['postgresql://replica'])
+
+        store.check_duplicate_order('123456', 'IVIG')
+
+        assert 'postgresql://primary' not in connections
+        executed = [call[0][0] for call in connections['postgresql://replica'].cursor.return_value.__enter__.return_value.execute.call_args_list]
+        assert executed[-1] == PostgreSQLDataStore.SELECT_DUPLICATE_ORDER_SQL
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_reads_pinned_to_primary_skip_replicas(self, mock_connect):
+        """Test reads made while reading_from_primary is in effect go to the primary even with a fresh replica."""
+        from app.replicas import reading_from_primary
+        connections = self.replica_connections(mock_connect)
+        store = PostgreSQLDataStore(database_url='postgresql://primary', replica_urls=['postgresql://replica'])
+
+        with reading_from_primary():
+            store.check_duplicate_order('123456', 'IVIG')
+
+        assert 'postgresql://replica' not in connections
+        primary_cursor = connections['postgresql://primary'].cursor.return_value.__enter__.return_value
+        assert primary_cursor.execute.call_args[0][0] == PostgreSQLDataStore.SELECT_DUPLICATE_ORDER_SQL
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_stale_replica_falls_back_to_primary(self, mock_connect):
+        """Test reads go to the primary when the replica lags more than allowed."""
+        connections = self.replica_connections(mock_connect, replica_status=(30, '0/100'))
+        store = PostgreSQLDataStore(database_url='postgresql://primary', replica_urls=['postgresql://replica'],
+                                    max_replica_lag=5)
+
+        store.check_duplicate_order('123456', 'IVIG')
+
+        primary_cursor = connections['postgresql://primary'].cursor.return_value.__enter__.return_value
+        assert primary_cursor.execute.call_args[0][0] == PostgreSQLDataStore.SELECT_DUPLICATE_ORDER_SQL
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_unreachable_replica_fails_over(self, mock_connect):
+        """Test a replica that can't be reached is marked down and the primary serves the read."""
+        connections = self.replica_connections(mock_connect)
+        fallback = mock_connect.side_effect
+        def connect(url, **kwargs):
+            if url == 'postgresql://replica':
+                raise Exception("connection refused")
+            return fallback(url, **kwargs)
+        mock_connect.side_effect = connect
+        store = PostgreSQLDataStore(database_url='postgresql://primary', replica_urls=['postgresql://replica'])
+
+        store.check_duplicate_order('123456', 'IVIG')
+
+        assert 'postgresql://primary' in connections
+        assert store.replicas.candidates() == []
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_session_reads_its_own_writes(self, mock_connect):
+        """Test a session's read after its write skips a replica that hasn't replayed the write."""
+        from app.replicas import StoreSession, current_session
+        connections = self.replica_connections(mock_connect, replica_status=(0, '0/100'))
+        store = PostgreSQLDataStore(database_url='postgresql://primary', replica_urls=['postgresql://replica'])
+
+        session = StoreSession()
+        token = current_session.set(session)
+        try:
+            store.add_patient('123456', 'Jane', 'Doe')
+            store.validate_patient('123456', 'Jane', 'Doe')
+        finally:
+            current_session.reset(token)
+
+        primary_cursor = connections['postgresql://primary'].cursor.return_value.__enter__.return_value
+        executed = [call[0][0] for call in primary_cursor.execute.call_args_list]
+        assert executed == [
+            PostgreSQLDataStore.INSERT_PATIENT_SQL, PostgreSQLDataStore.SELECT_WAL_LSN_SQL,
+            PostgreSQLDataStore.SELECT_PATIENT_SQL,
+        ]
+        assert session.written_lsn == '0/200'
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_echoed_lsn_holds_back_reads_on_any_worker(self, mock_connect):
+        """Test a store that never saw the write still skips a replica behind the LSN the client echoed."""
+        from app.replicas import StoreSession, current_session
+        connections = self.replica_connections(mock_connect, replica_status=(0, '0/100'))
+        store = PostgreSQLDataStore(database_url='postgresql://primary', replica_urls=['postgresql://replica'])
+
+        token = current_session.set(StoreSession('0/200'))
+        try:
+            store.check_duplicate_order('123456', 'IVIG')
+        finally:
+            current_session.reset(token)
+
+        primary_cursor = connections['postgresql://primary'].cursor.return_value.__enter__.return_value
+        assert primary_cursor.execute.call_args[0][0] == PostgreSQLDataStore.SELECT_DUPLICATE_ORDER_SQL
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_migrate_partitions_orders(self, mock_connect):
+        """Test the schema partitions orders by month and creates partitions ahead."""
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        PostgreSQLDataStore(database_url='postgresql://test').migrate()
+
+        ddl = mock_cursor.execute.call_args[0][0]
+        assert 'PARTITION BY RANGE (timestamp)' in ddl
+        assert 'SELECT ensure_order_partitions(3)' in ddl
+        assert ddl.index('CREATE TABLE IF NOT EXISTS order_archives') < ddl.index('SELECT ensure_order_partitions(3)')
+        assert 'DROP TABLE IF EXISTS store_version' in ddl
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_new_partitions_take_over_default_partition_rows(self, mock_connect):
+        """Test a month's orders in the default partition are moved into its partition, not left behind."""
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        PostgreSQLDataStore(database_url='postgresql://test').migrate()
+
+        ddl = mock_cursor.execute.call_args[0][0]
+        assert 'RAISE NOTICE' not in ddl
+        assert 'DELETE FROM orders_default' in ddl
+        assert 'ATTACH PARTITION' in ddl
+        assert 'PG_ADVISORY_XACT_LOCK' in ddl
+        assert 'bump_store_version()' not in ddl.replace('DROP FUNCTION IF EXISTS bump_store_version()', '')
+
+    @patch('app.postgres_data_store.date')
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_archive_orders_moves_old_partitions(self, mock_connect, mock_date, tmp_path):
+        """Test partitions past the retention window are written to archive files, then detached and dropped."""
+        from datetime import date, datetime
+        mock_date.today.return_value = date(2025, 6, 15)
+        mock_date.side_effect = date
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [('orders_2024_05',), ('orders_2024_06',), ('orders_default',)]
+        mock_cursor.__iter__.return_value = iter([{'order_id': 7, 'timestamp': datetime(2024, 5, 2)}])
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test', archive_dir=str(tmp_path))
+        archived = store.archive_orders(retention_months=12)
+
+        assert [archive['partition'] for archive in archived] == ['orders_2024_05']
+        assert archived[0]['rows'] == 1
+        executed = [call[0][0] for call in mock_cursor.execute.call_args_list]
+        assert "ALTER TABLE orders DETACH PARTITION orders_2024_05" in executed
+        assert "DROP TABLE orders_2024_05" in executed
+        released = next(statement for statement in executed if 'UPDATE text_blobs' in statement)
+        assert 'COUNT(*) AS count' in released
+        assert any(statement.strip().startswith('INSERT INTO order_archives') for statement in executed)
+        assert not any('orders_2024_06' in statement for statement in executed)
+
+        # Archived orders are still readable for exports
+        mock_cursor.fetchall.return_value = [(archived[0]['path'],)]
+        assert [order['order_id'] for order in store.iter_archived_orders()] == [7]
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_list_orders_returns_next_cursor(self, mock_connect):
+        """Test listing orders fetches one extra row to build the next cursor."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [
+            {'order_id': 3, 'timestamp': '2025-01-03T10:00:00'},
+            {'order_id': 2, 'timestamp': '2025-01-02T10:00:00'},
+            {'order_id': 1, 'timestamp': '2025-01-01T10:00:00'},
+        ]
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+        page = store.list_orders(2, provider_npi='1234567890', include_text=False)
+
+        assert [o['order_id'] for o in page['orders']] == [3, 2]
+        assert page['next_cursor'] is not None
+        query, params = mock_cursor.execute.call_args[0]
+        assert 'provider_npi = %s' in query
+        assert 'care_plan' not in query
+        assert params == ('1234567890', 3)
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_get_patient_history(self, mock_connect):
+        """Test patient history queries orders and a summary for the MRN."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [{'order_id': 2}, {'order_id': 1}]
+        mock_cursor.fetchone.return_value = {
+            'total_orders': 2,
+            'medications': ['Aspirin'],
+            'providers': [{'npi': '2', 'name': 'Dr. Jones'}, {'npi': '1', 'name': 'Dr. Smith'}],
+            'last_order_date': '2025-01-02T10:00:00'
+        }
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+        history = store.get_patient_history('123456', 10)
+
+        assert [o['order_id'] for o in history['orders']] == [2, 1]
+        assert history['summary']['total_orders'] == 2
+        assert [p['npi'] for p in history['summary']['providers']] == ['1', '2']
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_find_similar_orders(self, mock_connect):
+        """Test near-duplicate lookup queries trigram similarity on the normalized medication."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [{'medication': 'IVIG', 'similarity': 1.0}]
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+        matches = store.find_similar_orders('123456', 'Immune Globulin 10%', 0.5)
+
+        assert matches == [{'medication': 'IVIG', 'similarity': 1.0}]
+        (threshold_sql, threshold_params), (query, params) = [c[0] for c in mock_cursor.execute.call_args_list]
+        assert 'pg_trgm.similarity_threshold' in threshold_sql and threshold_params == ('0.5',)
+        assert 'medication_normalized %% %s' in query and 'SIMILARITY(medication_normalized' in query
+        assert params[:3] == ('ivig', '123456', 'ivig')
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_export_orders_since_order_id(self, mock_connect):
+        """Test incremental export filters on the order id cursor."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [{'order_id': 4}]
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+        orders = store.export_orders(since_order_id=3)
+
+        assert orders == [{'order_id': 4}]
+        query, params = mock_cursor.execute.call_args[0]
+        assert 'order_id > %s' in query
+        assert params == (3,)
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_export_orders_is_oldest_first(self, mock_connect):
+        """Test full and incremental exports all ask for orders oldest-first, as the other stores return them."""
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+
+        for kwargs in ({}, {'since_order_id': 3}, {'since_timestamp': '2024-01-01'}):
+            store.export_orders(**kwargs)
+            order_by = mock_cursor.execute.call_args[0][0].split('ORDER BY')[1]
+            assert 'DESC' not in order_by
+            assert order_by.strip().endswith('order_id')
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_export_orders_joins_only_requested_text(self, mock_connect):
+        """Test exports join order_details for the chosen text columns and skip it without any."""
+        mock_cursor = MagicMock()
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+        store.export_orders(text_fields=('care_plan',))
+        query = mock_cursor.execute.call_args[0][0]
+        assert 'LEFT JOIN order_details' in query
+        assert 'care_plan' in query and 'patient_records' not in query
+
+        store.export_orders(text_fields=())
+        query = mock_cursor.execute.call_args[0][0]
+        assert 'order_details' not in query
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_get_order_details(self, mock_connect):
+        """Test order details are loaded by order id from order_details."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [{'order_id': 4, 'care_plan': TextCodec().compress('Plan')}]
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+        details = store.get_order_details([4, 5], ('care_plan',))
+
+        assert details == {4: {'care_plan': 'Plan'}}
+        query, params = mock_cursor.execute.call_args[0]
+        assert query.startswith("SELECT order_id, care_plan_blob.data AS care_plan FROM order_details")
+        assert 'patient_records' not in query
+        assert params == ([4, 5],)
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_get_version(self, mock_connect):
+        """Test the store version is derived from the rows' writing transactions, without a counter row."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = (7,)
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+        assert store.get_version() == 7
+        query = mock_cursor.execute.call_args[0][0]
+        assert 'PG_SNAPSHOT_XMIN(PG_CURRENT_SNAPSHOT())' in query
+        assert all(f'FROM {table} WHERE write_xid' in query for table in PostgreSQLDataStore.VERSIONED_TABLES)
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_get_analytics(self, mock_connect):
+        """Test analytics are read from the daily summary table."""
+        from datetime import date
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.side_effect = [
+            [{'period': date(2025, 1, 1), 'orders': 3}],
+            [
+                {'dimension': 'diagnosis', 'key': 'mg', 'count': 3},
+                {'dimension': 'medication', 'key': 'ivig', 'count': 2},
+                {'dimension': 'provider', 'key': '1', 'count': 3},
+            ]
+        ]
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+        analytics = store.get_analytics(start_date='2025-01-01T00:00:00', bucket='month')
+
+        assert analytics['total_orders'] == 3
+        assert analytics['series'] == [{'period': '2025-01-01', 'orders': 3}]
+        assert analytics['by_medication'] == [{'key': 'ivig', 'count': 2}]
+        assert analytics['top_diagnoses'] == [{'key': 'mg', 'count': 3}]
+        query, params = mock_cursor.execute.call_args_list[0][0]
+        assert 'order_daily_stats' in query
+        assert params == ('month', '2025-01-01T00:00:00')
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_get_changes_returns_without_waiting_when_orders_exist(self, mock_connect):
+        """Test the change feed returns committed orders after the cursor without listening on the connection."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.return_value = [{'order_id': 4, 'change_xid': 812}]
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+        changes = store.get_changes([790, 3], 10, timeout=30)
+
+        assert changes == [([812, 4], {'order_id': 4})]
+        query, params = mock_cursor.execute.call_args[0]
+        assert 'PG_SNAPSHOT_XMIN(PG_CURRENT_SNAPSHOT())' in query
+        assert params == (790, 3, 10)
+        mock_conn.execute.assert_not_called()
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_get_changes_waits_on_the_order_signal(self, mock_connect):
+        """Test an empty read waits for the process's orders listener, then reads again."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchall.side_effect = [[], [{'order_id': 5, 'change_xid': 900}]]
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+        store.order_signal = Mock(generation=0)
+        changes = store.get_changes(None, 10, timeout=30)
+
+        assert changes == [([900, 5], {'order_id': 5})]
+        store.order_signal.wait.assert_called_once()
+        assert mock_cursor.execute.call_args_list[0][0][1] == (0, 0, 10)
+
+    def test_get_changes_rejects_malformed_cursors(self):
+        """Test change feed cursors must be a [transaction id, order id] pair."""
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+        for cursor in (3, [1], [1, -2], ['1', 2]):
+            with pytest.raises(ValueError):
+                store.get_changes(cursor, 10, timeout=0)
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_consume_rate_limit(self, mock_connect):
+        """Test the token bucket is updated in one upsert and rejections report when tokens are available."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.side_effect = [(4.0, True), (0.5, False)]
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+
+        assert store.consume_rate_limit('generate:ip:1', capacity=5, refill_rate=0.25) == 0
+        assert store.consume_rate_limit('generate:ip:1', capacity=5, refill_rate=0.25) == 2.0
+        query, params = mock_cursor.execute.call_args[0]
+        assert 'ON CONFLICT (key) DO UPDATE' in query
+        assert params['key'] == 'generate:ip:1'
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_prune_rate_limits(self, mock_connect):
+        """Test buckets refilled up to capacity are deleted, and the count of deleted rows is returned."""
+        mock_cursor = MagicMock(rowcount=3)
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        assert PostgreSQLDataStore(database_url='postgresql://test').prune_rate_limits(5, 0.25) == 3
+        query, params = mock_cursor.execute.call_args[0]
+        assert query == PostgreSQLDataStore.PRUNE_RATE_LIMITS_SQL
+        assert params == {'capacity': 5.0, 'refill_rate': 0.25}
+        mock_conn.commit.assert_called_once()
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_listen_identity_changes(self, mock_connect):
+        """Test provider and patient notifications are decoded and passed on until the stop event is set."""
+        import threading
+        notify = Mock(payload='{"op": "INSERT", "table": "providers", "row": {"npi": "1234567893", "name": "Dr. Smith"}}')
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.notifies.return_value = [notify]
+        mock_connect.return_value = mock_conn
+        stop = threading.Event()
+        changes = []
+
+        def on_change(change):
+            changes.append(change)
+            if change is not None:
+                stop.set()
+
+        PostgreSQLDataStore(database_url='postgresql://test').listen_identity_changes(on_change, stop)
+
+        mock_conn.execute.assert_called_with("LISTEN identities_changed")
+        assert changes == [None, {'op': 'INSERT', 'table': 'providers', 'row': {'npi': '1234567893', 'name': 'Dr. Smith'}}]
+
+    @patch('app.postgres_data_store.psycopg.connect')
+    def test_query_care_plans_uses_term_containment(self, mock_connect):
+        """Test section queries match the parsed terms by JSONB containment and never touch the care plan text."""
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = {'total': 3}
+        mock_cursor.fetchall.return_value = [{'order_id': 9, 'care_plan_sections': {'monitoring': ['Renal panel']}}]
+        mock_conn = MagicMock()
+        mock_conn.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_connect.return_value = mock_conn
+
+        store = PostgreSQLDataStore(database_url='postgresql://test')
+        result = store.query_care_plans('monitoring', ['renal'], limit=1)
+
+        query, params = mock_cursor.execute.call_args[0]
+        assert 'care_plan_terms @> %s::jsonb' in query
+        assert 'care_plan_hash' not in query
+        assert json.loads(params[0]) == {'monitoring': ['renal']}
+        assert result == {'total': 3, 'orders': mock_cursor.fetchall.return_value, 'next_offset': 1}
+        with pytest.raises(ValueError, match="section must be one of"):
+            store.query_care_plans('summary', ['renal'], limit=1)
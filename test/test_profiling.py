@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.profiling import RequestProfiler, ProfileStore, traced
+
+@traced('test.work')
+def work():
+    return sum(range(1000))
+
+@traced('test.async_work')
+async def async_work():
+    await asyncio.sleep(0.01)
+    return 1
+
+class TestRequestProfiler:
+
+    def test_requested_profile_requires_admin_token(self):
+        """Test explicitly requested profiles are only captured for admins."""
+        profiler = RequestProfiler(admin_token='secret')
+        assert profiler.start('GET', '/x', True, None) is None
+        assert profiler.start('GET', '/x', True, 'wrong') is None
+
+        active = profiler.start('GET', '/x', True, 'secret')
+        assert active is not None
+        report = profiler.finish(active, 200)
+        assert profiler.store.get(report.profile_id) is report
+        assert 'function calls' in report.stats
+
+    def test_no_admin_token_configured_disables_requested_profiles(self):
+        """Test requested profiles are refused when no admin token is configured."""
+        profiler = RequestProfiler()
+        assert profiler.start('GET', '/x', True, '') is None
+        assert profiler.is_admin(None) is False
+
+    def test_sampling_profiles_one_in_n_requests(self):
+        """Test sampling captures every Nth request."""
+        profiler = RequestProfiler(sample_every=3)
+        results = []
+        for _ in range(6):
+            active = profiler.start('GET', '/x', False, None)
+            results.append(active is not None)
+            if active:
+                assert active.report.sampled is True
+                profiler.finish(active)
+        assert results == [False, False, True, False, False, True]
+
+    def test_traced_records_spans_only_while_profiling(self):
+        """Test traced functions add spans to the active profile and are no-ops otherwise."""
+        profiler = RequestProfiler(admin_token='secret')
+        assert work() == 499500
+
+        active = profiler.start('GET', '/x', True, 'secret')
+        work()
+        report = profiler.finish(active)
+        assert [span['name'] for span in report.spans] == ['test.work']
+
+    def test_traced_coroutine_records_await_time(self):
+        """Test traced coroutines record a span covering the awaited work."""
+        profiler = RequestProfiler(admin_token='secret')
+        active = profiler.start('GET', '/x', True, 'secret')
+        assert asyncio.run(async_work()) == 1
+        report = profiler.finish(active)
+
+        assert [span['name'] for span in report.spans] == ['test.async_work']
+        assert report.spans[0]['duration'] >= 0.01
+
+    def test_profile_store_is_bounded(self):
+        """Test the profile store keeps only the newest reports."""
+        profiler = RequestProfiler(admin_token='secret', store=ProfileStore(capacity=2))
+        ids = []
+        for _ in range(3):
+            ids.append(profiler.finish(profiler.start('GET', '/x', True, 'secret')).profile_id)
+
+        assert profiler.store.get(ids[0]) is None
+        assert [r['profile_id'] for r in profiler.store.list()] == [ids[2], ids[1]]
@@ -0,0 +1,56 @@
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.prompt import DEFAULT_EXAMPLE, generate_prompt, select_example
+from app.prompt_examples import EXAMPLES, ExampleIndex, diagnosis_category
+
+ORDER = {
+    'patient_first_name': 'Jane', 'patient_last_name': 'Doe', 'patient_mrn': '123456',
+    'primary_diagnosis': 'G70.00', 'medication': 'IVIG', 'additional_diagnoses': 'None',
+    'medication_history': 'None', 'patient_records': 'None',
+}
+
+class TestExampleIndex:
+
+    def test_medication_and_diagnosis_pick_the_specific_example(self):
+        """Test the drug and ICD-10 category choose the example written for them, whatever the drug is called."""
+        assert select_example(ORDER).name == 'ivig_myasthenia'
+        assert select_example({**ORDER, 'medication': 'Immune Globulin 10%', 'primary_diagnosis': 'D83.9'}).name == 'ivig_immunodeficiency'
+        assert select_example({**ORDER, 'primary_diagnosis': 'g61.81'}).name == 'ivig_neuropathy'
+
+    def test_class_examples_cover_related_drugs(self):
+        """Test brands and biosimilars fall back to the example of their drug class."""
+        assert select_example({**ORDER, 'medication': 'Ocrevus 300 mg'}).name == 'anti_cd20'
+        assert select_example({**ORDER, 'medication': 'Rituximab-abbs'}).name == 'anti_cd20'
+        assert select_example({**ORDER, 'medication': 'Remicade'}).name == 'anti_tnf'
+        assert select_example({**ORDER, 'medication': 'Venofer'}).name == 'iv_iron'
+
+    def test_unknown_medication_uses_default_example(self):
+        """Test a medication without a library example gets the full default example."""
+        assert select_example({**ORDER, 'medication': 'Eculizumab'}) is DEFAULT_EXAMPLE
+        assert select_example({}) is DEFAULT_EXAMPLE
+        assert ExampleIndex(EXAMPLES).lookup('', 'G70.00') is None
+
+    def test_free_text_diagnosis_matches_medication_only(self):
+        """Test a diagnosis that isn't an ICD-10 code still finds the medication's general example."""
+        assert diagnosis_category('Myasthenia gravis') is None
+        assert select_example({**ORDER, 'primary_diagnosis': 'Myasthenia gravis'}).name == 'ivig_myasthenia'
+
+    def test_library_examples_shrink_the_prompt(self):
+        """Test prompts with a library example are a fraction of the size of the default one."""
+        default_prompt = generate_prompt({**ORDER, 'medication': 'Eculizumab'})
+
+        for example in EXAMPLES:
+            assert len(example.text) < len(DEFAULT_EXAMPLE.text) / 3
+        assert len(generate_prompt(ORDER)) < len(default_prompt) / 2
+
+    def test_prompt_uses_the_given_example(self):
+        """Test a caller that already picked the example doesn't have it looked up again."""
+        with patch('app.prompt.select_example') as lookup:
+            prompt = generate_prompt(ORDER, DEFAULT_EXAMPLE)
+
+        lookup.assert_not_called()
+        assert prompt.startswith(DEFAULT_EXAMPLE.text)
@@ -0,0 +1,70 @@
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.replicas import ReplicaRouter, StoreSession, parse_lsn
+
+class TestReplicaRouter:
+
+    def test_parse_lsn_orders_positions(self):
+        """Test LSNs compare by their high then low halves."""
+        assert parse_lsn('0/16B3748') < parse_lsn('0/16B3750') < parse_lsn('1/0')
+
+    def test_candidates_rotate(self):
+        """Test replicas are tried round-robin."""
+        router = ReplicaRouter(['a', 'b'], max_lag=5)
+
+        assert router.candidates() == ['a', 'b']
+        assert router.candidates() == ['b', 'a']
+
+    def test_failed_replica_is_skipped_until_retry(self):
+        """Test a replica marked down is left out until retry_after passes."""
+        router = ReplicaRouter(['a', 'b'], max_lag=5, retry_after=0)
+        router.retry_after = 60
+        router.mark_down('a')
+
+        assert router.candidates() == ['b']
+
+        router.retry_after = 0
+        router.mark_down('a')
+        assert 'a' in router.candidates()
+
+    def test_stale_replica_is_rejected(self):
+        """Test replicas lagging more than max_lag don't serve reads."""
+        router = ReplicaRouter(['a'], max_lag=5)
+        router.update('a', 10.0, '0/100')
+
+        assert router.rejection('a', None) == 'stale'
+
+        router.update('a', 1.0, '0/100')
+        assert router.rejection('a', None) is None
+
+    def test_session_reads_wait_for_its_writes(self):
+        """Test a session that wrote only reads from replicas that replayed its write."""
+        router = ReplicaRouter(['a'], max_lag=5)
+        router.update('a', 0.0, '0/100')
+        required = StoreSession('0/200').required_lsn
+
+        assert router.needs_check('a', required)
+        assert router.rejection('a', required) == 'behind_session'
+
+        router.update('a', 0.0, '0/200')
+        assert not router.needs_check('a', required)
+        assert router.rejection('a', required) is None
+
+class TestStoreSession:
+
+    def test_write_raises_the_required_lsn(self):
+        """Test a write during the request is handed back and waited for by the request's later reads."""
+        session = StoreSession('0/200')
+        session.record_write('0/300')
+
+        assert session.written_lsn == '0/300'
+        assert session.required_lsn == 0x300
+
+    def test_malformed_lsn_is_ignored(self):
+        """Test a mangled echoed LSN leaves the read to the lag rule instead of failing the request."""
+        assert StoreSession('garbage').required_lsn is None
+        assert StoreSession(None).required_lsn is None
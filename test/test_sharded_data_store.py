@@ -0,0 +1,181 @@
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.in_memory_data_store import InMemoryDataStore
+from app.sharded_data_store import ShardedDataStore, shard_index
+
+def order(mrn: str, medication: str = 'IVIG', npi: str = '1234567893', name: str = 'Dr. Smith') -> dict:
+    return {
+        'patient_mrn': mrn, 'patient_first_name': 'Jane', 'patient_last_name': 'Doe',
+        'provider_npi': npi, 'provider_name': name, 'medication': medication,
+        'primary_diagnosis': 'G70.00', 'additional_diagnoses': '', 'medication_history': '',
+        'patient_records': f'records {mrn}', 'care_plan': f'plan {mrn}',
+    }
+
+# MRNs known to land on each of three shards
+MRNS = {index: [mrn for mrn in (f'{n:06d}' for n in range(100)) if shard_index(mrn, 3) == index][:2] for index in range(3)}
+
+class TestShardedDataStore:
+
+    def setup_method(self):
+        self.registry = InMemoryDataStore()
+        self.shards = [InMemoryDataStore() for _ in range(3)]
+        self.store = ShardedDataStore(self.shards, self.registry)
+
+    def submit(self, data: dict) -> dict:
+        self.store.add_patient(data['patient_mrn'], data['patient_first_name'], data['patient_last_name'])
+        self.store.add_provider(data['provider_npi'], data['provider_name'])
+        self.store.add_order(data)
+        return data
+
+    def test_patients_and_orders_are_routed_by_mrn(self):
+        """Test a patient's data lands on the shard its MRN hashes to, with a copy of the provider."""
+        data = self.submit(order(MRNS[1][0]))
+
+        assert list(self.shards[1].patients) == [MRNS[1][0]]
+        assert self.shards[1].providers['1234567893']['name'] == 'Dr. Smith'
+        assert self.shards[0].orders == [] and self.shards[2].orders == []
+        assert data['order_id'] == 1 * 3 + 1
+        assert self.store.check_duplicate_order(MRNS[1][0], 'IVIG') is True
+
+    def test_provider_uniqueness_is_global(self):
+        """Test provider conflicts are found whichever shard the orders went to."""
+        self.submit(order(MRNS[0][0], npi='1234567893', name='Dr. Smith'))
+
+        result = self.store.validate_provider('9999999999', 'Dr. Smith')
+
+        assert result['conflict'] is True
+        assert self.store.get_stats()['total_providers'] == 1
+
+    def test_exports_are_merged_in_time_order(self):
+        """Test exports and streams interleave every shard's orders oldest-first with unique ids."""
+        mrns = [MRNS[2][0], MRNS[0][0], MRNS[1][0], MRNS[2][1]]
+        ids = [self.submit(order(mrn))['order_id'] for mrn in mrns]
+
+        exported = self.store.export_orders()
+        streamed = list(self.store.iter_orders(text_fields=()))
+
+        assert [o['patient_mrn'] for o in exported] == mrns
+        assert [o['order_id'] for o in exported] == ids
+        assert [o['order_id'] for o in streamed] == ids
+        assert len(set(ids)) == 4
+        assert 'care_plan' not in streamed[0]
+        assert [o['order_id'] for o in self.store.export_orders(since_order_id=ids[1])] == \
+            [order_id for order_id in ids if order_id > ids[1]]
+
+    def test_full_export_order_matches_across_backends(self):
+        """Test a full export lists the same orders in the same oldest-first order sharded or not."""
+        single = InMemoryDataStore()
+        mrns = [MRNS[1][0], MRNS[2][0], MRNS[0][0], MRNS[1][1]]
+        for n, mrn in enumerate(mrns):
+            data = dict(order(mrn), timestamp=f'2024-01-0{n + 1} 09:00:00')
+            self.submit(dict(data))
+            single.add_order(dict(data))
+
+        sharded = [o['patient_mrn'] for o in self.store.export_orders()]
+        unsharded = [o['patient_mrn'] for o in single.export_orders()]
+
+        assert sharded == unsharded == mrns
+
+    def test_order_details_and_history_use_global_ids(self):
+        """Test order ids from the merged results load the right shard's text and history."""
+        first = self.submit(order(MRNS[0][0]))['order_id']
+        second = self.submit(order(MRNS[2][0]))['order_id']
+
+        details = self.store.get_order_details([first, second], ['care_plan'])
+        history = self.store.get_patient_history(MRNS[2][0], 5)
+
+        assert details == {first: {'care_plan': f'plan {MRNS[0][0]}'}, second: {'care_plan': f'plan {MRNS[2][0]}'}}
+        assert [o['order_id'] for o in history['orders']] == [second]
+
+    def test_stats_and_analytics_are_summed(self):
+        """Test stats and analytics add up every shard."""
+        for mrn in [MRNS[0][0], MRNS[1][0], MRNS[1][1], MRNS[2][0]]:
+            self.submit(order(mrn))
+
+        stats = self.store.get_stats()
+        analytics = self.store.get_analytics()
+
+        assert stats['total_orders'] == 4
+        assert stats['total_patients'] == 4
+        assert analytics['total_orders'] == 4
+        assert analytics['by_medication'] == [{'key': 'ivig', 'count': 4}]
+        assert sum(point['orders'] for point in analytics['series']) == 4
+
+    def test_list_orders_pages_across_shards(self):
+        """Test keyset pages walk every shard's orders newest-first without gaps or repeats."""
+        mrns = [MRNS[index % 3][index // 3 % 2] for index in range(6)]
+        ids = [self.submit(order(mrn, medication=f'Drug {n}'))['order_id'] for n, mrn in enumerate(mrns)]
+
+        seen = []
+        cursor = None
+        while True:
+            page = self.store.list_orders(limit=4, cursor=cursor)
+            seen.extend(o['order_id'] for o in page['orders'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+
+        assert seen == list(reversed(ids))
+
+    def test_list_orders_pages_every_order_exactly_once(self):
+        """Test paging many orders a few at a time lists each one once, whichever shard it's on."""
+        mrns = [MRNS[n * 7 % 3][n % 2] for n in range(40)]
+        ids = [self.submit(order(mrn, medication=f'Drug {n}'))['order_id'] for n, mrn in enumerate(mrns)]
+
+        seen = []
+        cursor = None
+        while True:
+            page = self.store.list_orders(limit=5, cursor=cursor)
+            assert len(page['orders']) <= 5
+            seen.extend(o['order_id'] for o in page['orders'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+
+        assert sorted(seen) == sorted(ids) and len(seen) == len(ids)
+        timestamps = {o['order_id']: o['timestamp'] for o in self.store.export_orders()}
+        assert [timestamps[order_id] for order_id in seen] == sorted(timestamps.values(), reverse=True)
+        patient_pages = self.store.list_orders(limit=3, patient_mrn=MRNS[1][0])
+        assert len(patient_pages['orders']) == 3 and patient_pages['next_cursor'] is not None
+
+    def test_changes_are_merged_oldest_first(self):
+        """Test the change feed returns every shard's orders after the cursor, which resumes each shard."""
+        ids = [self.submit(order(mrn))['order_id'] for mrn in [MRNS[0][0], MRNS[1][0], MRNS[2][0]]]
+
+        changes = self.store.get_changes(None, 10, 0)
+        assert [change.order['order_id'] for change in changes] == ids
+        assert [change.order['order_id'] for change in self.store.get_changes(changes[0].cursor, 1, 0)] == [ids[1]]
+        assert self.store.get_changes(changes[-1].cursor, 10, 0) == []
+        assert self.store.get_changes(self.store.get_change_cursor(), 10, 0) == []
+
+    def test_changes_from_a_lagging_shard_are_not_skipped(self):
+        """Test orders a shard adds after a consumer read past it are still delivered."""
+        for mrn in [MRNS[1][0]] * 5:
+            self.submit(order(mrn))
+        cursor = self.store.get_changes(None, 10, 0)[-1].cursor
+
+        late = [self.submit(order(MRNS[0][0]))['order_id'], self.submit(order(MRNS[2][0]))['order_id']]
+
+        assert max(late) < 5 * 3
+        assert [change.order['order_id'] for change in self.store.get_changes(cursor, 10, 0)] == late
+
+    def test_malformed_change_cursor_is_rejected(self):
+        """Test a cursor that isn't a list of shard positions raises ValueError."""
+        for cursor in (3, [[7, 1]], [['a']]):
+            with pytest.raises(ValueError):
+                self.store.get_changes(cursor, 10, 0)
+
+    def test_search_merges_by_rank(self):
+        """Test search results from every shard come back best match first."""
+        self.submit({**order(MRNS[0][0]), 'care_plan': 'infusion reaction monitoring'})
+        self.submit({**order(MRNS[1][0]), 'care_plan': 'infusion reaction infusion reaction monitoring'})
+
+        results = self.store.search_orders('infusion', limit=10)
+
+        assert len(results['orders']) == 2
+        assert results['orders'][0]['rank'] >= results['orders'][1]['rank']
+        assert results['next_offset'] is None
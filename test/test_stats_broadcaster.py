@@ -0,0 +1,52 @@
+import pytest
+from unittest.mock import MagicMock
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.stats_broadcaster import StatsBroadcaster
+from app.in_memory_data_store import InMemoryDataStore
+
+class TestStatsBroadcaster:
+
+    def test_subscriber_receives_stats_after_change(self):
+        """Test subscribers get the current stats and then stats after each change."""
+        store = InMemoryDataStore()
+        broadcaster = StatsBroadcaster(store, check_interval=5)
+        subscription = broadcaster.subscribe()
+
+        assert subscription.get(timeout=2)['total_orders'] == 0
+
+        store.add_order({'patient_mrn': 'MRN123'})
+        broadcaster.notify_change()
+        assert subscription.get(timeout=2)['total_orders'] == 1
+
+    def test_stats_computed_once_per_change_for_all_subscribers(self):
+        """Test stats are computed once per store version no matter how many subscribers."""
+        store = MagicMock()
+        store.get_version.return_value = 1
+        store.get_stats.return_value = {'total_orders': 1}
+        broadcaster = StatsBroadcaster(store, check_interval=5)
+
+        subscriptions = [broadcaster.subscribe() for _ in range(3)]
+        for subscription in subscriptions:
+            assert subscription.get(timeout=2) == {'total_orders': 1}
+
+        broadcaster.notify_change()
+        time.sleep(0.1)
+        assert store.get_stats.call_count == 1
+
+    def test_no_store_access_without_subscribers(self):
+        """Test an idle broadcaster doesn't query the store."""
+        store = MagicMock()
+        store.get_version.return_value = 1
+        store.get_stats.return_value = {}
+        broadcaster = StatsBroadcaster(store, check_interval=0.01)
+
+        broadcaster.unsubscribe(broadcaster.subscribe())
+        time.sleep(0.1)
+        calls = store.get_version.call_count
+        time.sleep(0.1)
+        assert store.get_version.call_count == calls
@@ -0,0 +1,86 @@
+import hashlib
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.text_blobs import HEADER, RAW, TextBlobStore, TextCodec, blob_hash, train_dictionary
+
+RECORDS = "Patient tolerated previous infusion well. No adverse reactions noted. " * 40
+
+class TestTextCodec:
+
+    def test_round_trip_compresses(self):
+        """Test text comes back unchanged and smaller than it went in."""
+        codec = TextCodec()
+        blob = codec.compress(RECORDS)
+
+        assert codec.decompress(blob) == RECORDS
+        assert len(blob) < len(RECORDS) / 4
+
+    def test_short_text_is_kept_raw(self):
+        """Test text that wouldn't shrink is stored as is behind a raw header."""
+        blob = TextCodec().compress('ok')
+
+        assert HEADER.unpack_from(blob) == (RAW, 0)
+        assert TextCodec().decompress(blob) == 'ok'
+
+    def test_dictionary_blobs_stay_readable(self):
+        """Test blobs written with a dictionary are read back by a codec that loads it on demand."""
+        samples = [f"Order {i}\nMonitor for infusion reactions every 15 minutes.\nCheck SCr before each dose.\n"
+                   for i in range(100)]
+        dictionary = train_dictionary(samples)
+        writer = TextCodec()
+        writer.use_dictionary(7, dictionary)
+        blob = writer.compress(samples[0])
+
+        loaded = []
+        reader = TextCodec(lambda dictionary_id: loaded.append(dictionary_id) or dictionary)
+        assert reader.decompress(blob) == samples[0]
+        assert loaded == [7]
+        assert len(blob) < len(TextCodec().compress(samples[0]))
+
+    def test_unknown_dictionary_raises(self):
+        """Test a blob whose dictionary can't be found raises ValueError."""
+        writer = TextCodec()
+        writer.use_dictionary(3, b"Monitor for infusion reactions.\n" * 10)
+        blob = writer.compress("Monitor for infusion reactions. " * 5)
+
+        with pytest.raises(ValueError, match="Unknown text dictionary 3"):
+            TextCodec().decompress(blob)
+
+    def test_hash_matches_postgres_sha256(self):
+        """Test the content address is the SHA-256 of the UTF-8 text, like SHA256(CONVERT_TO(text, 'UTF8'))."""
+        assert blob_hash('café') == hashlib.sha256('café'.encode('utf-8')).digest()
+
+class TestTextBlobStore:
+
+    def test_identical_text_is_stored_once(self):
+        """Test repeated text adds a reference but no second blob, which the compression ratio reflects."""
+        blobs = TextBlobStore()
+        first = blobs.put(RECORDS)
+        second = blobs.put(RECORDS)
+
+        assert first == second
+        assert len(blobs.blobs) == 1
+        assert blobs.get(first) == RECORDS
+        assert blobs.compression_ratio() == round(2 * len(RECORDS) / len(blobs.blobs[first]), 2)
+
+    def test_none_is_not_stored(self):
+        """Test missing text has no blob."""
+        blobs = TextBlobStore()
+
+        assert blobs.put(None) is None
+        assert blobs.get(None) is None
+        assert blobs.compression_ratio() == 1.0
+
+    def test_dictionary_is_trained_after_enough_texts(self):
+        """Test a dictionary is trained once enough distinct texts are stored, and earlier blobs stay readable."""
+        blobs = TextBlobStore()
+        blobs.TRAINING_SAMPLES = 10
+        keys = [blobs.put(f"Care plan {i}\nAssess for headache and aseptic meningitis.\n") for i in range(12)]
+
+        assert blobs.codec.dictionary_id == 1
+        assert blobs.get(keys[0]) == "Care plan 0\nAssess for headache and aseptic meningitis.\n"
+        assert blobs.get(keys[11]) == "Care plan 11\nAssess for headache and aseptic meningitis.\n"
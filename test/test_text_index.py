@@ -0,0 +1,34 @@
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.text_index import InvertedIndex, tokenize
+
+class TestInvertedIndex:
+
+    def test_tokenize_drops_stop_words_and_punctuation(self):
+        """Test tokenizing lowercases text and drops stop words."""
+        assert tokenize("Risk of Thrombosis, and renal injury.") == ['risk', 'thrombosis', 'renal', 'injury']
+        assert tokenize("") == []
+
+    def test_search_requires_all_terms(self):
+        """Test search only matches documents containing every query term."""
+        index = InvertedIndex()
+        index.add(1, "Monitor for thrombosis")
+        index.add(2, "Monitor renal function")
+        index.add(3, "Renal thrombosis risk")
+
+        assert [doc_id for doc_id, _ in index.search("renal thrombosis")] == [3]
+        assert index.search("anaphylaxis") == []
+        assert index.search("the") == []
+
+    def test_search_ranks_by_term_frequency(self):
+        """Test documents mentioning a term more often rank higher."""
+        index = InvertedIndex()
+        index.add(1, "thrombosis")
+        index.add(2, "thrombosis thrombosis thrombosis")
+        index.add(3, "headache")
+
+        assert [doc_id for doc_id, _ in index.search("Thrombosis")] == [2, 1]